@@ -3,37 +3,140 @@
 支持通过MCP协议调用天气服务工具
 """
 
+import contextlib
 import os
-from typing import Optional, List, Dict, Any
+import sys
+from typing import Optional, List, Dict, Any, Tuple
 import anthropic
 import httpx
 from dotenv import load_dotenv
 import requests
 
+# 与 crisis 工作流（crisis/util.py）一样按模块名导入，两边共用同一份模块状态（如启用的 cassette），
+# 不会因 crisis.batch 和 batch 两种导入路径各加载一份
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "crisis"))
+
+from batch import BatchRunner
+from telemetry import Telemetry, attempt_hooks
+from cassette import cassette_transport
+from hedging import Attempt, HedgePolicy, hedged_call, policy_from_env
+from endpoints import Endpoint, EndpointPool, pool_from_env, report_first_token
+from prompts import apply_cache_minimum
+
 # 加载环境变量
 load_dotenv()
 
+# 中转 API 地址（移除末尾的 /v1 避免路径重复），可通过环境变量 ANTHROPIC_BASE_URL 覆盖，如指向本地 stub 服务器
+DEFAULT_BASE_URL = os.getenv("ANTHROPIC_BASE_URL", "https://anthropic.claude-plus.top")
+
+# 自定义传输层时需要自行传入连接池限制（与 SDK 默认值一致）
+CONNECTION_LIMITS = httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+
+# 两个智能体共用的调用遥测（token、延迟、首 token 延迟、重试、停止原因），
+# 设置 LLM_TELEMETRY_PATH 时调用记录由后台线程追加到 JSONL；导出见 telemetry.to_prometheus()
+telemetry = Telemetry(jsonl_path=os.getenv("LLM_TELEMETRY_PATH"))
+
+# 对冲请求（默认关闭，设置 LLM_HEDGE=1 开启）：首 token 迟迟未到时再发一个相同请求，先响应的生效，
+# 另一个被取消，用于削减中转站的长尾延迟；见 crisis/hedging.py
+hedge_policy: Optional[HedgePolicy] = policy_from_env()
+
+
+def endpoint_client(endpoint: Endpoint) -> anthropic.Anthropic:
+    """为端点创建客户端：端点自己的密钥、地址、代理和超时，传输层与智能体的默认客户端相同"""
+    return anthropic.Anthropic(
+        api_key=endpoint.api_key,
+        base_url=endpoint.base_url,
+        max_retries=endpoint.max_retries,
+        timeout=endpoint.http_timeout,
+        http_client=anthropic.DefaultHttpxClient(
+            event_hooks=attempt_hooks(),
+            transport=cassette_transport(endpoint.proxy, limits=CONNECTION_LIMITS),
+        ),
+    )
+
+
+# 多端点（默认关闭，设置 LLM_ENDPOINTS 开启）：按延迟和健康度选择中转站或直连，故障端点熔断；
+# 见 crisis/endpoints.py
+endpoint_pool: Optional[EndpointPool] = pool_from_env(endpoint_client)
+
+# 天气智能体的默认系统提示词。每次调用都原样发送；约 140 token，不足模型的最小可缓存长度，
+# 只有更长的自定义系统提示词才会带上缓存断点
+WEATHER_SYSTEM_PROMPT = """你是一个有用的AI助手，专门帮助用户查询天气信息。
+你可以使用以下工具：
+- get-forecast: 获取指定坐标的天气预报
+- get-alerts: 获取指定州的天气警报
+
+当用户询问天气信息时，请使用这些工具来提供准确的信息。
+美国主要城市坐标参考：
+- 旧金山: 37.7749, -122.4194
+- 纽约: 40.7128, -74.0060
+- 洛杉矶: 34.0522, -118.2437
+- 芝加哥: 41.8781, -87.6298
+- 迈阿密: 25.7617, -80.1918"""
+
+
+def cached_system(system_prompt: str, model: str) -> List[Dict[str, Any]]:
+    """
+    把系统提示词包装为内容块，达到模型的最小可缓存长度时打上 cache_control 断点
+    
+    Args:
+        system_prompt: 系统提示词
+        model: 接收请求的模型（不同模型的最小可缓存长度不同，见 crisis/prompts.py）
+        
+    Returns:
+        可直接作为 system 参数的内容块列表
+    """
+    return apply_cache_minimum(
+        [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}], model
+    )
+
+
+def usage_to_dict(usage: Any) -> Dict[str, int]:
+    """提取响应 usage 中的 token 用量，包括提示词缓存的写入和命中"""
+    return {
+        field: getattr(usage, field, None) or 0
+        for field in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+    }
+
 
 class MCPWeatherAgent:
     """使用 MCP Connector 的天气智能体"""
     
-    def __init__(self, api_key: Optional[str] = None, mcp_server_url: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, mcp_server_url: Optional[str] = None,
+                 base_url: Optional[str] = None, endpoints: Optional[EndpointPool] = None):
         """
         初始化智能体
         
         Args:
             api_key: Anthropic API密钥，如果不提供则从环境变量读取
             mcp_server_url: MCP 服务器 URL，默认为本地服务器
+            base_url: API 地址，默认为 DEFAULT_BASE_URL
+            endpoints: 对话使用的端点池；不传入时，只有 api_key 和 base_url 都未指定才使用模块级的 endpoint_pool，
+                否则只使用指定的 api_key 和 base_url
         """
+        if endpoints is None and api_key is None and base_url is None:
+            endpoints = endpoint_pool
+        self.endpoints = endpoints
         self.api_key = api_key or os.getenv("ANTHROPIC_API_KEY_PLUS")
-        if not self.api_key:
+        if not self.api_key and self.endpoints is None:
             raise ValueError("未找到Anthropic API密钥。请在环境变量中设置ANTHROPIC_API_KEY或直接传入api_key参数。")
         
         # 初始化Anthropic客户端
-        self.client = anthropic.Anthropic(
-            api_key=self.api_key,
-            base_url="https://anthropic.claude-plus.top",  # 设置中转 API URL，移除末尾的 /v1 避免路径重复
-        )
+        if self.api_key:
+            self.client = anthropic.Anthropic(
+                api_key=self.api_key,
+                base_url=base_url or DEFAULT_BASE_URL,
+                # 统计 SDK 内部重试；传输层支持录制/回放（见 crisis/cassette.py）
+                http_client=anthropic.DefaultHttpxClient(
+                    event_hooks=attempt_hooks(),
+                    transport=cassette_transport(limits=CONNECTION_LIMITS),
+                ),
+            )
+        else:
+            self.client = self.endpoints.client(self.endpoints.endpoints[0])
+        
+        # 最近一次调用的 token 用量（含提示词缓存写入/命中）
+        self.last_usage: Dict[str, int] = {}
         
         # MCP 服务器配置
         self.mcp_server_url = mcp_server_url or "http://localhost:3001/mcp"
@@ -77,40 +180,12 @@ class MCPWeatherAgent:
         try:
             # 默认系统提示词
             if system_prompt is None:
-                system_prompt = """你是一个有用的AI助手，专门帮助用户查询天气信息。
-你可以使用以下工具：
-- get-forecast: 获取指定坐标的天气预报
-- get-alerts: 获取指定州的天气警报
-
-当用户询问天气信息时，请使用这些工具来提供准确的信息。
-美国主要城市坐标参考：
-- 旧金山: 37.7749, -122.4194
-- 纽约: 40.7128, -74.0060
-- 洛杉矶: 34.0522, -118.2437
-- 芝加哥: 41.8781, -87.6298
-- 迈阿密: 25.7617, -80.1918"""
+                system_prompt = WEATHER_SYSTEM_PROMPT
             
-            # 使用 MCP Connector 调用 API
-            response = self.client.beta.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=1000,
-                system=system_prompt,
-                messages=[
-                    {"role": "user", "content": message}
-                ],
-                mcp_servers=[
-                    {
-                        "type": "url",
-                        "url": self.mcp_server_url,
-                        "name": "weather-server",
-                        "tool_configuration": {
-                            "enabled": True,
-                            "allowed_tools": ["get-forecast", "get-alerts"]
-                        }
-                    }
-                ],
-                betas=["mcp-client-2025-04-04"]
-            )
+            # 使用 MCP Connector 调用 API；配置了端点池时在最合适的端点上调用，端点故障时切换
+            response = self._with_endpoint(lambda client: self._create(client, message, system_prompt))
+            
+            self.last_usage = usage_to_dict(response.usage)
             
             # 处理响应内容
             full_response = ""
@@ -138,38 +213,19 @@ class MCPWeatherAgent:
         except Exception as e:
             return f"❌ 未知错误: {type(e).__name__}: {str(e)}"
     
-    def chat_stream(self, message: str, system_prompt: str = None):
-        """
-        与智能体流式对话，实时输出响应
-        
-        Args:
-            message: 用户消息
-            system_prompt: 系统提示词，可选
-            
-        Yields:
-            逐步输出的文本片段
-        """
-        try:
-            # 默认系统提示词
-            if system_prompt is None:
-                system_prompt = """你是一个有用的AI助手，专门帮助用户查询天气信息。
-你可以使用以下工具：
-- get-forecast: 获取指定坐标的天气预报
-- get-alerts: 获取指定州的天气警报
-
-当用户询问天气信息时，请使用这些工具来提供准确的信息。
-美国主要城市坐标参考：
-- 旧金山: 37.7749, -122.4194
-- 纽约: 40.7128, -74.0060
-- 洛杉矶: 34.0522, -118.2437
-- 芝加哥: 41.8781, -87.6298
-- 迈阿密: 25.7617, -80.1918"""
-            
-            # 使用流式 API 调用
-            with self.client.beta.messages.stream(
+    def _with_endpoint(self, fn):
+        """用默认客户端执行 fn；配置了端点池时在最合适的端点上执行，端点故障时切换"""
+        if self.endpoints is None:
+            return fn(self.client)
+        return self.endpoints.call(lambda endpoint: fn(self.endpoints.client(endpoint)))
+    
+    def _create(self, client: anthropic.Anthropic, message: str, system_prompt: str):
+        """一次非流式 MCP Connector 请求"""
+        with telemetry.track("claude-sonnet-4-20250514", "MCPWeatherAgent.chat") as call:
+            response = client.beta.messages.create(
                 model="claude-sonnet-4-20250514",
                 max_tokens=1000,
-                system=system_prompt,
+                system=cached_system(system_prompt, "claude-sonnet-4-20250514"),
                 messages=[
                     {"role": "user", "content": message}
                 ],
@@ -185,48 +241,102 @@ class MCPWeatherAgent:
                     }
                 ],
                 betas=["mcp-client-2025-04-04"]
-            ) as stream:
-                full_response = ""
+            )
+            call.finish(response.usage, response.stop_reason)
+        return response
+    
+    def endpoint_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各端点的熔断状态、调用数、错误率和延迟（未配置端点池时为空）"""
+        return self.endpoints.stats() if self.endpoints is not None else {}
+    
+    def chat_stream(self, message: str, system_prompt: str = None):
+        """
+        与智能体流式对话，实时输出响应
+        
+        Args:
+            message: 用户消息
+            system_prompt: 系统提示词，可选
+            
+        Yields:
+            逐步输出的文本片段
+        """
+        try:
+            # 默认系统提示词
+            if system_prompt is None:
+                system_prompt = WEATHER_SYSTEM_PROMPT
+            
+            # 使用流式 API 调用；配置了端点池时只选择端点（开始输出后无法切换），以首 token 延迟计入统计
+            pool = self.endpoints
+            with (pool.lease() if pool is not None else contextlib.nullcontext()) as lease, \
+                    telemetry.track("claude-sonnet-4-20250514", "MCPWeatherAgent.chat_stream") as call:
+                stream_client = self.client if lease is None else pool.client(lease.endpoint)
+                with stream_client.beta.messages.stream(
+                    model="claude-sonnet-4-20250514",
+                    max_tokens=1000,
+                    system=cached_system(system_prompt, "claude-sonnet-4-20250514"),
+                    messages=[
+                        {"role": "user", "content": message}
+                    ],
+                    mcp_servers=[
+                        {
+                            "type": "url",
+                            "url": self.mcp_server_url,
+                            "name": "weather-server",
+                            "tool_configuration": {
+                                "enabled": True,
+                                "allowed_tools": ["get-forecast", "get-alerts"]
+                            }
+                        }
+                    ],
+                    betas=["mcp-client-2025-04-04"]
+                ) as stream:
+                    full_response = ""
                 
-                for event in stream:
-                    # 处理不同类型的流式事件
-                    if event.type == "content_block_start":
-                        content_block = event.content_block
-                        if content_block.type == "text":
-                            # 文本内容块开始
-                            pass
-                        elif content_block.type == "mcp_tool_use":
-                            # MCP工具使用开始
-                            tool_info = f"\n🛠️ 正在使用工具: {content_block.name}"
-                            if hasattr(content_block, 'server_name'):
-                                tool_info += f" (来自: {content_block.server_name})"
-                            print(tool_info, end="", flush=True)
-                            full_response += tool_info
+                    for event in stream:
+                        # 处理不同类型的流式事件
+                        if event.type == "content_block_start":
+                            content_block = event.content_block
+                            if content_block.type == "text":
+                                # 文本内容块开始
+                                pass
+                            elif content_block.type == "mcp_tool_use":
+                                # MCP工具使用开始
+                                tool_info = f"\n🛠️ 正在使用工具: {content_block.name}"
+                                if hasattr(content_block, 'server_name'):
+                                    tool_info += f" (来自: {content_block.server_name})"
+                                print(tool_info, end="", flush=True)
+                                full_response += tool_info
                     
-                    elif event.type == "content_block_delta":
-                        delta = event.delta
-                        if delta.type == "text_delta":
-                            # 文本增量更新
-                            text_chunk = delta.text
-                            print(text_chunk, end="", flush=True)
-                            full_response += text_chunk
-                        elif delta.type == "input_json_delta":
-                            # 工具输入的JSON增量（通常不需要显示）
-                            pass
+                        elif event.type == "content_block_delta":
+                            delta = event.delta
+                            if delta.type == "text_delta":
+                                # 文本增量更新
+                                call.first_token()
+                                if lease is not None:
+                                    lease.first_token()
+                                text_chunk = delta.text
+                                print(text_chunk, end="", flush=True)
+                                full_response += text_chunk
+                            elif delta.type == "input_json_delta":
+                                # 工具输入的JSON增量（通常不需要显示）
+                                pass
                     
-                    elif event.type == "content_block_stop":
-                        # 内容块结束
-                        pass
+                        elif event.type == "content_block_stop":
+                            # 内容块结束
+                            pass
                     
-                    elif event.type == "message_delta":
-                        # 消息级别的更新
-                        pass
+                        elif event.type == "message_delta":
+                            # 消息级别的更新
+                            pass
                     
-                    elif event.type == "message_stop":
-                        # 消息结束
-                        break
+                        elif event.type == "message_stop":
+                            # 消息结束
+                            break
                 
-                return full_response
+                    snapshot = stream.current_message_snapshot
+                    call.finish(snapshot.usage, snapshot.stop_reason)
+                    self.last_usage = usage_to_dict(snapshot.usage)
+                    return full_response
                 
         except anthropic.APIConnectionError as e:
             error_msg = f"❌ 连接错误: 无法连接到API服务器。请检查网络连接。\n详细错误: {str(e)}"
@@ -277,16 +387,46 @@ class MCPWeatherAgent:
 class SimpleAgent:
     """简化的通用AI智能体"""
     
-    def __init__(self, api_key: Optional[str] = None):
-        """初始化智能体"""
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 hedge: Optional[HedgePolicy] = None, endpoints: Optional[EndpointPool] = None):
+        """
+        初始化智能体
+        
+        Args:
+            api_key: API 密钥，默认读取环境变量 ANTHROPIC_API_KEY_PLUS
+            base_url: API 地址，默认为 DEFAULT_BASE_URL
+            hedge: ask 使用的对冲策略，默认为模块级的 hedge_policy（未开启时不对冲）
+            endpoints: ask 使用的端点池；不传入时，只有 api_key 和 base_url 都未指定才使用模块级的 endpoint_pool，
+                否则只使用指定的 api_key 和 base_url
+        """
+        if endpoints is None and api_key is None and base_url is None:
+            endpoints = endpoint_pool
+        self.endpoints = endpoints
         self.api_key = api_key or os.getenv("ANTHROPIC_API_KEY_PLUS")
-        if not self.api_key:
+        if not self.api_key and self.endpoints is None:
             raise ValueError("未找到Anthropic API密钥。请在环境变量中设置ANTHROPIC_API_KEY")
         
-        self.client = anthropic.Anthropic(
-            api_key=self.api_key,
-            base_url="https://anthropic.claude-plus.top",  # 设置中转 API URL，移除末尾的 /v1 避免路径重复
-        )
+        if self.api_key:
+            self.client = anthropic.Anthropic(
+                api_key=self.api_key,
+                base_url=base_url or DEFAULT_BASE_URL,
+                # 统计 SDK 内部重试；传输层支持录制/回放（见 crisis/cassette.py）
+                http_client=anthropic.DefaultHttpxClient(
+                    event_hooks=attempt_hooks(),
+                    transport=cassette_transport(limits=CONNECTION_LIMITS),
+                ),
+            )
+        else:
+            # 只配置了端点池：流式和批量问答使用第一个端点
+            self.client = self.endpoints.client(self.endpoints.endpoints[0])
+        
+        # 最近一次调用的 token 用量（含提示词缓存写入/命中）
+        self.last_usage: Dict[str, int] = {}
+        
+        self.hedge = hedge or hedge_policy
+        
+        # 批量问答执行器，首次调用 ask_batch 时创建
+        self._batch_runner: Optional[BatchRunner] = None
     
     def ask(self, question: str, system_prompt: str = "你是一个有用的AI助手。", stream: bool = False) -> str:
         """简单的问答功能"""
@@ -294,38 +434,133 @@ class SimpleAgent:
             return self.ask_stream(question, system_prompt)
         
         try:
-            response = self.client.messages.create(
+            if self.hedge is not None:
+                # 对冲请求优先使用另一个端点（rank=1）
+                text, usage = hedged_call(lambda attempt: self._with_endpoint(
+                    lambda client: self._ask_attempt(client, question, system_prompt, attempt), attempt.index), self.hedge)
+                # 只记录胜出请求的用量，落败的请求可能在另一个线程中晚些结束
+                self.last_usage = usage
+                return text
+            return self._with_endpoint(lambda client: self._ask_once(client, question, system_prompt))
+        except Exception as e:
+            return f"❌ 错误: {str(e)}"
+    
+    def _with_endpoint(self, fn, rank: int = 0):
+        """用默认客户端执行 fn；配置了端点池时在最合适的端点上执行，端点故障时切换"""
+        if self.endpoints is None:
+            return fn(self.client)
+        return self.endpoints.call(lambda endpoint: fn(self.endpoints.client(endpoint)), rank)
+    
+    def _ask_once(self, client: anthropic.Anthropic, question: str, system_prompt: str) -> str:
+        """一次非流式问答请求"""
+        with telemetry.track("claude-sonnet-4-20250514", "SimpleAgent.ask") as call:
+            response = client.messages.create(
                 model="claude-sonnet-4-20250514",
                 max_tokens=1000,
                 system=system_prompt,
                 messages=[{"role": "user", "content": question}]
             )
-            return response.content[0].text
+            call.finish(response.usage, response.stop_reason)
+        self.last_usage = usage_to_dict(response.usage)
+        return response.content[0].text
+    
+    def _ask_attempt(self, client: anthropic.Anthropic, question: str, system_prompt: str,
+                     attempt: Attempt) -> Tuple[str, Dict[str, int]]:
+        """对冲中的一次问答请求，使用流式接口以便检测首 token；落败时关闭流。返回回答和 token 用量"""
+        source = "SimpleAgent.ask:hedge" if attempt.index else "SimpleAgent.ask"
+        chunks = []
+        with telemetry.track("claude-sonnet-4-20250514", source) as call:
+            try:
+                with client.messages.stream(
+                    model="claude-sonnet-4-20250514",
+                    max_tokens=1000,
+                    system=system_prompt,
+                    messages=[{"role": "user", "content": question}]
+                ) as stream:
+                    attempt.on_cancel(stream.close)
+                    for text in stream.text_stream:
+                        call.first_token()
+                        report_first_token()
+                        attempt.first_token()
+                        chunks.append(text)
+                    snapshot = stream.current_message_snapshot
+            except Exception:
+                attempt.check()
+                raise
+            attempt.check()
+            call.finish(snapshot.usage, snapshot.stop_reason)
+        return "".join(chunks), usage_to_dict(snapshot.usage)
+    
+    def hedging_stats(self) -> Dict[str, Any]:
+        """对冲调用数、对冲比例、对冲胜出数和当前对冲延迟（未开启对冲时为空）"""
+        return self.hedge.stats() if self.hedge is not None else {}
+    
+    def endpoint_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各端点的熔断状态、调用数、错误率和延迟（未配置端点池时为空）"""
+        return self.endpoints.stats() if self.endpoints is not None else {}
+    
+    def ask_batch(self, questions: List[str], system_prompt: str = "你是一个有用的AI助手。") -> List[str]:
+        """
+        批量问答：通过 Message Batches API 提交，适合不需要实时返回的大批量问题
+        
+        批量接口有独立的限额，不挤占实时问答的速率限制；接口不支持批量时自动回退为限速的实时调用。
+        
+        Args:
+            questions: 问题列表
+            system_prompt: 系统提示词
+            
+        Returns:
+            与问题一一对应的回答，失败的问题返回错误信息
+        """
+        if self._batch_runner is None:
+            self._batch_runner = BatchRunner(self.client)
+        
+        batch_requests = [
+            (f"q-{i}", {
+                "model": "claude-sonnet-4-20250514",
+                "max_tokens": 1000,
+                "system": system_prompt,
+                "messages": [{"role": "user", "content": question}],
+            })
+            for i, question in enumerate(questions)
+        ]
+        answers = {}
+        try:
+            for result in self._batch_runner.run(batch_requests):
+                answers[result.custom_id] = result.text if result.ok else f"❌ 错误: {result.error}"
+                if result.ok:
+                    telemetry.record_usage("claude-sonnet-4-20250514", result.usage, f"SimpleAgent.ask_batch:{result.mode}")
         except Exception as e:
-            return f"❌ 错误: {str(e)}"
+            return [f"❌ 错误: {str(e)}"] * len(questions)
+        return [answers.get(f"q-{i}", "❌ 错误: 未返回结果") for i in range(len(questions))]
     
     def ask_stream(self, question: str, system_prompt: str = "你是一个有用的AI助手。") -> str:
         """流式问答功能"""
         try:
-            with self.client.messages.stream(
-                model="claude-sonnet-4-20250514",
-                max_tokens=1000,
-                system=system_prompt,
-                messages=[{"role": "user", "content": question}]
-            ) as stream:
-                full_response = ""
+            with telemetry.track("claude-sonnet-4-20250514", "SimpleAgent.ask_stream") as call:
+                with self.client.messages.stream(
+                    model="claude-sonnet-4-20250514",
+                    max_tokens=1000,
+                    system=system_prompt,
+                    messages=[{"role": "user", "content": question}]
+                ) as stream:
+                    full_response = ""
                 
-                for event in stream:
-                    if event.type == "content_block_delta":
-                        delta = event.delta
-                        if delta.type == "text_delta":
-                            text_chunk = delta.text
-                            print(text_chunk, end="", flush=True)
-                            full_response += text_chunk
-                    elif event.type == "message_stop":
-                        break
+                    for event in stream:
+                        if event.type == "content_block_delta":
+                            delta = event.delta
+                            if delta.type == "text_delta":
+                                call.first_token()
+                                text_chunk = delta.text
+                                print(text_chunk, end="", flush=True)
+                                full_response += text_chunk
+                        elif event.type == "message_stop":
+                            break
                 
-                return full_response
+                    snapshot = stream.current_message_snapshot
+                    call.finish(snapshot.usage, snapshot.stop_reason)
+                    self.last_usage = usage_to_dict(snapshot.usage)
+                    return full_response
                 
         except Exception as e:
             error_msg = f"❌ 错误: {str(e)}"
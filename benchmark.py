@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+端到端基准测试（基于 cassette 录制/回放）
+
+先用 record 模式对真实 API（或 stub 服务器）运行一遍，把请求/响应连同流式数据块的到达时间
+录制到 cassette 文件；之后用 replay 模式重复运行，不访问 API、不产生费用，结果可复现：
+
+    python benchmark.py record --cassette benchmarks/llm.jsonl.gz
+    python benchmark.py replay --cassette benchmarks/llm.jsonl.gz --runs 5
+    python benchmark.py replay --cassette benchmarks/llm.jsonl.gz --speed 0   # 去掉网络时间，只测本地开销
+
+测试目标：crisis 工作流的 analyze_alert、chain，以及 MCPWeatherAgent.chat_stream。
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+ALERTS = [
+    "告警级别: ERROR\n错误信息: Uni bridge call failed with error code 10015\n"
+    "错误详情: 调用uni.getUserInfo()时返回错误码10015，无法获取用户信息",
+    "告警级别: ERROR\n错误类型: TypeError\n错误信息: Cannot read property 'length' of undefined\n"
+    "堆栈信息: at processData (https://example.com/js/main.js:245:12)",
+    "告警级别: CRITICAL\n错误信息: 订单服务响应变慢，P99 延迟 3.2s\n接口: POST /api/v1/orders\nHTTP状态码: 504",
+]
+
+CHAIN_INPUT = "订单服务在 14:30 出现大量 504，持续 5 分钟后自动恢复"
+CHAIN_PROMPTS = [
+    "用一句话概括以下事件",
+    "根据概括列出最可能的三个原因",
+    "为每个原因给出一条排查建议",
+]
+
+WEATHER_QUESTIONS = ["旧金山今天的天气如何？", "加州有什么天气警报吗？"]
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基于 cassette 录制/回放的端到端基准测试")
+    parser.add_argument("mode", choices=["record", "replay", "auto"])
+    parser.add_argument("--cassette", default="benchmarks/llm.jsonl.gz")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数，0 表示不等待")
+    parser.add_argument("--runs", type=int, default=3, help="每个目标运行的次数（record 模式固定为 1）")
+    parser.add_argument("--targets", default="analyze_alert,chain,chat_stream")
+    args = parser.parse_args()
+
+    # 客户端在导入时读取 cassette 设置，agent.py 和 crisis 工作流共用同一个 cassette
+    os.environ["LLM_CASSETTE"] = args.cassette
+    os.environ["LLM_CASSETTE_MODE"] = args.mode
+    os.environ["LLM_CASSETTE_SPEED"] = str(args.speed)
+    if args.mode == "replay":
+        os.environ.setdefault("ANTHROPIC_API_KEY", "replay")
+        os.environ.setdefault("ANTHROPIC_API_KEY_PLUS", "replay")
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "crisis"))
+    import cassette
+    import util
+    import workflow
+    from agent import MCPWeatherAgent, telemetry as agent_telemetry
+    from template_miner import TemplateClassificationCache
+    from config import TEMPLATE_CACHE_CONFIG
+
+    util.disable_cache()
+    weather_agent = None
+
+    def run_analyze_alert():
+        # 每轮使用空的模板缓存，保证每轮发出相同的请求
+        workflow.template_cache = TemplateClassificationCache(
+            None, TEMPLATE_CACHE_CONFIG["min_confidence"], TEMPLATE_CACHE_CONFIG["miner"]
+        )
+        for alert in ALERTS:
+            workflow.analyze_alert(alert, source="benchmark")
+
+    def run_chain():
+        workflow.chain(CHAIN_INPUT, CHAIN_PROMPTS)
+
+    def run_chat_stream():
+        nonlocal weather_agent
+        if weather_agent is None:
+            weather_agent = MCPWeatherAgent()
+        for question in WEATHER_QUESTIONS:
+            weather_agent.chat_stream(question)
+
+    targets = {"analyze_alert": run_analyze_alert, "chain": run_chain, "chat_stream": run_chat_stream}
+    runs = 1 if args.mode == "record" else args.runs
+
+    print(f"🎬 cassette: {args.cassette}（{args.mode}，speed={args.speed}），每个目标 {runs} 轮\n")
+    print(f"{'目标':<16}{'平均(s)':>10}{'p50(s)':>10}{'p95(s)':>10}{'最小(s)':>10}{'最大(s)':>10}")
+    for name in args.targets.split(","):
+        durations = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                targets[name]()
+            durations.append(time.perf_counter() - start)
+        print(f"{name:<16}{statistics.mean(durations):>10.3f}{_percentile(durations, 50):>10.3f}"
+              f"{_percentile(durations, 95):>10.3f}{min(durations):>10.3f}{max(durations):>10.3f}")
+
+    print("\n📊 调用遥测")
+    for row in util.telemetry_stats() + agent_telemetry.summary():
+        print(f"  {row['source']:<28}{row['step'] or '-':<16}调用 {row['calls']:>3}  "
+              f"平均延迟 {row['avg_latency_s'] or 0:.3f}s  TTFT {row['avg_ttft_s'] or 0:.3f}s")
+    stats = cassette.active().stats()
+    print(f"\n🎞️ cassette: 回放 {stats['replayed']} 次，录制 {stats['recorded']} 次，未命中 {stats['misses']} 次")
+    if args.mode == "replay" and stats["misses"]:
+        print("⚠️ 有请求没有录制，请先用 record 或 auto 模式重新录制")
+
+
+if __name__ == "__main__":
+    main()
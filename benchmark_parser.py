@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+结构化响应解析基准测试
+
+对比原来的 extract_xml（每个标签重新构造正则、重新扫描整个响应）和 util.parse_tags（一次扫描取出所有标签），
+不访问 API：
+
+    python benchmark_parser.py
+    python benchmark_parser.py --repeat 2000 --padding 20000
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "crisis"))
+
+from util import parse_tags
+
+CLASSIFICATION = """
+<classification>
+<category>uni_error</category>
+<reasoning>{padding}发现 Uni 相关关键词和错误码 10015，调用 uni.getUserInfo() 失败</reasoning>
+<confidence>高</confidence>
+</classification>
+"""
+
+ROUTE = """
+<reasoning>{padding}用户反馈账号无法登录，并提到密码重置邮件没有收到，属于账号问题</reasoning>
+<selection>account</selection>
+"""
+
+
+# 一次要求较多字段的提示词（如事件复盘），字段越多，逐个扫描的开销越大
+POSTMORTEM_FIELDS = ["summary", "impact", "timeline", "root_cause", "trigger", "detection", "mitigation", "action_items"]
+POSTMORTEM = "\n".join(f"<{field}>{{padding}}{field} 的内容</{field}>" for field in POSTMORTEM_FIELDS)
+
+
+def legacy_extract_xml(text: str, tag: str) -> str:
+    """原来的实现：每次调用都构造并编译一个正则，扫描整个响应"""
+    match = re.search(f'<{tag}>(.*?)</{tag}>', text, re.DOTALL)
+    return match.group(1) if match else ""
+
+
+def single_pass_fields(text: str, tags):
+    """新的实现：解析一次，再按名称取各字段"""
+    parsed = parse_tags(text)
+    return [parsed.get(tag) for tag in tags]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比 extract_xml 与 parse_tags 的解析耗时")
+    parser.add_argument("--repeat", type=int, default=5000, help="每种情况解析的次数")
+    parser.add_argument("--padding", type=int, default=2000, help="推理部分额外填充的字符数，模拟较长的响应")
+    args = parser.parse_args()
+
+    padding = "逐项分析告警中的错误信息和堆栈。" * (args.padding // 16)
+    cases = {
+        "analyze_alert": (CLASSIFICATION.format(padding=padding), ["category", "reasoning", "confidence"]),
+        "route": (ROUTE.format(padding=padding), ["reasoning", "selection"]),
+        "postmortem": (POSTMORTEM.format(padding=padding[:len(padding) // 4]), POSTMORTEM_FIELDS),
+    }
+
+    print(f"响应填充 {len(padding)} 字符，每种情况 {args.repeat} 次\n")
+    print(f"{'情况':<16}{'字段数':>6}{'extract_xml(μs)':>18}{'parse_tags(μs)':>18}{'加速':>8}")
+    for name, (text, tags) in cases.items():
+        assert single_pass_fields(text, tags) == [legacy_extract_xml(text, tag) for tag in tags]
+
+        legacy = timeit.timeit(lambda: [legacy_extract_xml(text, tag) for tag in tags], number=args.repeat)
+        single_pass = timeit.timeit(lambda: single_pass_fields(text, tags), number=args.repeat)
+        legacy_us = legacy / args.repeat * 1e6
+        single_us = single_pass / args.repeat * 1e6
+        print(f"{name:<16}{len(tags):>6}{legacy_us:>18.2f}{single_us:>18.2f}{legacy_us / single_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
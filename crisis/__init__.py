@@ -12,8 +12,12 @@ from .config import (
     SEVERITY_KEYWORDS,
     SYSTEM_COMPONENTS,
     DEFAULT_CONFIG,
-    RESPONSE_TEMPLATES
+    RESPONSE_TEMPLATES,
+    ADMISSION_CONFIG,
+    INCIDENT_CONFIG
 )
+from .admission import AdmissionController, AdmissionDecision
+from .incident import IncidentSession, IncidentStore
 
 __version__ = "1.0.0"
 __author__ = "Crisis Agent Team"
@@ -26,5 +30,11 @@ __all__ = [
     "SEVERITY_KEYWORDS", 
     "SYSTEM_COMPONENTS",
     "DEFAULT_CONFIG",
-    "RESPONSE_TEMPLATES"
+    "RESPONSE_TEMPLATES",
+    "ADMISSION_CONFIG",
+    "AdmissionController",
+    "AdmissionDecision",
+    "INCIDENT_CONFIG",
+    "IncidentSession",
+    "IncidentStore"
 ] 
\ No newline at end of file
@@ -0,0 +1,304 @@
+"""
+告警准入控制与降载
+
+告警风暴期间限制进入分析路径的工作量，保证关键告警的处理延迟：
+- 全局队列上限（在途 + 排队的告警数）
+- 按告警来源的令牌桶限流，避免单一来源挤占全部容量
+- 过载时分级降级：跳过历史匹配 → 低优先级告警采样 → 拒绝并给出重试建议
+- 关键告警不参与采样和来源限流，并享有额外的保留容量
+
+本模块只依赖标准库，规则引擎（AlertAnalysisAgent）和 LLM 工作流（workflow.py）共用。
+"""
+
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# 降级等级（按严重程度递增）
+LEVEL_NORMAL = "normal"
+LEVEL_SKIP_HISTORY = "skip_history"
+LEVEL_SAMPLE_LOW = "sample_low"
+LEVEL_REJECT = "reject"
+
+# 告警优先级
+PRIORITY_CRITICAL = "critical"
+PRIORITY_HIGH = "high"
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"
+
+# 告警级别字段取值 -> 优先级
+_LEVEL_PRIORITY = {
+    "critical": PRIORITY_CRITICAL, "fatal": PRIORITY_CRITICAL, "p0": PRIORITY_CRITICAL,
+    "严重": PRIORITY_CRITICAL, "紧急": PRIORITY_CRITICAL,
+    "high": PRIORITY_HIGH, "error": PRIORITY_HIGH, "p1": PRIORITY_HIGH, "高": PRIORITY_HIGH,
+    "medium": PRIORITY_NORMAL, "p2": PRIORITY_NORMAL, "中": PRIORITY_NORMAL,
+    "warning": PRIORITY_LOW, "warn": PRIORITY_LOW, "low": PRIORITY_LOW, "info": PRIORITY_LOW,
+    "p3": PRIORITY_LOW, "低": PRIORITY_LOW, "信息": PRIORITY_LOW,
+}
+
+_LEVEL_PATTERN = re.compile(
+    r'(?:告警级别|级别|severity|level)\s*[:：]\s*([A-Za-z0-9]+|[一-鿿]{1,2})',
+    re.IGNORECASE
+)
+
+# 未标注级别时的关键词兜底
+_CRITICAL_KEYWORDS = ["系统崩溃", "服务中断", "数据丢失", "完全不可用", "业务中断"]
+
+
+def detect_priority(alert_details: str) -> str:
+    """
+    从告警文本中快速判断优先级（不做完整分析）
+
+    Args:
+        alert_details: 告警详细信息
+
+    Returns:
+        critical / high / normal / low 之一
+    """
+    match = _LEVEL_PATTERN.search(alert_details)
+    if match:
+        priority = _LEVEL_PRIORITY.get(match.group(1).lower())
+        if priority:
+            return priority
+
+    if any(keyword in alert_details for keyword in _CRITICAL_KEYWORDS):
+        return PRIORITY_CRITICAL
+
+    return PRIORITY_NORMAL
+
+
+class TokenBucket:
+    """线程安全的令牌桶"""
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（允许的突发量）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def try_acquire(self, amount: float = 1.0) -> bool:
+        """尝试取出令牌，不足时立即返回 False"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return True
+            return False
+
+    def force_acquire(self, amount: float = 1.0):
+        """强制取出令牌（允许透支），用于不受限流约束但仍需计入用量的请求"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+
+    def release(self, amount: float = 1.0):
+        """归还未使用的令牌（不超过桶容量）"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        """距离可以取出指定数量令牌还需等待的秒数"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= amount:
+                return 0.0
+            if self.rate <= 0:
+                return float("inf")
+            return (amount - self.tokens) / self.rate
+
+
+class AdmissionDecision:
+    """
+    准入决策
+
+    被准入的决策需要在处理结束后释放占用的队列名额，推荐用法：
+
+        decision = controller.admit(source, alert_details)
+        if not decision.admitted:
+            ...  # 按 decision.retry_after 给出重试建议
+        with decision:
+            ...  # 按 decision.skip_history 等标志执行分析
+    """
+
+    def __init__(self, controller: "AdmissionController", admitted: bool, level: str,
+                 priority: str, source: str, reason: str = "", retry_after: float = 0.0):
+        self.controller = controller
+        self.admitted = admitted
+        self.level = level
+        self.priority = priority
+        self.source = source
+        self.reason = reason
+        self.retry_after = retry_after
+        self._released = not admitted
+
+    @property
+    def skip_history(self) -> bool:
+        """当前负载下是否应跳过历史匹配"""
+        return self.level != LEVEL_NORMAL
+
+    def release(self):
+        """释放队列名额（可重复调用）"""
+        if not self._released:
+            self._released = True
+            self.controller._release()
+
+    def __enter__(self) -> "AdmissionDecision":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "admitted": self.admitted,
+            "level": self.level,
+            "priority": self.priority,
+            "source": self.source,
+            "reason": self.reason,
+            "retry_after": round(self.retry_after, 2),
+        }
+
+
+class AdmissionController:
+    """
+    告警准入控制器
+
+    负载 = 在途告警数 / max_queue，按负载比例决定降级等级：
+    - 低于 skip_history_ratio: 正常处理
+    - 低于 sample_low_ratio: 跳过历史匹配
+    - 低于 1.0: 跳过历史匹配，并按 low_severity_sample_rate 采样低优先级告警
+    - 达到上限: 拒绝非关键告警；关键告警可继续使用 critical_reserve 保留容量
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            config: 准入配置，字段含义见 config.ADMISSION_CONFIG
+        """
+        config = config or {}
+        self.max_queue = max(1, int(config.get("max_queue", 64)))
+        self.critical_reserve = max(0, int(config.get("critical_reserve", 16)))
+        self.skip_history_ratio = config.get("skip_history_ratio", 0.5)
+        self.sample_low_ratio = config.get("sample_low_ratio", 0.75)
+        self.low_severity_sample_rate = config.get("low_severity_sample_rate", 0.2)
+        self.source_rate = config.get("source_rate", 10.0)
+        self.source_burst = config.get("source_burst", 20)
+        self.retry_after = config.get("retry_after", 5.0)
+
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "admitted": 0,
+            "skip_history": 0,
+            "sampled_out": 0,
+            "rejected": 0,
+            "rate_limited": 0,
+            "max_in_flight": 0,
+        }
+
+    def _bucket(self, source: str) -> TokenBucket:
+        bucket = self._buckets.get(source)
+        if bucket is None:
+            bucket = self._buckets[source] = TokenBucket(self.source_rate, self.source_burst)
+        return bucket
+
+    def current_level(self) -> str:
+        """根据当前在途数量计算降级等级"""
+        load = self._in_flight / self.max_queue
+        if load >= 1.0:
+            return LEVEL_REJECT
+        if load >= self.sample_low_ratio:
+            return LEVEL_SAMPLE_LOW
+        if load >= self.skip_history_ratio:
+            return LEVEL_SKIP_HISTORY
+        return LEVEL_NORMAL
+
+    def admit(self, source: str = "default", alert_details: str = "",
+              priority: Optional[str] = None) -> AdmissionDecision:
+        """
+        对一条告警做准入判断
+
+        Args:
+            source: 告警来源（用于按来源限流）
+            alert_details: 告警详细信息（用于判断优先级）
+            priority: 显式指定的优先级，不提供则从告警文本推断
+
+        Returns:
+            准入决策；admitted 为 True 时调用方负责在处理结束后 release
+        """
+        priority = priority or detect_priority(alert_details)
+        critical = priority == PRIORITY_CRITICAL
+
+        with self._lock:
+            level = self.current_level()
+            bucket = self._bucket(source)
+
+            if critical:
+                # 关键告警只受保留容量约束，但仍计入来源用量
+                if self._in_flight >= self.max_queue + self.critical_reserve:
+                    self._stats["rejected"] += 1
+                    return AdmissionDecision(self, False, LEVEL_REJECT, priority, source,
+                                             reason="queue_full", retry_after=self.retry_after)
+                bucket.force_acquire()
+            else:
+                if level == LEVEL_REJECT:
+                    self._stats["rejected"] += 1
+                    return AdmissionDecision(self, False, level, priority, source,
+                                             reason="queue_full", retry_after=self.retry_after)
+                if not bucket.try_acquire():
+                    self._stats["rate_limited"] += 1
+                    wait = bucket.wait_time()
+                    retry_after = max(wait, 0.1) if wait != float("inf") else self.retry_after
+                    return AdmissionDecision(self, False, LEVEL_REJECT, priority, source,
+                                             reason="rate_limited", retry_after=retry_after)
+                if (level == LEVEL_SAMPLE_LOW and priority == PRIORITY_LOW
+                        and random.random() >= self.low_severity_sample_rate):
+                    self._stats["sampled_out"] += 1
+                    return AdmissionDecision(self, False, level, priority, source,
+                                             reason="sampled_out", retry_after=self.retry_after)
+
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._in_flight)
+            if level != LEVEL_NORMAL:
+                self._stats["skip_history"] += 1
+            return AdmissionDecision(self, True, level, priority, source)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+
+    def stats(self) -> Dict[str, Any]:
+        """准入与降载统计"""
+        with self._lock:
+            shed = {
+                "skip_history": self._stats["skip_history"],
+                "sampled_out": self._stats["sampled_out"],
+                "rejected": self._stats["rejected"],
+                "rate_limited": self._stats["rate_limited"],
+            }
+            return {
+                "admitted": self._stats["admitted"],
+                "in_flight": self._in_flight,
+                "max_in_flight": self._stats["max_in_flight"],
+                "level": self.current_level(),
+                "shed": shed,
+                "shed_total": shed["sampled_out"] + shed["rejected"] + shed["rate_limited"],
+            }
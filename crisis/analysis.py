@@ -1,14 +1,17 @@
 import json
 import re
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Set, Tuple
 from datetime import datetime
 import logging
 
 # 导入配置
 from .config import (
     ERROR_CODE_MAPPING, KNOWLEDGE_BASE, SEVERITY_KEYWORDS, 
-    SYSTEM_COMPONENTS, DEFAULT_CONFIG, RESPONSE_TEMPLATES
+    SYSTEM_COMPONENTS, DEFAULT_CONFIG, RESPONSE_TEMPLATES, ADMISSION_CONFIG,
+    INCIDENT_CONFIG
 )
+from .admission import AdmissionController, AdmissionDecision
+from .incident import IncidentStore
 
 class AlertAnalysisAgent:
     """
@@ -26,7 +29,7 @@ class AlertAnalysisAgent:
         Args:
             knowledge_base: 历史数据知识库
             error_code_mapping: 错误码映射库
-            config: 配置参数
+            config: 配置参数（可通过 "admission" 键覆盖准入控制配置）
             code_repository: 代码仓库访问接口
         """
         self.knowledge_base = knowledge_base or KNOWLEDGE_BASE
@@ -34,6 +37,9 @@ class AlertAnalysisAgent:
         self.config = {**DEFAULT_CONFIG, **(config or {})}
         self.code_repository = code_repository
         self.logger = self._setup_logger()
+        self.admission = AdmissionController({**ADMISSION_CONFIG, **self.config.get('admission', {})})
+        incident_config = {**INCIDENT_CONFIG, **self.config.get('incident', {})}
+        self.incidents = IncidentStore(incident_config['max_sessions'], incident_config['session_ttl'])
         
     def _setup_logger(self) -> logging.Logger:
         """设置日志记录器"""
@@ -50,38 +56,49 @@ class AlertAnalysisAgent:
         
         return logger
     
-    def analyze_alert(self, alert_details: str) -> str:
+    def analyze_alert(self, alert_details: str, source: str = "default") -> str:
         """
         分析告警的主要方法
         
         Args:
             alert_details: 告警详细信息
+            source: 告警来源，用于按来源限流
             
         Returns:
-            分析结果（XML格式）
+            分析结果（XML格式）；过载被降载时返回带重试建议的拒绝结果
         """
-        try:
-            self.logger.info("开始分析告警")
-            
-            # 1. 识别可能的触发原因
-            possible_causes = self._identify_possible_causes(alert_details)
-            
-            # 2. 评估影响范围
-            impact_assessment = self._assess_impact(alert_details)
-            
-            # 3. 提供针对性的响应措施
-            response_measures = self._generate_response_measures(alert_details, possible_causes)
-            
-            # 格式化输出
-            result = self._format_analysis_result(possible_causes, impact_assessment, response_measures)
-            self.logger.info("告警分析完成")
-            return result
-            
-        except Exception as e:
-            self.logger.error(f"告警分析过程中发生错误: {str(e)}")
-            return self._format_error_response(str(e))
+        decision = self.admission.admit(source, alert_details)
+        if not decision.admitted:
+            self.logger.warning(f"告警被准入控制拒绝: 来源={source}, 原因={decision.reason}")
+            return self._format_rejection_response(decision)
+        
+        with decision:
+            try:
+                self.logger.info("开始分析告警")
+                if decision.skip_history:
+                    self.logger.info(f"系统负载较高（{decision.level}），跳过历史匹配")
+                
+                # 1. 识别可能的触发原因
+                possible_causes = self._identify_possible_causes(
+                    alert_details, include_history=not decision.skip_history
+                )
+                
+                # 2. 评估影响范围
+                impact_assessment = self._assess_impact(alert_details)
+                
+                # 3. 提供针对性的响应措施
+                response_measures = self._generate_response_measures(alert_details, possible_causes)
+                
+                # 格式化输出
+                result = self._format_analysis_result(possible_causes, impact_assessment, response_measures)
+                self.logger.info("告警分析完成")
+                return result
+                
+            except Exception as e:
+                self.logger.error(f"告警分析过程中发生错误: {str(e)}")
+                return self._format_error_response(str(e))
     
-    def _identify_possible_causes(self, alert_details: str) -> List[str]:
+    def _identify_possible_causes(self, alert_details: str, include_history: bool = True) -> List[str]:
         """识别可能的触发原因"""
         causes = []
         
@@ -97,9 +114,10 @@ class AlertAnalysisAgent:
         keywords_analysis = self._analyze_keywords(alert_details)
         causes.extend(keywords_analysis)
         
-        # 历史数据比较
-        historical_analysis = self._compare_with_history(alert_details)
-        causes.extend(historical_analysis)
+        # 历史数据比较（高负载时跳过）
+        if include_history:
+            historical_analysis = self._compare_with_history(alert_details)
+            causes.extend(historical_analysis)
         
         # 系统组件分析
         component_analysis = self._analyze_system_components(alert_details)
@@ -162,14 +180,14 @@ class AlertAnalysisAgent:
         
         return causes
     
+    def _find_components(self, alert_details: str) -> List[str]:
+        """查找告警中提到的系统组件"""
+        alert_lower = alert_details.lower()
+        return [component for component in SYSTEM_COMPONENTS if component.lower() in alert_lower]
+    
     def _analyze_system_components(self, alert_details: str) -> List[str]:
         """分析涉及的系统组件"""
-        components_found = []
-        alert_lower = alert_details.lower()
-        
-        for component in SYSTEM_COMPONENTS:
-            if component.lower() in alert_lower:
-                components_found.append(component)
+        components_found = self._find_components(alert_details)
         
         causes = []
         if components_found:
@@ -180,33 +198,47 @@ class AlertAnalysisAgent:
     def _compare_with_history(self, alert_details: str) -> List[str]:
         """与历史数据比较分析"""
         historical_causes = []
+        
+        for similarity, event_id, event_data in self._match_history(self._tokenize_words(alert_details)):
+            historical_causes.append(self._format_historical_cause(similarity, event_id, event_data))
+            self.logger.debug(f"匹配历史事件: {event_id}, 相似度: {similarity:.2f}")
+        
+        return historical_causes
+    
+    def _match_history(self, words: Set[str]) -> List[Tuple[float, str, Dict[str, Any]]]:
+        """基于词集合匹配历史事件，返回按相似度排序的前几个匹配"""
         max_matches = self.config.get('max_historical_matches', 3)
         similarity_threshold = self.config.get('similarity_threshold', 0.6)
         
         similarities = []
         for event_id, event_data in self.knowledge_base.items():
-            similarity = self._calculate_similarity(alert_details, event_data.get('description', ''))
+            event_words = self._tokenize_words(event_data.get('description', ''))
+            similarity = self._similarity_from_words(words, event_words)
             if similarity > similarity_threshold:
                 similarities.append((similarity, event_id, event_data))
         
         # 按相似度排序，取前几个
         similarities.sort(reverse=True, key=lambda x: x[0])
-        
-        for similarity, event_id, event_data in similarities[:max_matches]:
-            historical_causes.append(
-                f"历史事件相似性分析 ({similarity:.2f}): "
-                f"事件 {event_id} - {event_data.get('cause', '未知原因')}"
-            )
-            self.logger.debug(f"匹配历史事件: {event_id}, 相似度: {similarity:.2f}")
-        
-        return historical_causes
+        return similarities[:max_matches]
+    
+    def _format_historical_cause(self, similarity: float, event_id: str, event_data: Dict[str, Any]) -> str:
+        """格式化历史事件匹配结果"""
+        return (
+            f"历史事件相似性分析 ({similarity:.2f}): "
+            f"事件 {event_id} - {event_data.get('cause', '未知原因')}"
+        )
+    
+    def _tokenize_words(self, text: str) -> Set[str]:
+        """提取文本词集合"""
+        return set(re.findall(r'\w+', text.lower()))
     
     def _calculate_similarity(self, text1: str, text2: str) -> float:
         """计算文本相似度（改进版）"""
+        return self._similarity_from_words(self._tokenize_words(text1), self._tokenize_words(text2))
+    
+    def _similarity_from_words(self, words1: Set[str], words2: Set[str]) -> float:
+        """基于词集合计算相似度"""
         # 简单的基于词汇重叠的相似度计算
-        words1 = set(re.findall(r'\w+', text1.lower()))
-        words2 = set(re.findall(r'\w+', text2.lower()))
-        
         if not words1 or not words2:
             return 0.0
         
@@ -221,13 +253,11 @@ class AlertAnalysisAgent:
         
         return jaccard * length_ratio
     
-    def _assess_impact(self, alert_details: str) -> str:
-        """评估影响范围和严重程度"""
+    def _detect_severity(self, alert_details: str) -> Tuple[str, int]:
+        """基于关键词确定严重程度，返回 (严重程度, 权重)"""
         max_severity = "信息"
         max_weight = 0
-        affected_systems = []
         
-        # 基于关键词确定严重程度
         for severity, data in SEVERITY_KEYWORDS.items():
             for keyword in data["keywords"]:
                 if keyword in alert_details:
@@ -235,6 +265,15 @@ class AlertAnalysisAgent:
                         max_weight = data["weight"]
                         max_severity = severity
         
+        return max_severity, max_weight
+    
+    def _assess_impact(self, alert_details: str) -> str:
+        """评估影响范围和严重程度"""
+        affected_systems = []
+        
+        # 基于关键词确定严重程度
+        max_severity, _ = self._detect_severity(alert_details)
+        
         # 识别受影响的系统组件
         alert_lower = alert_details.lower()
         for component in SYSTEM_COMPONENTS:
@@ -382,6 +421,31 @@ class AlertAnalysisAgent:
 3. 增强系统监控和自动恢复能力
 4. 定期进行系统健康检查
 </response_measures>
+</analysis>"""
+    
+    def _format_rejection_response(self, decision: AdmissionDecision) -> str:
+        """格式化准入拒绝响应（包含重试建议）"""
+        reasons = {
+            "queue_full": "分析队列已满",
+            "rate_limited": f"告警来源 {decision.source} 超出限流配额",
+            "sampled_out": "系统过载，低优先级告警被采样丢弃",
+        }
+        return f"""<analysis>
+<possible_causes>
+• 告警未分析: {reasons.get(decision.reason, decision.reason)}
+</possible_causes>
+
+<impact_assessment>
+严重程度: 未评估
+告警优先级: {decision.priority}
+</impact_assessment>
+
+<response_measures>
+即时措施:
+1. 请在 {decision.retry_after:.1f} 秒后重试
+2. 如为关键告警，请在告警级别中标注 CRITICAL 以获得优先处理
+</response_measures>
+<retry_after>{decision.retry_after:.1f}</retry_after>
 </analysis>"""
     
     def add_historical_data(self, event_id: str, event_data: Dict[str, Any]):
@@ -394,6 +458,142 @@ class AlertAnalysisAgent:
         self.error_code_mapping[error_code] = meaning
         self.logger.info(f"更新错误码映射: {error_code} -> {meaning}")
     
+    def analyze_incident_update(self, incident_id: str, alert_details: str,
+                                source: str = "default") -> Dict[str, Any]:
+        """
+        增量分析持续事件的一次告警更新
+        
+        只对相对上一次更新新增的内容提取错误码、组件和严重程度；历史匹配基于累计的词集合；
+        完整分析结果只在出现增量时重新生成。
+        
+        Args:
+            incident_id: 事件ID，同一事件的多次告警使用相同ID
+            alert_details: 本次收到的完整告警信息
+            source: 告警来源，用于按来源限流
+            
+        Returns:
+            增量信息（新增错误码、新增组件、严重程度变化、新增历史匹配）和完整分析结果
+        """
+        decision = self.admission.admit(source, alert_details)
+        if not decision.admitted:
+            self.logger.warning(f"事件 {incident_id} 的更新被准入控制拒绝: 原因={decision.reason}")
+            return {
+                "incident_id": incident_id,
+                "admitted": False,
+                "retry_after": decision.retry_after,
+                "analysis": self._format_rejection_response(decision),
+            }
+        
+        session = self.incidents.get_or_create(incident_id)
+        with decision, session.lock:
+            try:
+                first_update = session.is_new
+                new_text = session.apply_update(alert_details)
+                state = session.state
+                if first_update:
+                    state.update({
+                        "error_codes": set(),
+                        "components": set(),
+                        "keyword_causes": {},
+                        "severity": ("信息", 0),
+                        "historical_matches": {},
+                        "words": set(),
+                    })
+                
+                # 只分析新增内容
+                new_codes = sorted(set(self._extract_error_codes(new_text)) - state["error_codes"])
+                state["error_codes"].update(new_codes)
+                
+                new_components = [c for c in self._find_components(new_text) if c not in state["components"]]
+                state["components"].update(new_components)
+                
+                new_keyword_causes = [c for c in self._analyze_keywords(new_text) if c not in state["keyword_causes"]]
+                state["keyword_causes"].update(dict.fromkeys(new_keyword_causes))
+                
+                previous_severity = state["severity"][0]
+                severity = self._detect_severity(new_text)
+                if severity[1] > state["severity"][1]:
+                    state["severity"] = severity
+                
+                # 历史匹配基于累计词集合，高负载时跳过
+                state["words"].update(self._tokenize_words(new_text))
+                new_matches = []
+                if new_text and not decision.skip_history:
+                    for similarity, event_id, event_data in self._match_history(state["words"]):
+                        if event_id not in state["historical_matches"]:
+                            state["historical_matches"][event_id] = similarity
+                            new_matches.append(event_id)
+                
+                severity_changed = not first_update and state["severity"][0] != previous_severity
+                changed = first_update or bool(
+                    new_codes or new_components or new_keyword_causes or new_matches or severity_changed
+                )
+                
+                if changed:
+                    possible_causes = self._causes_from_incident_state(state)
+                    impact_assessment = self._assess_impact(session.text)
+                    response_measures = self._generate_response_measures(session.text, possible_causes)
+                    session.result = self._format_analysis_result(
+                        possible_causes, impact_assessment, response_measures
+                    )
+                    self.logger.info(f"事件 {incident_id} 第 {session.updates} 次更新，分析结果已更新")
+                else:
+                    self.logger.info(f"事件 {incident_id} 第 {session.updates} 次更新无新增信息，复用上次分析")
+                
+                return {
+                    "incident_id": incident_id,
+                    "admitted": True,
+                    "update": session.updates,
+                    "changed": changed,
+                    "new_error_codes": new_codes,
+                    "new_components": new_components,
+                    "severity": state["severity"][0],
+                    "previous_severity": None if first_update else previous_severity,
+                    "severity_changed": severity_changed,
+                    "new_historical_matches": new_matches,
+                    "analysis": session.result,
+                }
+            
+            except Exception as e:
+                self.logger.error(f"事件增量分析过程中发生错误: {str(e)}")
+                return {
+                    "incident_id": incident_id,
+                    "admitted": True,
+                    "error": str(e),
+                    "analysis": self._format_error_response(str(e)),
+                }
+    
+    def _causes_from_incident_state(self, state: Dict[str, Any]) -> List[str]:
+        """根据事件累计状态生成可能原因列表（顺序与 _identify_possible_causes 一致）"""
+        causes = []
+        for code in sorted(state["error_codes"]):
+            if code in self.error_code_mapping:
+                causes.append(f"错误码 {code}: {self.error_code_mapping[code]}")
+        
+        causes.extend(state["keyword_causes"])
+        
+        for event_id, similarity in state["historical_matches"].items():
+            event_data = self.knowledge_base.get(event_id, {})
+            causes.append(self._format_historical_cause(similarity, event_id, event_data))
+        
+        components = [c for c in SYSTEM_COMPONENTS if c in state["components"]]
+        if components:
+            causes.append(f"涉及系统组件: {', '.join(components)}")
+        
+        if not causes:
+            causes.append("需要进一步调查：告警信息中未发现已知错误模式")
+        
+        return causes
+    
+    def close_incident(self, incident_id: str):
+        """事件结束时释放会话状态"""
+        self.incidents.close(incident_id)
+        self.logger.info(f"关闭事件会话: {incident_id}")
+    
+    def get_admission_stats(self) -> Dict[str, Any]:
+        """获取准入控制与降载统计"""
+        return self.admission.stats()
+    
     def get_analysis_summary(self, alert_details: str) -> Dict[str, Any]:
         """获取分析摘要（结构化数据）"""
         try:
@@ -0,0 +1,200 @@
+"""
+Message Batches 批量执行
+
+离线的大批量请求（如每晚重新分析前一天的告警、批量问答）通过 Message Batches API 提交：
+- 按 custom_id 提交一批请求，带退避地轮询处理状态，结束后流式读取结果
+- 批量接口有独立的限额，不与实时流量争抢速率限制
+- 接口不支持批量（如部分中转 API 返回 404）时自动回退为限速的实时调用
+
+本模块只依赖 anthropic SDK，agent.py 和 crisis 工作流共用。
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import anthropic
+
+# 表示接口不支持批量处理的状态码（403 是密钥或权限问题，照常报错，不回退为实时调用）
+UNSUPPORTED_STATUS = {404, 405, 501}
+
+
+class BatchResult:
+    """单个请求的结果"""
+
+    __slots__ = ("custom_id", "text", "error", "usage", "mode")
+
+    def __init__(self, custom_id: str, text: str = "", error: Optional[str] = None,
+                 usage: Any = None, mode: str = "batch"):
+        self.custom_id = custom_id
+        self.text = text
+        self.error = error
+        self.usage = usage
+        self.mode = mode  # "batch" 或 "realtime"（回退的实时调用）
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        status = "ok" if self.ok else f"error={self.error!r}"
+        return f"BatchResult({self.custom_id!r}, {status}, mode={self.mode!r})"
+
+
+def message_text(message: Any) -> str:
+    """拼接消息中的文本块"""
+    return "".join(block.text for block in message.content if getattr(block, "type", None) == "text")
+
+
+def is_unsupported(exc: BaseException) -> bool:
+    """判断异常是否表示接口不支持 Message Batches"""
+    if isinstance(exc, anthropic.APIResponseValidationError):
+        return True
+    return getattr(exc, "status_code", None) in UNSUPPORTED_STATUS
+
+
+class BatchRunner:
+    """
+    Message Batches 执行器
+
+    run() 接收 (custom_id, params) 列表，params 与 messages.create 的参数相同，
+    按完成顺序返回 BatchResult。
+    """
+
+    def __init__(self, client: anthropic.Anthropic, poll_interval: float = 5.0,
+                 max_poll_interval: float = 60.0, poll_backoff: float = 1.5,
+                 timeout: float = 24 * 3600, max_batch_size: int = 10000,
+                 fallback_concurrency: int = 2, fallback_rpm: float = 30,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        Args:
+            client: Anthropic 客户端
+            poll_interval: 首次轮询间隔（秒）
+            max_poll_interval: 最长轮询间隔（秒）
+            poll_backoff: 每次轮询后间隔的增长倍数
+            timeout: 批次最长等待时间（秒），超时后取消批次，未完成的请求以错误返回
+            max_batch_size: 单个批次的最大请求数，超出时拆分为多个批次
+            fallback_concurrency: 回退为实时调用时的并发数
+            fallback_rpm: 回退为实时调用时的每分钟请求数上限，避免挤占实时流量
+            sleep: 等待函数（测试时可替换）
+        """
+        self.client = client
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_backoff = poll_backoff
+        self.timeout = timeout
+        self.max_batch_size = max_batch_size
+        self.fallback_concurrency = max(1, fallback_concurrency)
+        self.fallback_rpm = fallback_rpm
+        self.sleep = sleep
+        # None 表示尚未探测，False 表示接口不支持批量，之后直接走实时调用
+        self.supported: Optional[bool] = None
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+        self._stats = {"batches": 0, "batch_requests": 0, "realtime_requests": 0,
+                       "polls": 0, "fallbacks": 0, "errors": 0}
+
+    def run(self, requests: Iterable[Tuple[str, Dict[str, Any]]]) -> Iterator[BatchResult]:
+        """
+        执行一批请求
+
+        Args:
+            requests: [(custom_id, messages.create 参数), ...]
+
+        Yields:
+            BatchResult，顺序与输入无关，按 custom_id 对应
+        """
+        requests = list(requests)
+        for start in range(0, len(requests), self.max_batch_size):
+            chunk = requests[start:start + self.max_batch_size]
+            if self.supported is False:
+                yield from self._run_realtime(chunk)
+                continue
+            try:
+                batch = self.client.messages.batches.create(
+                    requests=[{"custom_id": custom_id, "params": params} for custom_id, params in chunk]
+                )
+            except anthropic.APIError as e:
+                if not is_unsupported(e):
+                    raise
+                print(f"⚠️ 接口不支持 Message Batches（{type(e).__name__}），回退为限速的实时调用")
+                self.supported = False
+                with self._lock:
+                    self._stats["fallbacks"] += 1
+                yield from self._run_realtime(chunk)
+                continue
+
+            self.supported = True
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["batch_requests"] += len(chunk)
+            self._wait_until_ended(batch.id)
+            yield from self._results(batch.id)
+
+    def _wait_until_ended(self, batch_id: str):
+        interval = self.poll_interval
+        deadline = time.monotonic() + self.timeout
+        cancelled = False
+        while True:
+            batch = self.client.messages.batches.retrieve(batch_id)
+            with self._lock:
+                self._stats["polls"] += 1
+            if batch.processing_status == "ended":
+                return
+            if not cancelled and time.monotonic() >= deadline:
+                print(f"⚠️ 批次 {batch_id} 超时，正在取消")
+                self.client.messages.batches.cancel(batch_id)
+                cancelled = True
+            self.sleep(interval)
+            interval = min(self.max_poll_interval, interval * self.poll_backoff)
+
+    def _results(self, batch_id: str) -> Iterator[BatchResult]:
+        for entry in self.client.messages.batches.results(batch_id):
+            result = entry.result
+            if result.type == "succeeded":
+                yield BatchResult(entry.custom_id, message_text(result.message), usage=result.message.usage)
+                continue
+            if result.type == "errored":
+                error = getattr(result.error, "error", result.error)
+                message = getattr(error, "message", None) or str(error)
+            else:
+                message = result.type  # canceled / expired
+            with self._lock:
+                self._stats["errors"] += 1
+            yield BatchResult(entry.custom_id, error=message)
+
+    def _throttle(self):
+        if self.fallback_rpm <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + 60.0 / self.fallback_rpm
+        if start > now:
+            self.sleep(start - now)
+
+    def _call_realtime(self, custom_id: str, params: Dict[str, Any]) -> BatchResult:
+        self._throttle()
+        try:
+            message = self.client.messages.create(**params)
+        except anthropic.APIError as e:
+            with self._lock:
+                self._stats["errors"] += 1
+            return BatchResult(custom_id, error=f"{type(e).__name__}: {e}", mode="realtime")
+        return BatchResult(custom_id, message_text(message), usage=message.usage, mode="realtime")
+
+    def _run_realtime(self, requests: List[Tuple[str, Dict[str, Any]]]) -> Iterator[BatchResult]:
+        with self._lock:
+            self._stats["realtime_requests"] += len(requests)
+        with ThreadPoolExecutor(max_workers=self.fallback_concurrency) as executor:
+            futures = [executor.submit(self._call_realtime, custom_id, params) for custom_id, params in requests]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def stats(self) -> Dict[str, Any]:
+        """批次数、批量/实时请求数、轮询次数和回退次数"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["supported"] = self.supported
+        return stats
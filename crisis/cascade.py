@@ -0,0 +1,153 @@
+"""
+模型级联
+
+分类、路由选择这类步骤输出很短、延迟敏感，大多数情况下小模型就能给出可靠结果。
+ModelCascade 按步骤配置模型梯队，先用最快的模型：
+- 结果被接受（能解析且置信度不是 低/中）时直接返回
+- 解析失败、置信度不足或调用出错时升级到下一级模型，最后一级的结果总是被接受
+- 按步骤统计升级率、各级模型的平均延迟，以及相对全部使用最后一级模型估算节省的延迟
+
+未配置梯队的步骤（或级联关闭时）只使用默认模型，行为与之前相同。
+"""
+
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+
+class _StepStats:
+    def __init__(self):
+        self.calls = 0
+        self.escalations = 0
+        self.errors = 0
+        self.latency = 0.0
+        # 模型 -> [调用次数, 总延迟]
+        self.models: Dict[str, List[float]] = {}
+
+    def observe(self, model: str, latency: float):
+        entry = self.models.setdefault(model, [0, 0.0])
+        entry[0] += 1
+        entry[1] += latency
+
+
+class ModelCascade:
+    """按步骤的模型梯队，置信度不足或解析失败时升级到更大的模型"""
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        Args:
+            config: 级联配置，见 config.MODEL_CASCADE_CONFIG（运行时修改 enabled 立即生效）
+        """
+        self.config = config
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _StepStats] = {}
+
+    def models(self, step: str) -> List[str]:
+        """该步骤依次尝试的模型"""
+        if self.config["enabled"] and self.config["tiers"].get(step):
+            return list(self.config["tiers"][step])
+        return [self.config["default_model"]]
+
+    def confident(self, confidence: str) -> bool:
+        """置信度是否足以接受当前模型的结果（缺失视为不足）"""
+        value = confidence.strip().lower()
+        return bool(value) and value not in self.config["escalate_confidence"]
+
+    def run(self, step: str, call: Callable[[str], str], accept: Callable[[str], bool]) -> str:
+        """
+        按梯队调用模型，返回第一个被接受的结果
+
+        Args:
+            step: 步骤名称（对应配置中的 tiers）
+            call: 用指定模型发起调用的函数
+            accept: 判断结果是否可接受（可解析且置信度足够）
+
+        Returns:
+            被接受的响应，或最后一级模型的响应
+        """
+        models = self.models(step)
+        start = time.monotonic()
+        for tier, model in enumerate(models):
+            last = tier == len(models) - 1
+            tier_start = time.monotonic()
+            try:
+                response = call(model)
+            except Exception:
+                self._record_error(step, model, time.monotonic() - tier_start)
+                if last:
+                    raise
+                continue
+            if last or self._accepted(accept, response):
+                self._record(step, model, tier, time.monotonic() - tier_start, time.monotonic() - start)
+                return response
+            self._observe(step, model, time.monotonic() - tier_start)
+
+    async def arun(self, step: str, call: Callable[[str], Awaitable[str]], accept: Callable[[str], bool]) -> str:
+        """run 的异步版本"""
+        models = self.models(step)
+        start = time.monotonic()
+        for tier, model in enumerate(models):
+            last = tier == len(models) - 1
+            tier_start = time.monotonic()
+            try:
+                response = await call(model)
+            except Exception:
+                self._record_error(step, model, time.monotonic() - tier_start)
+                if last:
+                    raise
+                continue
+            if last or self._accepted(accept, response):
+                self._record(step, model, tier, time.monotonic() - tier_start, time.monotonic() - start)
+                return response
+            self._observe(step, model, time.monotonic() - tier_start)
+
+    @staticmethod
+    def _accepted(accept: Callable[[str], bool], response: str) -> bool:
+        try:
+            return bool(accept(response))
+        except Exception:
+            return False
+
+    def _step(self, step: str) -> _StepStats:
+        return self._stats.setdefault(step, _StepStats())
+
+    def _observe(self, step: str, model: str, latency: float):
+        with self._lock:
+            self._step(step).observe(model, latency)
+
+    def _record_error(self, step: str, model: str, latency: float):
+        with self._lock:
+            stats = self._step(step)
+            stats.errors += 1
+            stats.observe(model, latency)
+
+    def _record(self, step: str, model: str, tier: int, latency: float, total: float):
+        with self._lock:
+            stats = self._step(step)
+            stats.observe(model, latency)
+            stats.calls += 1
+            stats.escalations += tier > 0
+            stats.latency += total
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        各步骤的调用数、升级次数和升级率、各级模型的平均延迟，以及估算节省的延迟
+
+        节省的延迟 = 调用数 × 最后一级模型的平均延迟 − 实际总延迟（含升级前小模型的耗时）；
+        最后一级模型还没有被调用过时无法估算，为 None。
+        """
+        result = {}
+        with self._lock:
+            for step, stats in self._stats.items():
+                models = self.models(step)
+                avg = {model: round(total / count, 3) for model, (count, total) in stats.models.items() if count}
+                baseline = avg.get(models[-1])
+                result[step] = {
+                    "calls": stats.calls,
+                    "escalations": stats.escalations,
+                    "escalation_rate": round(stats.escalations / stats.calls, 3) if stats.calls else 0.0,
+                    "errors": stats.errors,
+                    "avg_latency_s": avg,
+                    "latency_saved_s": round(stats.calls * baseline - stats.latency, 3) if baseline else None,
+                }
+        return result
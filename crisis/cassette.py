@@ -0,0 +1,365 @@
+"""
+请求录制与回放（cassette）
+
+在 httpx 传输层录制真实的请求/响应，回放时不访问 API，用于可复现、零成本的端到端基准测试：
+- record：照常请求，并把响应（含流式响应每个数据块的到达时间）写入 cassette 文件，覆盖原有录制
+- replay：只从 cassette 返回响应，未录制的请求返回 400（cassette miss）
+- auto：已录制的请求回放，未录制的请求照常发出并追加录制
+- 回放可按原始时间（speed=1）、压缩时间（speed>1）或无延迟（speed=0）返回
+
+cassette 文件为 JSONL（.gz 结尾时 gzip 压缩），每行一次交互，按请求内容的哈希匹配；
+同一请求录制多次时按顺序回放（如 529 后的重试），用完后重复最后一次。
+录制的交互先缓存在内存中，flush()（退出 use_cassette、切换 cassette 或进程退出时自动调用）时写入；
+.gz 文件每次整体重写，只有一个 gzip 成员。
+
+用法：
+    with use_cassette("bench.jsonl.gz", mode="replay", speed=0):
+        analyze_alert(...)
+
+或设置环境变量 LLM_CASSETTE=路径、LLM_CASSETTE_MODE=record|replay|auto、LLM_CASSETTE_SPEED=1，
+客户端创建时自动启用。本模块只依赖 httpx，agent.py 和 crisis 工作流共用。
+"""
+
+import asyncio
+import atexit
+import codecs
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+MODES = ("record", "replay", "auto")
+
+# 回放时保留的响应头，其余（日期、限额、连接相关）不录制
+KEPT_HEADERS = ("content-type", "request-id", "retry-after", "retry-after-ms", "x-should-retry")
+
+
+def request_key(request: httpx.Request) -> str:
+    """按方法、路径和请求体（JSON 规范化后）计算匹配键"""
+    body = request.read()
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False).encode("utf-8")
+    except ValueError:
+        pass
+    digest = hashlib.sha256(f"{request.method} {request.url.path}\n".encode("utf-8") + body)
+    return digest.hexdigest()[:32]
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Cassette:
+    """一个 cassette 文件及其回放状态"""
+
+    def __init__(self, path: str, mode: str = "replay", speed: float = 1.0):
+        """
+        Args:
+            path: cassette 文件路径（.gz 结尾时压缩）
+            mode: "record"、"replay" 或 "auto"
+            speed: 回放速度倍数，1 为原始时间，10 为压缩到 1/10，0 表示不等待
+        """
+        if mode not in MODES:
+            raise ValueError(f"未知的 cassette 模式: {mode}，可选 {MODES}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._interactions: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._cursor: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._stats = {"replayed": 0, "recorded": 0, "misses": 0}
+        # 尚未写入的交互；.gz 文件整体重写，_written 保留文件中已有的行
+        self._pending: List[str] = []
+        self._written: List[str] = []
+        # record 模式第一次写入时覆盖原文件，auto 模式追加
+        self._truncate = mode == "record"
+        if mode != "record" and os.path.exists(path):
+            self._load()
+        if mode != "replay":
+            atexit.register(self.flush)
+
+    def _load(self):
+        with _open(self.path, "r") as f:
+            for line in f:
+                if line.strip():
+                    interaction = json.loads(line)
+                    self._interactions[interaction["key"]].append(interaction)
+                    self._written.append(line if line.endswith("\n") else line + "\n")
+
+    def next(self, key: str) -> Optional[Dict[str, Any]]:
+        """取出该请求的下一次录制，用完后重复最后一次"""
+        with self._lock:
+            recorded = self._interactions.get(key)
+            if not recorded:
+                self._stats["misses"] += 1
+                return None
+            index = min(self._cursor[key], len(recorded) - 1)
+            self._cursor[key] += 1
+            self._stats["replayed"] += 1
+            return recorded[index]
+
+    def save(self, interaction: Dict[str, Any]):
+        """记录一次交互（flush 时写入文件），auto 模式下立即可供回放"""
+        line = json.dumps(interaction, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._pending.append(line)
+            self._stats["recorded"] += 1
+            if self.mode == "auto":
+                self._interactions[interaction["key"]].append(interaction)
+                self._cursor[interaction["key"]] += 1
+
+    def flush(self):
+        """把尚未写入的交互写入文件：.gz 文件整体重写并压缩一次，其他文件追加（record 模式首次写入时覆盖）"""
+        with self._lock:
+            if not self._pending:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            if self.path.endswith(".gz"):
+                self._written += self._pending
+                tmp_path = f"{self.path}.tmp"
+                with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                    f.writelines(self._written)
+                os.replace(tmp_path, self.path)
+            else:
+                with _open(self.path, "w" if self._truncate else "a") as f:
+                    f.writelines(self._pending)
+            self._pending = []
+            self._truncate = False
+
+    def delay(self, offset: float, start: float) -> float:
+        """距离录制时的 offset（按 speed 缩放）还需等待的秒数"""
+        if self.speed <= 0:
+            return 0.0
+        return max(0.0, start + offset / self.speed - time.perf_counter())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "mode": self.mode, "speed": self.speed,
+                    "requests": len(self._interactions)}
+
+
+# 当前启用的 cassette；None 时传输层直接透传
+_active: Optional[Cassette] = None
+
+
+def activate(path: str, mode: str = "replay", speed: float = 1.0) -> Cassette:
+    """启用 cassette，之后经过 CassetteTransport 的请求都会被录制或回放"""
+    global _active
+    if _active is not None:
+        _active.flush()
+    _active = Cassette(path, mode, speed)
+    return _active
+
+
+def deactivate():
+    global _active
+    if _active is not None:
+        _active.flush()
+    _active = None
+
+
+def active() -> Optional[Cassette]:
+    return _active
+
+
+@contextmanager
+def use_cassette(path: str, mode: str = "replay", speed: float = 1.0) -> Iterator[Cassette]:
+    """在 with 块内启用 cassette，退出后恢复之前的设置"""
+    global _active
+    previous = _active
+    cassette = Cassette(path, mode, speed)
+    _active = cassette
+    try:
+        yield cassette
+    finally:
+        cassette.flush()
+        _active = previous
+
+
+if os.getenv("LLM_CASSETTE"):
+    activate(os.environ["LLM_CASSETTE"], os.getenv("LLM_CASSETTE_MODE", "replay"),
+             float(os.getenv("LLM_CASSETTE_SPEED", "1")))
+
+
+class _Recorder:
+    """记录响应数据块及其相对请求开始的到达时间，响应读完或关闭时写入 cassette"""
+
+    def __init__(self, cassette: Cassette, request: httpx.Request, key: str,
+                 response: httpx.Response, start: float):
+        self.cassette = cassette
+        self.start = start
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.chunks: List[List[Any]] = []
+        self.saved = False
+        try:
+            body = json.loads(request.content)
+        except ValueError:
+            body = {}
+        self.interaction = {
+            "key": key,
+            "method": request.method,
+            "path": request.url.path,
+            "model": body.get("model"),
+            "stream": bool(body.get("stream")),
+            "status": response.status_code,
+            "headers": {k: v for k, v in response.headers.items() if k.lower() in KEPT_HEADERS},
+            "ttfb": round(time.perf_counter() - start, 4),
+        }
+
+    def chunk(self, data: bytes):
+        text = self.decoder.decode(data)
+        if text:
+            self.chunks.append([round(time.perf_counter() - self.start, 4), text])
+
+    def done(self):
+        if self.saved:
+            return
+        self.saved = True
+        tail = self.decoder.decode(b"", final=True)
+        if tail:
+            self.chunks.append([round(time.perf_counter() - self.start, 4), tail])
+        self.cassette.save(dict(self.interaction, chunks=self.chunks))
+
+
+class _RecordingStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    def __init__(self, stream, recorder: _Recorder):
+        self.stream = stream
+        self.recorder = recorder
+
+    def __iter__(self) -> Iterator[bytes]:
+        for data in self.stream:
+            self.recorder.chunk(data)
+            yield data
+        self.recorder.done()
+
+    async def __aiter__(self):
+        async for data in self.stream:
+            self.recorder.chunk(data)
+            yield data
+        self.recorder.done()
+
+    def close(self):
+        # 客户端提前关闭流时同样保存已收到的部分，回放时在同一位置结束
+        self.recorder.done()
+        self.stream.close()
+
+    async def aclose(self):
+        self.recorder.done()
+        await self.stream.aclose()
+
+
+class _ReplayStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    def __init__(self, cassette: Cassette, chunks: List[List[Any]], start: float):
+        self.cassette = cassette
+        self.chunks = chunks
+        self.start = start
+
+    def __iter__(self) -> Iterator[bytes]:
+        for offset, text in self.chunks:
+            wait = self.cassette.delay(offset, self.start)
+            if wait:
+                time.sleep(wait)
+            yield text.encode("utf-8")
+
+    async def __aiter__(self):
+        for offset, text in self.chunks:
+            wait = self.cassette.delay(offset, self.start)
+            if wait:
+                await asyncio.sleep(wait)
+            yield text.encode("utf-8")
+
+
+def _miss_response(request: httpx.Request) -> httpx.Response:
+    # 400 不会被 SDK 重试，错误信息直接返回给调用方
+    return httpx.Response(400, json={"type": "error", "error": {
+        "type": "invalid_request_error",
+        "message": f"cassette miss: {request.method} {request.url.path} 没有录制（replay 模式）",
+    }}, request=request)
+
+
+class CassetteTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    包装真实的 httpx 传输层：没有启用 cassette 时透传，启用后录制或回放
+
+    同步和异步客户端都可以使用，inner 需与客户端类型一致。
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def _begin(self, request: httpx.Request):
+        cassette = _active
+        if cassette is None:
+            return None, None, None
+        key = request_key(request)
+        interaction = cassette.next(key) if cassette.mode != "record" else None
+        if interaction is None and cassette.mode != "replay":
+            # 录制时不接受压缩编码，数据块以文本保存
+            request.headers["Accept-Encoding"] = "identity"
+        return cassette, key, interaction
+
+    def _replay(self, cassette: Cassette, interaction: Dict[str, Any], request: httpx.Request,
+                start: float) -> httpx.Response:
+        return httpx.Response(interaction["status"], headers=interaction["headers"],
+                              stream=_ReplayStream(cassette, interaction["chunks"], start), request=request)
+
+    def _record(self, cassette: Cassette, key: str, request: httpx.Request,
+                response: httpx.Response, start: float) -> httpx.Response:
+        recorder = _Recorder(cassette, request, key, response, start)
+        return httpx.Response(response.status_code, headers=response.headers,
+                              stream=_RecordingStream(response.stream, recorder),
+                              extensions=response.extensions, request=request)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        cassette, key, interaction = self._begin(request)
+        if cassette is None:
+            return self.inner.handle_request(request)
+        if interaction is not None:
+            time.sleep(cassette.delay(interaction["ttfb"], start))
+            return self._replay(cassette, interaction, request, start)
+        if cassette.mode == "replay":
+            return _miss_response(request)
+        return self._record(cassette, key, request, self.inner.handle_request(request), start)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        cassette, key, interaction = self._begin(request)
+        if cassette is None:
+            return await self.inner.handle_async_request(request)
+        if interaction is not None:
+            await asyncio.sleep(cassette.delay(interaction["ttfb"], start))
+            return self._replay(cassette, interaction, request, start)
+        if cassette.mode == "replay":
+            return _miss_response(request)
+        return self._record(cassette, key, request, await self.inner.handle_async_request(request), start)
+
+    def close(self):
+        self.inner.close()
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+def cassette_transport(proxy: Optional[str] = None, is_async: bool = False, **kwargs) -> CassetteTransport:
+    """
+    创建可录制/回放的传输层
+
+    httpx 客户端传入 transport 后不再处理 proxy 和 limits 参数，需要在这里传给内层传输层。
+
+    Args:
+        proxy: 代理地址
+        is_async: 是否用于 AsyncClient
+        **kwargs: 传给 httpx.HTTPTransport / AsyncHTTPTransport 的其他参数（如 limits）
+    """
+    inner_class = httpx.AsyncHTTPTransport if is_async else httpx.HTTPTransport
+    return CassetteTransport(inner_class(proxy=proxy, **kwargs))
@@ -0,0 +1,331 @@
+"""
+告警内容压缩
+
+带长堆栈、重复日志行和 User-Agent 的告警原样嵌入提示词时，输入 token 数和首 token 延迟都会明显增加。
+AlertCompactor 在告警进入提示词前做确定性的压缩：
+- 去掉公共缩进和行尾空白
+- 连续重复的行或行块（如递归堆栈、只有时间戳不同的日志行）只保留一次并注明重复次数
+- 连续的框架堆栈帧（java.*、org.springframework.*、node_modules 等）折叠为一行，异常后的第一帧和应用帧保留
+- 高熵 ID（UUID、长十六进制串、JWT、随机令牌）替换为占位符，错误码等短数字不受影响
+- User-Agent 缩短为浏览器和平台
+- 仍超过 token 预算时，按重要性从低到高、从后往前省略行，错误信息、错误码和应用帧最后才被省略
+
+压缩只影响提示词中的告警内容，模板缓存、预分类和历史检索仍使用原始告警。
+"""
+
+import math
+import re
+import textwrap
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from tokens import estimate_tokens, truncate_to_tokens
+
+# 最多识别的重复行块长度（如递归调用中 A → B → A → B 的周期为 2）
+MAX_REPEAT_PERIOD = 4
+
+# 每段省略标记预留的 token 数
+MARKER_TOKENS = 8
+
+# 堆栈帧：Java "at pkg.Class.method(File.java:12)"，JavaScript "at fn (url:line:col)" 或 "at url:line:col"
+_JAVA_FRAME = re.compile(r'^\s*at\s+([\w$.<>\[\]/-]+)\((.*)\)\s*$')
+_JS_FRAME = re.compile(r'^\s*at\s+(?:(.+?)\s+\()?(\S+?):\d+(?::\d+)?\)?\s*$')
+_EXCEPTION_LINE = re.compile(r'(?:Exception|Error|Caused by|错误|异常|失败)', re.IGNORECASE)
+
+# 高熵 ID（按顺序应用）
+_ID_MASKS = [
+    (re.compile(r'(?<![\w-])eyJ[\w-]{8,}\.[\w-]{8,}\.[\w-]{8,}'), "<JWT>"),
+    (re.compile(r'(?<![0-9A-Za-z])[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'
+                r'(?![0-9A-Za-z])'), "<UUID>"),
+    (re.compile(r'(?<![0-9A-Za-z])(?=[0-9a-fA-F]*[a-fA-F])(?=[0-9a-fA-F]*\d)[0-9a-fA-F]{16,}(?![0-9A-Za-z])'), "<HEX>"),
+]
+_TOKEN_CANDIDATE = re.compile(r'(?<![A-Za-z0-9_-])[A-Za-z0-9_-]{20,}(?![A-Za-z0-9_-])')
+_DIGITS = re.compile(r'\d+')
+_ERROR_CODE = re.compile(r'(?<!\d)\d{3,6}(?!\d)')
+_CODE_FIELD = re.compile(r'(?:码|code|状态|status)', re.IGNORECASE)
+# 字段名后的错误码/状态码（如 "status=502"、"错误码: 10205"、"HTTP/1.1 504"），合并重复行时保留
+_CODE_VALUE = re.compile(r'(?:(?:码|code|状态|status)[\s"\'=:：]*|HTTP(?:/[\d.]+)?\s+)\d{3,6}(?!\d)', re.IGNORECASE)
+_FIELD_LINE = re.compile(r'\s*[^\s:：]{1,20}\s*[:：]')
+
+_USER_AGENT = re.compile(r'Mozilla/\d\.\d\s*\(([^)]*)\)[^\n]*')
+_BROWSERS = [
+    re.compile(p) for p in (
+        r'MicroMessenger/[\d.]+', r'uni-app', r'Edg[A-Z]?/[\d.]+', r'OPR/[\d.]+', r'Firefox/[\d.]+',
+        r'CriOS/[\d.]+', r'Chrome/[\d.]+', r'Version/[\d.]+(?=.*Safari)', r'AppleWebKit/[\d.]+',
+    )
+]
+_PLATFORM_NOISE = {"u", "k", "wv", "x64", "win64", "wow64", "x11"}
+
+# 压缩统计中的各项操作
+ACTIONS = ("collapsed_lines", "folded_frames", "masked_ids", "user_agents", "dropped_lines", "truncated")
+
+
+class CompactedAlert:
+    """一次压缩的结果"""
+
+    def __init__(self, text: str, tokens_before: int, tokens_after: int, actions: Dict[str, int]):
+        self.text = text
+        self.tokens_before = tokens_before
+        self.tokens_after = tokens_after
+        self.actions = actions
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    @property
+    def ratio(self) -> float:
+        """压缩后 / 压缩前的 token 比例"""
+        return round(self.tokens_after / self.tokens_before, 3) if self.tokens_before else 1.0
+
+    def __repr__(self) -> str:
+        return f"CompactedAlert({self.tokens_before} -> {self.tokens_after} tokens, {self.actions})"
+
+
+def _entropy(text: str) -> float:
+    counts = Counter(text)
+    return -sum(c / len(text) * math.log2(c / len(text)) for c in counts.values())
+
+
+def _looks_random(token: str) -> bool:
+    """同时含大小写字母和数字且字符分布接近随机的长串（会话令牌、签名等）"""
+    return (any(c.isdigit() for c in token) and any(c.isupper() for c in token)
+            and any(c.islower() for c in token) and _entropy(token) >= 3.5)
+
+
+def compact_user_agent(user_agent: str) -> str:
+    """把完整的 User-Agent 缩短为 "浏览器 (平台)"，无法识别时原样返回"""
+    match = _USER_AGENT.search(user_agent)
+    if not match:
+        return user_agent
+    parts = [p.strip() for p in match.group(1).split(";")]
+    platform = "; ".join([p for p in parts if p.lower() not in _PLATFORM_NOISE][:2])
+    rest = user_agent[match.end(1):]
+    for pattern in _BROWSERS:
+        browser = pattern.search(rest)
+        if browser:
+            return f"{browser.group(0)} ({platform})"
+    return f"({platform})"
+
+
+class AlertCompactor:
+    """告警内容压缩器，线程安全，最近压缩过的告警直接返回缓存的结果"""
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        Args:
+            config: 压缩配置，见 config.COMPACTION_CONFIG
+        """
+        self.token_budget: Optional[int] = config.get("token_budget")
+        self.mask_ids: bool = config.get("mask_ids", True)
+        self.framework_packages: Tuple[str, ...] = tuple(config.get("framework_packages", ()))
+        self.framework_paths: Tuple[str, ...] = tuple(config.get("framework_paths", ()))
+        self.min_fold: int = config.get("min_fold", 2)
+        self._recent: "OrderedDict[str, CompactedAlert]" = OrderedDict()
+        self._recent_size: int = config.get("memo_size", 128)
+        self._lock = threading.Lock()
+        self._stats = {"alerts": 0, "tokens_before": 0, "tokens_after": 0, **{a: 0 for a in ACTIONS}}
+
+    def compact(self, alert_details: str) -> CompactedAlert:
+        """
+        压缩告警内容
+
+        Args:
+            alert_details: 原始告警文本
+
+        Returns:
+            CompactedAlert，含压缩后的文本、压缩前后的估算 token 数和各项操作的次数
+        """
+        with self._lock:
+            cached = self._recent.get(alert_details)
+            if cached is not None:
+                self._recent.move_to_end(alert_details)
+                return cached
+
+        actions = {a: 0 for a in ACTIONS}
+        lines = [line.rstrip() for line in textwrap.dedent(alert_details).strip("\n").splitlines()]
+        lines = self._mask(lines, actions)
+        lines = self._fold_frames(lines, actions)
+        lines = self._collapse_repeats(lines, actions)
+        text = "\n".join(lines)
+        if self.token_budget is not None and estimate_tokens(text) > self.token_budget:
+            text = self._fit_budget(lines, actions)
+
+        result = CompactedAlert(text, estimate_tokens(alert_details), estimate_tokens(text), actions)
+        with self._lock:
+            self._recent[alert_details] = result
+            if len(self._recent) > self._recent_size:
+                self._recent.popitem(last=False)
+            self._stats["alerts"] += 1
+            self._stats["tokens_before"] += result.tokens_before
+            self._stats["tokens_after"] += result.tokens_after
+            for action, count in actions.items():
+                self._stats[action] += count
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """压缩的告警数、压缩前后的 token 总数、节省比例和各项操作次数"""
+        with self._lock:
+            stats = dict(self._stats)
+        before = stats["tokens_before"]
+        stats["saved_ratio"] = round(1 - stats["tokens_after"] / before, 3) if before else 0.0
+        return stats
+
+    # --- 各压缩步骤 ---
+
+    def _frame_target(self, line: str) -> Optional[str]:
+        """堆栈帧所在的方法（Java）或文件位置（JavaScript），非堆栈帧返回 None"""
+        match = _JAVA_FRAME.match(line)
+        if match:
+            return match.group(1)
+        match = _JS_FRAME.match(line)
+        if match:
+            return match.group(2)
+        return None
+
+    def _is_framework(self, target: str) -> bool:
+        return target.startswith(self.framework_packages) or any(p in target for p in self.framework_paths)
+
+    def _mask(self, lines: List[str], actions: Dict[str, int]) -> List[str]:
+        masked = []
+        for line in lines:
+            if _USER_AGENT.search(line):
+                compacted = _USER_AGENT.sub(lambda m: compact_user_agent(m.group(0)), line)
+                actions["user_agents"] += compacted != line
+                line = compacted
+            # 堆栈帧原样保留（应用帧的文件名、行号都是分析依据）
+            if self.mask_ids and self._frame_target(line) is None:
+                for pattern, placeholder in _ID_MASKS:
+                    line, count = pattern.subn(placeholder, line)
+                    actions["masked_ids"] += count
+                line = _TOKEN_CANDIDATE.sub(lambda m: self._mask_token(m.group(0), actions), line)
+            masked.append(line)
+        return masked
+
+    @staticmethod
+    def _mask_token(token: str, actions: Dict[str, int]) -> str:
+        if not _looks_random(token):
+            return token
+        actions["masked_ids"] += 1
+        return "<TOKEN>"
+
+    def _collapse_repeats(self, lines: List[str], actions: Dict[str, int]) -> List[str]:
+        """连续重复的行块只保留一次；普通行忽略时间戳、计数等数字差异，但错误码不同的行不合并，堆栈帧要求完全相同"""
+        keys = [line if self._frame_target(line) is not None else _repeat_key(line) for line in lines]
+        result = []
+        i = 0
+        while i < len(lines):
+            best_period, best_repeats = 1, 1
+            for period in range(1, MAX_REPEAT_PERIOD + 1):
+                block = keys[i:i + period]
+                if len(block) < period or not any(k.strip() for k in block):
+                    break
+                repeats = 1
+                while keys[i + repeats * period:i + (repeats + 1) * period] == block:
+                    repeats += 1
+                if repeats > 1 and (repeats - 1) * period > (best_repeats - 1) * best_period:
+                    best_period, best_repeats = period, repeats
+            result.extend(lines[i:i + best_period])
+            if best_repeats > 1:
+                indent = re.match(r'\s*', lines[i]).group(0)
+                what = "上一行" if best_period == 1 else f"以上 {best_period} 行"
+                result.append(f"{indent}...（{what}重复 {best_repeats - 1} 次）")
+                actions["collapsed_lines"] += (best_repeats - 1) * best_period
+            i += best_period * best_repeats
+        return result
+
+    def _fold_frames(self, lines: List[str], actions: Dict[str, int]) -> List[str]:
+        """连续的框架帧折叠为一行；异常后的第一帧（抛出位置）始终保留"""
+        result = []
+        run: List[Tuple[str, str]] = []
+        first_frame = True
+
+        def flush():
+            if len(run) >= self.min_fold:
+                indent = re.match(r'\s*', run[0][0]).group(0)
+                roots = list(OrderedDict.fromkeys(_frame_root(target) for _, target in run))
+                more = " 等" if len(roots) > 3 else ""
+                result.append(f"{indent}...（折叠 {len(run)} 个框架帧: {', '.join(roots[:3])}{more}）")
+                actions["folded_frames"] += len(run)
+            else:
+                result.extend(line for line, _ in run)
+            run.clear()
+
+        for line in lines:
+            target = self._frame_target(line)
+            if target is not None and not first_frame and self._is_framework(target):
+                run.append((line, target))
+                continue
+            flush()
+            result.append(line)
+            first_frame = target is None and bool(_EXCEPTION_LINE.search(line))
+            if target is not None:
+                first_frame = False
+        flush()
+        return result
+
+    def _priority(self, line: str) -> int:
+        """行的重要性：4 错误信息/错误码，3 应用帧，2 字段行，1 框架帧和其他"""
+        target = self._frame_target(line)
+        if target is not None:
+            return 1 if self._is_framework(target) else 3
+        if _EXCEPTION_LINE.search(line) or _ERROR_CODE.search(line) and _CODE_FIELD.search(line):
+            return 4
+        if _FIELD_LINE.match(line):
+            return 2
+        return 1
+
+    def _fit_budget(self, lines: List[str], actions: Dict[str, int]) -> str:
+        """按重要性从低到高、同等重要性从后往前省略行，连续省略的行合并为一个标记"""
+        costs = [estimate_tokens(line) + 1 for line in lines]
+        total = sum(costs)
+        dropped = set()
+        regions = 0  # 连续省略区间的个数，每个区间一个省略标记
+        order = sorted(range(len(lines)), key=lambda i: (self._priority(lines[i]), -i))
+        for i in order:
+            if total + MARKER_TOKENS * regions <= self.token_budget:
+                break
+            regions += 1 - (i - 1 in dropped) - (i + 1 in dropped)
+            dropped.add(i)
+            total -= costs[i]
+
+        result = []
+        skipped = 0
+        for i, line in enumerate(lines):
+            if i in dropped:
+                skipped += 1
+                continue
+            if skipped:
+                result.append(f"...（省略 {skipped} 行）")
+                skipped = 0
+            result.append(line)
+        if skipped:
+            result.append(f"...（省略 {skipped} 行）")
+        actions["dropped_lines"] += len(dropped)
+
+        text = "\n".join(result)
+        if estimate_tokens(text) > self.token_budget:
+            # 只剩关键行仍超出预算时保留开头
+            text = truncate_to_tokens(text, self.token_budget - MARKER_TOKENS) + "\n...（已截断）"
+            actions["truncated"] += 1
+        return text
+
+
+def _frame_root(target: str) -> str:
+    """折叠标记中显示的框架名：Java 取前两级包名，JavaScript 取 node_modules 下的包名或文件名"""
+    if "node_modules/" in target:
+        return target.split("node_modules/", 1)[1].split("/", 1)[0]
+    if "/" in target or ":" in target:
+        return target.rsplit("/", 1)[-1].split("?", 1)[0]
+    return ".".join(target.split(".")[:2])
+
+
+def _repeat_key(line: str) -> str:
+    """合并重复行时比较的键：错误码/状态码保持原样，其余数字（时间戳、计数）统一为 0"""
+    parts, pos = [], 0
+    for match in _CODE_VALUE.finditer(line):
+        parts += [_DIGITS.sub("0", line[pos:match.start()]), match.group(0)]
+        pos = match.end()
+    parts.append(_DIGITS.sub("0", line[pos:]))
+    return "".join(parts)
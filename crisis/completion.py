@@ -0,0 +1,281 @@
+"""
+按完成顺序返回的并发执行
+
+等所有输入都完成才返回时，一个慢调用拖住整批结果，一个异常丢弃全部结果。
+这里的执行器在每个输入完成时立即返回 (序号, 结果或异常)：
+- 单项时限：从该项开始执行起计时，超时的项返回 TimeoutError
+- 总时限：到期时尚未完成的项全部返回 TimeoutError，并取消剩余的调用
+- 对冲：运行时间超过 hedge_after 的项再发起一次相同的调用，先完成的结果生效，
+  hedge_after 可以是秒数，也可以是 "p90" 这样按已完成项耗时的分位数
+- 单项失败只影响该项；对冲中的一次调用失败时等待另一次
+
+线程版本无法中断正在执行的调用：超时或被对冲胜出的调用在后台继续运行至结束，结果被丢弃，
+尚未开始的调用会被取消。asyncio 版本会真正取消对应的协程（同时关闭 HTTP 请求）。
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+# 已完成项少于该数量时，分位数形式的 hedge_after 不生效
+MIN_HEDGE_SAMPLES = 3
+
+# 有项尚未开始执行时的轮询间隔（秒），用于及时开始计时
+POLL_INTERVAL = 0.05
+
+HedgeAfter = Union[float, str, None]
+
+
+class _Progress:
+    """
+    各项的开始时间、完成状态和对冲状态，线程和 asyncio 版本共用
+
+    线程版本中 start() 在工作线程里调用，其余方法在迭代线程里调用，遍历开始时间时使用加锁取得的快照。
+    """
+
+    def __init__(self, count: int, item_timeout: Optional[float], timeout: Optional[float],
+                 hedge_after: HedgeAfter, max_hedges: int):
+        self.count = count
+        self.item_timeout = item_timeout
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.max_hedges = max_hedges
+        self.quantile = None
+        self.hedge_after = None
+        if isinstance(hedge_after, str):
+            self.quantile = float(hedge_after.lstrip("pP")) / 100
+        else:
+            self.hedge_after = hedge_after
+        self.started: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self.resolved: Set[int] = set()
+        self.hedged: Set[int] = set()
+        self.latencies: List[float] = []
+
+    @property
+    def hedging(self) -> bool:
+        return self.hedge_after is not None or self.quantile is not None
+
+    def start(self, index: int):
+        with self._lock:
+            self.started.setdefault(index, time.monotonic())
+
+    def _started(self) -> List[Tuple[int, float]]:
+        """开始时间的快照"""
+        with self._lock:
+            return list(self.started.items())
+
+    def resolve(self, index: int, completed: bool = True) -> bool:
+        """标记某项已返回，已返回过时返回 False"""
+        if index in self.resolved:
+            return False
+        self.resolved.add(index)
+        with self._lock:
+            start = self.started.get(index)
+        if completed and start is not None:
+            self.latencies.append(time.monotonic() - start)
+        return True
+
+    @property
+    def finished(self) -> bool:
+        return len(self.resolved) == self.count
+
+    def remaining(self) -> List[int]:
+        return [i for i in range(self.count) if i not in self.resolved]
+
+    def hedge_delay(self) -> Optional[float]:
+        if self.quantile is None:
+            return self.hedge_after
+        if len(self.latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+
+    def overdue(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def expired(self) -> List[int]:
+        """超过单项时限、尚未返回的项"""
+        if self.item_timeout is None:
+            return []
+        now = time.monotonic()
+        return [i for i, start in self._started()
+                if i not in self.resolved and now - start >= self.item_timeout]
+
+    def to_hedge(self, hedges_in_flight: int) -> List[int]:
+        """需要对冲的项，运行最久的优先，同时进行的对冲不超过 max_hedges"""
+        delay = self.hedge_delay()
+        slots = self.max_hedges - hedges_in_flight
+        if delay is None or slots <= 0:
+            return []
+        now = time.monotonic()
+        candidates = sorted((start, i) for i, start in self._started()
+                            if i not in self.resolved and i not in self.hedged and now - start >= delay)
+        return [i for _, i in candidates[:slots]]
+
+    def wait_time(self) -> Optional[float]:
+        """距离下一个时限或对冲时间点的秒数，None 表示只需等待完成"""
+        now = time.monotonic()
+        moments = [self.deadline] if self.deadline is not None else []
+        timed = self.item_timeout is not None or self.hedging
+        delay = self.hedge_delay()
+        started = self._started()
+        for i, start in started:
+            if i in self.resolved:
+                continue
+            if self.item_timeout is not None:
+                moments.append(start + self.item_timeout)
+            if delay is not None and i not in self.hedged:
+                moments.append(start + delay)
+        if timed and len(started) < self.count:
+            moments.append(now + POLL_INTERVAL)
+        if self.quantile is not None and delay is None:
+            moments.append(now + POLL_INTERVAL)
+        return max(0.0, min(moments) - now) if moments else None
+
+
+def _timeout_error(index: int, overall: bool, progress: _Progress) -> TimeoutError:
+    if overall:
+        return TimeoutError(f"第 {index} 项在总时限内未完成")
+    return TimeoutError(f"第 {index} 项超过单项时限 {progress.item_timeout}s")
+
+
+def iter_completed(fn: Callable[[Any], Any], items: Iterable[Any], max_workers: int = 3,
+                   item_timeout: Optional[float] = None, timeout: Optional[float] = None,
+                   hedge_after: HedgeAfter = None, hedge_fn: Optional[Callable[[Any], Any]] = None,
+                   max_hedges: Optional[int] = None) -> Iterator[Tuple[int, Any]]:
+    """
+    用线程池执行 fn(item)，按完成顺序返回
+
+    Args:
+        fn: 处理单个输入的函数
+        items: 输入
+        max_workers: 并发线程数
+        item_timeout: 单项时限（秒），从该项开始执行起计时
+        timeout: 总时限（秒），从调用起计时
+        hedge_after: 运行多久后发起对冲（秒数或 "p90" 形式的分位数），None 表示不对冲
+        hedge_fn: 对冲时调用的函数，默认与 fn 相同
+        max_hedges: 同时进行的对冲上限，默认等于 max_workers
+
+    Yields:
+        (输入序号, 结果或异常)，超时的项为 TimeoutError
+    """
+    items = list(items)
+    hedge_fn = hedge_fn or fn
+    progress = _Progress(len(items), item_timeout, timeout, hedge_after, max_hedges or max_workers)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    hedger = ThreadPoolExecutor(max_workers=max_hedges or max_workers) if progress.hedging else None
+    owners: Dict[Future, int] = {}
+    hedges: Set[Future] = set()
+
+    def run(index: int) -> Any:
+        progress.start(index)
+        return fn(items[index])
+
+    def cancel(index: int):
+        for future, owner in owners.items():
+            if owner == index:
+                future.cancel()
+
+    for index in range(len(items)):
+        owners[executor.submit(run, index)] = index
+    try:
+        while not progress.finished:
+            if progress.overdue():
+                for index in progress.remaining():
+                    progress.resolve(index, completed=False)
+                    yield index, _timeout_error(index, True, progress)
+                return
+            for index in progress.expired():
+                progress.resolve(index, completed=False)
+                cancel(index)
+                yield index, _timeout_error(index, False, progress)
+            if progress.finished:
+                break
+            for index in progress.to_hedge(sum(1 for f in hedges if not f.done())):
+                progress.hedged.add(index)
+                future = hedger.submit(hedge_fn, items[index])
+                owners[future] = index
+                hedges.add(future)
+
+            done, _ = wait(list(owners), timeout=progress.wait_time(), return_when=FIRST_COMPLETED)
+            # 同一批完成时成功的结果优先，对冲中失败的一次不会覆盖成功的一次
+            for future in sorted(done, key=lambda f: f.cancelled() or f.exception() is not None):
+                index = owners.pop(future)
+                hedges.discard(future)
+                if future.cancelled() or index in progress.resolved:
+                    continue
+                error = future.exception()
+                if error is not None and any(owner == index and not f.done() for f, owner in owners.items()):
+                    continue  # 对冲的另一次调用仍在进行
+                progress.resolve(index)
+                cancel(index)
+                yield index, error if error is not None else future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if hedger is not None:
+            hedger.shutdown(wait=False, cancel_futures=True)
+
+
+async def aiter_completed(fn: Callable[[Any], Awaitable[Any]], items: Iterable[Any], max_concurrency: int = 64,
+                          item_timeout: Optional[float] = None, timeout: Optional[float] = None,
+                          hedge_after: HedgeAfter = None,
+                          hedge_fn: Optional[Callable[[Any], Awaitable[Any]]] = None,
+                          max_hedges: Optional[int] = None) -> AsyncIterator[Tuple[int, Any]]:
+    """iter_completed 的 asyncio 版本：超时、对冲失败方和停止迭代时剩余的协程都会被取消"""
+    items = list(items)
+    hedge_fn = hedge_fn or fn
+    progress = _Progress(len(items), item_timeout, timeout, hedge_after, max_hedges or max_concurrency)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    owners: Dict[asyncio.Task, int] = {}
+    hedges: Set[asyncio.Task] = set()
+
+    async def run(index: int) -> Any:
+        async with semaphore:
+            progress.start(index)
+            return await fn(items[index])
+
+    def cancel(index: int):
+        for task, owner in owners.items():
+            if owner == index:
+                task.cancel()
+
+    for index in range(len(items)):
+        owners[asyncio.ensure_future(run(index))] = index
+    try:
+        while not progress.finished:
+            if progress.overdue():
+                for index in progress.remaining():
+                    progress.resolve(index, completed=False)
+                    yield index, _timeout_error(index, True, progress)
+                return
+            for index in progress.expired():
+                progress.resolve(index, completed=False)
+                cancel(index)
+                yield index, _timeout_error(index, False, progress)
+            if progress.finished:
+                break
+            for index in progress.to_hedge(sum(1 for t in hedges if not t.done())):
+                progress.hedged.add(index)
+                task = asyncio.ensure_future(hedge_fn(items[index]))
+                owners[task] = index
+                hedges.add(task)
+
+            done, _ = await asyncio.wait(list(owners), timeout=progress.wait_time(), return_when=FIRST_COMPLETED)
+            for task in sorted(done, key=lambda t: t.cancelled() or t.exception() is not None):
+                index = owners.pop(task)
+                hedges.discard(task)
+                if task.cancelled() or index in progress.resolved:
+                    continue
+                error = task.exception()
+                if error is not None and any(owner == index and not t.done() for t, owner in owners.items()):
+                    continue  # 对冲的另一次调用仍在进行
+                progress.resolve(index)
+                cancel(index)
+                yield index, error if error is not None else task.result()
+    finally:
+        tasks = list(owners)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -124,6 +124,125 @@ DEFAULT_CONFIG = {
     "analysis_timeout": 30,  # 分析超时时间（秒）
 }
 
+# 准入控制与降载配置（告警风暴时保护关键告警延迟）
+ADMISSION_CONFIG = {
+    "max_queue": 64,  # 在途告警上限，达到后拒绝非关键告警
+    "critical_reserve": 16,  # 为关键告警额外保留的容量
+    "skip_history_ratio": 0.5,  # 负载达到该比例时跳过历史匹配
+    "sample_low_ratio": 0.75,  # 负载达到该比例时对低优先级告警采样
+    "low_severity_sample_rate": 0.2,  # 采样阶段低优先级告警的保留比例
+    "source_rate": 10.0,  # 每个告警来源每秒允许的告警数
+    "source_burst": 20,  # 每个告警来源允许的突发量
+    "retry_after": 5.0,  # 拒绝时建议的重试间隔（秒）
+}
+
+# 事件会话配置（持续事件的增量重分析）
+INCIDENT_CONFIG = {
+    "max_sessions": 256,  # 最多保留的事件会话数
+    "session_ttl": 6 * 3600,  # 无更新的会话保留时间（秒）
+}
+
+# 告警模板分类缓存配置（模板命中时跳过分类 LLM 调用）
+TEMPLATE_CACHE_CONFIG = {
+    "enabled": True,
+    "path": ".cache/template-classifications.json",  # 相对 crisis 目录
+    "min_confidence": "高",  # 只缓存该置信度及以上的分类结果
+    "save_interval": 5.0,  # 修改合并写入文件的间隔（秒），0 表示每次修改立即写入
+    "miner": {
+        "depth": 4,  # 解析树深度
+        "similarity_threshold": 0.7,  # 合并到已有模板的最低相似度（合并后的模板缓存结果失效）
+        "max_children": 100,  # 解析树节点最大子节点数
+    },
+}
+
+# 本地预分类器配置（规则 + 朴素贝叶斯，置信度足够时跳过分类 LLM 调用）
+PRECLASSIFIER_CONFIG = {
+    "enabled": True,
+    "model_path": ".cache/preclassifier.json",  # 相对 crisis 目录，不存在时只使用规则
+    "threshold": 0.9,  # 直接给出类别所需的最低概率，低于该值回退到 LLM
+    "high_confidence": 0.97,  # 达到该概率时置信度记为"高"，否则记为"中"
+    "min_signals": 2,  # 模型未佐证时，直接给出类别所需命中的最少规则数（单条规则不足以跳过 LLM）
+    "corpus_path": None,  # 设置后把 LLM 分类结果追加到该 JSONL，用于训练和评估（如 ".cache/classification-corpus.jsonl"）
+    "audit_rate": 0.05,  # 设置 corpus_path 时，本地已决定的告警按该比例仍交给 LLM 分类并记录，使语料不偏向难分类的告警
+}
+
+# 推测执行配置：分类/路由选择的同时按本地先验预测分支并提前启动专项调用
+SPECULATION_CONFIG = {
+    "enabled": False,
+    "min_prior": 0.5,  # 先验概率达到该值才推测
+    "max_in_flight": 8,  # 同时进行的推测调用上限
+    "waste_tokens_per_min": 20000,  # 每分钟允许因预测错误浪费的估算 token 数
+}
+
+# 流式分类配置：</category> 到达即开始专项分析
+STREAMING_CONFIG = {
+    "enabled": False,
+    "stop_after_category": False,  # 分类标签到达后立即终止生成（不再等待分类依据和置信度）
+}
+
+# 模型级联配置：小模型先做分类/路由选择，置信度不足或解析失败时升级到大模型
+MODEL_CASCADE_CONFIG = {
+    "enabled": True,
+    "default_model": "claude-3-5-sonnet-20241022",  # 关闭级联或步骤未配置梯队时使用
+    "tiers": {  # 步骤 -> 依次尝试的模型（由小到大）
+        "classification": ["claude-3-5-haiku-20241022", "claude-3-5-sonnet-20241022"],
+        "route_selection": ["claude-3-5-haiku-20241022", "claude-3-5-sonnet-20241022"],
+    },
+    "escalate_confidence": ["低", "中", "low", "medium"],  # 这些置信度（或缺失）时升级到下一级模型
+}
+
+# 告警内容压缩配置（告警嵌入提示词前折叠堆栈、合并重复行、掩码高熵 ID）
+COMPACTION_CONFIG = {
+    "enabled": True,
+    "token_budget": 1500,  # 压缩后告警内容的估算 token 上限，None 表示不截断
+    "mask_ids": True,  # 把 UUID、长十六进制串、JWT、随机令牌替换为占位符
+    "min_fold": 2,  # 连续框架帧达到该数量才折叠
+    "framework_packages": [  # Java 框架帧的包名前缀
+        "java.", "javax.", "jdk.", "sun.", "com.sun.", "kotlin.", "kotlinx.", "scala.",
+        "org.springframework.", "org.apache.", "org.hibernate.", "org.eclipse.jetty.", "io.netty.",
+        "io.undertow.", "reactor.", "com.fasterxml.", "com.zaxxer.", "net.bytebuddy.", "feign.", "okhttp3.",
+    ],
+    "framework_paths": [  # JavaScript 框架帧的文件路径特征
+        "node_modules/", "node:internal", "internal/", "webpack", "react-dom", "vue.runtime", "zone.js",
+        "uni-app", "vendor.js", "chunk-vendors",
+    ],
+}
+
+# 相似历史事件检索配置（BM25，摘要注入专项分析提示词）
+RETRIEVAL_CONFIG = {
+    "top_k": 3,  # 每条告警检索的历史事件数
+    "token_budget": 300,  # 注入提示词的摘要 token 上限
+    "min_score": 1.0,  # 最低 BM25 得分
+}
+
+# DAG 工作流配置（互不依赖的步骤并发执行）
+DAG_CONFIG = {
+    "max_concurrency": 4,  # 同时执行的步骤上限
+    "memo_entries": 256,  # 按输入哈希记忆的步骤结果上限
+}
+
+# 工作流提示词模板（模板名称 -> 相对 crisis 目录的文件名）
+PROMPT_TEMPLATES = {
+    "classification": "alert-classification-prompt.md",
+    "uni_error": "aladdin-error-prompt.md",
+    "javascript_error": "javascript-error-prompt.md",
+    "backend_api_error": "backend-api-error-prompt.md",
+    "analysis": "analysis-prompt.md",
+}
+
+# 并行扇出调度器配置（按服务商配额设置）
+SCHEDULER_CONFIG = {
+    "rpm": 50,  # 每分钟请求数上限
+    "tpm": 40000,  # 每分钟输入 token 数上限
+    "initial_concurrency": 4,  # 初始并发数
+    "min_concurrency": 1,
+    "max_concurrency": 32,
+    "max_retries": 5,  # 单个请求最大重试次数
+    "base_backoff": 1.0,  # 指数退避基准（秒）
+    "max_backoff": 60.0,  # 单次退避上限（秒）
+    "latency_target": None,  # 目标延迟（秒），超出时收缩并发
+}
+
 # 响应措施模板
 RESPONSE_TEMPLATES = {
     "uni": {
@@ -0,0 +1,355 @@
+"""
+DAG 工作流
+
+chain / parallel / route 只能表达固定形状的流程，组合流程只能手写成串行代码，
+互不依赖的步骤（如分类、历史事件检索、代码扫描）也要一个接一个地等。
+DAG 按各步骤声明的输入确定执行顺序：
+- 依赖全部完成的步骤立即开始，互不依赖的步骤并发执行，受全局并发上限约束
+- 步骤结果按（步骤名, 输入值哈希）记忆，相同输入再次运行时直接复用
+- 某一步失败时，依赖它的步骤被跳过（以 StepError 返回），其余步骤照常执行
+- 每次运行返回各步骤的开始时间、耗时和状态
+"""
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+class StepError(Exception):
+    """步骤执行失败，或因依赖的步骤失败被跳过"""
+
+    def __init__(self, step: str, error: Optional[BaseException] = None, upstream: Optional[str] = None):
+        if upstream is not None:
+            message = f"步骤 {step} 已跳过: 依赖的步骤 {upstream} 失败"
+        else:
+            message = f"步骤 {step} 失败: {type(error).__name__}: {error}"
+        super().__init__(message)
+        self.step = step
+        self.error = error
+        self.upstream = upstream
+
+
+class StepTrace:
+    """单个步骤的执行记录，start 为相对本次运行开始的秒数"""
+
+    def __init__(self, name: str, status: str, start: float, duration: float):
+        self.name = name
+        self.status = status  # ok / error / skipped / cached
+        self.start = start
+        self.duration = duration
+
+    def __repr__(self) -> str:
+        return f"StepTrace({self.name!r}, {self.status}, start={self.start:.3f}s, duration={self.duration:.3f}s)"
+
+
+class DAGResult:
+    """一次运行的结果：各步骤的值、错误和执行记录"""
+
+    def __init__(self, values: Dict[str, Any], errors: Dict[str, StepError], trace: List[StepTrace],
+                 elapsed: float):
+        self.values = values
+        self.errors = errors
+        self.trace = trace
+        self.elapsed = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def __getitem__(self, name: str) -> Any:
+        """步骤的结果；步骤失败或被跳过时抛出对应的 StepError"""
+        if name in self.errors:
+            raise self.errors[name]
+        return self.values[name]
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self.values.get(name, default)
+
+    def format_trace(self, width: int = 30) -> str:
+        """按开始时间排列的步骤时间线"""
+        total = max(self.elapsed, 1e-9)
+        name_width = max((len(t.name) for t in self.trace), default=0)
+        lines = []
+        for t in sorted(self.trace, key=lambda t: t.start):
+            offset = min(width - 1, int(t.start / total * width))
+            length = max(1, round(t.duration / total * width)) if t.status in ("ok", "error") else 0
+            bar = (" " * offset + "█" * length)[:width]
+            lines.append(f"{t.name:<{name_width}}  {t.status:<7} {t.start:6.2f}s +{t.duration:5.2f}s |{bar:<{width}}|")
+        lines.append(f"总耗时 {self.elapsed:.2f}s")
+        return "\n".join(lines)
+
+
+class _Step:
+    __slots__ = ("name", "fn", "inputs", "memoize")
+
+    def __init__(self, name: str, fn: Callable, inputs: Tuple[str, ...], memoize: bool):
+        self.name = name
+        self.fn = fn
+        self.inputs = inputs
+        self.memoize = memoize
+
+
+class _Run:
+    """一次运行的调度状态，线程版本和异步版本共用"""
+
+    def __init__(self, dag: "DAG", inputs: Dict[str, Any], order: List[str]):
+        self.dag = dag
+        self.values = dict(inputs)
+        self.results: Dict[str, Any] = {}
+        self.errors: Dict[str, StepError] = {}
+        self.trace: List[StepTrace] = []
+        self.start = time.monotonic()
+        self.waiting = {name: {i for i in dag._steps[name].inputs if i in dag._steps} for name in order}
+        self.dependents: Dict[str, List[str]] = {name: [] for name in order}
+        for name, deps in self.waiting.items():
+            for dep in deps:
+                self.dependents[dep].append(name)
+        self.ready = [name for name in order if not self.waiting[name]]
+
+    def take_ready(self) -> List[Tuple[_Step, Dict[str, Any], Optional[str]]]:
+        """取出可以开始的步骤；依赖失败的直接跳过，命中记忆的直接完成"""
+        runnable = []
+        while self.ready:
+            step = self.dag._steps[self.ready.pop(0)]
+            failed = next((i for i in step.inputs if i in self.errors), None)
+            if failed is not None:
+                self._resolve(step.name, "skipped", 0.0, error=StepError(step.name, upstream=failed))
+                continue
+            kwargs = {i: self.values[i] for i in step.inputs}
+            key = self.dag._memo_key(step, kwargs) if step.memoize else None
+            hit, value = self.dag._memo_get(key)
+            if hit:
+                self._resolve(step.name, "cached", 0.0, value=value)
+                continue
+            runnable.append((step, kwargs, key))
+        return runnable
+
+    def finish(self, step: _Step, key: Optional[str], outcome: Any, started: float, duration: float):
+        if isinstance(outcome, Exception):
+            self._resolve(step.name, "error", duration, error=StepError(step.name, outcome), started=started)
+        else:
+            self.dag._memo_put(key, outcome)
+            self._resolve(step.name, "ok", duration, value=outcome, started=started)
+
+    def _resolve(self, name: str, status: str, duration: float, value: Any = None,
+                 error: Optional[StepError] = None, started: Optional[float] = None):
+        if error is None:
+            self.values[name] = self.results[name] = value
+        else:
+            self.errors[name] = error
+        started = time.monotonic() if started is None else started
+        self.trace.append(StepTrace(name, status, started - self.start, duration))
+        for dependent in self.dependents[name]:
+            self.waiting[dependent].discard(name)
+            if not self.waiting[dependent]:
+                self.ready.append(dependent)
+
+    def result(self) -> DAGResult:
+        return DAGResult(self.results, self.errors, self.trace, time.monotonic() - self.start)
+
+
+class DAG:
+    """按输入依赖并发执行的步骤图"""
+
+    def __init__(self, max_concurrency: int = 4, memo_entries: int = 256):
+        """
+        Args:
+            max_concurrency: 同时执行的步骤上限（线程版本对同一个 DAG 的所有并发运行生效）
+            memo_entries: 记忆的步骤结果上限，超出后淘汰最久未使用的
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.memo_entries = memo_entries
+        self._steps: Dict[str, _Step] = {}
+        self._slots = threading.Semaphore(self.max_concurrency)
+        self._memo: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "steps": 0, "memo_hits": 0, "errors": 0, "skipped": 0}
+
+    def add(self, name: str, fn: Callable, inputs: Sequence[str] = (), memoize: bool = True) -> "DAG":
+        """
+        添加步骤
+
+        Args:
+            name: 步骤名称，也是其结果供其他步骤引用的名字
+            fn: 以关键字参数接收各输入的函数（arun 中可以是协程函数）
+            inputs: 依赖的步骤名称或运行时提供的输入名称
+            memoize: 是否按输入值记忆结果（有副作用或依赖外部状态的步骤应关闭）
+        """
+        if name in self._steps:
+            raise ValueError(f"步骤 {name} 已存在")
+        self._steps[name] = _Step(name, fn, tuple(inputs), memoize)
+        return self
+
+    def step(self, name: Optional[str] = None, inputs: Sequence[str] = (), memoize: bool = True):
+        """装饰器形式的 add，默认使用函数名作为步骤名"""
+        def register(fn: Callable) -> Callable:
+            self.add(name or fn.__name__, fn, inputs, memoize)
+            return fn
+        return register
+
+    def plan(self, provided: Iterable[str] = (), targets: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        计算需要执行的步骤的拓扑顺序
+
+        Args:
+            provided: 运行时提供的输入名称
+            targets: 需要的步骤，只执行它们及其上游；None 表示全部步骤
+
+        Raises:
+            ValueError: 输入名称未知、与步骤重名或存在环
+        """
+        provided = set(provided)
+        clash = provided & set(self._steps)
+        if clash:
+            raise ValueError(f"输入名称与步骤重名: {sorted(clash)}")
+        order: List[str] = []
+        state: Dict[str, int] = {}  # 1 = 访问中，2 = 已完成
+
+        def visit(name: str, path: Tuple[str, ...]):
+            if state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                raise ValueError(f"步骤之间存在环: {' → '.join(path + (name,))}")
+            if name not in self._steps:
+                raise ValueError(f"未知的步骤: {name}")
+            state[name] = 1
+            for dep in self._steps[name].inputs:
+                if dep in self._steps:
+                    visit(dep, path + (name,))
+                elif dep not in provided:
+                    raise ValueError(f"步骤 {name} 的输入 {dep} 既不是步骤也没有提供")
+            state[name] = 2
+            order.append(name)
+
+        for name in (self._steps if targets is None else targets):
+            visit(name, ())
+        return order
+
+    def run(self, inputs: Optional[Dict[str, Any]] = None, targets: Optional[Iterable[str]] = None) -> DAGResult:
+        """
+        用线程执行步骤图
+
+        Args:
+            inputs: 运行时提供的输入
+            targets: 需要的步骤，只执行它们及其上游；None 表示全部步骤
+
+        Returns:
+            DAGResult，失败或被跳过的步骤记录在 errors 中，不会抛出
+        """
+        inputs = inputs or {}
+        order = self.plan(inputs, targets)
+        run = _Run(self, inputs, order)
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, max(1, len(order)))) as executor:
+            running = {}
+            while True:
+                for step, kwargs, key in run.take_ready():
+                    running[executor.submit(self._execute, step, kwargs)] = (step, key)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step, key = running.pop(future)
+                    run.finish(step, key, *future.result())
+        return self._record(run.result())
+
+    async def arun(self, inputs: Optional[Dict[str, Any]] = None,
+                   targets: Optional[Iterable[str]] = None) -> DAGResult:
+        """
+        run 的异步版本
+
+        协程函数直接在事件循环中执行，普通函数在默认线程池中执行；并发上限对单次运行生效。
+        """
+        inputs = inputs or {}
+        order = self.plan(inputs, targets)
+        run = _Run(self, inputs, order)
+        slots = asyncio.Semaphore(self.max_concurrency)
+        loop = asyncio.get_running_loop()
+
+        async def execute(step: _Step, kwargs: Dict[str, Any]):
+            async with slots:
+                started = time.monotonic()
+                try:
+                    if inspect.iscoroutinefunction(step.fn):
+                        outcome = await step.fn(**kwargs)
+                    else:
+                        outcome = await loop.run_in_executor(None, functools.partial(step.fn, **kwargs))
+                        if inspect.isawaitable(outcome):
+                            # 返回协程的包装函数（如 telemetry.in_step）
+                            outcome = await outcome
+                except Exception as e:
+                    outcome = e
+                return outcome, started, time.monotonic() - started
+
+        running = {}
+        try:
+            while True:
+                for step, kwargs, key in run.take_ready():
+                    running[asyncio.ensure_future(execute(step, kwargs))] = (step, key)
+                if not running:
+                    break
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    step, key = running.pop(task)
+                    run.finish(step, key, *task.result())
+        finally:
+            for task in running:
+                task.cancel()
+        return self._record(run.result())
+
+    def _execute(self, step: _Step, kwargs: Dict[str, Any]) -> Tuple[Any, float, float]:
+        with self._slots:
+            started = time.monotonic()
+            try:
+                outcome = step.fn(**kwargs)
+            except Exception as e:
+                outcome = e
+            return outcome, started, time.monotonic() - started
+
+    @staticmethod
+    def _memo_key(step: _Step, kwargs: Dict[str, Any]) -> str:
+        payload = json.dumps([step.name, kwargs], ensure_ascii=False, sort_keys=True, default=repr)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _memo_get(self, key: Optional[str]) -> Tuple[bool, Any]:
+        if key is None:
+            return False, None
+        with self._lock:
+            if key not in self._memo:
+                return False, None
+            self._memo.move_to_end(key)
+            return True, self._memo[key]
+
+    def _memo_put(self, key: Optional[str], value: Any):
+        if key is None or self.memo_entries <= 0:
+            return
+        with self._lock:
+            self._memo[key] = value
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.memo_entries:
+                self._memo.popitem(last=False)
+
+    def clear_memo(self):
+        with self._lock:
+            self._memo.clear()
+
+    def _record(self, result: DAGResult) -> DAGResult:
+        with self._lock:
+            self._stats["runs"] += 1
+            for t in result.trace:
+                self._stats["steps"] += t.status in ("ok", "error")
+                self._stats["memo_hits"] += t.status == "cached"
+                self._stats["errors"] += t.status == "error"
+                self._stats["skipped"] += t.status == "skipped"
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """运行次数、实际执行的步骤数、记忆命中数、失败和跳过的步骤数"""
+        with self._lock:
+            return {**self._stats, "memo_entries": len(self._memo)}
@@ -0,0 +1,407 @@
+"""
+多端点选择与熔断
+
+API 可以经中转站访问，也可以经代理直连，两条路径各有自己的密钥、地址和代理。只配置一条时，
+中转站不稳定会让每个请求都等到超时；EndpointPool 同时持有多个端点：
+- 按端点统计滚动的延迟（EWMA，流式请求取首 token 延迟）和错误率，每次调用选择"预期成功耗时"（延迟 ÷ 成功率）最低的端点
+- 连续失败或窗口内错误率过高时熔断（open），冷却期内不再选择该端点；冷却结束后半开（half-open），
+  只放行一个探测请求，成功则恢复，失败则冷却时间加倍
+- 端点故障（连接错误、超时、5xx/529、429、认证失败）时自动换下一个端点重试，参数错误等请求本身的问题直接抛出
+- 全部端点都熔断时只放行一个请求尝试最快恢复的那个，其余请求抛出 CircuitOpenError 快速失败，
+  不必各自等到超时
+
+本模块不依赖 crisis 的其他模块，agent.py 可以直接导入；客户端由调用方通过 make_client 创建。
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, TypeVar
+
+import anthropic
+import httpx
+
+T = TypeVar("T")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# call() / acall() 当前调用的端点租约，fn 中的流式请求通过 report_first_token() 报告首 token
+_current_lease: contextvars.ContextVar = contextvars.ContextVar("endpoint_lease", default=None)
+
+# 表示端点本身有问题的 HTTP 状态码（换端点可能成功）
+ENDPOINT_FAILURE_STATUS = {401, 403, 408, 429}
+
+
+class Endpoint:
+    """一个 API 端点：地址、密钥、代理和超时设置"""
+
+    def __init__(self, name: str, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 proxy: Optional[str] = None, timeout: float = 600.0, connect_timeout: float = 5.0,
+                 max_retries: int = 1):
+        """
+        Args:
+            name: 端点名称（统计和日志中使用）
+            api_key: API 密钥
+            base_url: API 地址，None 表示 SDK 默认地址
+            proxy: 代理地址，None 表示不使用代理
+            timeout: 读取超时（秒）
+            connect_timeout: 连接超时（秒），不可达的端点在这个时间内失败并切换
+            max_retries: SDK 在该端点上的重试次数（换端点本身也是重试，不宜过多）
+        """
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url
+        self.proxy = proxy
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+
+    @property
+    def http_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.name!r}, base_url={self.base_url!r}, proxy={self.proxy!r})"
+
+
+def endpoints_from_env(var: str = "LLM_ENDPOINTS") -> Optional[List[Endpoint]]:
+    """
+    从环境变量读取端点列表（JSON 数组），未设置时返回 None
+
+    每项包含 name，以及 base_url、proxy、timeout、connect_timeout、max_retries（可选）；
+    密钥通过 api_key_env 指定的环境变量读取（也可以直接给出 api_key）。例如：
+    [{"name": "relay", "base_url": "https://anthropic.claude-plus.top", "api_key_env": "ANTHROPIC_API_KEY_PLUS"},
+     {"name": "direct", "api_key_env": "ANTHROPIC_API_KEY", "proxy": "http://127.0.0.1:7890/"}]
+    """
+    raw = os.getenv(var)
+    if not raw:
+        return None
+    endpoints = []
+    for spec in json.loads(raw):
+        spec = dict(spec)
+        key_env = spec.pop("api_key_env", None)
+        if key_env:
+            spec["api_key"] = os.getenv(key_env)
+        endpoints.append(Endpoint(**spec))
+    return endpoints
+
+
+def is_endpoint_failure(error: BaseException) -> bool:
+    """异常是否说明端点有问题（换一个端点可能成功）"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status >= 500 or status in ENDPOINT_FAILURE_STATUS
+    return isinstance(error, (anthropic.APIConnectionError, httpx.TransportError, ConnectionError, TimeoutError))
+
+
+class CircuitOpenError(RuntimeError):
+    """所有端点都已熔断且已有探测请求在进行，快速失败而不是等待超时"""
+
+
+class _EndpointState:
+    def __init__(self, endpoint: Endpoint, window: int):
+        self.endpoint = endpoint
+        self.state = CLOSED
+        self.latency: Optional[float] = None  # EWMA，秒
+        self.results: deque = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.cooldown = 0.0
+        self.probing = False
+        self.calls = 0
+        self.errors = 0
+        self.opens = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def error_rate(self) -> float:
+        return self.results.count(False) / len(self.results) if self.results else 0.0
+
+
+class Lease:
+    """lease() / call() 选中的端点，记录首 token 时间"""
+
+    def __init__(self, endpoint: Endpoint):
+        self.endpoint = endpoint
+        self._start = time.monotonic()
+        self._first_token: Optional[float] = None
+
+    def first_token(self):
+        if self._first_token is None:
+            self._first_token = time.monotonic() - self._start
+
+    def latency(self) -> float:
+        return self._first_token if self._first_token is not None else time.monotonic() - self._start
+
+
+def report_first_token():
+    """
+    在 call() / acall() 的 fn 中收到首个片段时调用
+
+    与 lease().first_token() 一样以首 token 延迟作为端点的延迟样本；不调用时（非流式请求）使用总耗时。
+    """
+    lease = _current_lease.get()
+    if lease is not None:
+        lease.first_token()
+
+
+class EndpointPool:
+    """按健康度和延迟选择端点，端点故障时熔断并切换"""
+
+    def __init__(self, endpoints: Sequence[Endpoint], make_client: Optional[Callable[[Endpoint], Any]] = None,
+                 failure_threshold: int = 3, error_rate_threshold: float = 0.5, window: int = 20,
+                 min_calls: int = 5, cooldown: float = 10.0, max_cooldown: float = 300.0, alpha: float = 0.2,
+                 failure_penalty: float = 1.0):
+        """
+        Args:
+            endpoints: 端点列表，顺序为同等条件下的优先级
+            make_client: 为端点创建（同步）客户端的函数，client() 按需调用并缓存
+            failure_threshold: 连续失败达到该次数时熔断
+            error_rate_threshold: 窗口内错误率达到该值（且调用数不少于 min_calls）时熔断
+            window: 错误率统计的最近调用数
+            min_calls: 按错误率熔断所需的最少调用数
+            cooldown: 首次熔断的冷却时间（秒），半开探测失败后加倍
+            max_cooldown: 冷却时间上限（秒）
+            alpha: 延迟 EWMA 的平滑系数
+            failure_penalty: 失败的调用计入延迟样本的额外时间（秒），立即失败的端点不会因此显得更快
+        """
+        if not endpoints:
+            raise ValueError("至少需要一个端点")
+        names = [endpoint.name for endpoint in endpoints]
+        if len(set(names)) != len(names):
+            raise ValueError(f"端点名称重复: {names}")
+        self.make_client = make_client
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_calls = min_calls
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.alpha = alpha
+        self.failure_penalty = failure_penalty
+        self._states = [_EndpointState(endpoint, window) for endpoint in endpoints]
+        self._clients: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def endpoints(self) -> List[Endpoint]:
+        return [state.endpoint for state in self._states]
+
+    def client(self, endpoint: Endpoint) -> Any:
+        """端点的客户端（首次使用时通过 make_client 创建）"""
+        with self._lock:
+            if endpoint.name not in self._clients:
+                self._clients[endpoint.name] = self.make_client(endpoint)
+            return self._clients[endpoint.name]
+
+    def select(self, exclude: Sequence[str] = (), rank: int = 0) -> Optional[Endpoint]:
+        """
+        选择端点
+
+        Args:
+            exclude: 本次调用已经失败、不再选择的端点名称
+            rank: 选择第几好的端点（对冲请求用 1 选择与首个请求不同的端点，只有一个可选时仍选它）
+
+        Returns:
+            端点；全部被排除时返回 None
+
+        Raises:
+            CircuitOpenError: 没有未熔断的端点，且已有探测请求在进行
+        """
+        now = time.monotonic()
+        with self._lock:
+            states = [s for s in self._states if s.endpoint.name not in exclude]
+            if not states:
+                return None
+            for s in states:
+                if s.state == OPEN and now - s.opened_at >= s.cooldown:
+                    s.state = HALF_OPEN
+            # 半开的端点优先放行一个探测请求，否则永远没有机会恢复
+            probe = next((s for s in states if s.state == HALF_OPEN and not s.probing), None)
+            if probe is not None and rank == 0:
+                probe.probing = True
+                return probe.endpoint
+            candidates = [s for s in states if s.state == CLOSED]
+            if not candidates:
+                if any(s.probing for s in states):
+                    # 探测结果出来之前，其余请求不再各自等待超时
+                    raise CircuitOpenError("所有端点都已熔断，正在等待探测请求的结果")
+                # 全部熔断且没有探测在进行：放行一个请求尝试最快恢复的端点（视为探测）
+                forced = min(states, key=lambda s: s.opened_at + s.cooldown)
+                forced.probing = True
+                return forced.endpoint
+            candidates.sort(key=self._score)
+            return candidates[min(rank, len(candidates) - 1)].endpoint
+
+    @staticmethod
+    def _score(state: _EndpointState) -> float:
+        # 预期成功耗时：没有样本的端点先试（0），错误率越高越慢
+        if state.latency is None:
+            return 0.0
+        return state.latency / max(0.05, 1.0 - state.error_rate)
+
+    def record(self, endpoint: Endpoint, latency: float, error: Optional[BaseException] = None):
+        """
+        记录一次调用的结果
+
+        Args:
+            endpoint: 调用使用的端点
+            latency: 耗时（秒）
+            error: 调用失败时的异常；不属于端点故障的异常（如参数错误）不影响端点健康度
+        """
+        with self._lock:
+            state = next(s for s in self._states if s.endpoint is endpoint)
+            was_probe, state.probing = state.probing, False
+            if error is not None and not is_endpoint_failure(error):
+                return
+            state.calls += 1
+            if error is not None:
+                latency += self.failure_penalty
+            state.latency = latency if state.latency is None else self.alpha * latency + (1 - self.alpha) * state.latency
+            if error is None:
+                state.results.append(True)
+                state.consecutive_failures = 0
+                if state.state != CLOSED:
+                    state.state = CLOSED
+                    state.cooldown = 0.0
+                    state.results.clear()
+                return
+            state.results.append(False)
+            state.errors += 1
+            state.consecutive_failures += 1
+            state.last_error = f"{type(error).__name__}: {error}"[:200]
+            if was_probe:
+                # 半开探测（或全部熔断时的尝试）失败，冷却时间加倍
+                self._open(state, min(self.max_cooldown, max(self.base_cooldown, state.cooldown * 2)))
+            elif state.state == CLOSED and (state.consecutive_failures >= self.failure_threshold or (
+                    len(state.results) >= self.min_calls and state.error_rate >= self.error_rate_threshold)):
+                self._open(state, self.base_cooldown)
+
+    @staticmethod
+    def _open(state: _EndpointState, cooldown: float):
+        state.state = OPEN
+        state.opened_at = time.monotonic()
+        state.cooldown = cooldown
+        state.opens += 1
+
+    @contextlib.contextmanager
+    def lease(self, exclude: Sequence[str] = (), rank: int = 0) -> Iterator["Lease"]:
+        """
+        选择一个端点并在结束时记录结果（不切换端点，用于流式调用等无法重试的场景）
+
+        流式调用收到首个片段时调用 lease.first_token()，以首 token 延迟作为该端点的延迟样本。
+
+        Raises:
+            RuntimeError: 所有端点都被排除
+            CircuitOpenError: 所有端点都已熔断且已有探测请求在进行
+        """
+        endpoint = self.select(exclude, rank)
+        if endpoint is None:
+            raise RuntimeError("没有可用的端点")
+        lease = Lease(endpoint)
+        try:
+            yield lease
+        except BaseException as e:
+            self.record(endpoint, lease.latency(), e)
+            raise
+        self.record(endpoint, lease.latency())
+
+    def call(self, fn: Callable[[Endpoint], T], rank: int = 0) -> T:
+        """
+        在最合适的端点上执行 fn，端点故障时换下一个端点，每个端点最多尝试一次
+
+        Args:
+            fn: 接收端点并发起请求的函数（通过 client(endpoint) 取得客户端），流式请求收到首个片段时
+                调用 report_first_token()
+            rank: 见 select
+
+        Returns:
+            fn 的返回值；所有端点都失败时抛出最后一个异常
+
+        Raises:
+            CircuitOpenError: 没有可尝试的端点（见 select）；已尝试过端点时抛出最后一个端点的异常
+        """
+        tried: List[str] = []
+        last_error: Optional[BaseException] = None
+        while True:
+            try:
+                endpoint = self.select(tried, rank)
+            except CircuitOpenError:
+                # 剩余端点都已熔断且在探测中：抛出已尝试端点的异常
+                if last_error is None:
+                    raise
+                raise last_error
+            lease = Lease(endpoint)
+            token = _current_lease.set(lease)
+            try:
+                result = fn(endpoint)
+            except BaseException as e:
+                # 取消（如对冲落败）也要释放半开探测，但不影响端点健康度
+                self.record(endpoint, lease.latency(), e)
+                tried.append(endpoint.name)
+                if not is_endpoint_failure(e) or len(tried) == len(self._states):
+                    raise
+                last_error = e
+                continue
+            finally:
+                _current_lease.reset(token)
+            self.record(endpoint, lease.latency())
+            return result
+
+    async def acall(self, fn: Callable[[Endpoint], Awaitable[T]], rank: int = 0) -> T:
+        """call 的异步版本"""
+        tried: List[str] = []
+        last_error: Optional[BaseException] = None
+        while True:
+            try:
+                endpoint = self.select(tried, rank)
+            except CircuitOpenError:
+                # 剩余端点都已熔断且在探测中：抛出已尝试端点的异常
+                if last_error is None:
+                    raise
+                raise last_error
+            lease = Lease(endpoint)
+            token = _current_lease.set(lease)
+            try:
+                result = await fn(endpoint)
+            except BaseException as e:
+                # 取消（如对冲落败）也要释放半开探测，但不影响端点健康度
+                self.record(endpoint, lease.latency(), e)
+                tried.append(endpoint.name)
+                if not is_endpoint_failure(e) or len(tried) == len(self._states):
+                    raise
+                last_error = e
+                continue
+            finally:
+                _current_lease.reset(token)
+            self.record(endpoint, lease.latency())
+            return result
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各端点的熔断状态、调用数、错误数和窗口错误率、延迟 EWMA、熔断次数和最近的错误"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                s.endpoint.name: {
+                    "state": s.state,
+                    "calls": s.calls,
+                    "errors": s.errors,
+                    "error_rate": round(s.error_rate, 4),
+                    "latency_ms": round(s.latency * 1000, 1) if s.latency is not None else None,
+                    "opens": s.opens,
+                    "retry_in_s": round(max(0.0, s.opened_at + s.cooldown - now), 1) if s.state == OPEN else 0.0,
+                    "last_error": s.last_error,
+                }
+                for s in self._states
+            }
+
+
+def pool_from_env(make_client: Callable[[Endpoint], Any], var: str = "LLM_ENDPOINTS") -> Optional[EndpointPool]:
+    """按环境变量 LLM_ENDPOINTS（见 endpoints_from_env）创建端点池，未设置时返回 None"""
+    endpoints = endpoints_from_env(var)
+    if not endpoints:
+        return None
+    return EndpointPool(endpoints, make_client)
@@ -0,0 +1,336 @@
+"""
+对冲请求
+
+经中转站访问 API 时延迟有长尾：少数请求的耗时是中位数的数倍，而告警分析的总延迟由最慢的调用决定。
+对冲请求在首个请求迟迟没有响应（流式调用为没有收到首 token）时再发一个相同的请求，先收到首 token
+（非流式请求为先返回）的请求胜出，另一个立即取消（关闭 HTTP 流，停止生成）：
+- 对冲延迟取最近首 token 延迟的分位数（默认 p95），样本不足时使用初始延迟
+- 对冲预算：每次调用积累 budget 个令牌，对冲消耗一个，对冲比例长期不超过 budget，避免故障时请求量翻倍
+- 统计对冲次数、对冲请求胜出次数和当前对冲延迟
+- 同步请求各自在独立的线程中执行，落败的请求不会占住线程让后续调用排队
+
+本模块不依赖 crisis 的其他模块，agent.py 可以直接导入。
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class HedgeCancelled(Exception):
+    """对冲中落败的请求被取消"""
+
+
+class HedgePolicy:
+    """自适应对冲延迟和对冲预算"""
+
+    def __init__(self, percentile: float = 0.95, budget: float = 0.05, initial_delay: float = 2.0,
+                 min_delay: float = 0.05, min_samples: int = 20, window: int = 500, burst: float = 10.0):
+        """
+        Args:
+            percentile: 对冲延迟取最近首 token 延迟的该分位数
+            budget: 允许对冲的调用比例（如 0.05 为 5%）
+            initial_delay: 样本数不足 min_samples 时的对冲延迟（秒）
+            min_delay: 对冲延迟下限（秒）
+            min_samples: 使用分位数所需的最少样本数
+            window: 保留的最近样本数
+            burst: 对冲令牌上限，允许短时间内集中对冲的次数
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.burst = burst
+        self._samples: deque = deque(maxlen=window)
+        self._tokens = burst
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "budget_denied": 0, "errors_recovered": 0}
+
+    def delay(self) -> float:
+        """当前的对冲延迟（秒）"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return self.initial_delay
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(self.percentile * len(ordered)))
+        return max(self.min_delay, ordered[index])
+
+    def observe(self, latency: float):
+        """记录一次请求的首 token 延迟（非流式请求为总延迟）"""
+        with self._lock:
+            self._samples.append(latency)
+
+    def begin(self):
+        """开始一次调用，积累对冲令牌"""
+        with self._lock:
+            self._stats["calls"] += 1
+            self._tokens = min(self.burst, self._tokens + self.budget)
+
+    def acquire(self) -> bool:
+        """申请一次对冲，预算不足时返回 False"""
+        with self._lock:
+            if self._tokens < 1:
+                self._stats["budget_denied"] += 1
+                return False
+            self._tokens -= 1
+            self._stats["hedged"] += 1
+            return True
+
+    def record(self, hedge_won: bool, recovered: bool = False):
+        """记录对冲的结果：对冲请求是否胜出，是否替失败的首个请求给出了结果"""
+        with self._lock:
+            self._stats["hedge_wins"] += hedge_won
+            self._stats["errors_recovered"] += recovered
+
+    def stats(self) -> Dict[str, Any]:
+        """调用数、对冲数和对冲比例、对冲胜出数和胜率、预算拒绝数、当前对冲延迟"""
+        delay = self.delay()
+        with self._lock:
+            stats = dict(self._stats)
+            samples = len(self._samples)
+        stats["hedge_rate"] = round(stats["hedged"] / stats["calls"], 4) if stats["calls"] else 0.0
+        stats["hedge_win_rate"] = round(stats["hedge_wins"] / stats["hedged"], 4) if stats["hedged"] else 0.0
+        stats["delay_s"] = round(delay, 4)
+        stats["samples"] = samples
+        return stats
+
+
+class Attempt:
+    """对冲中的一次请求，请求函数通过它报告首 token 和注册取消操作"""
+
+    def __init__(self, index: int, policy: HedgePolicy, is_async: bool = False, race: Optional["_Race"] = None):
+        self.index = index  # 0 为首个请求，1 为对冲请求
+        self.policy = policy
+        self.race = race
+        self.cancelled = False
+        self.progressed = asyncio.Event() if is_async else threading.Event()
+        self._start = time.monotonic()
+        self._cancel_callbacks: List[Callable[[], Any]] = []
+        self._lock = threading.Lock()
+
+    def first_token(self):
+        """收到首个片段时调用（只记录一次）；先收到首 token 的请求胜出，其余请求被取消"""
+        if not self.progressed.is_set():
+            self.progressed.set()
+            self.policy.observe(time.monotonic() - self._start)
+            if self.race is not None:
+                self.race.commit(self)
+
+    def on_cancel(self, callback: Callable[[], Any]):
+        """注册取消时执行的操作（如关闭 HTTP 流）；已经取消时立即执行"""
+        with self._lock:
+            if not self.cancelled:
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def finish(self, ok: bool):
+        """请求结束：成功但没有报告首 token 时（非流式请求）以总延迟作为样本"""
+        if not self.progressed.is_set():
+            self.progressed.set()
+            if ok and not self.cancelled:
+                self.policy.observe(time.monotonic() - self._start)
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._cancel_callbacks = self._cancel_callbacks, []
+        if self.index == 0 and not self.progressed.is_set():
+            # 首个请求落败时仍没有首 token，已等待的时间是其延迟的下限，计入样本以免分位数偏低
+            self.policy.observe(time.monotonic() - self._start)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def check(self):
+        """已取消时抛出 HedgeCancelled，供请求函数在关闭流后区分取消和真正的错误"""
+        if self.cancelled:
+            raise HedgeCancelled(f"第 {self.index + 1} 个请求在对冲中落败，已取消")
+
+
+class _Race:
+    """一次对冲调用中的各个请求：第一个收到首 token 或成功返回的请求胜出，其余请求立即取消"""
+
+    def __init__(self):
+        self.attempts: List[Attempt] = []
+        self.winner: Optional[Attempt] = None
+        self._lock = threading.Lock()
+
+    def add(self, attempt: Attempt) -> bool:
+        """加入一个请求；已经有请求胜出时返回 False，不再发起"""
+        with self._lock:
+            if self.winner is not None:
+                return False
+            self.attempts.append(attempt)
+            return True
+
+    def commit(self, attempt: Attempt):
+        with self._lock:
+            if self.winner is not None:
+                return
+            self.winner = attempt
+            losers = [other for other in self.attempts if other is not attempt]
+        for other in losers:
+            other.cancel()
+
+
+def hedged_call(request: Callable[[Attempt], T], policy: HedgePolicy) -> T:
+    """
+    执行可能被对冲的同步请求
+
+    Args:
+        request: 发起一次请求的函数，收到首个片段时调用 attempt.first_token()，
+            并用 attempt.on_cancel() 注册关闭请求的操作（同步请求只能通过关闭连接取消）
+        policy: 对冲策略
+
+    Returns:
+        先成功返回的请求的结果；两个请求都失败时抛出首个请求的异常
+    """
+    policy.begin()
+    race = _Race()
+    primary = Attempt(0, policy, race=race)
+    race.add(primary)
+    futures = {_submit(request, primary): primary}
+    primary.progressed.wait(policy.delay())
+    if not primary.progressed.is_set() and policy.acquire():
+        hedge = Attempt(1, policy, race=race)
+        if race.add(hedge):
+            futures[_submit(request, hedge)] = hedge
+
+    errors = {}
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in sorted(done, key=lambda f: futures[f].index):
+            attempt = futures[future]
+            if future.exception() is not None:
+                if not attempt.cancelled:  # 另一个请求先收到首 token，落败请求的 HedgeCancelled 不算失败
+                    errors[attempt.index] = future.exception()
+                continue
+            race.commit(attempt)
+            if len(futures) > 1:
+                policy.record(attempt.index == 1, recovered=0 in errors)
+            return future.result()
+    if len(futures) > 1:
+        policy.record(False)
+    raise _final_error(race, errors)
+
+
+async def ahedged_call(request: Callable[[Attempt], Awaitable[T]], policy: HedgePolicy) -> T:
+    """hedged_call 的异步版本，落败的请求以取消任务的方式终止"""
+    policy.begin()
+    race = _Race()
+    tasks: Dict[asyncio.Task, Attempt] = {}
+
+    def start(attempt: Attempt):
+        task = asyncio.ensure_future(_arun(request, attempt))
+        tasks[task] = attempt
+        attempt.on_cancel(task.cancel)
+
+    primary = Attempt(0, policy, is_async=True, race=race)
+    race.add(primary)
+    start(primary)
+    try:
+        progressed = asyncio.ensure_future(primary.progressed.wait())
+        try:
+            await asyncio.wait([progressed, *tasks], timeout=policy.delay(), return_when=FIRST_COMPLETED)
+        finally:
+            progressed.cancel()
+        if not primary.progressed.is_set() and policy.acquire():
+            hedge = Attempt(1, policy, is_async=True, race=race)
+            if race.add(hedge):
+                start(hedge)
+
+        errors = {}
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=FIRST_COMPLETED)
+            for task in sorted(done, key=lambda t: tasks[t].index):
+                attempt = tasks[task]
+                if task.cancelled():
+                    continue  # 另一个请求先收到首 token，落败的请求已取消
+                if task.exception() is not None:
+                    errors[attempt.index] = task.exception()
+                    continue
+                race.commit(attempt)
+                if len(tasks) > 1:
+                    policy.record(attempt.index == 1, recovered=0 in errors)
+                return task.result()
+        if len(tasks) > 1:
+            policy.record(False)
+        raise _final_error(race, errors)
+    finally:
+        for task, attempt in tasks.items():
+            if not task.done():
+                attempt.cancel()
+                task.cancel()
+
+
+def _final_error(race: _Race, errors: Dict[int, BaseException]) -> BaseException:
+    """所有请求都失败时抛出的异常：已有请求胜出时为它的异常（落败的一方只是被取消），否则为首个请求的异常"""
+    if race.winner is not None and race.winner.index in errors:
+        return errors[race.winner.index]
+    return errors[min(errors)]
+
+
+def _submit(request: Callable[[Attempt], T], attempt: Attempt) -> Future:
+    """在新线程中执行一次请求：落败的请求关闭连接前可能仍占用线程，不与其他调用共用线程池"""
+    future: Future = Future()
+    future.set_running_or_notify_cancel()
+    # 请求在调用方的上下文中执行，遥测步骤等 contextvars 保持不变
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            future.set_result(context.run(_run, request, attempt))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=f"hedge-{attempt.index}", daemon=True).start()
+    return future
+
+
+def _run(request: Callable[[Attempt], T], attempt: Attempt) -> T:
+    ok = False
+    try:
+        result = request(attempt)
+        ok = True
+        return result
+    finally:
+        attempt.finish(ok)
+
+
+async def _arun(request: Callable[[Attempt], Awaitable[T]], attempt: Attempt) -> T:
+    ok = False
+    try:
+        result = await request(attempt)
+        ok = True
+        return result
+    finally:
+        attempt.finish(ok)
+
+
+def policy_from_env() -> Optional[HedgePolicy]:
+    """
+    按环境变量创建对冲策略：LLM_HEDGE=1 开启，LLM_HEDGE_PERCENTILE / LLM_HEDGE_BUDGET /
+    LLM_HEDGE_INITIAL_DELAY 覆盖默认值；未开启时返回 None
+    """
+    if os.getenv("LLM_HEDGE", "0") in ("", "0"):
+        return None
+    return HedgePolicy(
+        percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95")),
+        budget=float(os.getenv("LLM_HEDGE_BUDGET", "0.05")),
+        initial_delay=float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "2.0")),
+    )
@@ -0,0 +1,152 @@
+"""
+事件会话：持续事件的增量重分析
+
+同一事件往往会产生一系列告警，每次更新只是在上一条告警文本后追加几行
+（新的错误码、新的受影响服务器等）。事件会话按事件 ID 保存上一次的分析状态，
+只对新增内容做分析，并通过分类签名判断是否需要重新调用 LLM 工作流。
+
+本模块只依赖标准库，规则引擎（AlertAnalysisAgent）和 LLM 工作流（workflow.py）共用。
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# 与告警分类相关的特征模式（服务器名、时间等不影响分类的内容不参与签名）
+_SIGNATURE_PATTERNS = [
+    ("code", re.compile(r'(?<![\d.:-])(\d{5})(?![\d.:-])')),
+    ("http", re.compile(r'(?:HTTP|状态码|status)\D{0,8}([1-5]\d{2})\b', re.IGNORECASE)),
+    ("exception", re.compile(r'\b((?:[A-Za-z_][\w$]*\.)*[A-Z]\w*(?:Error|Exception))\b')),
+    ("uni", re.compile(r'\b(uni\.\w+)', re.IGNORECASE)),
+]
+
+_SIGNATURE_KEYWORDS = [
+    "javascript", "script error", "bridge", "桥接", "uni", "api", "接口",
+    "数据库", "database", "sql", "浏览器", "前端", "后端", "微服务",
+]
+
+
+def classification_signature(alert_details: str) -> str:
+    """
+    提取告警中与分类相关的特征并生成稳定签名
+
+    Args:
+        alert_details: 告警详细信息
+
+    Returns:
+        特征签名字符串；签名相同意味着分类结果不会改变
+    """
+    features = set()
+    for name, pattern in _SIGNATURE_PATTERNS:
+        for match in pattern.findall(alert_details):
+            features.add(f"{name}:{match.lower()}")
+
+    alert_lower = alert_details.lower()
+    for keyword in _SIGNATURE_KEYWORDS:
+        if keyword in alert_lower:
+            features.add(f"kw:{keyword}")
+
+    return "|".join(sorted(features))
+
+
+class IncidentSession:
+    """单个事件的分析会话，保存累计文本和上一次的分析状态"""
+
+    def __init__(self, incident_id: str):
+        self.incident_id = incident_id
+        self.text = ""
+        self.updates = 0
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        # 调用方自由使用的累计分析状态（错误码集合、组件集合等）
+        self.state: Dict[str, Any] = {}
+        # 上一次 LLM 分析时的分类签名与结果
+        self.signature: Optional[str] = None
+        self.result: Optional[Any] = None
+        self._seen_lines = set()
+        self.lock = threading.Lock()
+
+    def apply_update(self, alert_details: str) -> str:
+        """
+        记录一次事件更新，返回相对于已有内容的新增部分
+
+        追加式更新直接取后缀；非追加式更新（内容被改写）按行去重后取新出现的行。
+
+        Args:
+            alert_details: 本次收到的完整告警文本
+
+        Returns:
+            新增内容（没有新增时为空字符串）
+        """
+        if self.text and alert_details.startswith(self.text):
+            new_text = alert_details[len(self.text):]
+        else:
+            new_lines = [line for line in alert_details.splitlines()
+                         if line.strip() and line.strip() not in self._seen_lines]
+            new_text = "\n".join(new_lines)
+
+        for line in new_text.splitlines():
+            if line.strip():
+                self._seen_lines.add(line.strip())
+
+        self.text = alert_details
+        self.updates += 1
+        self.updated_at = time.time()
+        return new_text
+
+    @property
+    def is_new(self) -> bool:
+        """是否尚未处理过任何更新"""
+        return self.updates == 0
+
+
+class IncidentStore:
+    """按事件 ID 管理会话，超出容量或过期的会话会被淘汰"""
+
+    def __init__(self, max_sessions: int = 256, session_ttl: float = 6 * 3600):
+        """
+        Args:
+            max_sessions: 最多保留的会话数（LRU 淘汰）
+            session_ttl: 会话在无更新情况下的存活时间（秒）
+        """
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self._sessions: "OrderedDict[str, IncidentSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, incident_id: str) -> IncidentSession:
+        """获取事件会话，不存在或已过期时新建"""
+        with self._lock:
+            self._evict_expired()
+            session = self._sessions.get(incident_id)
+            if session is None:
+                session = IncidentSession(incident_id)
+                self._sessions[incident_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(incident_id)
+            return session
+
+    def get(self, incident_id: str) -> Optional[IncidentSession]:
+        with self._lock:
+            return self._sessions.get(incident_id)
+
+    def close(self, incident_id: str) -> Optional[IncidentSession]:
+        """事件结束时移除会话"""
+        with self._lock:
+            return self._sessions.pop(incident_id, None)
+
+    def active_incidents(self) -> List[str]:
+        with self._lock:
+            self._evict_expired()
+            return list(self._sessions.keys())
+
+    def _evict_expired(self):
+        now = time.time()
+        expired = [incident_id for incident_id, session in self._sessions.items()
+                   if now - session.updated_at > self.session_ttl]
+        for incident_id in expired:
+            del self._sessions[incident_id]
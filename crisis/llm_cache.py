@@ -0,0 +1,202 @@
+"""
+LLM 响应缓存
+
+两级内容寻址缓存：内存 LRU + 磁盘 SQLite。缓存键是
+(model, system prompt, prompt, temperature, max_tokens) 的哈希，
+支持过期时间（TTL）、容量上限淘汰和命中统计。
+
+读路径不写磁盘：命中只在内存中记录访问时间，攒够一批或写入时再批量写回；
+磁盘条目数在内存中估计，超出上限 10% 后才批量淘汰，写入时不必每次统计行数。
+
+重放或重新处理历史告警时，未改动的上游调用直接命中缓存，不再重复付费。
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# 超出 max_entries 的比例达到该值时批量淘汰到 max_entries
+EVICTION_SLACK = 0.1
+
+
+def make_cache_key(model: str, system: Any, prompt: Any, temperature: float, max_tokens: int) -> str:
+    """
+    计算请求的缓存键
+
+    system 和 prompt 可以是字符串或内容块列表，统一序列化后哈希。
+    """
+    payload = json.dumps(
+        [model, system, prompt, temperature, max_tokens],
+        ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """内存 LRU + SQLite 两级缓存"""
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None,
+                 max_entries: int = 100000, memory_entries: int = 1024, touch_batch: int = 256):
+        """
+        Args:
+            path: SQLite 文件路径，为 None 时只使用内存缓存
+            ttl: 缓存有效期（秒），None 表示不过期
+            max_entries: 磁盘缓存最大条目数，超出 10% 后按最近访问时间淘汰到该数量
+            memory_entries: 内存 LRU 最大条目数
+            touch_batch: 累计多少次命中后把访问时间写回磁盘（写入和关闭时也会写回）
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.touch_batch = touch_batch
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._touches: Dict[str, float] = {}  # 尚未写回磁盘的访问时间
+        self._disk_rows = 0  # 磁盘条目数的估计（覆盖已有键时偏大，淘汰时校正）
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0, "expired": 0}
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL, expires_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+            self._db.commit()
+            self._disk_rows = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            atexit.register(self.flush)
+
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存，未命中或已过期时返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._touch(key, now)
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+                self._stats["expired"] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at is None or expires_at > now:
+                        self._remember(key, value, expires_at)
+                        self._touch(key, now)
+                        self._stats["disk_hits"] += 1
+                        return value
+                    # 过期的行留到写入或淘汰时再删除，读路径不写磁盘
+                    self._stats["expired"] += 1
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, value: str):
+        """写入缓存"""
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._db is not None:
+                self._touches.pop(key, None)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?)", (key, value, now, now, expires_at)
+                )
+                self._disk_rows += 1
+                if self._disk_rows > self.max_entries * (1 + EVICTION_SLACK):
+                    self._evict_disk(now)
+                else:
+                    self._write_touches()
+                self._db.commit()
+            self._stats["writes"] += 1
+
+    def _remember(self, key: str, value: str, expires_at: Optional[float]):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _touch(self, key: str, now: float):
+        """记录一次命中的访问时间，攒够 touch_batch 条后写回磁盘"""
+        if self._db is None:
+            return
+        self._touches[key] = now
+        if len(self._touches) >= self.touch_batch:
+            self._write_touches()
+            self._db.commit()
+
+    def _write_touches(self):
+        """把累计的访问时间写入当前事务（由调用方提交）"""
+        if self._touches:
+            self._db.executemany("UPDATE responses SET accessed_at = ? WHERE key = ?",
+                                 [(accessed_at, key) for key, accessed_at in self._touches.items()])
+            self._touches.clear()
+
+    def _evict_disk(self, now: float):
+        """删除过期条目，再按最近访问时间淘汰到 max_entries，并校正条目数"""
+        self._write_touches()
+        self._db.execute("DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        count = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)", (excess,)
+            )
+            self._stats["evictions"] += excess
+        self._disk_rows = min(count, self.max_entries)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._memory.clear()
+            self._touches.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+                self._disk_rows = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存命中统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            if self._db is not None:
+                stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
+
+    def flush(self):
+        """把尚未写回的访问时间写入磁盘"""
+        with self._lock:
+            if self._db is not None and self._touches:
+                self._write_touches()
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._write_touches()
+                self._db.commit()
+                self._db.close()
+                self._db = None
@@ -0,0 +1,212 @@
+"""
+流水线执行
+
+多步处理（如链式 LLM 调用）逐个输入串行执行时，N 个输入需要 N × 步数次串行往返。
+流水线把每一步作为一个阶段，各阶段有独立的并发上限，阶段之间用有界队列连接：
+- 输入 k+1 可以处于第 1 步，同时输入 k 处于第 2 步，吞吐量由最慢的阶段决定
+- 有界队列提供背压，快的阶段不会无限堆积中间结果
+- 单个输入的失败只影响该输入（以 StageError 返回），其余输入继续处理
+- 结果可按输入顺序返回，也可按完成顺序返回
+- 消费方提前停止迭代时，各阶段停止取新的输入
+"""
+
+import asyncio
+import queue
+import threading
+from typing import (
+    Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Iterator, List, Sequence, Tuple, Union
+)
+
+_DONE = object()
+
+
+class StageError(Exception):
+    """某个输入在流水线某一阶段失败"""
+
+    def __init__(self, stage: int, error: BaseException):
+        super().__init__(f"第 {stage + 1} 阶段失败: {type(error).__name__}: {error}")
+        self.stage = stage
+        self.error = error
+
+
+def _limits(concurrency: Union[int, Sequence[int]], stages: int) -> List[int]:
+    limits = [concurrency] * stages if isinstance(concurrency, int) else list(concurrency)
+    if len(limits) != stages:
+        raise ValueError(f"并发上限数量（{len(limits)}）与阶段数（{stages}）不一致")
+    return [max(1, limit) for limit in limits]
+
+
+def _ordered(entries: Iterable[Tuple[int, Any]], ordered: bool) -> Iterator[Tuple[int, Any]]:
+    """按完成顺序到达的结果，按需重排为输入顺序"""
+    pending = {}
+    next_index = 0
+    for index, result in entries:
+        if not ordered:
+            yield index, result
+            continue
+        pending[index] = result
+        while next_index in pending:
+            yield next_index, pending.pop(next_index)
+            next_index += 1
+
+
+def run_pipeline(items: Iterable[Any], stages: Sequence[Callable[[Any], Any]],
+                 concurrency: Union[int, Sequence[int]] = 1, queue_size: int = 8,
+                 ordered: bool = True) -> Iterator[Tuple[int, Any]]:
+    """
+    用线程执行流水线
+
+    Args:
+        items: 输入（可以是惰性迭代器，按需读取）
+        stages: 各阶段的处理函数，上一阶段的输出是下一阶段的输入
+        concurrency: 每个阶段的并发上限，整数表示所有阶段相同
+        queue_size: 阶段之间队列的容量
+        ordered: True 按输入顺序返回，False 按完成顺序返回
+
+    Yields:
+        (输入序号, 最后一个阶段的结果或 StageError)
+    """
+    stages = list(stages)
+    limits = _limits(concurrency, len(stages))
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in range(len(stages) + 1)]
+    stop = threading.Event()
+    lock = threading.Lock()
+    alive = list(limits)
+    feed_error: List[BaseException] = []
+
+    def put(q: queue.Queue, entry: Any) -> bool:
+        # 带超时地等待队列空位，消费方停止后放弃
+        while not stop.is_set():
+            try:
+                q.put(entry, timeout=0.05)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q: queue.Queue) -> Any:
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.05)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def feed():
+        try:
+            for index, item in enumerate(items):
+                if not put(queues[0], (index, item)):
+                    return
+        except Exception as e:
+            feed_error.append(e)
+        for _ in range(limits[0]):
+            put(queues[0], _DONE)
+
+    def work(stage: int):
+        while True:
+            entry = get(queues[stage])
+            if entry is _DONE:
+                break
+            index, value = entry
+            if not isinstance(value, StageError):
+                try:
+                    value = stages[stage](value)
+                except Exception as e:
+                    value = StageError(stage, e)
+            if not put(queues[stage + 1], (index, value)):
+                break
+        # 本阶段最后一个退出的线程通知下一阶段结束
+        with lock:
+            alive[stage] -= 1
+            last = alive[stage] == 0
+        if last:
+            for _ in range(limits[stage + 1] if stage + 1 < len(stages) else 1):
+                put(queues[stage + 1], _DONE)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    threads += [threading.Thread(target=work, args=(stage,), daemon=True)
+                for stage, limit in enumerate(limits) for _ in range(limit)]
+    for thread in threads:
+        thread.start()
+
+    def results() -> Iterator[Tuple[int, Any]]:
+        while True:
+            entry = get(queues[-1])
+            if entry is _DONE:
+                return
+            yield entry
+
+    try:
+        yield from _ordered(results(), ordered)
+        if feed_error:
+            raise feed_error[0]
+    finally:
+        stop.set()
+
+
+async def arun_pipeline(items: Union[Iterable[Any], AsyncIterable[Any]],
+                        stages: Sequence[Callable[[Any], Awaitable[Any]]],
+                        concurrency: Union[int, Sequence[int]] = 1, queue_size: int = 8,
+                        ordered: bool = True) -> AsyncIterator[Tuple[int, Any]]:
+    """run_pipeline 的异步版本：各阶段为协程函数，停止迭代（aclose）时取消所有阶段"""
+    stages = list(stages)
+    limits = _limits(concurrency, len(stages))
+    queues = [asyncio.Queue(maxsize=max(1, queue_size)) for _ in range(len(stages) + 1)]
+    alive = list(limits)
+    feed_error: List[BaseException] = []
+
+    async def feed():
+        try:
+            if hasattr(items, "__aiter__"):
+                index = 0
+                async for item in items:
+                    await queues[0].put((index, item))
+                    index += 1
+            else:
+                for index, item in enumerate(items):
+                    await queues[0].put((index, item))
+        except Exception as e:
+            feed_error.append(e)
+        for _ in range(limits[0]):
+            await queues[0].put(_DONE)
+
+    async def work(stage: int):
+        while True:
+            entry = await queues[stage].get()
+            if entry is _DONE:
+                break
+            index, value = entry
+            if not isinstance(value, StageError):
+                try:
+                    value = await stages[stage](value)
+                except Exception as e:
+                    value = StageError(stage, e)
+            await queues[stage + 1].put((index, value))
+        alive[stage] -= 1
+        if alive[stage] == 0:
+            for _ in range(limits[stage + 1] if stage + 1 < len(stages) else 1):
+                await queues[stage + 1].put(_DONE)
+
+    tasks = [asyncio.ensure_future(feed())]
+    tasks += [asyncio.ensure_future(work(stage)) for stage, limit in enumerate(limits) for _ in range(limit)]
+    pending = {}
+    next_index = 0
+    try:
+        while True:
+            entry = await queues[-1].get()
+            if entry is _DONE:
+                break
+            index, result = entry
+            if not ordered:
+                yield index, result
+                continue
+            pending[index] = result
+            while next_index in pending:
+                yield next_index, pending.pop(next_index)
+                next_index += 1
+        if feed_error:
+            raise feed_error[0]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,286 @@
+"""
+告警本地预分类器
+
+大多数告警带有决定性特征（uni. 调用和 uni 错误码、JS 堆栈帧、HTTP 状态码、
+java.sql 异常等），不需要 LLM 就能确定类别。预分类器由两部分组成：
+- 规则：带权重的特征正则
+- 朴素贝叶斯：在标注语料上训练的多项式模型，持久化为 JSON
+
+规则权重不是校准过的概率：单条强规则经 softmax 后就可能超过阈值。因此除了置信度达到阈值，
+还要求有佐证——该类别至少命中 min_signals 条规则，或已训练的朴素贝叶斯模型给出相同类别；
+否则回退到 LLM 分类。
+
+命令行：
+    python preclassifier.py train corpus.jsonl [--model PATH]
+    python preclassifier.py eval corpus.jsonl [--model PATH] [--threshold 0.9]
+
+语料为 JSONL，每行 {"alert": "...", "category": "..."}，category 为 LLM 的分类结果。
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from retrieval import tokenize
+
+CATEGORIES = ("uni_error", "javascript_error", "backend_api_error")
+
+# (类别, 特征正则, 权重)
+RULES = [
+    ("uni_error", re.compile(r'\buni\.\w+', re.IGNORECASE), 3.0),
+    ("uni_error", re.compile(r'uni\s*(?:js\s*)?bridge|js\s*bridge|桥接', re.IGNORECASE), 3.0),
+    ("uni_error", re.compile(r'(?<!\d)100(?:0[1-9]|1[0-9])(?!\d)'), 1.5),
+    ("uni_error", re.compile(r'\buni\b|uni(?=[一-鿿])', re.IGNORECASE), 1.0),
+    ("javascript_error", re.compile(r'\bat\s+[\w$.<>]+\s+\(?https?://\S+\.js:\d+:\d+'), 3.0),
+    ("javascript_error", re.compile(r'\b(?:TypeError|ReferenceError|SyntaxError|RangeError|URIError)\b'), 2.5),
+    ("javascript_error", re.compile(r'Cannot read propert|is not a function|is not defined|Script error', re.IGNORECASE), 2.5),
+    ("javascript_error", re.compile(r'Mozilla/\d|浏览器|前端', re.IGNORECASE), 1.0),
+    ("backend_api_error", re.compile(r'(?:HTTP|状态码|status)\D{0,8}[45]\d{2}\b', re.IGNORECASE), 2.5),
+    ("backend_api_error", re.compile(r'\bjava\.(?:sql|net|io|lang)\.\w+(?:Exception|Error)'), 3.0),
+    ("backend_api_error", re.compile(r'\bat\s+[\w$.]+\([\w$]+\.java:\d+\)'), 2.5),
+    ("backend_api_error", re.compile(r'Internal Server Error|Bad Gateway|Service Unavailable|Gateway Timeout', re.IGNORECASE), 2.0),
+    ("backend_api_error", re.compile(r'接口路径|/api/v?\d*|数据库|SQLException|连接池', re.IGNORECASE), 1.5),
+]
+
+
+class PreClassifier:
+    """
+    规则 + 朴素贝叶斯的本地分类器
+
+    规则得分经 softmax 转为概率，与朴素贝叶斯后验相乘后归一化；
+    未训练模型时只使用规则。
+    """
+
+    def __init__(self, model_path: Optional[str] = None, threshold: float = 0.9, min_signals: int = 2):
+        """
+        Args:
+            model_path: 朴素贝叶斯模型文件路径（不存在时只使用规则）
+            threshold: 直接给出类别所需的最低置信度
+            min_signals: 模型未佐证时，直接给出类别所需命中的最少规则数
+        """
+        self.model_path = model_path
+        self.threshold = threshold
+        self.min_signals = min_signals
+        self.class_counts: Dict[str, int] = {}
+        self.token_counts: Dict[str, Dict[str, int]] = {}
+        self.token_totals: Dict[str, int] = {}
+        self.vocabulary: set = set()
+        self._lock = threading.Lock()
+        self._stats = {"decided": 0, "deferred": 0, "unsupported": 0}
+        if model_path and os.path.exists(model_path):
+            self.load(model_path)
+
+    @property
+    def trained(self) -> bool:
+        return bool(self.class_counts)
+
+    def rule_scores(self, alert_details: str) -> Dict[str, float]:
+        """按规则累计各类别得分"""
+        scores = {category: 0.0 for category in CATEGORIES}
+        for category, pattern, weight in RULES:
+            if pattern.search(alert_details):
+                scores[category] += weight
+        return scores
+
+    def supported(self, alert_details: str, category: str) -> bool:
+        """类别是否有佐证：命中至少 min_signals 条该类别的规则，或已训练模型的预测与之一致"""
+        hits = sum(1 for c, pattern, _ in RULES if c == category and pattern.search(alert_details))
+        if hits >= self.min_signals:
+            return True
+        if self.trained:
+            log_probs = self._nb_log_probs(alert_details)
+            return max(log_probs, key=log_probs.get) == category
+        return False
+
+    def _nb_log_probs(self, alert_details: str) -> Dict[str, float]:
+        total_docs = sum(self.class_counts.values())
+        vocab_size = len(self.vocabulary) + 1
+        tokens = Counter(tokenize(alert_details))
+        log_probs = {}
+        for category in CATEGORIES:
+            counts = self.token_counts.get(category, {})
+            total = self.token_totals.get(category, 0)
+            log_prob = math.log((self.class_counts.get(category, 0) + 1) / (total_docs + len(CATEGORIES)))
+            for token, tf in tokens.items():
+                if token in self.vocabulary:
+                    log_prob += tf * math.log((counts.get(token, 0) + 1) / (total + vocab_size))
+            log_probs[category] = log_prob
+        return log_probs
+
+    def predict_proba(self, alert_details: str) -> Dict[str, float]:
+        """
+        计算各类别概率
+
+        Args:
+            alert_details: 告警详细信息
+
+        Returns:
+            类别 -> 概率
+        """
+        log_scores = dict(self.rule_scores(alert_details))
+        if self.trained:
+            for category, log_prob in self._nb_log_probs(alert_details).items():
+                log_scores[category] += log_prob
+        top = max(log_scores.values())
+        exp_scores = {c: math.exp(s - top) for c, s in log_scores.items()}
+        total = sum(exp_scores.values())
+        return {c: v / total for c, v in exp_scores.items()}
+
+    def classify(self, alert_details: str, record: bool = True) -> Tuple[Optional[str], float]:
+        """
+        本地分类
+
+        Args:
+            alert_details: 告警详细信息
+            record: 是否计入 stats()
+
+        Returns:
+            (类别, 置信度)；置信度低于阈值或缺少佐证时类别为 None，调用方应回退到 LLM
+        """
+        probs = self.predict_proba(alert_details)
+        category = max(probs, key=probs.get)
+        confidence = probs[category]
+        decided = confidence >= self.threshold
+        unsupported = decided and not self.supported(alert_details, category)
+        decided = decided and not unsupported
+        if record:
+            with self._lock:
+                self._stats["decided" if decided else "deferred"] += 1
+                self._stats["unsupported"] += unsupported
+        return (category if decided else None), confidence
+
+    def train(self, samples: List[Tuple[str, str]]):
+        """
+        在标注语料上训练（覆盖已有模型）
+
+        Args:
+            samples: [(告警文本, 类别), ...]
+        """
+        class_counts: Counter = Counter()
+        token_counts: Dict[str, Counter] = defaultdict(Counter)
+        for alert_details, category in samples:
+            if category not in CATEGORIES:
+                continue
+            class_counts[category] += 1
+            token_counts[category].update(tokenize(alert_details))
+        with self._lock:
+            self.class_counts = dict(class_counts)
+            self.token_counts = {c: dict(counts) for c, counts in token_counts.items()}
+            self.token_totals = {c: sum(counts.values()) for c, counts in token_counts.items()}
+            self.vocabulary = set().union(*token_counts.values()) if token_counts else set()
+
+    def save(self, path: Optional[str] = None):
+        path = path or self.model_path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"class_counts": self.class_counts, "token_counts": self.token_counts},
+                      f, ensure_ascii=False)
+
+    def load(self, path: str):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.class_counts = data["class_counts"]
+        self.token_counts = data["token_counts"]
+        self.token_totals = {c: sum(counts.values()) for c, counts in self.token_counts.items()}
+        self.vocabulary = set().union(*(set(c) for c in self.token_counts.values())) if self.token_counts else set()
+
+    def stats(self) -> Dict[str, Any]:
+        """本地直接分类的比例"""
+        with self._lock:
+            stats = dict(self._stats)
+        total = stats["decided"] + stats["deferred"]
+        stats["decide_rate"] = round(stats["decided"] / total, 4) if total else 0.0
+        stats["trained"] = self.trained
+        return stats
+
+
+def record_sample(path: str, alert_details: str, category: str, source: str = "deferred"):
+    """
+    把 LLM 的分类结果追加到标注语料，用于后续训练和评估
+
+    Args:
+        source: deferred 为预分类器未决定、交给 LLM 的告警；audit 为预分类器已决定、
+            按 audit_rate 抽样交给 LLM 复核的告警。只用 deferred 样本评估会高估一致率。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({"alert": alert_details, "category": category, "source": source},
+                           ensure_ascii=False) + "\n")
+
+
+def load_corpus(path: str) -> List[Tuple[str, str]]:
+    samples = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                samples.append((item["alert"], item["category"]))
+    return samples
+
+
+def evaluate(classifier: PreClassifier, samples: List[Tuple[str, str]]) -> Dict[str, Any]:
+    """
+    评估预分类器与 LLM 标注的一致性
+
+    Returns:
+        覆盖率（本地直接决定的比例）、决定部分与 LLM 的一致率、按类别的一致情况和单次分类耗时
+    """
+    decided, agreed = 0, 0
+    per_category: Dict[str, Counter] = defaultdict(Counter)
+    start = time.perf_counter()
+    for alert_details, label in samples:
+        category, _ = classifier.classify(alert_details)
+        if category is None:
+            per_category[label]["deferred"] += 1
+            continue
+        decided += 1
+        if category == label:
+            agreed += 1
+            per_category[label]["agreed"] += 1
+        else:
+            per_category[label][f"as_{category}"] += 1
+    elapsed = time.perf_counter() - start
+    total = len(samples)
+    return {
+        "samples": total,
+        "threshold": classifier.threshold,
+        "coverage": round(decided / total, 4) if total else 0.0,
+        "agreement": round(agreed / decided, 4) if decided else 0.0,
+        "per_category": {c: dict(v) for c, v in per_category.items()},
+        "avg_latency_us": round(elapsed / total * 1e6, 1) if total else 0.0,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    from config import PRECLASSIFIER_CONFIG
+
+    default_model = os.path.join(os.path.dirname(os.path.abspath(__file__)), PRECLASSIFIER_CONFIG["model_path"])
+    parser = argparse.ArgumentParser(description="告警本地预分类器：训练与评估")
+    parser.add_argument("command", choices=["train", "eval"])
+    parser.add_argument("corpus", help="标注语料（JSONL，字段 alert / category）")
+    parser.add_argument("--model", default=default_model, help="模型文件路径")
+    parser.add_argument("--threshold", type=float, default=PRECLASSIFIER_CONFIG["threshold"])
+    parser.add_argument("--min-signals", type=int, default=PRECLASSIFIER_CONFIG["min_signals"])
+    args = parser.parse_args(argv)
+
+    samples = load_corpus(args.corpus)
+    if args.command == "train":
+        classifier = PreClassifier(threshold=args.threshold, min_signals=args.min_signals)
+        classifier.train(samples)
+        classifier.save(args.model)
+        print(f"✅ 已训练 {sum(classifier.class_counts.values())} 条样本，模型保存到 {args.model}")
+    else:
+        classifier = PreClassifier(args.model, args.threshold, args.min_signals)
+        report = evaluate(classifier, samples)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
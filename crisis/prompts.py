@@ -0,0 +1,186 @@
+"""
+提示词模板注册表
+
+启动时（或首次使用时）一次性加载所有提示词模板，路径相对 crisis 包目录解析，
+与当前工作目录无关。模板预编译为静态片段和变量片段，渲染时只做一次拼接；
+只有文件修改时间变化时才重新加载。
+
+模板把固定的说明放在前面、可变内容（告警、检索结果）放在末尾，render_blocks()
+据此生成带 cache_control 断点的内容块，使静态前缀可以命中服务端的提示词缓存。
+服务端只缓存达到模型最小长度的前缀，发送前由 apply_cache_minimum() 按实际模型
+去掉前缀不足的断点（目前的模板前缀都不足，断点只在模板足够长时生效）。
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Union
+
+from tokens import estimate_tokens
+
+_VARIABLE_PATTERN = re.compile(r'\{\{(\w+)\}\}')
+
+# 各模型系列可缓存前缀的最小 token 数，未列出的模型使用 DEFAULT_CACHE_MIN_TOKENS
+CACHE_MIN_TOKENS = {"haiku": 2048}
+DEFAULT_CACHE_MIN_TOKENS = 1024
+
+
+def cache_min_tokens(model: str) -> int:
+    """模型可缓存前缀的最小 token 数"""
+    for family, minimum in CACHE_MIN_TOKENS.items():
+        if family in model:
+            return minimum
+    return DEFAULT_CACHE_MIN_TOKENS
+
+
+def apply_cache_minimum(content: Union[str, List[Dict[str, Any]]], model: str,
+                        prefix_tokens: int = 0) -> Union[str, List[Dict[str, Any]]]:
+    """
+    去掉前缀不足模型最小可缓存长度的 cache_control 断点
+
+    断点之前的全部内容（系统提示词和之前的内容块）构成缓存前缀，不足 cache_min_tokens(model)
+    时服务端不缓存，断点只是空操作。
+
+    Args:
+        content: 内容块列表（字符串原样返回）
+        model: 接收请求的模型
+        prefix_tokens: 内容块之前的 token 数（如系统提示词）
+
+    Returns:
+        不含无效断点的内容块列表
+    """
+    if isinstance(content, str):
+        return content
+    minimum = cache_min_tokens(model)
+    blocks = []
+    for block in content:
+        prefix_tokens += estimate_tokens(block.get("text", ""))
+        if "cache_control" in block and prefix_tokens < minimum:
+            block = {key: value for key, value in block.items() if key != "cache_control"}
+        blocks.append(block)
+    return blocks
+
+
+class PromptTemplate:
+    """预编译的提示词模板，占位符格式为 {{NAME}}"""
+
+    def __init__(self, name: str, text: str, path: Optional[str] = None, mtime: float = 0.0):
+        self.name = name
+        self.text = text
+        self.path = path
+        self.mtime = mtime
+        # 静态片段与变量交替排列：static[0] var[0] static[1] var[1] ... static[n]
+        parts = _VARIABLE_PATTERN.split(text)
+        self.static_segments: List[str] = parts[0::2]
+        self.variables: List[str] = parts[1::2]
+
+    @property
+    def static_prefix(self) -> str:
+        """第一个变量之前的静态内容"""
+        return self.static_segments[0]
+
+    def render(self, **values: str) -> str:
+        """
+        渲染模板
+
+        Args:
+            **values: 变量值，未提供的变量保留原占位符
+
+        Returns:
+            渲染后的提示词
+        """
+        out = [self.static_segments[0]]
+        for variable, static in zip(self.variables, self.static_segments[1:]):
+            value = values.get(variable)
+            out.append(value if value is not None else f"{{{{{variable}}}}}")
+            out.append(static)
+        return "".join(out)
+
+    def render_blocks(self, **values: str) -> List[Dict[str, Any]]:
+        """
+        渲染为消息内容块：静态前缀一块并打上 cache_control 断点，其余内容一块
+
+        断点是否有效取决于接收请求的模型，由 apply_cache_minimum() 在发送前判断。
+
+        Args:
+            **values: 变量值，未提供的变量保留原占位符
+
+        Returns:
+            可直接作为 messages[].content 的内容块列表
+        """
+        rendered = self.render(**values)
+        prefix = self.static_prefix
+        blocks: List[Dict[str, Any]] = []
+        if prefix:
+            blocks.append({"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}})
+        if len(rendered) > len(prefix):
+            blocks.append({"type": "text", "text": rendered[len(prefix):]})
+        return blocks
+
+
+class PromptRegistry:
+    """按名称管理提示词模板，文件修改时间变化时自动重新加载"""
+
+    def __init__(self, base_dir: str, templates: Dict[str, str], check_interval: float = 2.0):
+        """
+        Args:
+            base_dir: 模板文件所在目录
+            templates: 模板名称 -> 文件名（相对 base_dir）
+            check_interval: 检查文件修改时间的最小间隔（秒），避免每次渲染都访问文件系统
+        """
+        self.base_dir = base_dir
+        self.files = dict(templates)
+        self.check_interval = check_interval
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.base_dir, self.files[name])
+
+    def preload(self):
+        """加载全部模板"""
+        for name in self.files:
+            self.get(name)
+
+    def _load(self, name: str) -> PromptTemplate:
+        path = self.path(name)
+        mtime = os.stat(path).st_mtime
+        with open(path, 'r', encoding='utf-8') as f:
+            return PromptTemplate(name, f.read(), path, mtime)
+
+    def get(self, name: str) -> PromptTemplate:
+        """
+        获取模板，必要时重新加载
+
+        Args:
+            name: 模板名称
+
+        Returns:
+            预编译的模板
+        """
+        now = time.monotonic()
+        template = self._templates.get(name)
+        if template is not None and now - self._checked_at.get(name, 0.0) < self.check_interval:
+            return template
+
+        with self._lock:
+            template = self._templates.get(name)
+            try:
+                changed = template is None or os.stat(template.path).st_mtime != template.mtime
+            except OSError:
+                # 文件暂时不可访问时继续使用已加载的版本
+                changed = template is None
+            if changed:
+                template = self._templates[name] = self._load(name)
+            self._checked_at[name] = now
+            return template
+
+    def render(self, name: str, **values: str) -> str:
+        """渲染指定模板"""
+        return self.get(name).render(**values)
+
+    def render_blocks(self, name: str, **values: str) -> List[Dict[str, Any]]:
+        """渲染指定模板为带缓存断点的内容块"""
+        return self.get(name).render_blocks(**values)
@@ -0,0 +1,202 @@
+"""
+相似历史事件检索（BM25）
+
+在本地对历史事件建立 BM25 倒排索引，每条告警检索 top-k 相似事件，
+并在 token 预算内生成摘要注入专项分析提示词，不增加额外的 LLM 调用。
+"""
+
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from tokens import estimate_tokens, truncate_to_tokens
+
+_WORD_PATTERN = re.compile(r'[a-z0-9_]+(?:\.[a-z0-9_]+)*')
+_CJK_RUN_PATTERN = re.compile(r'[一-鿿]+')
+
+# 参与索引的事件字段
+_INDEXED_FIELDS = ("description", "cause", "solution")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中英文混合分词：英文/数字按词切分，中文按字二元组（bigram）切分
+
+    Args:
+        text: 待分词文本
+
+    Returns:
+        词项列表
+    """
+    text = text.lower()
+    terms = _WORD_PATTERN.findall(text)
+    for run in _CJK_RUN_PATTERN.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+class BM25Index:
+    """BM25 倒排索引"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add(self, doc_id: str, text: str, payload: Optional[Dict[str, Any]] = None):
+        """添加或替换一个文档"""
+        terms = tokenize(text)
+        with self._lock:
+            if doc_id in self.documents:
+                self._remove(doc_id)
+            self.documents[doc_id] = payload if payload is not None else {"text": text}
+            for term, tf in Counter(terms).items():
+                self._postings[term][doc_id] = tf
+            self._lengths[doc_id] = len(terms)
+            self._total_length += len(terms)
+
+    def _remove(self, doc_id: str):
+        for term in list(self._postings):
+            postings = self._postings[term]
+            if postings.pop(doc_id, None) is not None and not postings:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(doc_id, 0)
+        del self.documents[doc_id]
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[float, str, Dict[str, Any]]]:
+        """
+        检索与查询最相关的 k 个文档
+
+        Args:
+            query: 查询文本（告警详情）
+            k: 返回数量
+
+        Returns:
+            [(得分, 文档ID, 文档内容), ...]，按得分降序
+        """
+        with self._lock:
+            n = len(self.documents)
+            if n == 0:
+                return []
+            avg_length = self._total_length / n
+            scores: Dict[str, float] = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [(score, doc_id, self.documents[doc_id]) for doc_id, score in ranked]
+
+
+class IncidentRetriever:
+    """
+    历史事件检索器
+
+    基于知识库建立索引，检索相似事件并生成 token 预算内的摘要，同时记录检索延迟
+    和注入的 token 数。
+    """
+
+    def __init__(self, knowledge_base: Optional[Dict[str, Dict[str, Any]]] = None,
+                 top_k: int = 3, token_budget: int = 300, min_score: float = 1.0):
+        """
+        Args:
+            knowledge_base: 历史事件知识库（格式同 config.KNOWLEDGE_BASE）
+            top_k: 每条告警检索的事件数
+            token_budget: 注入提示词的摘要 token 上限
+            min_score: 最低 BM25 得分，低于该值的事件不注入
+        """
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.min_score = min_score
+        self.index = BM25Index()
+        self._stats_lock = threading.Lock()
+        self._retrievals = 0
+        self._latency_total_ms = 0.0
+        self._latency_max_ms = 0.0
+        self._injected_tokens = 0
+        for event_id, event_data in (knowledge_base or {}).items():
+            self.add_incident(event_id, event_data)
+
+    def add_incident(self, event_id: str, event_data: Dict[str, Any]):
+        """添加历史事件到索引"""
+        text = " ".join(str(event_data.get(field, "")) for field in _INDEXED_FIELDS)
+        self.index.add(event_id, text, event_data)
+
+    def retrieve(self, alert_details: str) -> List[Tuple[float, str, Dict[str, Any]]]:
+        """检索相似历史事件并记录延迟"""
+        start = time.perf_counter()
+        hits = [hit for hit in self.index.search(alert_details, self.top_k) if hit[0] >= self.min_score]
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self._retrievals += 1
+            self._latency_total_ms += elapsed_ms
+            self._latency_max_ms = max(self._latency_max_ms, elapsed_ms)
+        return hits
+
+    def summarize(self, hits: List[Tuple[float, str, Dict[str, Any]]]) -> str:
+        """在 token 预算内生成相似事件摘要"""
+        lines = []
+        used = 0
+        for score, event_id, event_data in hits:
+            line = (
+                f"- [{event_id}] {event_data.get('description', '')}；"
+                f"原因: {event_data.get('cause', '未知')}；"
+                f"处理: {event_data.get('solution', '未知')}"
+            )
+            remaining = self.token_budget - used
+            if remaining <= 0:
+                break
+            line = truncate_to_tokens(line, remaining)
+            lines.append(line)
+            used += estimate_tokens(line)
+        return "\n".join(lines)
+
+    def context_for(self, alert_details: str) -> str:
+        """
+        为告警生成可直接注入提示词的相似事件上下文
+
+        Args:
+            alert_details: 告警详细信息
+
+        Returns:
+            相似事件摘要；没有相关事件时返回 "无"
+        """
+        summary = self.summarize(self.retrieve(alert_details))
+        with self._stats_lock:
+            self._injected_tokens += estimate_tokens(summary)
+        return summary or "无"
+
+    def stats(self) -> Dict[str, Any]:
+        """检索延迟与注入 token 统计"""
+        with self._stats_lock:
+            count = self._retrievals
+            return {
+                "indexed_incidents": len(self.index),
+                "retrievals": count,
+                "avg_latency_ms": round(self._latency_total_ms / count, 3) if count else 0.0,
+                "max_latency_ms": round(self._latency_max_ms, 3),
+                "injected_tokens": self._injected_tokens,
+                "avg_injected_tokens": round(self._injected_tokens / count, 1) if count else 0.0,
+            }
@@ -0,0 +1,262 @@
+"""
+限流感知的自适应并发调度器
+
+用于并行扇出大量 LLM 调用：
+- 用令牌桶同时约束每分钟请求数（RPM）和每分钟 token 数（TPM，按提示词长度估算）
+- 按 AIMD 调整并发：成功时加性增长，遇到 429/529 或延迟超标时乘性减半
+- 可重试错误按带抖动的指数退避重试，并遵守服务端返回的 retry-after
+- 统计实际达到的吞吐量
+
+目标是尽量贴近服务商配额运行，同时避免陷入重试风暴。
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+import anthropic
+
+from admission import TokenBucket
+from tokens import estimate_tokens
+
+T = TypeVar("T")
+
+# 可重试的 HTTP 状态码；429/529 同时触发并发收缩
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+BACKPRESSURE_STATUS = {429, 529}
+
+
+def retry_info(exc: BaseException) -> Tuple[bool, bool, Optional[float]]:
+    """
+    判断异常是否可重试
+
+    Returns:
+        (是否可重试, 是否为限流/过载信号, 服务端建议的重试等待秒数)
+    """
+    if isinstance(exc, (anthropic.APIConnectionError, anthropic.APITimeoutError)):
+        return True, False, None
+
+    status = getattr(exc, "status_code", None)
+    if status not in RETRYABLE_STATUS:
+        return False, False, None
+
+    retry_after = None
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            retry_after = float(headers["retry-after-ms"]) / 1000
+        elif headers.get("retry-after"):
+            retry_after = float(headers["retry-after"])
+    except (TypeError, ValueError):
+        retry_after = None
+    return True, status in BACKPRESSURE_STATUS, retry_after
+
+
+class RateLimitScheduler:
+    """
+    RPM/TPM 令牌桶 + AIMD 并发控制 + 退避重试
+
+    线程安全，可在多个线程中同时调用 run()；map() 使用内部线程池执行一批任务。
+    """
+
+    def __init__(self, rpm: float = 50, tpm: float = 40000, initial_concurrency: int = 4,
+                 min_concurrency: int = 1, max_concurrency: int = 32, max_retries: int = 5,
+                 base_backoff: float = 1.0, max_backoff: float = 60.0,
+                 latency_target: Optional[float] = None):
+        """
+        Args:
+            rpm: 每分钟请求数上限
+            tpm: 每分钟输入 token 数上限
+            initial_concurrency: 初始并发数
+            min_concurrency: 并发下限
+            max_concurrency: 并发上限
+            max_retries: 单个请求的最大重试次数
+            base_backoff: 指数退避的基准等待时间（秒）
+            max_backoff: 单次退避的最长等待时间（秒）
+            latency_target: 单次调用的目标延迟（秒），超出时收缩并发；None 表示只按错误收缩
+        """
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.latency_target = latency_target
+
+        self._request_bucket = TokenBucket(rpm / 60.0, max(1.0, rpm))
+        self._token_bucket = TokenBucket(tpm / 60.0, max(1.0, tpm))
+        self._limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+        self._stats = {
+            "completed": 0,
+            "failed": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "slow_calls": 0,
+            "tokens": 0,
+            "latency_total": 0.0,
+            "peak_concurrency": 0,
+        }
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+
+    @property
+    def concurrency_limit(self) -> int:
+        return int(self._limit)
+
+    def _acquire_slot(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    self._cond.wait(self._paused_until - now)
+                    continue
+                if self._in_flight < int(self._limit):
+                    self._in_flight += 1
+                    self._stats["peak_concurrency"] = max(self._stats["peak_concurrency"], self._in_flight)
+                    if self._started_at is None:
+                        self._started_at = now
+                    return
+                self._cond.wait()
+
+    def _release_slot(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _wait_budget(self, tokens: int):
+        tokens = min(tokens, self._token_bucket.capacity)
+        while True:
+            wait = max(self._request_bucket.wait_time(), self._token_bucket.wait_time(tokens))
+            if wait <= 0:
+                if self._request_bucket.try_acquire():
+                    if self._token_bucket.try_acquire(tokens):
+                        return
+                    # token 预算不足时归还请求令牌，重新等待
+                    self._request_bucket.release()
+                continue
+            time.sleep(min(wait, 1.0))
+
+    def _on_success(self, latency: float):
+        with self._cond:
+            if self.latency_target is not None and latency > self.latency_target:
+                self._stats["slow_calls"] += 1
+                self._decrease(time.monotonic())
+            else:
+                # 加性增长：每完成约 limit 个请求并发 +1
+                self._limit = min(self.max_concurrency, self._limit + 1.0 / self._limit)
+            self._cond.notify_all()
+
+    def _on_backpressure(self, retry_after: Optional[float]):
+        with self._cond:
+            now = time.monotonic()
+            self._decrease(now)
+            if retry_after:
+                # 服务端要求等待时暂停所有新请求，避免重试风暴
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+    def _decrease(self, now: float):
+        # 同一批并发失败只收缩一次
+        if now - self._last_decrease >= 1.0:
+            self._limit = max(self.min_concurrency, self._limit / 2)
+            self._last_decrease = now
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff) + random.uniform(0, self.base_backoff)
+        # 完全抖动（full jitter）的指数退避
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+
+    def run(self, fn: Callable[[], T], estimated_tokens: int = 0) -> T:
+        """
+        在调度器约束下执行一次调用（含重试）
+
+        Args:
+            fn: 实际调用，失败时抛出 anthropic 异常
+            estimated_tokens: 本次调用的估算输入 token 数
+
+        Returns:
+            fn 的返回值；重试耗尽或遇到不可重试错误时抛出最后一次异常
+        """
+        attempt = 0
+        while True:
+            self._acquire_slot()
+            try:
+                self._wait_budget(estimated_tokens)
+                start = time.monotonic()
+                result = fn()
+            except Exception as e:
+                retryable, backpressure, retry_after = retry_info(e)
+                if backpressure:
+                    with self._cond:
+                        self._stats["rate_limited"] += 1
+                    self._on_backpressure(retry_after)
+                if not retryable or attempt >= self.max_retries:
+                    with self._cond:
+                        self._stats["failed"] += 1
+                        self._finished_at = time.monotonic()
+                    raise
+            else:
+                latency = time.monotonic() - start
+                self._on_success(latency)
+                with self._cond:
+                    self._stats["completed"] += 1
+                    self._stats["tokens"] += estimated_tokens
+                    self._stats["latency_total"] += latency
+                    self._finished_at = time.monotonic()
+                return result
+            finally:
+                self._release_slot()
+
+            delay = self._backoff(attempt, retry_after)
+            attempt += 1
+            with self._cond:
+                self._stats["retries"] += 1
+            time.sleep(delay)
+
+    def map(self, fn: Callable[[Any], T], items: Sequence[Any],
+            estimate: Optional[Callable[[Any], int]] = None, return_exceptions: bool = False) -> List[Any]:
+        """
+        按调度器约束并发处理一批输入，结果顺序与输入一致
+
+        Args:
+            fn: 处理单个输入的函数
+            items: 输入列表
+            estimate: 估算单个输入 token 数的函数，默认按字符串长度估算
+            return_exceptions: 为 True 时失败输入的位置放入异常，其余结果照常返回；
+                为 False 时等所有输入处理完后抛出第一个异常
+
+        Returns:
+            与输入一一对应的结果列表
+        """
+        estimate = estimate or (lambda item: estimate_tokens(str(item)))
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = [
+                executor.submit(self.run, lambda item=item: fn(item), estimate(item))
+                for item in items
+            ]
+        if not return_exceptions:
+            return [f.result() for f in futures]
+        return [f.exception() or f.result() for f in futures]
+
+    def stats(self) -> Dict[str, Any]:
+        """调度统计，包括实际达到的吞吐量"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["concurrency_limit"] = int(self._limit)
+            stats["in_flight"] = self._in_flight
+            elapsed = 0.0
+            if self._started_at is not None and self._finished_at is not None:
+                elapsed = max(self._finished_at - self._started_at, 1e-9)
+        completed = stats["completed"]
+        stats["elapsed_s"] = round(elapsed, 3)
+        stats["requests_per_min"] = round(completed / elapsed * 60, 2) if elapsed else 0.0
+        stats["tokens_per_min"] = round(stats["tokens"] / elapsed * 60, 1) if elapsed else 0.0
+        stats["avg_latency_s"] = round(stats.pop("latency_total") / completed, 3) if completed else 0.0
+        return stats
@@ -0,0 +1,215 @@
+"""
+相同请求合并（single-flight）
+
+告警风暴时大量 worker 会在同一时刻发出完全相同的 LLM 请求。single-flight 让
+并发的相同请求只触发一次上游调用，其余请求等待并共享结果：
+- SingleFlight: 进程内合并（线程和 asyncio 协程均支持）
+- FileLockSingleFlight: 跨进程合并，基于本地锁文件，结果通过共享的磁盘缓存传递
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支持 fcntl，跨进程合并不可用
+    fcntl = None
+
+T = TypeVar("T")
+
+
+class _Call:
+    """一次进行中的上游调用"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _AsyncCall:
+    """一次进行中的异步上游调用：独立的任务，以及等待它的协程数（含领导者）"""
+
+    def __init__(self, task: "asyncio.Future"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """进程内 single-flight"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, _AsyncCall]]" = \
+            weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "coalesced": 0}
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """
+        执行 fn；若相同 key 的调用正在进行，则等待并共享其结果
+
+        Args:
+            key: 请求的唯一标识（如请求内容的哈希）
+            fn: 实际执行上游调用的函数
+
+        Returns:
+            fn 的结果（领导者调用失败时，等待者收到相同的异常）
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats["coalesced"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats["leaders"] += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        do 的 asyncio 版本，同一事件循环内的相同请求共享一次调用
+
+        上游调用作为独立的任务运行，领导者和等待者都通过 shield 等待它：任何一方被取消
+        都不影响其他等待者；所有等待者都被取消后才取消上游调用。
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._async_calls.setdefault(loop, {})
+            call = calls.get(key)
+            if call is not None:
+                self._stats["coalesced"] += 1
+            else:
+                call = calls[key] = _AsyncCall(asyncio.ensure_future(fn()))
+                call.task.add_done_callback(lambda _: self._forget(calls, key, call))
+                self._stats["leaders"] += 1
+            call.waiters += 1
+
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            with self._lock:
+                call.waiters -= 1
+                abandoned = call.waiters == 0 and not call.task.done()
+                if abandoned and calls.get(key) is call:
+                    # 没有协程再等待结果，新的相同请求重新发起调用
+                    del calls[key]
+            if abandoned:
+                call.task.cancel()
+            raise
+        else:
+            with self._lock:
+                call.waiters -= 1
+
+    def _forget(self, calls: Dict[str, _AsyncCall], key: str, call: _AsyncCall):
+        with self._lock:
+            if calls.get(key) is call:
+                del calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """合并统计：leaders 为实际上游调用数，coalesced 为被合并节省的调用数"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls) + sum(len(c) for c in self._async_calls.values())
+        total = stats["leaders"] + stats["coalesced"]
+        stats["coalesced_ratio"] = round(stats["coalesced"] / total, 4) if total else 0.0
+        return stats
+
+
+class FileLockSingleFlight:
+    """
+    跨进程 single-flight
+
+    同一请求在多个进程中并发时，只有拿到锁文件的进程调用上游并把结果写入共享存储，
+    其他进程等待锁释放后从共享存储读取结果。进程内的并发请求先经过 SingleFlight 合并。
+    持有锁的进程在释放前删除锁文件；等待者拿到锁后确认锁文件未被替换，否则重新打开。
+    """
+
+    def __init__(self, lock_dir: str, store: Any, local: Optional[SingleFlight] = None):
+        """
+        Args:
+            lock_dir: 锁文件目录
+            store: 共享结果存储，需要提供 get(key) / put(key, value)（如磁盘 LLMCache）
+            local: 进程内 SingleFlight，不提供则新建
+        """
+        if fcntl is None:
+            raise RuntimeError("当前平台不支持 fcntl，无法启用跨进程请求合并")
+        self.lock_dir = lock_dir
+        self.store = store
+        self.local = local or SingleFlight()
+        self._lock = threading.Lock()
+        self._stats = {"cross_process_leaders": 0, "cross_process_coalesced": 0}
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        return self.local.do(key, lambda: self._do_locked(key, fn))
+
+    def _do_locked(self, key: str, fn: Callable[[], T]) -> T:
+        path = os.path.join(self.lock_dir, f"{key}.lock")
+        waited = False
+        while True:
+            lock_file = open(path, "a+")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # 其他进程正在请求，阻塞等待其完成
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                waited = True
+            if self._holds(lock_file, path):
+                break
+            # 等待期间前一个持有者删除了锁文件，锁在旧文件上，需要重新打开
+            lock_file.close()
+
+        with lock_file:
+            try:
+                cached = self.store.get(key)
+                if cached is not None:
+                    if waited:
+                        with self._lock:
+                            self._stats["cross_process_coalesced"] += 1
+                    return cached
+                with self._lock:
+                    self._stats["cross_process_leaders"] += 1
+                result = fn()
+                self.store.put(key, result)
+                return result
+            finally:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _holds(lock_file, path: str) -> bool:
+        """锁文件路径仍指向已加锁的文件"""
+        try:
+            return os.path.samestat(os.fstat(lock_file.fileno()), os.stat(path))
+        except FileNotFoundError:
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.local.stats()
+        with self._lock:
+            stats.update(self._stats)
+        return stats
@@ -0,0 +1,109 @@
+"""
+推测执行
+
+分类（或路由选择）与专项分析本是串行的两次 LLM 调用。推测执行根据本地先验
+预测最可能的分支，在分类调用的同时启动该分支的专项分析：
+- 预测正确：直接使用已在进行的专项分析结果，端到端延迟接近一次调用
+- 预测错误：取消推测调用，按实际分支重新调用
+
+浪费的调用按估算 token 数计入预算（令牌桶），预算不足或推测并发达到上限时不再推测。
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from admission import TokenBucket
+
+D = TypeVar("D")
+R = TypeVar("R")
+
+
+class SpeculationBudget:
+    """推测执行预算：限制同时进行的推测调用数和每分钟浪费的 token 数"""
+
+    def __init__(self, max_in_flight: int = 8, waste_tokens_per_min: float = 20000):
+        """
+        Args:
+            max_in_flight: 同时进行的推测调用上限
+            waste_tokens_per_min: 每分钟允许浪费（预测错误被取消）的估算 token 数
+        """
+        self.max_in_flight = max_in_flight
+        self._waste = TokenBucket(waste_tokens_per_min / 60.0, max(1.0, waste_tokens_per_min))
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {"speculated": 0, "hits": 0, "misses": 0, "skipped": 0, "wasted_tokens": 0}
+
+    def try_acquire(self, estimated_tokens: int) -> bool:
+        """预算允许时占用一个推测名额"""
+        with self._lock:
+            if self._in_flight >= self.max_in_flight or self._waste.wait_time(estimated_tokens) > 0:
+                self._stats["skipped"] += 1
+                return False
+            self._in_flight += 1
+            self._stats["speculated"] += 1
+            return True
+
+    def release(self, hit: bool, estimated_tokens: int):
+        """记录推测结果，预测错误时把被取消调用的 token 计入浪费预算"""
+        with self._lock:
+            self._in_flight -= 1
+            if hit:
+                self._stats["hits"] += 1
+            else:
+                self._stats["misses"] += 1
+                self._stats["wasted_tokens"] += estimated_tokens
+                self._waste.force_acquire(estimated_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        """推测命中率与浪费统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = self._in_flight
+        decided = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / decided, 4) if decided else 0.0
+        return stats
+
+
+async def speculate(decide: Callable[[], Awaitable[D]], choose: Callable[[D], Any],
+                    branch: Callable[[Any], Awaitable[R]], predicted: Any,
+                    budget: Optional[SpeculationBudget] = None,
+                    estimated_tokens: int = 0) -> Tuple[D, R, Optional[bool]]:
+    """
+    在决策调用进行的同时推测执行预测分支
+
+    Args:
+        decide: 决策调用（如分类）
+        choose: 从决策结果得到实际分支
+        branch: 执行某个分支（如专项分析）
+        predicted: 本地先验预测的分支
+        budget: 推测预算，预算不足时退化为串行执行
+        estimated_tokens: 一次分支调用的估算 token 数
+
+    Returns:
+        (决策结果, 分支结果, 是否命中)；未推测时命中为 None
+    """
+    if budget is not None and not budget.try_acquire(estimated_tokens):
+        decision = await decide()
+        return decision, await branch(choose(decision)), None
+
+    speculative = asyncio.ensure_future(branch(predicted))
+    # 被放弃的推测调用即使失败也不需要上报异常
+    speculative.add_done_callback(lambda task: task.cancelled() or task.exception())
+    try:
+        decision = await decide()
+        actual = choose(decision)
+    except BaseException:
+        speculative.cancel()
+        if budget is not None:
+            budget.release(False, estimated_tokens)
+        raise
+
+    hit = actual == predicted
+    if budget is not None:
+        budget.release(hit, estimated_tokens)
+    if hit:
+        return decision, await speculative, True
+
+    speculative.cancel()
+    return decision, await branch(actual), False
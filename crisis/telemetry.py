@@ -0,0 +1,387 @@
+"""
+LLM 调用遥测
+
+为每次 LLM 调用记录模型、输入/输出/缓存 token 数、首 token 延迟（TTFT）、总延迟、
+输出速度（tokens/sec）、重试次数、停止原因和估算费用，并按（模型, 工作流步骤）在内存中聚合：
+- Telemetry.track(): 包裹一次调用，自动计时、计数重试并记录异常
+- Telemetry.step(): 标记当前工作流步骤（基于 contextvars，asyncio 任务自动继承）
+- attempt_hooks(): httpx 事件钩子，统计 SDK 内部重试产生的实际请求次数
+- 导出为 Prometheus 文本格式和 JSONL
+
+本模块只依赖标准库，agent.py 和 crisis 工作流共用。
+"""
+
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# 每百万 token 的美元价格：(输入, 输出, 缓存写入, 缓存命中)，按需更新
+MODEL_PRICES = {
+    "claude-3-5-sonnet-20241022": (3.0, 15.0, 3.75, 0.30),
+    "claude-sonnet-4-20250514": (3.0, 15.0, 3.75, 0.30),
+    "claude-3-5-haiku-20241022": (0.80, 4.0, 1.0, 0.08),
+}
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0)
+TOKEN_FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+_current_step: contextvars.ContextVar = contextvars.ContextVar("llm_step", default="")
+_current_call: contextvars.ContextVar = contextvars.ContextVar("llm_call", default=None)
+
+
+def estimate_cost(model: str, usage: Dict[str, int]) -> Optional[float]:
+    """按 MODEL_PRICES 估算一次调用的费用（美元），未知模型返回 None"""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    return sum(usage.get(field, 0) * price for field, price in zip(TOKEN_FIELDS, (prices[0], prices[1], prices[2], prices[3]))) / 1e6
+
+
+class CallTracker:
+    """一次进行中的调用"""
+
+    def __init__(self, model: str, step: str, source: str):
+        self.model = model
+        self.step = step
+        self.source = source
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.attempts = 0
+        self.ttft: Optional[float] = None
+        self.usage: Dict[str, int] = {}
+        self.stop_reason: Optional[str] = None
+        self.error: Optional[str] = None
+
+    def first_token(self):
+        """流式调用收到第一个文本片段时调用"""
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self._start
+
+    def finish(self, usage: Any = None, stop_reason: Optional[str] = None):
+        """记录响应中的 usage 和停止原因"""
+        if usage is not None:
+            self.usage = {field: getattr(usage, field, None) or 0 for field in TOKEN_FIELDS}
+        self.stop_reason = stop_reason
+
+    def to_record(self) -> Dict[str, Any]:
+        latency = time.perf_counter() - self._start
+        output_tokens = self.usage.get("output_tokens", 0)
+        # 流式调用的输出速度从首 token 开始计算
+        generation_time = latency - (self.ttft or 0.0)
+        record = {
+            "ts": round(self.started_at, 3),
+            "source": self.source,
+            "step": self.step,
+            "model": self.model,
+            **{field: self.usage.get(field, 0) for field in TOKEN_FIELDS},
+            "ttft_s": round(self.ttft, 4) if self.ttft is not None else None,
+            "latency_s": round(latency, 4),
+            "tokens_per_s": round(output_tokens / generation_time, 2) if output_tokens and generation_time > 0 else None,
+            "retries": max(0, self.attempts - 1),
+            "stop_reason": self.stop_reason,
+            "error": self.error,
+        }
+        cost = estimate_cost(self.model, self.usage)
+        record["cost_usd"] = round(cost, 6) if cost is not None else None
+        return record
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class _Aggregate:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.cost_usd = 0.0
+        self.tokens = dict.fromkeys(TOKEN_FIELDS, 0)
+        self.stop_reasons: Dict[str, int] = defaultdict(int)
+        self.latency = _Histogram(LATENCY_BUCKETS)
+        self.ttft = _Histogram(TTFT_BUCKETS)
+        self.output_tokens_timed = 0
+        self.generation_time = 0.0
+
+
+class Telemetry:
+    """内存聚合的调用遥测"""
+
+    def __init__(self, jsonl_path: Optional[str] = None, max_records: int = 10000, flush_interval: float = 1.0):
+        """
+        Args:
+            jsonl_path: 设置后调用记录追加到该 JSONL 文件
+            max_records: 内存中保留的最近调用记录数
+            flush_interval: 追加 JSONL 的间隔（秒），期间的记录由后台线程合并为一次写入，
+                进程退出时写入剩余记录
+        """
+        self.jsonl_path = jsonl_path
+        self.flush_interval = flush_interval
+        self.records: deque = deque(maxlen=max_records)
+        self._aggregates: Dict[tuple, _Aggregate] = defaultdict(_Aggregate)
+        self._lock = threading.Lock()
+        self._pending: List[str] = []
+        self._timer: Optional[threading.Timer] = None
+        # 保证多次写入按记录顺序落盘
+        self._write_lock = threading.Lock()
+        if jsonl_path:
+            atexit.register(self.flush)
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        """标记当前工作流步骤，期间的调用按该步骤聚合"""
+        token = _current_step.set(name)
+        try:
+            yield
+        finally:
+            _current_step.reset(token)
+
+    @contextmanager
+    def track(self, model: str, source: str = "") -> Iterator[CallTracker]:
+        """
+        记录一次调用
+
+        Args:
+            model: 模型名称
+            source: 调用来源（如 llm_call、SimpleAgent.ask）
+
+        Yields:
+            CallTracker，调用方在拿到响应后调用 finish()，流式调用在首个片段到达时调用 first_token()
+        """
+        call = CallTracker(model, _current_step.get(), source)
+        token = _current_call.set(call)
+        try:
+            yield call
+        except BaseException as e:
+            call.error = type(e).__name__
+            raise
+        finally:
+            try:
+                _current_call.reset(token)
+            except ValueError:
+                # 生成器在其他上下文中关闭时无法重置，不影响记录
+                pass
+            self.record(call.to_record())
+
+    def in_step(self, name: str, fn: Callable) -> Callable:
+        """
+        包装函数使其在指定步骤内执行
+
+        用于提交到线程池或推迟执行的调用（线程不继承 contextvars）；
+        fn 返回协程时，步骤在协程实际运行期间生效。
+        """
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.step(name):
+                result = fn(*args, **kwargs)
+            if inspect.isawaitable(result):
+                async def run():
+                    with self.step(name):
+                        return await result
+                return run()
+            return result
+        return wrapper
+
+    def record_usage(self, model: str, usage: Any, source: str = ""):
+        """记录只有用量、没有单次延迟的调用（如批量结果）"""
+        call = CallTracker(model, _current_step.get(), source)
+        call.finish(usage)
+        record = call.to_record()
+        record["latency_s"] = record["tokens_per_s"] = None
+        self.record(record)
+
+    def record_cache_hit(self, model: str, source: str = ""):
+        """记录一次响应缓存命中（没有上游调用）"""
+        with self._lock:
+            self._aggregates[(model, _current_step.get(), source)].cache_hits += 1
+
+    def record(self, record: Dict[str, Any]):
+        """写入一条调用记录并更新聚合，JSONL 由后台线程按 flush_interval 追加"""
+        line = json.dumps(record, ensure_ascii=False) + "\n" if self.jsonl_path else None
+        with self._lock:
+            self.records.append(record)
+            agg = self._aggregates[(record["model"], record["step"], record["source"])]
+            agg.calls += 1
+            if record.get("error"):
+                agg.errors += 1
+            agg.retries += record.get("retries") or 0
+            agg.cost_usd += record.get("cost_usd") or 0.0
+            for field in TOKEN_FIELDS:
+                agg.tokens[field] += record.get(field) or 0
+            if record.get("stop_reason"):
+                agg.stop_reasons[record["stop_reason"]] += 1
+            if record.get("latency_s") is not None:
+                agg.latency.observe(record["latency_s"])
+            if record.get("ttft_s") is not None:
+                agg.ttft.observe(record["ttft_s"])
+            if record.get("tokens_per_s"):
+                agg.output_tokens_timed += record["output_tokens"]
+                agg.generation_time += record["output_tokens"] / record["tokens_per_s"]
+            if line is not None:
+                self._pending.append(line)
+                if self._timer is None:
+                    self._timer = threading.Timer(self.flush_interval, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+    def flush(self) -> int:
+        """立即把尚未写入的记录追加到 JSONL，返回写入条数"""
+        with self._write_lock:
+            with self._lock:
+                lines, self._pending = self._pending, []
+                timer, self._timer = self._timer, None
+            if timer is not None:
+                timer.cancel()
+            if lines:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+        return len(lines)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """按（模型, 步骤, 来源）聚合的统计"""
+        with self._lock:
+            rows = []
+            for (model, step, source), agg in sorted(self._aggregates.items()):
+                rows.append({
+                    "model": model,
+                    "step": step,
+                    "source": source,
+                    "calls": agg.calls,
+                    "errors": agg.errors,
+                    "cache_hits": agg.cache_hits,
+                    "retries": agg.retries,
+                    **agg.tokens,
+                    "avg_latency_s": round(agg.latency.total / agg.latency.count, 4) if agg.latency.count else None,
+                    "avg_ttft_s": round(agg.ttft.total / agg.ttft.count, 4) if agg.ttft.count else None,
+                    "tokens_per_s": round(agg.output_tokens_timed / agg.generation_time, 2) if agg.generation_time else None,
+                    "stop_reasons": dict(agg.stop_reasons),
+                    "cost_usd": round(agg.cost_usd, 6),
+                })
+            return rows
+
+    def totals(self) -> Dict[str, Any]:
+        """所有调用的 token 用量合计"""
+        totals: Dict[str, Any] = {"calls": 0, **dict.fromkeys(TOKEN_FIELDS, 0), "cost_usd": 0.0}
+        for row in self.summary():
+            totals["calls"] += row["calls"]
+            totals["cost_usd"] += row["cost_usd"]
+            for field in TOKEN_FIELDS:
+                totals[field] += row[field]
+        totals["cost_usd"] = round(totals["cost_usd"], 6)
+        return totals
+
+    def to_prometheus(self, prefix: str = "llm") -> str:
+        """导出为 Prometheus 文本格式"""
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        def labels(**values) -> str:
+            escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                       for k, v in values.items())
+            return "{" + ",".join(escaped) + "}"
+
+        with self._lock:
+            items = sorted(self._aggregates.items())
+
+            metric("calls_total", "counter", "LLM calls by outcome")
+            for (model, step, source), agg in items:
+                base = dict(model=model, step=step, source=source)
+                lines.append(f"{prefix}_calls_total{labels(**base, status='ok')} {agg.calls - agg.errors}")
+                lines.append(f"{prefix}_calls_total{labels(**base, status='error')} {agg.errors}")
+
+            metric("cache_hits_total", "counter", "Responses served from the response cache")
+            for (model, step, source), agg in items:
+                lines.append(f"{prefix}_cache_hits_total{labels(model=model, step=step, source=source)} {agg.cache_hits}")
+
+            metric("tokens_total", "counter", "Tokens by type")
+            for (model, step, source), agg in items:
+                for field in TOKEN_FIELDS:
+                    kind = field.replace("_input_tokens", "").replace("_tokens", "")
+                    lines.append(f"{prefix}_tokens_total{labels(model=model, step=step, source=source, type=kind)} "
+                                 f"{agg.tokens[field]}")
+
+            metric("retries_total", "counter", "Retried HTTP attempts")
+            for (model, step, source), agg in items:
+                lines.append(f"{prefix}_retries_total{labels(model=model, step=step, source=source)} {agg.retries}")
+
+            metric("stop_reason_total", "counter", "Responses by stop reason")
+            for (model, step, source), agg in items:
+                for reason, count in sorted(agg.stop_reasons.items()):
+                    lines.append(f"{prefix}_stop_reason_total{labels(model=model, step=step, source=source, reason=reason)} {count}")
+
+            metric("cost_usd_total", "counter", "Estimated cost in USD")
+            for (model, step, source), agg in items:
+                lines.append(f"{prefix}_cost_usd_total{labels(model=model, step=step, source=source)} {agg.cost_usd:.6f}")
+
+            metric("output_tokens_per_second", "gauge", "Mean output generation speed")
+            for (model, step, source), agg in items:
+                if agg.generation_time:
+                    lines.append(f"{prefix}_output_tokens_per_second{labels(model=model, step=step, source=source)} "
+                                 f"{agg.output_tokens_timed / agg.generation_time:.2f}")
+
+            for name, attr, help_text in (("request_latency_seconds", "latency", "Total call latency"),
+                                          ("time_to_first_token_seconds", "ttft", "Time to first streamed token")):
+                metric(name, "histogram", help_text)
+                for (model, step, source), agg in items:
+                    hist = getattr(agg, attr)
+                    base = dict(model=model, step=step, source=source)
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        lines.append(f"{prefix}_{name}_bucket{labels(**base, le=bound)} {count}")
+                    lines.append(f"{prefix}_{name}_bucket{labels(**base, le='+Inf')} {hist.count}")
+                    lines.append(f"{prefix}_{name}_sum{labels(**base)} {hist.total:.6f}")
+                    lines.append(f"{prefix}_{name}_count{labels(**base)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def export_jsonl(self, path: str) -> int:
+        """把内存中的调用记录写入 JSONL 文件，返回写入条数"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._lock:
+            records = list(self.records)
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return len(records)
+
+    def reset(self):
+        with self._lock:
+            self.records.clear()
+            self._aggregates.clear()
+
+
+def _count_attempt(request: Any):
+    call = _current_call.get()
+    if call is not None:
+        call.attempts += 1
+
+
+async def _async_count_attempt(request: Any):
+    _count_attempt(request)
+
+
+def attempt_hooks(is_async: bool = False) -> Dict[str, list]:
+    """httpx 事件钩子：统计每次调用实际发出的请求数（含 SDK 内部重试）"""
+    return {"request": [_async_count_attempt if is_async else _count_attempt]}
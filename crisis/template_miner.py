@@ -0,0 +1,389 @@
+"""
+告警模板挖掘与分类缓存
+
+告警大多来自少量模板，只是参数不同（时间、用户ID、服务器名等）；错误码/状态码区分不同的故障，不作为参数。
+TemplateMiner 实现在线的 Drain 风格解析树，把每条告警映射到稳定的模板ID；
+TemplateClassificationCache 在其上维护持久化的 模板ID -> 类别/置信度 缓存，
+命中时工作流可以跳过分类阶段的 LLM 调用。模板被泛化（新的位置变为 <*>）后缓存结果失效，
+泛化后分类结果与之前不同的模板不再缓存，避免把不同类别的告警合并到同一个缓存结果。
+
+参考: He et al., "Drain: An Online Log Parsing Approach with Fixed Depth Tree", ICWS 2017
+"""
+
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+WILDCARD = "<*>"
+
+# 参数掩码规则（按顺序应用）
+_MASKS = [
+    (re.compile(r'\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b'), "<UUID>"),
+    (re.compile(r'\b\d{4}-\d{2}-\d{2}\b'), "<DATE>"),
+    (re.compile(r'\b\d{1,2}:\d{2}:\d{2}(?:\.\d+)?\b'), "<TIME>"),
+    (re.compile(r'\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b'), "<IP>"),
+    (re.compile(r'\b0x[0-9a-fA-F]+\b'), "<HEX>"),
+    (re.compile(r'\b[0-9a-fA-F]{16,}\b'), "<HEX>"),
+    (re.compile(r'\d+(?:\.\d+)?'), "<NUM>"),
+]
+
+# 错误码/状态码字段（与 compaction._CODE_VALUE 一致）：码值区分不同的故障，保持原样不掩码
+_CODE_VALUE = re.compile(r'(?:(?:码|code|状态|status)[\s"\'=:：]*|HTTP(?:/[\d.]+)?\s+)\d{3,6}(?!\d)', re.IGNORECASE)
+
+
+def _mask(text: str) -> str:
+    for pattern, placeholder in _MASKS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+
+def mask_parameters(text: str) -> str:
+    """用占位符替换告警中的变量参数，错误码/状态码保持原样"""
+    parts, pos = [], 0
+    for match in _CODE_VALUE.finditer(text):
+        parts += [_mask(text[pos:match.start()]), match.group(0)]
+        pos = match.end()
+    parts.append(_mask(text[pos:]))
+    return "".join(parts)
+
+
+def _has_code(token: str) -> bool:
+    """掩码后仍含数字的词只可能是错误码/状态码"""
+    return any(ch.isdigit() for ch in token)
+
+
+class LogCluster:
+    """一个模板聚类"""
+
+    def __init__(self, cluster_id: int, tokens: List[str], size: int = 1, version: int = 1):
+        self.cluster_id = cluster_id
+        self.tokens = tokens
+        self.size = size
+        self.version = version  # 模板每被泛化一次加一
+
+    @property
+    def template_id(self) -> str:
+        return f"T{self.cluster_id}"
+
+    @property
+    def template(self) -> str:
+        return " ".join(self.tokens)
+
+
+class TemplateMiner:
+    """
+    Drain 风格的在线模板挖掘器
+
+    解析树结构：根节点 -> 词数 -> 前 depth-2 个词 -> 叶子（聚类列表）。
+    叶子内按位置相同词的比例选择最相似的聚类，超过 similarity_threshold 则合并
+    （不同位置替换为 <*>），否则新建聚类。聚类ID在合并后保持不变。
+    """
+
+    def __init__(self, depth: int = 4, similarity_threshold: float = 0.5, max_children: int = 100):
+        """
+        Args:
+            depth: 解析树深度（至少为3）
+            similarity_threshold: 合并到已有模板的最低相似度
+            max_children: 每个内部节点的最大子节点数，超出后归入 <*> 分支
+        """
+        self.depth = max(3, depth)
+        self.similarity_threshold = similarity_threshold
+        self.max_children = max_children
+        self.clusters: Dict[int, LogCluster] = {}
+        self._root: Dict[str, Any] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def tokenize(self, text: str) -> List[str]:
+        return mask_parameters(text).split()
+
+    def add(self, text: str) -> LogCluster:
+        """
+        处理一条告警，返回其所属模板（必要时新建或泛化模板）
+
+        Args:
+            text: 告警原文
+
+        Returns:
+            告警所属的模板聚类
+        """
+        tokens = self.tokenize(text)
+        with self._lock:
+            leaf = self._leaf(tokens, create=True)
+            cluster = self._best_match(leaf, tokens)
+            if cluster is None:
+                cluster = LogCluster(self._next_id, tokens)
+                self._next_id += 1
+                self.clusters[cluster.cluster_id] = cluster
+                leaf.append(cluster.cluster_id)
+            else:
+                merged = [t if t == c else WILDCARD for t, c in zip(tokens, cluster.tokens)]
+                if merged != cluster.tokens:
+                    cluster.tokens = merged
+                    cluster.version += 1
+                cluster.size += 1
+            return cluster
+
+    def cluster(self, template_id: str) -> Optional[LogCluster]:
+        """按模板ID查找聚类"""
+        with self._lock:
+            return self.clusters.get(int(template_id.lstrip("T")))
+
+    def match(self, text: str) -> Optional[LogCluster]:
+        """只查找匹配的模板，不修改解析树"""
+        tokens = self.tokenize(text)
+        with self._lock:
+            leaf = self._leaf(tokens, create=False)
+            return self._best_match(leaf, tokens) if leaf is not None else None
+
+    def _leaf(self, tokens: List[str], create: bool) -> Optional[List[int]]:
+        length_key = str(len(tokens))
+        node = self._root.get(length_key)
+        if node is None:
+            if not create:
+                return None
+            node = self._root[length_key] = {}
+
+        prefix_depth = min(self.depth - 2, len(tokens))
+        for i in range(prefix_depth):
+            # 含数字的词大概率是参数，统一走 <*> 分支
+            token = WILDCARD if any(ch.isdigit() for ch in tokens[i]) else tokens[i]
+            child = node.get(token)
+            if child is None:
+                if token != WILDCARD and WILDCARD in node and len(node) >= self.max_children:
+                    child = node[WILDCARD]
+                elif not create:
+                    child = node.get(WILDCARD)
+                    if child is None:
+                        return None
+                else:
+                    if len(node) >= self.max_children:
+                        token = WILDCARD
+                    child = node.setdefault(token, {})
+            node = child
+
+        if create:
+            return node.setdefault("__clusters__", [])
+        return node.get("__clusters__")
+
+    def _best_match(self, cluster_ids: List[int], tokens: List[str]) -> Optional[LogCluster]:
+        best, best_similarity, best_wildcards = None, -1.0, -1
+        for cluster_id in cluster_ids:
+            cluster = self.clusters[cluster_id]
+            similarity, wildcards = self._similarity(cluster.tokens, tokens)
+            if similarity > best_similarity or (similarity == best_similarity and wildcards > best_wildcards):
+                best, best_similarity, best_wildcards = cluster, similarity, wildcards
+        if best is not None and best_similarity >= self.similarity_threshold:
+            return best
+        return None
+
+    @staticmethod
+    def _similarity(template: List[str], tokens: List[str]):
+        if not tokens:
+            return 1.0, 0
+        same, wildcards = 0, 0
+        for t, c in zip(template, tokens):
+            if t == WILDCARD:
+                wildcards += 1
+            elif t == c:
+                same += 1
+            elif _has_code(t) or _has_code(c):
+                # 错误码/状态码不同的告警不合并到同一个模板
+                return 0.0, wildcards
+        return same / len(tokens), wildcards
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "depth": self.depth,
+                "similarity_threshold": self.similarity_threshold,
+                "max_children": self.max_children,
+                "next_id": self._next_id,
+                "clusters": [
+                    {"id": c.cluster_id, "tokens": c.tokens, "size": c.size, "version": c.version}
+                    for c in self.clusters.values()
+                ],
+            }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TemplateMiner":
+        miner = cls(data.get("depth", 4), data.get("similarity_threshold", 0.5), data.get("max_children", 100))
+        for item in data.get("clusters", []):
+            cluster = LogCluster(item["id"], item["tokens"], item.get("size", 1), item.get("version", 1))
+            miner.clusters[cluster.cluster_id] = cluster
+            # 同一叶子内的模板前缀相同，按模板词重建解析树路径即可
+            miner._leaf(cluster.tokens, create=True).append(cluster.cluster_id)
+        miner._next_id = max([data.get("next_id", 1)] + [c + 1 for c in miner.clusters])
+        return miner
+
+
+class TemplateClassificationCache:
+    """
+    持久化的 模板ID -> 类别/置信度 缓存
+
+    只缓存置信度达到 min_confidence 的分类结果；模板挖掘器状态与缓存一起保存，
+    保证重启后模板ID保持稳定。
+
+    每个缓存结果记录写入时的模板版本，模板被泛化后结果失效；失效后重新分类的类别与之前不同时，
+    该模板同时覆盖了不同类别的告警，标记为歧义模板，之后不再缓存。
+    修改在 save_interval 秒内合并为一次写入（进程退出时写入未保存的修改）。
+    """
+
+    CONFIDENCE_LEVELS = {"低": 1, "中": 2, "高": 3}
+
+    def __init__(self, path: Optional[str] = None, min_confidence: str = "高",
+                 miner_config: Optional[Dict[str, Any]] = None, save_interval: float = 0.0):
+        """
+        Args:
+            path: 持久化文件路径，为 None 时只保存在内存中
+            min_confidence: 写入缓存的最低置信度（低/中/高）
+            miner_config: TemplateMiner 参数（depth/similarity_threshold/max_children）
+            save_interval: 合并写入的间隔（秒），0 表示每次修改立即写入
+        """
+        self.path = path
+        self.min_confidence = min_confidence
+        self.save_interval = save_interval
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.ambiguous: set = set()
+        self.miner = TemplateMiner(**(miner_config or {}))
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.saves = 0
+        self._stale: Dict[str, str] = {}  # 因泛化失效的模板 -> 失效前的类别
+        self._dirty = False
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self._load()
+        atexit.register(self.flush)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.miner = TemplateMiner.from_dict(data.get("miner", {}))
+            self.entries = data.get("entries", {})
+            self.ambiguous = set(data.get("ambiguous", []))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ 模板分类缓存加载失败，将重新构建: {e}")
+
+    def save(self):
+        """原子地写入持久化文件"""
+        if not self.path:
+            return
+        with self._lock:
+            data = {"miner": self.miner.to_dict(), "entries": dict(self.entries), "ambiguous": sorted(self.ambiguous)}
+            self.saves += 1
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def flush(self):
+        """立即写入尚未保存的修改"""
+        with self._lock:
+            timer, self._timer = self._timer, None
+            dirty, self._dirty = self._dirty, False
+        if timer is not None:
+            timer.cancel()
+        if dirty:
+            self.save()
+
+    def _schedule_save(self):
+        """标记有未保存的修改，save_interval 秒后合并写入"""
+        if not self.path:
+            return
+        if self.save_interval <= 0:
+            self.save()
+            return
+        with self._lock:
+            self._dirty = True
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.save_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def template_id(self, alert_details: str) -> str:
+        """获取告警的模板ID（在线更新模板）"""
+        return self.miner.add(alert_details).template_id
+
+    def get(self, template_id: str) -> Optional[Dict[str, Any]]:
+        """查询缓存的分类结果，并记录命中统计"""
+        cluster = self.miner.cluster(template_id)
+        invalidated = False
+        with self._lock:
+            entry = self.entries.get(template_id)
+            if entry is not None and cluster is not None and entry.get("version", 1) != cluster.version:
+                # 模板在写入后被泛化，可能已包含其他类别的告警
+                self._stale[template_id] = self.entries.pop(template_id)["category"]
+                self.invalidated += 1
+                invalidated = True
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                entry["hits"] = entry.get("hits", 0) + 1
+        if invalidated:
+            # 失效立即安排写入，否则进程崩溃后旧的分类结果会从文件中恢复
+            self._schedule_save()
+        return entry
+
+    def put(self, template_id: str, category: str, confidence: str) -> bool:
+        """
+        写入分类结果（置信度不足时忽略）
+
+        Returns:
+            是否写入了缓存
+        """
+        level = self.CONFIDENCE_LEVELS.get(confidence.strip(), 0)
+        if not category or level < self.CONFIDENCE_LEVELS.get(self.min_confidence, 3):
+            return False
+        cluster = self.miner.cluster(template_id)
+        with self._lock:
+            if template_id in self.ambiguous:
+                return False
+            previous = self._stale.pop(template_id, None)
+            if previous is not None and previous != category:
+                self.ambiguous.add(template_id)
+                written = False
+            else:
+                self.entries[template_id] = {
+                    "category": category,
+                    "confidence": confidence.strip(),
+                    "hits": 0,
+                    "updated_at": time.time(),
+                    "version": cluster.version if cluster is not None else 1,
+                }
+                written = True
+        self._schedule_save()
+        return written
+
+    def invalidate(self, template_id: str):
+        """移除错误的缓存结果"""
+        with self._lock:
+            self.entries.pop(template_id, None)
+        self._schedule_save()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存命中统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "templates": len(self.miner.clusters),
+                "cached_templates": len(self.entries),
+                "ambiguous_templates": len(self.ambiguous),
+                "invalidated": self.invalidated,
+                "saves": self.saves,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
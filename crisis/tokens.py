@@ -0,0 +1,42 @@
+"""
+Token 数估算
+
+不依赖 tokenizer 的快速估算，用于 token 预算控制（检索上下文注入、限流预估、
+告警压缩等）。中日韩字符约 1 token/字，其余文本约 4 字符/token。
+"""
+
+import re
+
+_CJK_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯＀-￯]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的 token 数
+
+    Args:
+        text: 任意文本
+
+    Returns:
+        估算的 token 数（非空文本至少为 1）
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return max(1, cjk + (other + 3) // 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """按估算 token 数截断文本（保留开头）"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 二分查找满足预算的最长前缀
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
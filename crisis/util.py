@@ -1,46 +1,820 @@
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic
+import asyncio
+import contextlib
 import os
 import re
+import threading
+import weakref
+from typing import (
+    Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union,
+)
 from dotenv import load_dotenv
 import httpx
+from llm_cache import LLMCache, make_cache_key
+from singleflight import SingleFlight, FileLockSingleFlight
+from batch import BatchRunner, BatchResult
+from telemetry import Telemetry, attempt_hooks
+from cassette import cassette_transport
+from hedging import Attempt, HedgePolicy, hedged_call, ahedged_call, policy_from_env
+from endpoints import Endpoint, EndpointPool, pool_from_env, report_first_token
+from prompts import apply_cache_minimum
+from tokens import estimate_tokens
 
 # 加载 .env 文件中的环境变量
 load_dotenv()
 
-# 创建带有代理设置的客户端
+# 代理地址，可通过环境变量 ANTHROPIC_PROXY 覆盖，设为空字符串表示不使用代理
+# （API 地址由 SDK 读取 ANTHROPIC_BASE_URL，可指向本地 stub 服务器）
+PROXY = os.getenv("ANTHROPIC_PROXY", "http://127.0.0.1:7890/") or None
+
+# 提示词可以是字符串，也可以是带 cache_control 断点的内容块列表
+Prompt = Union[str, List[Dict[str, Any]]]
+
+T = TypeVar("T")
+
+# 创建带有代理设置的客户端（传输层支持录制/回放，见 cassette.py）
 client = Anthropic(
     api_key=os.environ["ANTHROPIC_API_KEY"],
     http_client=httpx.Client(
-        proxy="http://127.0.0.1:7890/"  # 设置代理
+        transport=cassette_transport(PROXY),  # 设置代理
+        event_hooks=attempt_hooks(),  # 统计 SDK 内部重试
     )
 )
 
-def llm_call(prompt: str, system_prompt: str = "", model="claude-3-5-sonnet-20241022") -> str:
+# 异步客户端：每个事件循环一个客户端，循环内所有调用共享同一个连接池
+ASYNC_MAX_CONCURRENCY = int(os.getenv("LLM_ASYNC_MAX_CONCURRENCY", "256"))
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = weakref.WeakKeyDictionary()
+
+def get_async_client() -> AsyncAnthropic:
+    """Return the AsyncAnthropic client bound to the running event loop."""
+    return _async_state()[0]
+
+def _async_state() -> tuple:
+    loop = asyncio.get_running_loop()
+    state = _async_clients.get(loop)
+    if state is None:
+        async_client = AsyncAnthropic(
+            api_key=os.environ["ANTHROPIC_API_KEY"],
+            http_client=httpx.AsyncClient(
+                transport=cassette_transport(
+                    PROXY,  # 设置代理
+                    is_async=True,
+                    limits=httpx.Limits(
+                        max_connections=ASYNC_MAX_CONCURRENCY,
+                        max_keepalive_connections=ASYNC_MAX_CONCURRENCY,
+                    ),
+                ),
+                timeout=httpx.Timeout(600.0, connect=10.0),
+                event_hooks=attempt_hooks(is_async=True),
+            ),
+        )
+        state = _async_clients[loop] = (async_client, asyncio.Semaphore(ASYNC_MAX_CONCURRENCY))
+    return state
+
+# 同步接口需要异步调用（如推测执行）时使用的后台事件循环，进程内只创建一个
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_lock = threading.Lock()
+
+def run_async(coro: Awaitable[T]) -> T:
+    """
+    Run a coroutine from synchronous code on a long-lived background event loop.
+
+    Unlike asyncio.run, this also works when the caller's thread already runs an event
+    loop, and every call reuses the same loop, so async_llm_call keeps a single
+    AsyncAnthropic client and connection pool instead of creating one per call.
+
+    Args:
+        coro: The coroutine to run.
+
+    Returns:
+        The coroutine's result.
+    """
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-background-loop", daemon=True).start()
+            _background_loop = loop
+        loop = _background_loop
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("不能在后台事件循环中同步等待，请直接 await 对应的异步接口")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+# 调用遥测：每次调用的 token、延迟、重试和停止原因，设置 LLM_TELEMETRY_PATH 时由后台线程追加到 JSONL
+telemetry = Telemetry(jsonl_path=os.getenv("LLM_TELEMETRY_PATH"))
+
+def usage_stats() -> Dict[str, Any]:
+    """
+    Return cumulative token usage of llm_call and its variants.
+
+    cache_read_input_tokens counts prompt-prefix cache hits and
+    cache_creation_input_tokens counts prefixes written to the cache.
+    Per-model and per-step breakdowns are available from telemetry_stats().
+    """
+    stats = telemetry.totals()
+    prompt_tokens = stats["input_tokens"] + stats["cache_creation_input_tokens"] + stats["cache_read_input_tokens"]
+    stats["cache_read_ratio"] = round(stats["cache_read_input_tokens"] / prompt_tokens, 4) if prompt_tokens else 0.0
+    return stats
+
+def telemetry_stats() -> List[Dict[str, Any]]:
+    """
+    Return call telemetry aggregated by (model, workflow step, source).
+
+    Each row has call/error/cache-hit/retry counts, token totals, average latency
+    and time to first token, output tokens/sec, stop reasons and estimated cost.
+    Use telemetry.to_prometheus() or telemetry.export_jsonl(path) to export.
+    """
+    return telemetry.summary()
+
+# 可选的响应缓存，默认关闭；通过 enable_cache() 或环境变量 LLM_CACHE_PATH 开启
+response_cache: Optional[LLMCache] = None
+
+def enable_cache(path: Optional[str] = None, ttl: Optional[float] = None,
+                 max_entries: int = 100000, memory_entries: int = 1024) -> LLMCache:
+    """
+    Enable the two-tier (in-memory LRU + SQLite) response cache for llm_call.
+
+    Args:
+        path (str, optional): SQLite file for the persistent tier. None keeps the cache in memory only.
+        ttl (float, optional): Seconds before an entry expires. None means entries never expire.
+        max_entries (int, optional): Maximum number of entries kept on disk.
+        memory_entries (int, optional): Maximum number of entries kept in the in-memory LRU.
+
+    Returns:
+        LLMCache: The active cache.
+    """
+    global response_cache
+    if response_cache is not None:
+        response_cache.close()
+    response_cache = LLMCache(path, ttl, max_entries, memory_entries)
+    return response_cache
+
+def disable_cache() -> None:
+    """Disable the response cache."""
+    global response_cache
+    if response_cache is not None:
+        response_cache.close()
+    response_cache = None
+
+def cache_stats() -> Dict[str, Any]:
+    """Return response cache statistics (empty when the cache is disabled)."""
+    return response_cache.stats() if response_cache is not None else {}
+
+if os.getenv("LLM_CACHE_PATH"):
+    enable_cache(
+        os.environ["LLM_CACHE_PATH"],
+        ttl=float(os.environ["LLM_CACHE_TTL"]) if os.getenv("LLM_CACHE_TTL") else None,
+    )
+
+# 相同请求合并：并发的相同请求只发起一次上游调用（设置 LLM_COALESCE=0 关闭）
+request_coalescer = SingleFlight() if os.getenv("LLM_COALESCE", "1") != "0" else None
+
+def enable_cross_process_coalescing(lock_dir: str) -> FileLockSingleFlight:
+    """
+    Coalesce identical in-flight requests across processes using lock files.
+
+    The process holding a request's lock file makes the upstream call; other
+    processes wait for the lock and read the result from the shared disk cache,
+    so enable_cache(path) must be called first.
+
+    Args:
+        lock_dir (str): Directory for the per-request lock files.
+
+    Returns:
+        FileLockSingleFlight: The active cross-process coalescer.
+    """
+    global request_coalescer
+    if response_cache is None or response_cache.path is None:
+        raise ValueError("跨进程请求合并需要先通过 enable_cache(path) 开启磁盘缓存")
+    request_coalescer = FileLockSingleFlight(lock_dir, response_cache)
+    return request_coalescer
+
+def coalescing_stats() -> Dict[str, Any]:
+    """Return single-flight counters: upstream calls (leaders) and calls saved (coalesced)."""
+    return request_coalescer.stats() if request_coalescer is not None else {}
+
+# 对冲请求，默认关闭；通过 enable_hedging() 或环境变量 LLM_HEDGE=1 开启
+hedge_policy: Optional[HedgePolicy] = policy_from_env()
+
+def enable_hedging(percentile: float = 0.95, budget: float = 0.05, initial_delay: float = 2.0,
+                   **kwargs) -> HedgePolicy:
+    """
+    Enable hedged requests for llm_call and async_llm_call.
+
+    When the first streamed token has not arrived within the adaptive delay (a percentile
+    of recent time-to-first-token), an identical request is sent; the first to respond is
+    used and the other is cancelled by closing its stream.
+
+    Args:
+        percentile (float, optional): Percentile of recent time-to-first-token used as the hedge delay.
+        budget (float, optional): Maximum long-run fraction of calls that may be hedged.
+        initial_delay (float, optional): Hedge delay in seconds until enough samples are collected.
+        **kwargs: Other HedgePolicy arguments (min_delay, min_samples, window, burst).
+
+    Returns:
+        HedgePolicy: The active policy.
+    """
+    global hedge_policy
+    hedge_policy = HedgePolicy(percentile, budget, initial_delay, **kwargs)
+    return hedge_policy
+
+def disable_hedging() -> None:
+    """Disable hedged requests."""
+    global hedge_policy
+    hedge_policy = None
+
+def hedging_stats() -> Dict[str, Any]:
+    """Return hedged call counts, hedge rate, hedge wins and the current hedge delay (empty when disabled)."""
+    return hedge_policy.stats() if hedge_policy is not None else {}
+
+# 多端点（如中转站 + 代理直连），默认关闭：只使用上面的全局客户端。
+# 通过 configure_endpoints() 或环境变量 LLM_ENDPOINTS 开启，见 endpoints.py
+def _endpoint_client(endpoint: Endpoint) -> Anthropic:
+    return Anthropic(
+        api_key=endpoint.api_key or os.environ["ANTHROPIC_API_KEY"],
+        base_url=endpoint.base_url,
+        max_retries=endpoint.max_retries,
+        timeout=endpoint.http_timeout,
+        http_client=httpx.Client(
+            transport=cassette_transport(endpoint.proxy),
+            event_hooks=attempt_hooks(),
+        ),
+    )
+
+endpoint_pool: Optional[EndpointPool] = pool_from_env(_endpoint_client)
+
+# 异步客户端同样按事件循环创建，每个循环内每个端点一个客户端
+_async_endpoint_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncAnthropic]]" = \
+    weakref.WeakKeyDictionary()
+
+def _async_endpoint_client(endpoint: Endpoint) -> AsyncAnthropic:
+    clients = _async_endpoint_clients.setdefault(asyncio.get_running_loop(), {})
+    if endpoint.name not in clients:
+        clients[endpoint.name] = AsyncAnthropic(
+            api_key=endpoint.api_key or os.environ["ANTHROPIC_API_KEY"],
+            base_url=endpoint.base_url,
+            max_retries=endpoint.max_retries,
+            timeout=endpoint.http_timeout,
+            http_client=httpx.AsyncClient(
+                transport=cassette_transport(
+                    endpoint.proxy,
+                    is_async=True,
+                    limits=httpx.Limits(
+                        max_connections=ASYNC_MAX_CONCURRENCY,
+                        max_keepalive_connections=ASYNC_MAX_CONCURRENCY,
+                    ),
+                ),
+                event_hooks=attempt_hooks(is_async=True),
+            ),
+        )
+    return clients[endpoint.name]
+
+def configure_endpoints(endpoints: List[Endpoint], **kwargs) -> EndpointPool:
+    """
+    Route llm_call, async_llm_call and the streaming calls across several API endpoints.
+
+    Each call goes to the endpoint with the lowest expected latency (rolling latency divided
+    by success rate). Endpoint failures (connection errors, timeouts, 5xx, 429, auth errors)
+    fail over to the next endpoint and open a per-endpoint circuit breaker, so a flaky relay
+    stops costing a timeout on every request; after a cooldown a single probe is let through.
+
+    Args:
+        endpoints (list[Endpoint]): Endpoints, each with its own API key, base URL and proxy.
+        **kwargs: EndpointPool arguments (failure_threshold, error_rate_threshold, window,
+            min_calls, cooldown, max_cooldown, alpha).
+
+    Returns:
+        EndpointPool: The active pool.
+    """
+    global endpoint_pool
+    endpoint_pool = EndpointPool(endpoints, _endpoint_client, **kwargs)
+    return endpoint_pool
+
+def disable_endpoints() -> None:
+    """Send every call through the global client again."""
+    global endpoint_pool
+    endpoint_pool = None
+
+def endpoint_stats() -> Dict[str, Dict[str, Any]]:
+    """Return per-endpoint breaker state, calls, errors, error rate and latency (empty when not configured)."""
+    return endpoint_pool.stats() if endpoint_pool is not None else {}
+
+def _with_endpoint(fn: Callable[[Anthropic], T], max_retries: Optional[int] = None, rank: int = 0) -> T:
+    """Run fn with the global client, or on the best endpoint with failover when endpoints are configured."""
+    def run(call_client: Anthropic) -> T:
+        return fn(call_client if max_retries is None else call_client.with_options(max_retries=max_retries))
+
+    pool = endpoint_pool
+    if pool is None:
+        return run(client)
+    return pool.call(lambda endpoint: run(pool.client(endpoint)), rank)
+
+async def _awith_endpoint(fn: Callable[[AsyncAnthropic], Awaitable[T]], rank: int = 0) -> T:
+    """Async variant of _with_endpoint."""
+    pool = endpoint_pool
+    if pool is None:
+        return await fn(_async_state()[0])
+    return await pool.acall(lambda endpoint: fn(_async_endpoint_client(endpoint)), rank)
+
+def _user_message(prompt: Prompt, model: str, system_prompt: str) -> Dict[str, Any]:
+    """The user message, without cache_control breakpoints whose prefix is too short for the model to cache."""
+    return {"role": "user", "content": apply_cache_minimum(prompt, model, estimate_tokens(system_prompt))}
+
+def llm_call(prompt: Prompt, system_prompt: str = "", model="claude-3-5-sonnet-20241022",
+             max_tokens: int = 4096, temperature: float = 0.1, use_cache: bool = True,
+             max_retries: Optional[int] = None, coalesce: bool = True, hedge: bool = True) -> str:
     """
     Calls the model with the given prompt and returns the response.
 
     Args:
-        prompt (str): The user prompt to send to the model.
+        prompt (str | list): The user prompt to send to the model, either a string or a list of
+            content blocks (e.g. a static prefix marked with cache_control followed by the variable part).
+            Breakpoints whose prefix is shorter than the model's cacheable minimum are dropped.
         system_prompt (str, optional): The system prompt to send to the model. Defaults to "".
         model (str, optional): The model to use for the call. Defaults to "claude-3-5-sonnet-20241022".
+        max_tokens (int, optional): Maximum number of tokens to generate. Defaults to 4096.
+        temperature (float, optional): Sampling temperature. Defaults to 0.1.
+        use_cache (bool, optional): Whether to consult the response cache when it is enabled. Defaults to True.
+        max_retries (int, optional): Override the SDK's own retry count, e.g. 0 when an external
+            scheduler handles retries. Defaults to the client setting.
+        coalesce (bool, optional): Share an identical in-flight request instead of sending a new one.
+            Set to False for deliberate duplicates such as hedged requests. Defaults to True.
+        hedge (bool, optional): Hedge the request when hedging is enabled (see enable_hedging).
+            Defaults to True.
 
     Returns:
         str: The response from the language model.
     """
-    # 使用全局配置的客户端
-    messages = [{"role": "user", "content": prompt}]
-    response = client.messages.create(
-        model=model,
-        max_tokens=4096,
-        system=system_prompt,
-        messages=messages,
-        temperature=0.1,
-    )
-    return response.content[0].text
+    cache_key, cached = _cache_lookup(use_cache, model, system_prompt, prompt, temperature, max_tokens)
+    if cached is not None:
+        telemetry.record_cache_hit(model, "llm_call")
+        return cached
+
+    params = dict(model=model, max_tokens=max_tokens, system=system_prompt,
+                  messages=[_user_message(prompt, model, system_prompt)], temperature=temperature)
+
+    def create(call_client: Anthropic) -> str:
+        with telemetry.track(model, "llm_call") as call:
+            response = call_client.messages.create(**params)
+            call.finish(response.usage, response.stop_reason)
+        return response.content[0].text
+
+    def request() -> str:
+        policy = hedge_policy
+        if policy is not None and hedge:
+            # 对冲请求优先使用另一个端点（rank=1）
+            return hedged_call(lambda attempt: _with_endpoint(
+                lambda call_client: _hedged_attempt(call_client, params, attempt), max_retries, attempt.index), policy)
+        # 使用全局配置的客户端，或配置的端点中最合适的一个
+        return _with_endpoint(create, max_retries)
+
+    key = cache_key or make_cache_key(model, system_prompt, prompt, temperature, max_tokens)
+    coalescer, leader = _coalesced_request(cache_key, request)
+    return coalescer.do(key, leader) if coalescer is not None and coalesce else leader()
+
+async def async_llm_call(prompt: Prompt, system_prompt: str = "", model="claude-3-5-sonnet-20241022",
+                         max_tokens: int = 4096, temperature: float = 0.1, use_cache: bool = True,
+                         coalesce: bool = True, hedge: bool = True) -> str:
+    """
+    Async variant of llm_call built on AsyncAnthropic.
+
+    All calls on the same event loop share one connection pool, and at most
+    LLM_ASYNC_MAX_CONCURRENCY (default 256) requests are in flight at once.
+    Arguments and return value are the same as llm_call.
+    """
+    cache_key, cached = await _acache_lookup(use_cache, model, system_prompt, prompt, temperature, max_tokens)
+    if cached is not None:
+        telemetry.record_cache_hit(model, "async_llm_call")
+        return cached
+
+    params = dict(model=model, max_tokens=max_tokens, system=system_prompt,
+                  messages=[_user_message(prompt, model, system_prompt)], temperature=temperature)
+
+    async def create(async_client: AsyncAnthropic) -> str:
+        with telemetry.track(model, "async_llm_call") as call:
+            response = await async_client.messages.create(**params)
+            call.finish(response.usage, response.stop_reason)
+        return response.content[0].text
+
+    async def request() -> str:
+        policy = hedge_policy
+        if policy is not None and hedge:
+            return await ahedged_call(lambda attempt: _awith_endpoint(
+                lambda async_client: _ahedged_attempt(async_client, params, attempt), attempt.index), policy)
+        async with _async_state()[1]:
+            return await _awith_endpoint(create)
+
+    key = cache_key or make_cache_key(model, system_prompt, prompt, temperature, max_tokens)
+    coalescer, leader = _coalesced_request(cache_key, request, is_async=True)
+    return await coalescer.ado(key, leader) if coalescer is not None and coalesce else await leader()
+
+def stream_llm_call(prompt: Prompt, system_prompt: str = "", model="claude-3-5-sonnet-20241022",
+                    max_tokens: int = 4096, temperature: float = 0.1, use_cache: bool = True) -> Iterator[str]:
+    """
+    Streaming variant of llm_call that yields text deltas as they arrive.
+
+    Closing the generator early (e.g. breaking out of the loop) closes the HTTP
+    stream, which stops generation. Only fully received responses are cached.
+    Arguments are the same as llm_call.
+    """
+    cache_key, cached = _cache_lookup(use_cache, model, system_prompt, prompt, temperature, max_tokens)
+    if cached is not None:
+        telemetry.record_cache_hit(model, "stream_llm_call")
+        yield cached
+        return
+
+    chunks = []
+    # 流式调用开始输出后无法换端点重试，只选择端点并记录结果
+    pool = endpoint_pool
+    with (pool.lease() if pool is not None else contextlib.nullcontext()) as lease:
+        stream_client = client if lease is None else pool.client(lease.endpoint)
+        with telemetry.track(model, "stream_llm_call") as call, stream_client.messages.stream(
+            model=model,
+            max_tokens=max_tokens,
+            system=system_prompt,
+            messages=[_user_message(prompt, model, system_prompt)],
+            temperature=temperature,
+        ) as stream:
+            try:
+                for text in stream.text_stream:
+                    call.first_token()
+                    if lease is not None:
+                        lease.first_token()
+                    chunks.append(text)
+                    yield text
+            finally:
+                # 提前关闭时记录已生成部分的用量，停止原因为空
+                _finish_stream(call, stream)
+    if cache_key is not None:
+        response_cache.put(cache_key, "".join(chunks))
+
+async def async_stream_llm_call(prompt: Prompt, system_prompt: str = "", model="claude-3-5-sonnet-20241022",
+                                max_tokens: int = 4096, temperature: float = 0.1,
+                                use_cache: bool = True) -> AsyncIterator[str]:
+    """Async variant of stream_llm_call; close the generator (aclose) to stop generation early."""
+    cache_key, cached = await _acache_lookup(use_cache, model, system_prompt, prompt, temperature, max_tokens)
+    if cached is not None:
+        telemetry.record_cache_hit(model, "async_stream_llm_call")
+        yield cached
+        return
+
+    chunks = []
+    async_client, semaphore = _async_state()
+    pool = endpoint_pool
+    async with semaphore:
+        with (pool.lease() if pool is not None else contextlib.nullcontext()) as lease, \
+                telemetry.track(model, "async_stream_llm_call") as call:
+            if lease is not None:
+                async_client = _async_endpoint_client(lease.endpoint)
+            async with async_client.messages.stream(
+                model=model,
+                max_tokens=max_tokens,
+                system=system_prompt,
+                messages=[_user_message(prompt, model, system_prompt)],
+                temperature=temperature,
+            ) as stream:
+                try:
+                    async for text in stream.text_stream:
+                        call.first_token()
+                        if lease is not None:
+                            lease.first_token()
+                        chunks.append(text)
+                        yield text
+                finally:
+                    _finish_stream(call, stream)
+    if cache_key is not None:
+        await _acache_put(cache_key, "".join(chunks))
+
+def _hedged_attempt(call_client: Anthropic, params: Dict[str, Any], attempt: Attempt) -> str:
+    """
+    One attempt of a hedged llm_call, streamed so the first token can be detected.
+
+    The losing attempt is cancelled by closing its stream from the winner's thread; a
+    sync attempt still waiting for response headers is closed once they arrive.
+    """
+    chunks = []
+    with telemetry.track(params["model"], "llm_call:hedge" if attempt.index else "llm_call") as call:
+        try:
+            with call_client.messages.stream(**params) as stream:
+                attempt.on_cancel(stream.close)
+                try:
+                    for text in stream.text_stream:
+                        call.first_token()
+                        report_first_token()
+                        attempt.first_token()
+                        chunks.append(text)
+                finally:
+                    _finish_stream(call, stream)
+        except Exception:
+            attempt.check()
+            raise
+        attempt.check()
+    return "".join(chunks)
+
+async def _ahedged_attempt(async_client: AsyncAnthropic, params: Dict[str, Any], attempt: Attempt) -> str:
+    """Async variant of _hedged_attempt; the losing attempt's task is cancelled."""
+    chunks = []
+    async with _async_state()[1]:
+        with telemetry.track(params["model"], "async_llm_call:hedge" if attempt.index else "async_llm_call") as call:
+            async with async_client.messages.stream(**params) as stream:
+                try:
+                    async for text in stream.text_stream:
+                        call.first_token()
+                        report_first_token()
+                        attempt.first_token()
+                        chunks.append(text)
+                finally:
+                    _finish_stream(call, stream)
+    return "".join(chunks)
+
+def _finish_stream(call, stream) -> None:
+    """Record usage and stop reason of a (possibly interrupted) stream."""
+    try:
+        snapshot = stream.current_message_snapshot
+    except AssertionError:
+        return  # message_start not received yet
+    call.finish(snapshot.usage, snapshot.stop_reason)
+
+# 离线批量执行：通过 Message Batches API 提交，不支持时回退为限速的实时调用
+batch_runner = BatchRunner(client)
+
+def iter_llm_batch(prompts: Dict[str, Prompt], system_prompt: str = "", model="claude-3-5-sonnet-20241022",
+                   max_tokens: int = 4096, temperature: float = 0.1, use_cache: bool = True) -> Iterator[BatchResult]:
+    """
+    Run many independent prompts through the Message Batches API, yielding results as they are read.
+
+    Batch requests have their own rate limits, so bulk jobs do not compete with live
+    traffic. When the endpoint does not support batches the prompts fall back to
+    throttled real-time calls. Cached responses are returned without being submitted,
+    and successful results are written to the response cache.
+
+    Args:
+        prompts (dict): custom_id -> prompt. IDs must match ^[a-zA-Z0-9_-]{1,64}$.
+        Other arguments are the same as llm_call.
+
+    Yields:
+        BatchResult: One result per custom_id, in completion order.
+    """
+    pending = []
+    cache_keys = {}
+    for custom_id, prompt in prompts.items():
+        cache_key, cached = _cache_lookup(use_cache, model, system_prompt, prompt, temperature, max_tokens)
+        if cached is not None:
+            telemetry.record_cache_hit(model, "llm_batch")
+            yield BatchResult(custom_id, cached, mode="cache")
+            continue
+        cache_keys[custom_id] = cache_key
+        params = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "messages": [_user_message(prompt, model, system_prompt)],
+            "temperature": temperature,
+        }
+        if system_prompt:
+            params["system"] = system_prompt
+        pending.append((custom_id, params))
+
+    for result in batch_runner.run(pending):
+        if result.ok:
+            # 批量结果没有单次调用的延迟，只记录用量
+            telemetry.record_usage(model, result.usage, f"llm_batch:{result.mode}")
+            if cache_keys.get(result.custom_id) is not None:
+                response_cache.put(cache_keys[result.custom_id], result.text)
+        yield result
+
+def llm_batch(prompts: Dict[str, Prompt], **kwargs) -> Dict[str, str]:
+    """
+    Collect iter_llm_batch results into a dict keyed by custom ID.
+
+    Raises:
+        RuntimeError: If any request failed; successful results are still cached.
+    """
+    texts, errors = {}, {}
+    for result in iter_llm_batch(prompts, **kwargs):
+        if result.ok:
+            texts[result.custom_id] = result.text
+        else:
+            errors[result.custom_id] = result.error
+    if errors:
+        raise RuntimeError(f"{len(errors)} 个批量请求失败: {errors}")
+    return texts
+
+def batch_stats() -> Dict[str, Any]:
+    """Return batch submission, polling and real-time fallback counters."""
+    return batch_runner.stats()
+
+def _coalesced_request(cache_key: Optional[str], request, is_async: bool = False) -> tuple:
+    """
+    Pick the coalescer for a request and wrap the request so the leader fills the cache.
+
+    Cross-process coalescing stores results itself and only applies when the cache is
+    in use; async calls coalesce within their event loop only.
+    """
+    coalescer = request_coalescer
+    cross_process = isinstance(coalescer, FileLockSingleFlight)
+    if cross_process and (is_async or cache_key is None):
+        coalescer, cross_process = coalescer.local, False
+    store = cache_key is not None and not cross_process
+
+    if is_async:
+        async def leader():
+            text = await request()
+            if store:
+                await _acache_put(cache_key, text)
+            return text
+    else:
+        def leader():
+            text = request()
+            if store:
+                response_cache.put(cache_key, text)
+            return text
+    return coalescer, leader
+
+def _cache_lookup(use_cache: bool, model: str, system_prompt: Any, prompt: Any,
+                  temperature: float, max_tokens: int) -> tuple:
+    """Return (cache_key, cached_text); cache_key is None when caching does not apply."""
+    if not use_cache or response_cache is None:
+        return None, None
+    cache_key = make_cache_key(model, system_prompt, prompt, temperature, max_tokens)
+    return cache_key, response_cache.get(cache_key)
+
+async def _acache_lookup(use_cache: bool, model: str, system_prompt: Any, prompt: Any,
+                         temperature: float, max_tokens: int) -> tuple:
+    """Async variant of _cache_lookup; SQLite lookups run in a worker thread so they never block the event loop."""
+    if use_cache and response_cache is not None and response_cache.path is not None:
+        return await asyncio.to_thread(_cache_lookup, use_cache, model, system_prompt, prompt, temperature, max_tokens)
+    return _cache_lookup(use_cache, model, system_prompt, prompt, temperature, max_tokens)
+
+async def _acache_put(cache_key: str, text: str) -> None:
+    """Store a response from async code, writing the SQLite tier in a worker thread."""
+    cache = response_cache
+    if cache is None:
+        return
+    if cache.path is not None:
+        await asyncio.to_thread(cache.put, cache_key, text)
+    else:
+        cache.put(cache_key, text)
+
+class Tag:
+    """
+    One tag from a structured response.
+
+    Attributes:
+        name (str): Tag name.
+        text (str): Raw content between the opening and closing tags (nested tags included).
+        children (List[Tag]): Tags nested directly inside this one.
+        complete (bool): False when the response ended before the closing tag (truncated output).
+        start (int): Offset of the opening tag in the response.
+    """
+
+    __slots__ = ("name", "text", "children", "complete", "start", "_raw_attrs")
+
+    def __init__(self, name: str, raw_attrs: str, text: str, children: List["Tag"], complete: bool, start: int):
+        self.name = name
+        self.text = text
+        self.children = children
+        self.complete = complete
+        self.start = start
+        self._raw_attrs = raw_attrs
+
+    @property
+    def attrs(self) -> Dict[str, str]:
+        """Attributes of the opening tag, parsed on first access."""
+        if not self._raw_attrs:
+            return {}
+        return {m.group(1): next(v for v in m.group(2, 3, 4) if v is not None)
+                for m in _ATTR_PATTERN.finditer(self._raw_attrs)}
+
+    def __repr__(self) -> str:
+        return f"Tag({self.name!r}, attrs={self.attrs!r}, complete={self.complete})"
+
+
+class TaggedResponse:
+    """
+    All tags of a response, parsed in a single pass by parse_tags.
+
+    Lookups by name return tags in document order (by opening tag position),
+    including nested and repeated tags.
+    """
+
+    def __init__(self, tags: List[Tag], index: Dict[str, List[Tag]], truncated: bool):
+        self.tags = tags
+        self.truncated = truncated
+        self._index = index
+
+    def find_all(self, name: str, partial: bool = False) -> List[Tag]:
+        """Return every tag with the given name; unclosed tags only when partial is True."""
+        found = self._index.get(name, [])
+        return found if partial else [tag for tag in found if tag.complete]
+
+    def find(self, name: str, partial: bool = False) -> Optional[Tag]:
+        """Return the first tag with the given name, or None."""
+        for tag in self._index.get(name, ()):
+            if partial or tag.complete:
+                return tag
+        return None
+
+    def get(self, name: str, default: str = "", partial: bool = False) -> str:
+        """
+        Return the content of the first tag with the given name.
+
+        Args:
+            name (str): The tag name.
+            default (str, optional): Returned when the tag is missing. Defaults to "".
+            partial (bool, optional): Also accept a tag cut off by truncated output,
+                returning its content up to the end of the response. Defaults to False.
+        """
+        tag = self.find(name, partial)
+        return tag.text if tag is not None else default
+
+    def get_all(self, name: str) -> List[str]:
+        """Return the content of every complete tag with the given name."""
+        return [tag.text for tag in self.find_all(name)]
+
+    def __contains__(self, name: str) -> bool:
+        return self.find(name) is not None
+
+
+_TAG_PATTERN = re.compile(r'<(/?)([A-Za-z_][\w.-]*)([^<>]*?)(/?)>')
+_ATTR_PATTERN = re.compile(r'([\w.:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))')
+
+
+def parse_tags(text: str, expected: Optional[Iterable[str]] = None) -> TaggedResponse:
+    """
+    Parse every XML-style tag of a structured response in one linear pass.
+
+    Handles nested, repeated and self-closing tags and tags with attributes. A closing
+    tag pairs with the nearest open tag of the same name; tags left open by truncated
+    output extend to the end of the text and are marked incomplete.
+
+    Prose can look like an opening tag (``Optional<T>``, ``List<String>``), so an unclosed
+    tag only marks the response truncated when its name is in ``expected`` or is closed
+    elsewhere in the response.
+
+    Args:
+        text (str): The response text.
+        expected (Iterable[str], optional): Tag names the caller asked the model to produce.
+
+    Returns:
+        TaggedResponse: The parsed tags.
+    """
+    roots: List[Tag] = []
+    index: Dict[str, List[Tag]] = {}
+    # 栈中每项：(标签名, 属性原文, 内容起点, 开始标签位置, 子标签)
+    stack: List[tuple] = []
+    closed = set(expected or ())
+
+    for match in _TAG_PATTERN.finditer(text):
+        closing, name, raw_attrs, self_closing = match.groups()
+        if not closing:
+            if self_closing:
+                tag = Tag(name, raw_attrs, "", [], True, match.start())
+                (stack[-1][4] if stack else roots).append(tag)
+                index.setdefault(name, []).append(tag)
+            else:
+                stack.append((name, raw_attrs, match.end(), match.start(), []))
+            continue
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] != name:
+                continue
+            _, raw, content_start, tag_start, children = stack[i]
+            # 未闭合的内层标签按普通文本处理，其中已闭合的子标签归入当前标签
+            for frame in stack[i + 1:]:
+                children.extend(frame[4])
+            del stack[i:]
+            tag = Tag(name, raw, text[content_start:match.start()], children, True, tag_start)
+            (stack[-1][4] if stack else roots).append(tag)
+            index.setdefault(name, []).append(tag)
+            closed.add(name)
+            break
+
+    # 输出被截断时，未闭合的标签从内到外延伸到文本末尾；只有调用方要求的或在别处闭合过的标签名
+    # 才说明输出被截断，正文中的 Optional<T> 之类不算
+    truncated = any(frame[0] in closed for frame in stack)
+    while stack:
+        name, raw, content_start, tag_start, children = stack.pop()
+        tag = Tag(name, raw, text[content_start:], children, False, tag_start)
+        (stack[-1][4] if stack else roots).append(tag)
+        index.setdefault(name, []).append(tag)
+
+    # 标签按闭合顺序加入，同名标签嵌套或截断时按开始位置恢复文档顺序
+    for tags in index.values():
+        if len(tags) > 1:
+            tags.sort(key=lambda t: t.start)
+    return TaggedResponse(roots, index, truncated)
+
 
 def extract_xml(text: str, tag: str) -> str:
     """
-    Extracts the content of the specified XML tag from the given text. Used for parsing structured responses 
+    Extracts the content of the specified XML tag from the given text.
+
+    Kept for compatibility; to read several tags from one response, call parse_tags
+    once and use TaggedResponse.get for each field.
 
     Args:
         text (str): The text containing the XML.
@@ -49,5 +823,58 @@ def extract_xml(text: str, tag: str) -> str:
     Returns:
         str: The content of the specified XML tag, or an empty string if the tag is not found.
     """
-    match = re.search(f'<{tag}>(.*?)</{tag}>', text, re.DOTALL)
-    return match.group(1) if match else ""
\ No newline at end of file
+    return parse_tags(text).get(tag)
+
+
+class StreamingTagParser:
+    """
+    Incremental XML tag parser for streamed responses.
+
+    Feed text chunks as they arrive; each call returns the (tag, content) pairs
+    whose closing tag appeared in that chunk, innermost tags first, so a tag
+    can be acted on before the rest of the response has been generated.
+    """
+
+    _TAG = re.compile(r'<(/?)([A-Za-z_][\w.-]*)>')
+    _PARTIAL = re.compile(r'</?[\w.-]*$')
+
+    def __init__(self):
+        self.buffer = ""
+        self.values: Dict[str, str] = {}
+        self._stack: List[Tuple[str, int]] = []
+        self._pos = 0
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """
+        Add a chunk of streamed text.
+
+        Args:
+            chunk (str): The next piece of the response.
+
+        Returns:
+            List[Tuple[str, str]]: Tags completed by this chunk, as (tag, content).
+        """
+        self.buffer += chunk
+        completed = []
+        for match in self._TAG.finditer(self.buffer, self._pos):
+            closing, tag = match.groups()
+            if not closing:
+                self._stack.append((tag, match.end()))
+            else:
+                # 关闭标签与最近的同名开启标签配对，忽略未闭合的内层标签
+                for i in range(len(self._stack) - 1, -1, -1):
+                    if self._stack[i][0] == tag:
+                        content = self.buffer[self._stack[i][1]:match.start()]
+                        del self._stack[i:]
+                        self.values.setdefault(tag, content)
+                        completed.append((tag, content))
+                        break
+            self._pos = match.end()
+
+        # 末尾可能是尚未接收完整的标签，下次从其起点继续扫描
+        last_open = self.buffer.rfind("<", self._pos)
+        if last_open != -1 and self._PARTIAL.match(self.buffer, last_open):
+            self._pos = last_open
+        else:
+            self._pos = len(self.buffer)
+        return completed
@@ -1,27 +1,195 @@
+import asyncio
+import os
+import random
+import time
 from concurrent.futures import ThreadPoolExecutor
-from typing import List, Dict, Callable
-from util import llm_call, extract_xml
+from typing import List, Dict, Callable, Optional, Tuple, Iterable, Iterator, AsyncIterator, Any
+from util import (
+    llm_call, async_llm_call, stream_llm_call, async_stream_llm_call, llm_batch, parse_tags, StreamingTagParser,
+    telemetry, run_async
+)
+from admission import AdmissionController
+from incident import IncidentStore, classification_signature
+from template_miner import TemplateClassificationCache
+from preclassifier import PreClassifier, record_sample
+from retrieval import IncidentRetriever, tokenize
+from speculation import SpeculationBudget, speculate
+from prompts import PromptRegistry
+from scheduler import RateLimitScheduler
+from pipeline import run_pipeline, arun_pipeline
+from completion import iter_completed, aiter_completed
+from compaction import AlertCompactor
+from cascade import ModelCascade
+from dag import DAG, DAGResult
+from tokens import estimate_tokens
+from config import (
+    ADMISSION_CONFIG, INCIDENT_CONFIG, TEMPLATE_CACHE_CONFIG, RETRIEVAL_CONFIG, KNOWLEDGE_BASE,
+    PROMPT_TEMPLATES, SCHEDULER_CONFIG, PRECLASSIFIER_CONFIG, SPECULATION_CONFIG,
+    STREAMING_CONFIG, COMPACTION_CONFIG, MODEL_CASCADE_CONFIG, DAG_CONFIG
+)
+
+CRISIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 提示词模板在导入时一次性加载，路径相对本目录解析
+prompt_registry = PromptRegistry(CRISIS_DIR, PROMPT_TEMPLATES)
+prompt_registry.preload()
+
+# 工作流级别的准入控制器，所有 analyze_alert 调用共享
+admission = AdmissionController(ADMISSION_CONFIG)
+
+# 持续事件的会话状态，按事件ID保存上一次的分析结果
+incidents = IncidentStore(INCIDENT_CONFIG["max_sessions"], INCIDENT_CONFIG["session_ttl"])
+
+# 告警模板 -> 分类结果缓存，命中时跳过分类 LLM 调用
+template_cache = TemplateClassificationCache(
+    os.path.join(CRISIS_DIR, TEMPLATE_CACHE_CONFIG["path"]) if TEMPLATE_CACHE_CONFIG["enabled"] else None,
+    TEMPLATE_CACHE_CONFIG["min_confidence"],
+    TEMPLATE_CACHE_CONFIG["miner"],
+    TEMPLATE_CACHE_CONFIG["save_interval"],
+)
+
+# 本地预分类器（规则 + 朴素贝叶斯），高置信度时跳过分类 LLM 调用
+preclassifier = PreClassifier(
+    os.path.join(CRISIS_DIR, PRECLASSIFIER_CONFIG["model_path"]),
+    PRECLASSIFIER_CONFIG["threshold"],
+    PRECLASSIFIER_CONFIG["min_signals"],
+)
+
+# 推测执行预算，route 和 analyze_alert 共享
+speculation_budget = SpeculationBudget(
+    SPECULATION_CONFIG["max_in_flight"],
+    SPECULATION_CONFIG["waste_tokens_per_min"],
+)
+
+# 告警内容压缩，只作用于嵌入提示词的告警文本
+compactor = AlertCompactor(COMPACTION_CONFIG)
+
+# 分类和路由选择的模型级联，置信度不足时升级到大模型
+model_cascade = ModelCascade(MODEL_CASCADE_CONFIG)
+
+# 告警分析 DAG（步骤在文件末尾注册），互不依赖的步骤并发执行
+alert_dag = DAG(DAG_CONFIG["max_concurrency"], DAG_CONFIG["memo_entries"])
+
+# 历史事件 BM25 检索，摘要注入专项分析提示词
+retriever = IncidentRetriever(
+    KNOWLEDGE_BASE,
+    RETRIEVAL_CONFIG["top_k"],
+    RETRIEVAL_CONFIG["token_budget"],
+    RETRIEVAL_CONFIG["min_score"],
+)
 
 def chain(input: str, prompts: List[str]) -> str:
     """Chain multiple LLM calls sequentially, passing results between steps."""
     result = input
     for i, prompt in enumerate(prompts, 1):
         print(f"\nStep {i}:")
-        result = llm_call(f"{prompt}\nInput: {result}")
+        with telemetry.step(f"chain_{i}"):
+            result = llm_call(f"{prompt}\nInput: {result}")
         print(result)
     return result
 
-def parallel(prompt: str, inputs: List[str], n_workers: int = 3) -> List[str]:
-    """Process multiple inputs concurrently with the same prompt."""
+def chain_many(inputs: Iterable[str], prompts: List[str], concurrency=3, queue_size: int = 8,
+               ordered: bool = True) -> Iterator[Tuple[int, Any]]:
+    """
+    Run chain over many inputs as a pipeline: each prompt is a stage with its own
+    concurrency limit, connected to the next by a bounded queue.
+
+    Args:
+        inputs: Inputs to process (may be a lazy iterator)
+        prompts: One prompt per step, as in chain
+        concurrency: Max in-flight calls per stage (int for all stages, or one per prompt)
+        queue_size: Capacity of the queues between stages
+        ordered: Yield in input order (True) or as items complete (False)
+
+    Yields:
+        (index, final result) or (index, StageError) for items that failed at some step
+    """
+    def stage(i: int, prompt: str) -> Callable[[str], str]:
+        call = telemetry.in_step(f"chain_{i}", llm_call)
+        return lambda result: call(f"{prompt}\nInput: {result}")
+
+    stages = [stage(i, prompt) for i, prompt in enumerate(prompts, 1)]
+    return run_pipeline(inputs, stages, concurrency, queue_size, ordered)
+
+def parallel(prompt: str, inputs: List[str], n_workers: int = 3,
+             scheduler: Optional[RateLimitScheduler] = None, batch: bool = False) -> List[str]:
+    """
+    Process multiple inputs concurrently with the same prompt.
+    
+    With a scheduler, concurrency adapts to rate limits (RPM/TPM budgets, AIMD on
+    429/529, jittered retries honoring retry-after) instead of using n_workers, and an
+    input that still fails (non-retryable error or retries exhausted) gets its exception
+    in its slot instead of discarding the rest of the batch.
+    With batch=True, inputs are submitted through the Message Batches API for
+    offline bulk jobs (falling back to throttled real-time calls when unsupported).
+    """
+    if batch:
+        with telemetry.step("parallel"):
+            results = llm_batch({f"item-{i}": f"{prompt}\nInput: {x}" for i, x in enumerate(inputs)})
+        return [results[f"item-{i}"] for i in range(len(inputs))]
+    
+    if scheduler is not None:
+        call = telemetry.in_step("parallel", llm_call)
+        return scheduler.map(lambda x: call(f"{prompt}\nInput: {x}", max_retries=0), inputs,
+                             estimate=lambda x: estimate_tokens(f"{prompt}\nInput: {x}"), return_exceptions=True)
+    
     with ThreadPoolExecutor(max_workers=n_workers) as executor:
-        futures = [executor.submit(llm_call, f"{prompt}\nInput: {x}") for x in inputs]
+        call = telemetry.in_step("parallel", llm_call)
+        futures = [executor.submit(call, f"{prompt}\nInput: {x}") for x in inputs]
         return [f.result() for f in futures]
 
-def route(input: str, routes: Dict[str, str]) -> str:
-    """Route input to specialized prompt using content classification."""
+def iter_parallel(prompt: str, inputs: List[str], n_workers: int = 3, item_timeout: Optional[float] = None,
+                  timeout: Optional[float] = None, hedge_after=None) -> Iterator[Tuple[int, Any]]:
+    """
+    Streaming variant of parallel: yield (index, result) as each call completes.
+
+    A failed call yields (index, exception) without affecting the others.
+
+    Args:
+        prompt: Prompt applied to every input
+        inputs: Inputs to process
+        n_workers: Number of concurrent calls
+        item_timeout: Per-call deadline in seconds, counted from when the call starts
+        timeout: Overall deadline in seconds; calls still running then yield TimeoutError
+        hedge_after: Send a duplicate request for calls running longer than this many
+            seconds, or a latency quantile of completed calls such as "p90"; the first
+            response wins
+
+    Yields:
+        (index, result) or (index, exception) in completion order
+    """
+    call = telemetry.in_step("parallel", llm_call)
+    return iter_completed(lambda x: call(f"{prompt}\nInput: {x}"), inputs, n_workers, item_timeout, timeout,
+                          hedge_after, lambda x: call(f"{prompt}\nInput: {x}", coalesce=False, hedge=False))
+
+def route(input: str, routes: Dict[str, str], speculative: Optional[bool] = None) -> str:
+    """
+    Route input to specialized prompt using content classification.
+    
+    In speculative mode (default: SPECULATION_CONFIG["enabled"]) the most likely route
+    from a local lexical prior starts together with the selection call; it runs on the
+    async client (on util's background event loop) so a wrong guess can be cancelled.
+    """
+    if _speculation_enabled(speculative):
+        return run_async(aroute(input, routes, speculative=True))
+    
     # First determine appropriate route using LLM with chain-of-thought
     print(f"\nAvailable routes: {list(routes.keys())}")
-    selector_prompt = f"""
+    selector_prompt = _route_selector_prompt(input, routes)
+    with telemetry.step("route_selection"):
+        route_response = model_cascade.run(
+            "route_selection", lambda model: llm_call(selector_prompt, model=model), _route_accepted(routes)
+        )
+    route_key = _parse_route_selection(route_response)
+    
+    # Process input with selected specialized prompt
+    selected_prompt = routes[route_key]
+    with telemetry.step("route_handler"):
+        return llm_call(f"{selected_prompt}\nInput: {input}")
+
+def _route_selector_prompt(input: str, routes: Dict[str, str]) -> str:
+    """Build the chain-of-thought route selection prompt."""
+    return f"""
     Analyze the input and select the most appropriate support team from these options: {list(routes.keys())}
     First explain your reasoning, then provide your selection in this XML format:
 
@@ -34,71 +202,366 @@ def route(input: str, routes: Dict[str, str]) -> str:
     The chosen team name
     </selection>
 
+    <confidence>
+    high, medium or low
+    </confidence>
+
     Input: {input}""".strip()
-    
-    route_response = llm_call(selector_prompt)
-    reasoning = extract_xml(route_response, 'reasoning')
-    route_key = extract_xml(route_response, 'selection').strip().lower()
+
+def _route_accepted(routes: Dict[str, str]) -> Callable[[str], bool]:
+    """Accept a selector response naming a known route without low/medium confidence."""
+    def accept(route_response: str) -> bool:
+        parsed = parse_tags(route_response)
+        return (parsed.get('selection').strip().lower() in routes
+                and model_cascade.confident(parsed.get('confidence')))
+    return accept
+
+def _route_prior(input: str, routes: Dict[str, str]) -> Optional[str]:
+    """Guess the route from token overlap between the input and each route; None if not confident."""
+    words = set(tokenize(input))
+    overlaps = {key: len(words & set(tokenize(f"{key} {prompt}"))) for key, prompt in routes.items()}
+    total = sum(overlaps.values())
+    if not total:
+        return None
+    key = max(overlaps, key=overlaps.get)
+    return key if overlaps[key] / total >= SPECULATION_CONFIG["min_prior"] else None
+
+def _speculation_enabled(speculative: Optional[bool]) -> bool:
+    return SPECULATION_CONFIG["enabled"] if speculative is None else speculative
+
+def cascade_stats() -> Dict:
+    """Return per-step escalation rates, per-model latency and the estimated latency saved by the model cascade."""
+    return model_cascade.stats()
+
+def speculation_stats() -> Dict:
+    """Return speculative execution hit rate and wasted tokens."""
+    return speculation_budget.stats()
+
+def _parse_route_selection(route_response: str) -> str:
+    """Extract and log the selected route from the selector response."""
+    parsed = parse_tags(route_response)
+    reasoning = parsed.get('reasoning')
+    route_key = parsed.get('selection').strip().lower()
     
     print("Routing Analysis:")
     print(reasoning)
     print(f"\nSelected route: {route_key}")
-    
-    # Process input with selected specialized prompt
-    selected_prompt = routes[route_key]
-    return llm_call(f"{selected_prompt}\nInput: {input}")
+    return route_key
 
-def analyze_alert(alert_details: str) -> str:
+def analyze_alert(alert_details: str, source: str = "default") -> str:
     """
     Analyze alert by first classifying it, then applying appropriate specialized analysis.
     
     Args:
         alert_details: The alert information to analyze
+        source: Alert source, used for per-source rate limiting
         
     Returns:
-        Comprehensive analysis based on alert category
+        Comprehensive analysis based on alert category, or a rejection with a
+        retry hint when the alert is shed under overload
+    """
+    decision = admission.admit(source, alert_details)
+    if not decision.admitted:
+        return _format_rejection(decision)
+    
+    with decision:
+        return _analyze_admitted_alert(alert_details, include_history=not decision.skip_history)
+
+def analyze_alert_dag(alert_details: str, source: str = "default") -> str:
     """
+    Analyze an alert through alert_dag, running independent steps concurrently.
+    
+    Local classification, prompt compaction and similar-incident retrieval do not depend
+    on each other, so retrieval overlaps with the classification call; the per-step
+    timeline is printed after the run.
+    
+    Raises:
+        StepError: A step failed (the original exception is in .error)
+    """
+    decision = admission.admit(source, alert_details)
+    if not decision.admitted:
+        return _format_rejection(decision)
+    
+    with decision:
+        result = alert_dag.run({"alert_details": alert_details, "include_history": not decision.skip_history})
+    return _dag_report(result)
+
+def analyze_incident_update(incident_id: str, alert_details: str, source: str = "default") -> str:
+    """
+    Analyze an update to an ongoing incident, reusing the previous analysis when possible.
+    
+    The LLM workflow is re-invoked only when the classification-relevant content
+    (error codes, HTTP status codes, exception types, uni calls, stack keywords)
+    changes; updates that only add unrelated lines return the previous result.
+    
+    Args:
+        incident_id: Incident key shared by every alert of the same incident
+        alert_details: The full alert text of this update
+        source: Alert source, used for per-source rate limiting
+        
+    Returns:
+        Analysis for the incident's accumulated alert text
+    """
+    session = incidents.get_or_create(incident_id)
+    with session.lock:
+        new_text = session.apply_update(alert_details)
+        signature = classification_signature(session.text)
+        
+        print(f"\n=== 事件 {incident_id} 第 {session.updates} 次更新 ===")
+        print(f"新增内容: {len(new_text.splitlines())} 行")
+        
+        if session.result is not None and signature == session.signature:
+            print("分类相关内容未变化，复用上次分析结果")
+            return session.result
+        
+        decision = admission.admit(source, session.text)
+        if not decision.admitted:
+            return _format_rejection(decision)
+        
+        with decision:
+            session.result = _analyze_admitted_alert(session.text, include_history=not decision.skip_history)
+            session.signature = signature
+            return session.result
+
+def dag_stats() -> Dict:
+    """Return alert_dag run counts, executed steps and memo hits."""
+    return alert_dag.stats()
+
+def close_incident(incident_id: str) -> None:
+    """Drop the session state of a resolved incident."""
+    incidents.close(incident_id)
+
+def _format_rejection(decision) -> str:
+    """Format a shed alert with its retry hint."""
+    print(f"\n告警被准入控制拒绝: {decision.reason}，建议 {decision.retry_after:.1f} 秒后重试")
+    return f"""
+=== 告警未分析 ===
+原因: {decision.reason}
+优先级: {decision.priority}
+建议重试间隔: {decision.retry_after:.1f} 秒
+"""
+
+def admission_stats() -> Dict:
+    """Return admission control and load shedding counters for analyze_alert."""
+    return admission.stats()
+
+def create_scheduler(**overrides) -> RateLimitScheduler:
+    """Create a rate-limit-aware scheduler for parallel from SCHEDULER_CONFIG."""
+    return RateLimitScheduler(**{**SCHEDULER_CONFIG, **overrides})
+
+def template_cache_stats() -> Dict:
+    """Return template classification cache size and hit rate."""
+    return template_cache.stats()
+
+def preclassifier_stats() -> Dict:
+    """Return how often the local pre-classifier decided without the LLM."""
+    return preclassifier.stats()
+
+def compaction_stats() -> Dict:
+    """Return alert compaction counters: tokens before/after and what was collapsed, folded or masked."""
+    return compactor.stats()
+
+def retrieval_stats() -> Dict:
+    """Return similar-incident retrieval latency and injected token counts."""
+    return retriever.stats()
+
+def telemetry_stats() -> List[Dict]:
+    """Return LLM call telemetry (tokens, latency, TTFT, retries, cost) per model and workflow step."""
+    return telemetry.summary()
+
+def add_incident(event_id: str, event_data: Dict) -> None:
+    """Index a resolved incident so later alerts can retrieve it."""
+    retriever.add_incident(event_id, event_data)
+
+def _analyze_admitted_alert(alert_details: str, include_history: bool = True) -> str:
+    """Classify and analyze an alert that has passed admission control."""
+    if SPECULATION_CONFIG["enabled"]:
+        # Speculation needs cancellable calls, so it runs on the async client
+        return run_async(_aanalyze_admitted_alert(alert_details, include_history))
+    
+    _print_compaction(alert_details)
     
-    # Step 1: Load classification prompt
-    with open('crisis/alert-classification-prompt.md', 'r', encoding='utf-8') as f:
-        classification_prompt = f.read().replace('{{ALERT_DETAILS}}', alert_details)
+    # Step 1: Try the local pre-classifier, then the template classification cache
+    template_id, classification = _local_classification(alert_details)
     
-    # Step 2: Classify the alert
+    if classification is None and STREAMING_CONFIG["enabled"]:
+        # Step 2: Stream the classification and start the analysis as soon as </category> arrives
+        return _analyze_streaming(template_id, alert_details, include_history)
+    
+    if classification is None:
+        # Step 2: Classify the alert
+        classification = _classify(template_id, alert_details)
+    
+    category, reasoning, confidence = classification
+    _print_classification(category, reasoning, confidence)
+    
+    # Step 3: Apply specialized analysis based on category
+    with telemetry.step("analysis"):
+        analysis_result = llm_call(_specialized_prompt(category, alert_details, include_history))
+    
+    return _format_analysis(category, reasoning, confidence, analysis_result)
+
+def _classify(template_id: Optional[str], alert_details: str, prompt_details: Optional[str] = None) -> Tuple[str, str, str]:
+    """
+    Classify the alert with the LLM cascade and remember the result for its template.
+    
+    prompt_details, when given, is the alert text to embed instead of compacting it here.
+    """
     print("\n=== 告警分类阶段 ===")
-    classification_response = llm_call(classification_prompt)
+    if prompt_details is None:
+        prompt_details = _prompt_details(alert_details)
+    classification_prompt = prompt_registry.render_blocks('classification', ALERT_DETAILS=prompt_details)
+    with telemetry.step("classification"):
+        classification_response = model_cascade.run(
+            "classification", lambda model: llm_call(classification_prompt, model=model), _classification_accepted
+        )
+    classification = _parse_classification(classification_response)
+    _remember_classification(template_id, alert_details, classification)
+    return classification
+
+def _analyze_streaming(template_id: Optional[str], alert_details: str, include_history: bool = True) -> str:
+    """Stream the classification, dispatching the specialized analysis the moment the category tag closes."""
+    print("\n=== 告警分类阶段（流式） ===")
+    parser = StreamingTagParser()
+    start = time.monotonic()
+    analysis = None
+    stopped = False
+    analyze = telemetry.in_step("analysis", llm_call)
     
-    # Extract classification results
-    category = extract_xml(classification_response, 'category').strip().lower()
-    reasoning = extract_xml(classification_response, 'reasoning')
-    confidence = extract_xml(classification_response, 'confidence')
+    with ThreadPoolExecutor(max_workers=1) as executor, telemetry.step("classification"):
+        stream = stream_llm_call(
+            prompt_registry.render_blocks('classification', ALERT_DETAILS=_prompt_details(alert_details))
+        )
+        try:
+            for chunk in stream:
+                for tag, content in parser.feed(chunk):
+                    if tag == 'category' and analysis is None:
+                        category = content.strip().lower()
+                        _print_time_to_route(category, start)
+                        analysis = executor.submit(
+                            analyze, _specialized_prompt(category, alert_details, include_history)
+                        )
+                if analysis is not None and STREAMING_CONFIG["stop_after_category"]:
+                    stopped = True
+                    break
+        finally:
+            # Closing the stream stops generation when we leave early
+            stream.close()
+        
+        classification = _streamed_classification(parser, stopped)
+        if analysis is None:
+            analysis = executor.submit(analyze, _specialized_prompt(classification[0], alert_details, include_history))
+        analysis_result = analysis.result()
+    
+    if not stopped:
+        _remember_classification(template_id, alert_details, classification)
+    return _finish_streamed_analysis(classification, analysis_result)
+
+def _streamed_classification(parser: StreamingTagParser, stopped: bool) -> Tuple[str, str, str]:
+    """Build (category, reasoning, confidence) from the tags received so far."""
+    category = parser.values.get('category', '').strip().lower()
+    if stopped:
+        return category, "（分类标签到达后已提前终止生成）", "未知"
+    return category, parser.values.get('reasoning', ''), parser.values.get('confidence', '')
+
+def _finish_streamed_analysis(classification: Tuple[str, str, str], analysis_result: str) -> str:
+    category, reasoning, confidence = classification
+    _print_classification(category, reasoning, confidence)
+    return _format_analysis(category, reasoning, confidence, analysis_result)
+
+def _print_time_to_route(category: str, start: float) -> None:
+    print(f"分类标签已到达: {category}（{time.monotonic() - start:.2f}s），开始专项分析")
+
+def _prompt_details(alert_details: str) -> str:
+    """Return the alert text embedded in prompts, compacted when enabled (compaction results are memoized)."""
+    return compactor.compact(alert_details).text if COMPACTION_CONFIG["enabled"] else alert_details
+
+def _print_compaction(alert_details: str) -> None:
+    if COMPACTION_CONFIG["enabled"]:
+        compacted = compactor.compact(alert_details)
+        if compacted.saved_tokens > 0:
+            print(f"\n告警内容压缩: {compacted.tokens_before} → {compacted.tokens_after} tokens")
+
+def _local_classification(alert_details: str) -> Tuple[Optional[str], Optional[Tuple[str, str, str]]]:
+    """
+    Return the alert's template ID and a (category, reasoning, confidence) decided without the LLM, if any.
+    
+    The template ID is None when the template cache is disabled, so the miner's parse tree does not grow.
+    """
+    template_id = template_cache.template_id(alert_details) if TEMPLATE_CACHE_CONFIG["enabled"] else None
     
+    if PRECLASSIFIER_CONFIG["enabled"]:
+        category, probability = preclassifier.classify(alert_details)
+        if category is not None and _audit_preclassification():
+            # Sampled for an LLM check so the labelled corpus also covers alerts decided locally
+            print(f"\n=== 本地预分类 {category}（{probability:.2f}）抽样交给 LLM 复核 ===")
+            return template_id, None
+        if category is not None:
+            print(f"\n=== 告警分类阶段（本地预分类: {probability:.2f}） ===")
+            confidence = '高' if probability >= PRECLASSIFIER_CONFIG["high_confidence"] else '中'
+            return template_id, (category, f"本地预分类器（规则 + 模型）判定，概率 {probability:.2f}", confidence)
+    
+    cached = template_cache.get(template_id) if template_id is not None else None
+    if not cached:
+        return template_id, None
+    
+    print(f"\n=== 告警分类阶段（模板缓存命中: {template_id}） ===")
+    return template_id, (cached["category"], f"与模板 {template_id} 的历史分类结果一致", cached["confidence"])
+
+def _parse_classification(classification_response: str) -> Tuple[str, str, str]:
+    """Extract (category, reasoning, confidence) from the classification response."""
+    parsed = parse_tags(classification_response)
+    return parsed.get('category').strip().lower(), parsed.get('reasoning'), parsed.get('confidence')
+
+def _classification_accepted(classification_response: str) -> bool:
+    """Accept a classification naming a known category without low/medium confidence."""
+    category, _, confidence = _parse_classification(classification_response)
+    return category in ('uni_error', 'javascript_error', 'backend_api_error') and model_cascade.confident(confidence)
+
+def _audit_preclassification() -> bool:
+    """Whether to send a locally decided alert to the LLM anyway, for an unbiased labelled corpus."""
+    return bool(PRECLASSIFIER_CONFIG["corpus_path"]) and random.random() < PRECLASSIFIER_CONFIG["audit_rate"]
+
+def _remember_classification(template_id: Optional[str], alert_details: str,
+                              classification: Tuple[str, str, str]) -> None:
+    """Cache a confident LLM classification for the alert's template and record it as a labelled sample."""
+    category, _, confidence = classification
+    if category in ('uni_error', 'javascript_error', 'backend_api_error'):
+        if template_id is not None:
+            template_cache.put(template_id, category, confidence)
+        if PRECLASSIFIER_CONFIG["corpus_path"]:
+            audited = PRECLASSIFIER_CONFIG["enabled"] and preclassifier.classify(alert_details, record=False)[0] is not None
+            record_sample(os.path.join(CRISIS_DIR, PRECLASSIFIER_CONFIG["corpus_path"]), alert_details, category,
+                          "audit" if audited else "deferred")
+
+def _print_classification(category: str, reasoning: str, confidence: str) -> None:
     print(f"分类结果: {category}")
     print(f"分类依据: {reasoning}")
     print(f"置信度: {confidence}")
+
+def _specialized_prompt(category: str, alert_details: str, include_history: bool = True,
+                        similar_incidents: Optional[str] = None, prompt_details: Optional[str] = None) -> List[Dict]:
+    """
+    Render the specialized analysis prompt for a category, with similar incidents injected.
+    
+    The static instructions form a cacheable prefix; the alert and retrieved incidents follow it.
+    similar_incidents and prompt_details, when given, are used instead of retrieving incidents
+    and compacting the alert here.
+    """
+    if similar_incidents is None:
+        similar_incidents = _similar_incidents(alert_details, include_history)
+    if prompt_details is None:
+        prompt_details = _prompt_details(alert_details)
     
-    # Step 3: Apply specialized analysis based on category
     print(f"\n=== {category.upper()} 专项分析阶段 ===")
     
     if category == 'uni_error':
         # For Uni errors, just return error code explanation
-        with open('crisis/uni-error-prompt.md', 'r', encoding='utf-8') as f:
-            prompt = f.read().replace('{{ALERT_DETAILS}}', alert_details)
-        analysis_result = llm_call(prompt)
-        
-    elif category == 'javascript_error':
-        # For JavaScript errors, analyze and prepare for code scanning
-        with open('crisis/javascript-error-prompt.md', 'r', encoding='utf-8') as f:
-            prompt = f.read().replace('{{ALERT_DETAILS}}', alert_details)
-        analysis_result = llm_call(prompt)
-        
-        # TODO: Implement code repository scanning
-        print("\n[待实现] 代码库扫描功能...")
+        template = 'uni_error'
         
-    elif category == 'backend_api_error':
-        # For backend API errors, analyze and prepare for code scanning
-        with open('crisis/backend-api-error-prompt.md', 'r', encoding='utf-8') as f:
-            prompt = f.read().replace('{{ALERT_DETAILS}}', alert_details)
-        analysis_result = llm_call(prompt)
+    elif category in ('javascript_error', 'backend_api_error'):
+        # For JavaScript and backend API errors, analyze and prepare for code scanning
+        template = category
         
         # TODO: Implement code repository scanning
         print("\n[待实现] 代码库扫描功能...")
@@ -106,12 +569,17 @@ def analyze_alert(alert_details: str) -> str:
     else:
         # Fallback to general analysis for unknown categories
         print(f"未知类别 {category}，使用通用分析...")
-        with open('crisis/analysis-prompt.md', 'r', encoding='utf-8') as f:
-            prompt = f.read().replace('{{ALERT_DETAILS}}', alert_details)
-        analysis_result = llm_call(prompt)
+        template = 'analysis'
     
-    # Combine classification and analysis results
-    final_result = f"""
+    return prompt_registry.render_blocks(template, ALERT_DETAILS=prompt_details, SIMILAR_INCIDENTS=similar_incidents)
+
+def _similar_incidents(alert_details: str, include_history: bool = True) -> str:
+    """Retrieve similar incidents for the specialized prompt (skipped under load)."""
+    return retriever.context_for(alert_details) if include_history else "无"
+
+def _format_analysis(category: str, reasoning: str, confidence: str, analysis_result: str) -> str:
+    """Combine classification and analysis results."""
+    return f"""
 === 告警分类结果 ===
 类别: {category}
 置信度: {confidence}
@@ -120,5 +588,227 @@ def analyze_alert(alert_details: str) -> str:
 === 专项分析结果 ===
 {analysis_result}
 """
+
+async def achain(input: str, prompts: List[str]) -> str:
+    """Async variant of chain: run the steps sequentially without blocking the event loop."""
+    result = input
+    for i, prompt in enumerate(prompts, 1):
+        print(f"\nStep {i}:")
+        with telemetry.step(f"chain_{i}"):
+            result = await async_llm_call(f"{prompt}\nInput: {result}")
+        print(result)
+    return result
+
+def achain_many(inputs, prompts: List[str], concurrency=3, queue_size: int = 8,
+                ordered: bool = True) -> AsyncIterator[Tuple[int, Any]]:
+    """Async variant of chain_many; inputs may be an iterable or an async iterable."""
+    def stage(i: int, prompt: str):
+        call = telemetry.in_step(f"chain_{i}", async_llm_call)
+        return lambda result: call(f"{prompt}\nInput: {result}")
+
+    stages = [stage(i, prompt) for i, prompt in enumerate(prompts, 1)]
+    return arun_pipeline(inputs, stages, concurrency, queue_size, ordered)
+
+async def aparallel(prompt: str, inputs: List[str], max_concurrency: int = 64) -> List[str]:
+    """Async variant of parallel: process inputs concurrently with at most max_concurrency calls in flight."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def run(x: str) -> str:
+        async with semaphore:
+            with telemetry.step("parallel"):
+                return await async_llm_call(f"{prompt}\nInput: {x}")
     
-    return final_result
\ No newline at end of file
+    return await asyncio.gather(*(run(x) for x in inputs))
+
+def aiter_parallel(prompt: str, inputs: List[str], max_concurrency: int = 64, item_timeout: Optional[float] = None,
+                   timeout: Optional[float] = None, hedge_after=None) -> AsyncIterator[Tuple[int, Any]]:
+    """Async variant of iter_parallel; timed-out and losing hedged calls are cancelled."""
+    call = telemetry.in_step("parallel", async_llm_call)
+    return aiter_completed(lambda x: call(f"{prompt}\nInput: {x}"), inputs, max_concurrency, item_timeout,
+                           timeout, hedge_after, lambda x: call(f"{prompt}\nInput: {x}", coalesce=False, hedge=False))
+
+async def aroute(input: str, routes: Dict[str, str], speculative: Optional[bool] = None) -> str:
+    """Async variant of route."""
+    print(f"\nAvailable routes: {list(routes.keys())}")
+    selector_prompt = _route_selector_prompt(input, routes)
+    predicted = _route_prior(input, routes) if _speculation_enabled(speculative) else None
+    
+    select_call = telemetry.in_step("route_selection", async_llm_call)
+    accept = _route_accepted(routes)
+    
+    def select(prompt: str):
+        return model_cascade.arun("route_selection", lambda model: select_call(prompt, model=model), accept)
+    
+    handle = telemetry.in_step("route_handler", async_llm_call)
+    if predicted is None:
+        route_response = await select(selector_prompt)
+        route_key = _parse_route_selection(route_response)
+        return await handle(f"{routes[route_key]}\nInput: {input}")
+    
+    print(f"Speculating on route: {predicted}")
+    _, result, hit = await speculate(
+        lambda: select(selector_prompt),
+        _parse_route_selection,
+        lambda key: handle(f"{routes[key]}\nInput: {input}"),
+        predicted,
+        speculation_budget,
+        estimate_tokens(f"{routes[predicted]}\nInput: {input}"),
+    )
+    _print_speculation(hit)
+    return result
+
+async def aanalyze_alert(alert_details: str, source: str = "default") -> str:
+    """Async variant of analyze_alert, sharing its admission control, caches and prompts."""
+    decision = admission.admit(source, alert_details)
+    if not decision.admitted:
+        return _format_rejection(decision)
+    
+    with decision:
+        return await _aanalyze_admitted_alert(alert_details, not decision.skip_history)
+
+async def aanalyze_alert_dag(alert_details: str, source: str = "default") -> str:
+    """Async variant of analyze_alert_dag; steps run in the default thread pool."""
+    decision = admission.admit(source, alert_details)
+    if not decision.admitted:
+        return _format_rejection(decision)
+    
+    with decision:
+        result = await alert_dag.arun({"alert_details": alert_details, "include_history": not decision.skip_history})
+    return _dag_report(result)
+
+async def _aanalyze_admitted_alert(alert_details: str, include_history: bool = True) -> str:
+    """Async classification and analysis, speculating on the likely category or streaming the classification when enabled."""
+    classify_call = telemetry.in_step("classification", async_llm_call)
+    analyze = telemetry.in_step("analysis", async_llm_call)
+    
+    def classify(prompt: List[Dict]):
+        return model_cascade.arun(
+            "classification", lambda model: classify_call(prompt, model=model), _classification_accepted
+        )
+    
+    _print_compaction(alert_details)
+    template_id, classification = _local_classification(alert_details)
+    
+    if classification is not None:
+        category, reasoning, confidence = classification
+        _print_classification(category, reasoning, confidence)
+        analysis_result = await analyze(_specialized_prompt(category, alert_details, include_history))
+        return _format_analysis(category, reasoning, confidence, analysis_result)
+    
+    predicted = _classification_prior(alert_details) if SPECULATION_CONFIG["enabled"] else None
+    if predicted is None and STREAMING_CONFIG["enabled"]:
+        return await _aanalyze_streaming(template_id, alert_details, include_history)
+    
+    print("\n=== 告警分类阶段 ===")
+    classification_prompt = prompt_registry.render_blocks('classification', ALERT_DETAILS=_prompt_details(alert_details))
+    
+    if predicted is None:
+        classification = _parse_classification(await classify(classification_prompt))
+        # The template cache and the labelled corpus write to disk, so keep them off the event loop
+        await asyncio.to_thread(_remember_classification, template_id, alert_details, classification)
+        category, reasoning, confidence = classification
+        _print_classification(category, reasoning, confidence)
+        analysis_result = await analyze(_specialized_prompt(category, alert_details, include_history))
+        return _format_analysis(category, reasoning, confidence, analysis_result)
+    
+    print(f"推测类别: {predicted}")
+    classification, analysis_result, hit = await speculate(
+        lambda: classify(classification_prompt),
+        lambda response: _parse_classification(response)[0],
+        lambda category: analyze(_specialized_prompt(category, alert_details, include_history)),
+        predicted,
+        speculation_budget,
+        estimate_tokens(prompt_registry.render(predicted, ALERT_DETAILS=_prompt_details(alert_details))),
+    )
+    _print_speculation(hit)
+    classification = _parse_classification(classification)
+    await asyncio.to_thread(_remember_classification, template_id, alert_details, classification)
+    category, reasoning, confidence = classification
+    _print_classification(category, reasoning, confidence)
+    return _format_analysis(category, reasoning, confidence, analysis_result)
+
+async def _aanalyze_streaming(template_id: Optional[str], alert_details: str, include_history: bool = True) -> str:
+    """Async variant of _analyze_streaming."""
+    print("\n=== 告警分类阶段（流式） ===")
+    parser = StreamingTagParser()
+    start = time.monotonic()
+    analysis = None
+    stopped = False
+    analyze = telemetry.in_step("analysis", async_llm_call)
+    
+    stream = async_stream_llm_call(
+        prompt_registry.render_blocks('classification', ALERT_DETAILS=_prompt_details(alert_details))
+    )
+    try:
+        with telemetry.step("classification"):
+            async for chunk in stream:
+                for tag, content in parser.feed(chunk):
+                    if tag == 'category' and analysis is None:
+                        category = content.strip().lower()
+                        _print_time_to_route(category, start)
+                        analysis = asyncio.ensure_future(
+                            analyze(_specialized_prompt(category, alert_details, include_history))
+                        )
+                if analysis is not None and STREAMING_CONFIG["stop_after_category"]:
+                    stopped = True
+                    break
+    except BaseException:
+        if analysis is not None:
+            analysis.cancel()
+        raise
+    finally:
+        await stream.aclose()
+    
+    classification = _streamed_classification(parser, stopped)
+    if analysis is None:
+        analysis_result = await analyze(_specialized_prompt(classification[0], alert_details, include_history))
+    else:
+        analysis_result = await analysis
+    if not stopped:
+        await asyncio.to_thread(_remember_classification, template_id, alert_details, classification)
+    return _finish_streamed_analysis(classification, analysis_result)
+
+def _classification_prior(alert_details: str) -> Optional[str]:
+    """Most likely category from the local pre-classifier, if its probability reaches min_prior."""
+    probs = preclassifier.predict_proba(alert_details)
+    category = max(probs, key=probs.get)
+    return category if probs[category] >= SPECULATION_CONFIG["min_prior"] else None
+
+def _print_speculation(hit: Optional[bool]) -> None:
+    if hit is None:
+        print("推测预算不足，按顺序执行")
+    else:
+        print("推测命中，复用已启动的专项调用" if hit else "推测未命中，已取消推测调用")
+
+def _compacted_details(alert_details: str) -> str:
+    _print_compaction(alert_details)
+    return _prompt_details(alert_details)
+
+def _dag_classification(alert_details: str, local_classification: Tuple[str, Optional[Tuple[str, str, str]]],
+                        prompt_details: str) -> Tuple[str, str, str]:
+    """Use the local classification when there is one, otherwise classify with the LLM."""
+    template_id, classification = local_classification
+    return classification if classification is not None else _classify(template_id, alert_details, prompt_details)
+
+def _dag_analysis(alert_details: str, classification: Tuple[str, str, str], history: str, prompt_details: str) -> str:
+    category, reasoning, confidence = classification
+    _print_classification(category, reasoning, confidence)
+    with telemetry.step("analysis"):
+        return llm_call(_specialized_prompt(category, alert_details, similar_incidents=history,
+                                            prompt_details=prompt_details))
+
+def _dag_report(result: DAGResult) -> str:
+    print("\n=== 步骤耗时 ===")
+    print(result.format_trace())
+    category, reasoning, confidence = result["classification"]
+    return _format_analysis(category, reasoning, confidence, result["analysis"])
+
+# 告警分析 DAG 的步骤：local_classification、prompt_details、history 互不依赖，并发执行；
+# 依赖外部状态（模板缓存、预分类器、随新事件增长的历史索引）或调用 LLM 的步骤不记忆结果，只有告警压缩可复用
+alert_dag.add("local_classification", _local_classification, ["alert_details"], memoize=False)
+alert_dag.add("prompt_details", _compacted_details, ["alert_details"])
+alert_dag.add("history", _similar_incidents, ["alert_details", "include_history"], memoize=False)
+alert_dag.add("classification", _dag_classification, ["alert_details", "local_classification", "prompt_details"],
+              memoize=False)
+alert_dag.add("analysis", _dag_analysis, ["alert_details", "classification", "history", "prompt_details"],
+              memoize=False)
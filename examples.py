@@ -95,6 +95,23 @@ def example_structured_response():
     print(f"学习顾问: {answer}\n")
 
 
+def example_batch_qa():
+    """示例5: 批量问答（离线任务，通过 Message Batches API 提交）"""
+    print("=== 示例5: 批量问答 ===")
+    agent = SimpleAgent()
+    
+    questions = [
+        "什么是人工智能？",
+        "Python中的装饰器是什么？",
+        "如何学习机器学习？"
+    ]
+    
+    answers = agent.ask_batch(questions)
+    for question, answer in zip(questions, answers):
+        print(f"问题: {question}")
+        print(f"回答: {answer}\n")
+
+
 def main():
     """运行所有示例"""
     try:
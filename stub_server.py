@@ -0,0 +1,664 @@
+#!/usr/bin/env python3
+"""
+本地 Anthropic 兼容 stub 服务器
+
+在不访问真实 API 的情况下测试和压测 agent.py 和 crisis 工作流：
+- POST /v1/messages：返回固定、按请求生成或按脚本依次给出的回复，支持 stream=True（SSE），
+  回复可以包含 mcp_tool_use / mcp_tool_result 内容块（MCPWeatherAgent 使用的 MCP Connector 格式）
+- 可配置首 token 延迟（TTFT）和输出速度（tokens/sec）的分布，固定随机种子保证可复现
+- 可按概率或按脚本注入 429（rate_limit_error）、529（overloaded_error）和断开连接故障
+- /v1/messages/batches：模拟 Message Batches API（创建、轮询、读取结果、取消），
+  可设置为不支持批量（返回 404），用于测试回退逻辑
+- GET /health：模拟 MCP 服务器的健康检查
+- 记录每个请求的路径、请求头和请求体，供测试检查请求结构
+- 模拟提示词缓存：最后一个 cache_control 断点之前的内容首次出现时计入
+  cache_creation_input_tokens，再次出现时计入 cache_read_input_tokens
+
+用法：
+    python stub_server.py [--port 8765] [--ttft lognormal:0.4,0.5] [--tokens-per-sec normal:80,15]
+                          [--fault 429=0.05] [--fault disconnect=0.01] [--script responses.json] [--seed 0]
+
+然后设置 ANTHROPIC_BASE_URL=http://127.0.0.1:8765 和 ANTHROPIC_PROXY=（空）。
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+
+class Fault:
+    """注入的故障：429 / 529 返回对应的错误响应，disconnect 直接断开连接"""
+
+    KINDS = ("429", "529", "disconnect")
+
+    def __init__(self, kind: str, retry_after: Optional[float] = None, after_events: int = 0):
+        """
+        Args:
+            kind: "429"、"529" 或 "disconnect"
+            retry_after: 429/529 响应的 retry-after（秒），None 表示不带该响应头
+            after_events: 流式请求在发送多少个 SSE 事件后断开，0 表示不返回任何响应
+        """
+        if kind not in self.KINDS:
+            raise ValueError(f"未知的故障类型: {kind}，可选 {self.KINDS}")
+        self.kind = kind
+        self.retry_after = retry_after
+        self.after_events = after_events
+
+    def __repr__(self) -> str:
+        return f"Fault({self.kind!r})"
+
+
+# 回复可以是文本、内容块列表、消息字段（content / stop_reason）或故障
+Response = Union[str, List[Dict[str, Any]], Dict[str, Any], Fault]
+Reply = Union[Response, Callable[[Dict[str, Any]], Response]]
+
+
+def text_block(text: str) -> Dict[str, Any]:
+    return {"type": "text", "text": text}
+
+
+def mcp_tool_use(name: str, input: Dict[str, Any], server_name: str = "weather-server",
+                 id: Optional[str] = None) -> Dict[str, Any]:
+    """MCP Connector 的工具调用块"""
+    return {"type": "mcp_tool_use", "id": id or f"mcptoolu_stub_{uuid.uuid4().hex[:12]}",
+            "name": name, "server_name": server_name, "input": input}
+
+
+def mcp_tool_result(tool_use_id: str, text: str, is_error: bool = False) -> Dict[str, Any]:
+    """MCP Connector 的工具结果块"""
+    return {"type": "mcp_tool_result", "tool_use_id": tool_use_id, "is_error": is_error,
+            "content": [text_block(text)]}
+
+
+def mcp_tool_reply(name: str, input: Dict[str, Any], result: str, answer: str,
+                   server_name: str = "weather-server") -> List[Dict[str, Any]]:
+    """一次完整的 MCP 工具调用回复：工具调用、工具结果、最终回答"""
+    use = mcp_tool_use(name, input, server_name)
+    return [use, mcp_tool_result(use["id"], result), text_block(answer)]
+
+
+class Distribution:
+    """
+    延迟 / 速度分布，用 StubServer 的随机数生成器采样
+
+    spec 格式：
+        "0.2"                  常数
+        "uniform:0.1,0.5"      均匀分布 [low, high]
+        "normal:0.3,0.05"      正态分布（均值, 标准差），截断到 >= 0
+        "lognormal:0.3,0.5"    对数正态分布（中位数, sigma），适合长尾延迟
+    """
+
+    KINDS = ("constant", "uniform", "normal", "lognormal")
+
+    def __init__(self, kind: str = "constant", a: float = 0.0, b: float = 0.0):
+        if kind not in self.KINDS:
+            raise ValueError(f"未知的分布类型: {kind}，可选 {self.KINDS}")
+        self.kind = kind
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def parse(cls, spec: Union[str, float, "Distribution", None]) -> Optional["Distribution"]:
+        if spec is None or isinstance(spec, Distribution):
+            return spec
+        if isinstance(spec, (int, float)):
+            return cls("constant", float(spec))
+        kind, _, params = spec.partition(":")
+        if not params:
+            return cls("constant", float(kind))
+        return cls(kind, *(float(v) for v in params.split(",")))
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "constant":
+            value = self.a
+        elif self.kind == "uniform":
+            value = rng.uniform(self.a, self.b)
+        elif self.kind == "normal":
+            value = rng.gauss(self.a, self.b)
+        else:
+            value = self.a * math.exp(rng.gauss(0.0, self.b))
+        return max(0.0, value)
+
+    def __repr__(self) -> str:
+        return f"Distribution({self.kind!r}, {self.a}, {self.b})"
+
+
+def estimate_tokens(payload: Any) -> int:
+    """粗略估算 token 数（约 4 个字符一个 token）"""
+    text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+    return max(1, len(text) // 4)
+
+
+def split_cached_prefix(body: Dict[str, Any]) -> Tuple[List[Any], List[Any]]:
+    """
+    按 tools → system → messages 的顺序展开请求内容，在最后一个 cache_control 断点处切分
+
+    Returns:
+        (可缓存的前缀, 其余内容)；没有断点时前缀为空
+    """
+    parts: List[Any] = list(body.get("tools") or [])
+    system = body.get("system")
+    if isinstance(system, list):
+        parts.extend(system)
+    elif system:
+        parts.append(system)
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            parts.extend({"role": message.get("role"), **block} for block in content)
+        else:
+            parts.append({"role": message.get("role"), "content": content})
+
+    breakpoint_index = -1
+    for i, part in enumerate(parts):
+        if isinstance(part, dict) and part.get("cache_control"):
+            breakpoint_index = i
+    return parts[:breakpoint_index + 1], parts[breakpoint_index + 1:]
+
+
+def parse_response(item: Any) -> Response:
+    """把脚本文件中的一项转换为回复；{"fault": "429", ...} 表示故障"""
+    if isinstance(item, dict) and "fault" in item:
+        return Fault(str(item["fault"]), item.get("retry_after"), item.get("after_events", 0))
+    return item
+
+
+def content_blocks(response: Response) -> List[Dict[str, Any]]:
+    """把回复统一为内容块列表"""
+    if isinstance(response, dict):
+        response = response["content"]
+    if isinstance(response, str):
+        return [text_block(response)]
+    return list(response)
+
+
+class StubServer:
+    """在后台线程运行的 stub 服务器"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, reply: Reply = "这是 stub 服务器的回复。",
+                 batches_supported: bool = True, batch_polls: int = 1,
+                 ttft: Union[str, float, Distribution, None] = None,
+                 tokens_per_sec: Union[str, float, Distribution, None] = None,
+                 faults: Optional[Dict[str, float]] = None, retry_after: Optional[float] = 1.0,
+                 seed: int = 0):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口，0 表示随机分配
+            reply: 回复（文本、内容块列表、消息字段或故障），或根据请求体生成回复的函数
+            batches_supported: 是否支持 Message Batches API，False 时批量接口返回 404
+            batch_polls: 批次在第几次查询后变为 ended（模拟处理耗时）
+            ttft: 首 token 延迟分布（秒，格式见 Distribution），None 表示立即返回
+            tokens_per_sec: 输出速度分布，None 表示不限速
+            faults: 每个请求按概率注入的故障，如 {"429": 0.05, "529": 0.01, "disconnect": 0.01}
+            retry_after: 按概率注入的 429/529 携带的 retry-after（秒）
+            seed: 随机种子，固定后延迟和故障序列可复现（并发请求按到达顺序采样）
+        """
+        self.reply = reply
+        self.batches_supported = batches_supported
+        self.batch_polls = batch_polls
+        self.ttft = Distribution.parse(ttft)
+        self.tokens_per_sec = Distribution.parse(tokens_per_sec)
+        self.faults = dict(faults or {})
+        self.retry_after = retry_after
+        self.requests: List[Dict[str, Any]] = []
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self._script: deque = deque()
+        self._rng = random.Random(seed)
+        self._cached_prefixes: set = set()
+        self._counters = dict.fromkeys(("messages", "streams", "faults_429", "faults_529", "faults_disconnect"), 0)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """在当前线程运行（命令行模式）"""
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def enqueue(self, *responses: Response) -> "StubServer":
+        """按顺序为接下来的 /v1/messages 请求指定回复，优先于 reply 和按概率注入的故障"""
+        with self._lock:
+            self._script.extend(responses)
+        return self
+
+    def load_script(self, path: str) -> "StubServer":
+        """从 JSON 文件加载回复脚本：列表，每项为文本、内容块列表、消息字段或 {"fault": ...}"""
+        with open(path, encoding="utf-8") as f:
+            return self.enqueue(*(parse_response(item) for item in json.load(f)))
+
+    def configure(self, reply: Optional[Reply] = None, ttft: Union[str, float, Distribution, None] = None,
+                  tokens_per_sec: Union[str, float, Distribution, None] = None,
+                  faults: Optional[Dict[str, float]] = None, seed: int = 0) -> "StubServer":
+        """
+        重新设置回复、延迟分布和故障概率，并清空回复脚本、重置随机种子
+
+        共享的 stub 服务器在每个测试开始时调用，避免受前一个测试的设置影响。
+        """
+        with self._lock:
+            if reply is not None:
+                self.reply = reply
+            self.ttft = Distribution.parse(ttft)
+            self.tokens_per_sec = Distribution.parse(tokens_per_sec)
+            self.faults = dict(faults or {})
+            self._script.clear()
+            self._rng.seed(seed)
+        return self
+
+    def stats(self) -> Dict[str, int]:
+        """处理的消息请求数、流式请求数和注入的各类故障数"""
+        with self._lock:
+            return dict(self._counters)
+
+    def message_requests(self) -> List[Dict[str, Any]]:
+        """已收到的 /v1/messages 请求体（不含批量接口）"""
+        with self._lock:
+            return [r["body"] for r in self.requests if r["path"].split("?")[0] == "/v1/messages"]
+
+    def usage_for(self, body: Dict[str, Any], output: Any) -> Dict[str, int]:
+        """计算请求的 usage，模拟提示词缓存的写入和命中"""
+        prefix, rest = split_cached_prefix(body)
+        usage = {
+            "input_tokens": estimate_tokens(rest) if rest else 0,
+            "output_tokens": estimate_tokens(output),
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0,
+        }
+        if prefix:
+            key = hashlib.sha256(json.dumps([body.get("model"), prefix], ensure_ascii=False,
+                                            sort_keys=True).encode("utf-8")).hexdigest()
+            with self._lock:
+                hit = key in self._cached_prefixes
+                self._cached_prefixes.add(key)
+            usage["cache_read_input_tokens" if hit else "cache_creation_input_tokens"] = estimate_tokens(prefix)
+        return usage
+
+    def next_response(self, body: Dict[str, Any]) -> Response:
+        """下一个 /v1/messages 请求的回复：先取脚本，再按概率注入故障，最后使用 reply"""
+        with self._lock:
+            if self._script:
+                return self._script.popleft()
+            draw = self._rng.random() if self.faults else 1.0
+        cumulative = 0.0
+        for kind, probability in self.faults.items():
+            cumulative += probability
+            if draw < cumulative:
+                # 流式请求在首个内容块开始后断开，模拟生成中途断线
+                return Fault(kind, self.retry_after, after_events=2)
+        return self.reply(body) if callable(self.reply) else self.reply
+
+    def build_message(self, body: Dict[str, Any], response: Optional[Response] = None) -> Dict[str, Any]:
+        """按请求体生成一条完整的 assistant 消息"""
+        if response is None:
+            response = self.reply(body) if callable(self.reply) else self.reply
+        content = content_blocks(response)
+        texts = [block["text"] for block in content if block["type"] == "text"]
+        output = "".join(texts) if len(texts) == len(content) else content
+        return {
+            "id": f"msg_stub_{uuid.uuid4().hex[:12]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "stub"),
+            "content": content,
+            "stop_reason": response.get("stop_reason", "end_turn") if isinstance(response, dict) else "end_turn",
+            "stop_sequence": None,
+            "usage": self.usage_for(body, output),
+        }
+
+    def sample_timing(self) -> Tuple[float, Optional[float]]:
+        """采样一次请求的 (TTFT 秒, tokens/sec)"""
+        with self._lock:
+            ttft = self.ttft.sample(self._rng) if self.ttft else 0.0
+            tokens_per_sec = self.tokens_per_sec.sample(self._rng) if self.tokens_per_sec else None
+        return ttft, tokens_per_sec or None
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def create_batch(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """创建批次；请求立即处理，查询 batch_polls 次后状态变为 ended"""
+        batch_id = f"msgbatch_stub_{uuid.uuid4().hex[:12]}"
+        results = []
+        for item in body.get("requests", []):
+            try:
+                result = {"type": "succeeded", "message": self.build_message(item["params"])}
+            except Exception as e:
+                result = {"type": "errored",
+                          "error": {"type": "error", "error": {"type": "api_error", "message": str(e)}}}
+            results.append({"custom_id": item["custom_id"], "result": result})
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            self.batches[batch_id] = {
+                "results": results,
+                "polls": 0,
+                "canceled": False,
+                "created_at": now.isoformat(),
+                "expires_at": (now + timedelta(days=1)).isoformat(),
+            }
+        return self.batch_object(batch_id, count_poll=False)
+
+    def batch_object(self, batch_id: str, count_poll: bool = True) -> Dict[str, Any]:
+        """批次状态（MessageBatch 对象）"""
+        with self._lock:
+            batch = self.batches[batch_id]
+            if count_poll:
+                batch["polls"] += 1
+            ended = batch["canceled"] or batch["polls"] >= self.batch_polls
+        total = len(batch["results"])
+        counts = {"processing": 0 if ended else total, "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0}
+        if ended:
+            for entry in batch["results"]:
+                counts[entry["result"]["type"]] += 1
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else ("canceling" if batch["canceled"] else "in_progress"),
+            "request_counts": counts,
+            "created_at": batch["created_at"],
+            "expires_at": batch["expires_at"],
+            "ended_at": datetime.now(timezone.utc).isoformat() if ended else None,
+            "cancel_initiated_at": None,
+            "archived_at": None,
+            "results_url": f"{self.url}/v1/messages/batches/{batch_id}/results" if ended else None,
+        }
+
+    def cancel_batch(self, batch_id: str) -> Dict[str, Any]:
+        with self._lock:
+            batch = self.batches[batch_id]
+            batch["canceled"] = True
+            for entry in batch["results"]:
+                entry["result"] = {"type": "canceled"}
+        return self.batch_object(batch_id, count_poll=False)
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _not_found(self):
+                self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+
+            def _batch_id(self, path: str) -> Optional[str]:
+                parts = path[len("/v1/messages/batches/"):].split("/")
+                return parts[0] if parts[0] in stub.batches else None
+
+            def _disconnect(self):
+                """不再发送任何数据，以 RST 断开连接（正常关闭会被客户端当作流已结束）"""
+                stub._count("faults_disconnect")
+                self.close_connection = True
+                try:
+                    self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                    self.connection.close()
+                except OSError:
+                    pass
+
+            def _send_error_fault(self, fault: Fault):
+                stub._count(f"faults_{fault.kind}")
+                error_type = "rate_limit_error" if fault.kind == "429" else "overloaded_error"
+                headers = {}
+                if fault.retry_after is not None:
+                    headers["retry-after"] = str(math.ceil(fault.retry_after))
+                    headers["retry-after-ms"] = str(int(fault.retry_after * 1000))
+                self._send_json(int(fault.kind), {"type": "error",
+                                                  "error": {"type": error_type, "message": f"stub {error_type}"}},
+                                headers)
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                with stub._lock:
+                    stub.requests.append({"path": self.path, "headers": dict(self.headers), "body": None})
+                if path.startswith("/health"):
+                    self._send_json(200, {"status": "ok", "server": "stub", "tools": ["get-forecast", "get-alerts"]})
+                elif path.startswith("/v1/messages/batches/") and stub.batches_supported and self._batch_id(path):
+                    batch_id = self._batch_id(path)
+                    if path.endswith("/results"):
+                        lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n"
+                                        for entry in stub.batches[batch_id]["results"])
+                        data = lines.encode("utf-8")
+                        self.send_response(200)
+                        self.send_header("Content-Type", "application/binary")
+                        self.send_header("Content-Length", str(len(data)))
+                        self.end_headers()
+                        self.wfile.write(data)
+                    else:
+                        self._send_json(200, stub.batch_object(batch_id))
+                else:
+                    self._not_found()
+
+            def do_POST(self):
+                path = self.path.split("?")[0]
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with stub._lock:
+                    stub.requests.append({"path": self.path, "headers": dict(self.headers), "body": body})
+
+                if path.startswith("/v1/messages/batches"):
+                    if not stub.batches_supported:
+                        self._not_found()
+                    elif path == "/v1/messages/batches":
+                        self._send_json(200, stub.create_batch(body))
+                    elif path.endswith("/cancel") and self._batch_id(path):
+                        self._send_json(200, stub.cancel_batch(self._batch_id(path)))
+                    else:
+                        self._not_found()
+                    return
+
+                if path != "/v1/messages":
+                    self._not_found()
+                    return
+
+                stub._count("messages")
+                response = stub.next_response(body)
+                fault = response if isinstance(response, Fault) else None
+                if fault is not None and fault.kind != "disconnect":
+                    self._send_error_fault(fault)
+                    return
+                if fault is not None and not (body.get("stream") and fault.after_events):
+                    self._disconnect()
+                    return
+
+                # 中途断开的流式请求照常生成回复，发送 after_events 个事件后断开
+                message = stub.build_message(body, None if fault else response)
+                ttft, tokens_per_sec = stub.sample_timing()
+                if body.get("stream"):
+                    stub._count("streams")
+                    self._send_stream(message, ttft, tokens_per_sec, fault)
+                else:
+                    output_tokens = message["usage"]["output_tokens"]
+                    time.sleep(ttft + (output_tokens / tokens_per_sec if tokens_per_sec else 0.0))
+                    self._send_json(200, message)
+
+            def _send_stream(self, message: Dict[str, Any], ttft: float, tokens_per_sec: Optional[float],
+                             fault: Optional[Fault] = None):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                usage = message["usage"]
+                start = dict(message, content=[], stop_reason=None, usage=dict(usage, output_tokens=1))
+                # (事件名, 数据, 发送前等待的秒数)：首个内容事件前等待 TTFT，之后按输出速度等待
+                events = [("message_start", {"type": "message_start", "message": start}, 0.0)]
+                wait = ttft
+                for index, block in enumerate(message["content"]):
+                    for event, data, tokens in _block_events(index, block):
+                        events.append((event, data, wait + (tokens / tokens_per_sec if tokens_per_sec else 0.0)))
+                        wait = 0.0
+                events += [
+                    ("message_delta", {"type": "message_delta",
+                                       "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+                                       "usage": {"output_tokens": usage["output_tokens"]}}, wait),
+                    ("message_stop", {"type": "message_stop"}, 0.0),
+                ]
+                try:
+                    for sent, (event, data, wait) in enumerate(events):
+                        if fault is not None and sent >= fault.after_events:
+                            self._disconnect()
+                            return
+                        if wait:
+                            time.sleep(wait)
+                        self.wfile.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前关闭流（如提前终止生成）
+                    pass
+
+        return Handler
+
+
+def _block_events(index: int, block: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any], int]]:
+    """单个内容块的 SSE 事件：(事件名, 数据, 该事件对应的输出 token 数)"""
+    if block["type"] == "text":
+        text = block["text"]
+        yield ("content_block_start", {"type": "content_block_start", "index": index,
+                                       "content_block": {"type": "text", "text": ""}}, 0)
+        for i in range(0, len(text), 8):
+            yield ("content_block_delta", {"type": "content_block_delta", "index": index,
+                                           "delta": {"type": "text_delta", "text": text[i:i + 8]}},
+                   estimate_tokens(text[i:i + 8]))
+    elif block["type"] in ("tool_use", "mcp_tool_use"):
+        partial_json = json.dumps(block.get("input", {}), ensure_ascii=False)
+        yield ("content_block_start", {"type": "content_block_start", "index": index,
+                                       "content_block": dict(block, input={})}, 0)
+        yield ("content_block_delta", {"type": "content_block_delta", "index": index,
+                                       "delta": {"type": "input_json_delta", "partial_json": partial_json}},
+               estimate_tokens(partial_json))
+    else:
+        # mcp_tool_result 等由服务端生成的块整块下发
+        yield ("content_block_start", {"type": "content_block_start", "index": index, "content_block": block}, 0)
+    yield ("content_block_stop", {"type": "content_block_stop", "index": index}, 0)
+
+
+_shared_stub: Optional[StubServer] = None
+
+
+def shared_stub() -> StubServer:
+    """
+    进程内共享的 stub 服务器
+
+    首次调用时启动，并把 ANTHROPIC_BASE_URL / ANTHROPIC_PROXY / ANTHROPIC_API_KEY 指向它。
+    crisis 工作流的客户端在导入时读取这些环境变量，因此多个测试脚本在同一进程中运行时
+    需要共用一个 stub 服务器（各测试通过 configure() 设置自己的回复、延迟和故障）。
+    """
+    global _shared_stub
+    if _shared_stub is None:
+        _shared_stub = StubServer().start()
+        os.environ["ANTHROPIC_BASE_URL"] = _shared_stub.url
+        os.environ["ANTHROPIC_PROXY"] = ""
+        os.environ.setdefault("ANTHROPIC_API_KEY", "stub-key")
+    return _shared_stub
+
+
+def crisis_stub() -> StubServer:
+    """
+    启动共享的 stub 服务器，并把仓库根目录和 crisis/ 加入 sys.path
+
+    crisis 的客户端在导入时读取 API 地址，测试脚本需要在导入 crisis 模块（和 agent）之前调用。
+    """
+    stub = shared_stub()
+    root = os.path.dirname(os.path.abspath(__file__))
+    for path in (root, os.path.join(root, "crisis")):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    return stub
+
+
+# crisis 工作流分类请求的回复（置信度为 中，经过完整的分类和专项分析流程）
+CLASSIFICATION_REPLY = """<classification>
+<category>backend_api_error</category>
+<reasoning>接口响应变慢</reasoning>
+<confidence>中</confidence>
+</classification>"""
+
+
+def classification_reply(body: Dict[str, Any]) -> str:
+    """分类请求返回 CLASSIFICATION_REPLY，其余请求返回普通文本"""
+    text = str(body.get("messages"))
+    return CLASSIFICATION_REPLY if "智能告警分类代理" in text else "stub 分析结果"
+
+
+def _parse_fault(spec: str) -> Tuple[str, float]:
+    kind, _, probability = spec.partition("=")
+    if kind not in Fault.KINDS or not probability:
+        raise argparse.ArgumentTypeError(f"故障格式为 KIND=概率，KIND 可选 {Fault.KINDS}")
+    return kind, float(probability)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 Anthropic 兼容 stub 服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--reply", default="这是 stub 服务器的回复。")
+    parser.add_argument("--script", help="回复脚本（JSON 列表），按顺序用于接下来的请求")
+    parser.add_argument("--ttft", help="首 token 延迟分布（秒），如 0.3、uniform:0.1,0.5、lognormal:0.4,0.5")
+    parser.add_argument("--tokens-per-sec", help="输出速度分布，如 80、normal:80,15")
+    parser.add_argument("--fault", type=_parse_fault, action="append", default=[],
+                        help="按概率注入故障，如 429=0.05、529=0.01、disconnect=0.01（可重复）")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="注入的 429/529 携带的 retry-after（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stub = StubServer(args.host, args.port, args.reply, ttft=args.ttft, tokens_per_sec=args.tokens_per_sec,
+                      faults=dict(args.fault), retry_after=args.retry_after, seed=args.seed)
+    if args.script:
+        stub.load_script(args.script)
+    print(f"🧪 stub 服务器已启动: {stub.url}")
+    print(f"   export ANTHROPIC_BASE_URL={stub.url} ANTHROPIC_PROXY=")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
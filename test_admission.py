@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+准入控制与降载测试脚本
+
+检查 crisis/admission.py 和 analyze_alert 的准入路径，不访问真实 API：
+- 按告警级别字段和关键词判断优先级
+- 负载升高时依次跳过历史匹配、采样低优先级告警、拒绝非关键告警，关键告警使用保留容量
+- 按来源的令牌桶限流，拒绝时给出重试建议
+- 告警风暴中 analyze_alert 只让上限内的告警进入 LLM 调用
+"""
+
+import threading
+import time
+from unittest import mock
+
+from stub_server import classification_reply, crisis_stub
+
+stub = crisis_stub()
+
+import workflow
+from admission import (
+    LEVEL_NORMAL, LEVEL_SAMPLE_LOW, LEVEL_SKIP_HISTORY, AdmissionController, TokenBucket,
+    detect_priority,
+)
+
+
+def test_detect_priority():
+    """测试优先级判断"""
+    print("=== 测试优先级判断 ===")
+    assert detect_priority("告警级别: CRITICAL\n数据库主从切换") == "critical"
+    assert detect_priority("级别：严重") == "critical"
+    assert detect_priority("severity: warning") == "low"
+    assert detect_priority("level: P1") == "high"
+    assert detect_priority("订单服务出现服务中断") == "critical"
+    assert detect_priority("订单服务响应变慢") == "normal"
+    print("✅ 优先级判断\n")
+
+
+def test_shedding_levels():
+    """测试负载升高时的分级降级和关键告警保留容量"""
+    print("=== 测试分级降级 ===")
+    controller = AdmissionController({"max_queue": 4, "critical_reserve": 1, "low_severity_sample_rate": 0.0,
+                                      "source_rate": 0.0, "source_burst": 100})
+    held = []
+    levels = []
+    for i in range(4):
+        decision = controller.admit(f"source-{i}", "level: P1 接口报错")
+        assert decision.admitted
+        levels.append(decision.level)
+        held.append(decision)
+    assert levels == [LEVEL_NORMAL, LEVEL_NORMAL, LEVEL_SKIP_HISTORY, LEVEL_SAMPLE_LOW]
+    assert held[2].skip_history and not held[0].skip_history
+
+    rejected = controller.admit("source-x", "level: P1 接口报错")
+    assert not rejected.admitted and rejected.reason == "queue_full" and rejected.retry_after == 5.0
+    # 关键告警可以使用保留容量，保留容量用完后同样被拒绝
+    critical = controller.admit("source-x", "告警级别: critical")
+    assert critical.admitted
+    assert not controller.admit("source-x", "告警级别: critical").admitted
+
+    # 释放后恢复正常；采样阶段低优先级告警按 low_severity_sample_rate=0 全部丢弃
+    critical.release()
+    held.pop().release()
+    sampled = controller.admit("source-y", "severity: info 磁盘使用率 80%")
+    assert not sampled.admitted and sampled.reason == "sampled_out"
+    for decision in held:
+        decision.release()
+        decision.release()  # 重复释放无影响
+    stats = controller.stats()
+    print(stats)
+    assert stats["in_flight"] == 0 and stats["level"] == LEVEL_NORMAL and stats["max_in_flight"] == 5
+    assert stats["shed"]["rejected"] == 2 and stats["shed"]["sampled_out"] == 1
+    print("✅ 分级降级\n")
+
+
+def test_source_rate_limit():
+    """测试按来源限流，关键告警不受来源限流约束"""
+    print("=== 测试来源限流 ===")
+    controller = AdmissionController({"source_rate": 10.0, "source_burst": 2})
+    for _ in range(2):
+        with controller.admit("noisy", "接口报错"):
+            pass
+    limited = controller.admit("noisy", "接口报错")
+    assert not limited.admitted and limited.reason == "rate_limited"
+    assert 0.05 <= limited.retry_after <= 0.1
+    assert controller.admit("quiet", "接口报错").admitted
+    assert controller.admit("noisy", "告警级别: critical").admitted
+    assert controller.stats()["shed"]["rate_limited"] == 1
+
+    bucket = TokenBucket(rate=0.0, capacity=1)
+    assert bucket.try_acquire() and not bucket.try_acquire() and bucket.wait_time() == float("inf")
+    print("✅ 来源限流\n")
+
+
+def test_alert_storm():
+    """测试告警风暴：只有上限内的告警调用 LLM，其余立即返回重试建议"""
+    print("=== 测试告警风暴 ===")
+
+    def slow_reply(body):
+        time.sleep(0.3)
+        return classification_reply(body)
+
+    controller = AdmissionController({"max_queue": 2, "critical_reserve": 0, "source_burst": 100})
+    stub.configure(reply=slow_reply)
+    results = [None] * 6
+    before = len(stub.message_requests())
+
+    def analyze(i: int):
+        results[i] = workflow.analyze_alert(f"订单服务 {i} 号实例响应变慢，用户反馈页面卡顿", source=f"storm-{i}")
+
+    try:
+        with mock.patch.object(workflow, "admission", controller), \
+                mock.patch.object(workflow.template_cache, "path", None):
+            threads = [threading.Thread(target=analyze, args=(i,)) for i in range(6)]
+            for thread in threads:
+                thread.start()
+                time.sleep(0.02)
+            for thread in threads:
+                thread.join()
+            stats = workflow.admission_stats()
+    finally:
+        stub.configure()
+    rejected = [r for r in results if "告警未分析" in r]
+    print(stats)
+    assert len(rejected) == 4 and all("queue_full" in r for r in rejected)
+    assert sum("专项分析结果" in r for r in results) == 2
+    # 被拒绝的告警不产生任何 LLM 调用（级联时每条告警的分类最多两次调用）
+    assert len(stub.message_requests()) - before <= 2 * 3
+    assert stats["admitted"] == 2 and stats["in_flight"] == 0 and stats["shed"]["rejected"] == 4
+    print("✅ 告警风暴\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_detect_priority()
+        test_shedding_levels()
+        test_source_rate_limit()
+        test_alert_storm()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+异步 LLM 调用层测试脚本
+
+检查 crisis/util.py 的 async_llm_call 和 workflow 的 achain / aparallel / aanalyze_alert，不访问真实 API：
+- 同一事件循环内的调用共用一个客户端和连接池
+- aparallel 并发执行且按输入顺序返回，并发数不超过 max_concurrency
+- SQLite 响应缓存的读写和模板缓存写入在工作线程执行，不阻塞事件循环
+- aanalyze_alert 与 analyze_alert 共用准入控制、分类和提示词
+"""
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from stub_server import classification_reply, crisis_stub
+
+stub = crisis_stub()
+
+import util
+import workflow
+from template_miner import TemplateClassificationCache
+
+
+def _slow_echo(delay: float):
+    in_flight = [0, 0]  # 当前并发数, 最大并发数
+    lock = threading.Lock()
+
+    def reply(body):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(delay)
+        with lock:
+            in_flight[0] -= 1
+        text = str(body["messages"][0]["content"])
+        return "回答:" + text.rsplit("Input: ", 1)[-1]
+    return reply, in_flight
+
+
+def test_shared_client():
+    """测试同一事件循环内共用客户端，不同事件循环各自创建"""
+    print("=== 测试客户端复用 ===")
+
+    async def states():
+        return util._async_state(), util._async_state()
+
+    first, second = asyncio.run(states())
+    assert first is second
+    other, _ = asyncio.run(states())
+    assert other[0] is not first[0]
+    print("✅ 客户端复用\n")
+
+
+def test_aparallel():
+    """测试 aparallel 并发执行、按输入顺序返回并限制并发数"""
+    print("=== 测试 aparallel ===")
+    reply, in_flight = _slow_echo(0.2)
+    stub.configure(reply=reply)
+    inputs = [f"异步输入 {i} {time.monotonic()}" for i in range(8)]
+    try:
+        start = time.monotonic()
+        results = asyncio.run(workflow.aparallel("复述输入", inputs, max_concurrency=4))
+        elapsed = time.monotonic() - start
+    finally:
+        stub.configure()
+    print(f"耗时 {elapsed:.2f}s，最大并发 {in_flight[1]}")
+    assert results == [f"回答:{x}" for x in inputs]
+    assert in_flight[1] == 4 and elapsed < 8 * 0.2
+    print("✅ aparallel\n")
+
+
+def test_achain():
+    """测试 achain 依次执行每一步"""
+    print("=== 测试 achain ===")
+    reply, _ = _slow_echo(0.0)
+    stub.configure(reply=reply)
+    try:
+        result = asyncio.run(workflow.achain(f"起点 {time.monotonic()}", ["第一步", "第二步"]))
+    finally:
+        stub.configure()
+    assert result.startswith("回答:回答:起点")
+    print("✅ achain\n")
+
+
+def test_cache_off_loop():
+    """测试 SQLite 缓存读写不在事件循环线程执行"""
+    print("=== 测试缓存读写线程 ===")
+    threads = []
+    stub.configure(reply="异步缓存回答")
+    prompt = f"异步缓存问题 {time.monotonic()}"
+
+    async def calls():
+        loop_thread = threading.get_ident()
+        first = await util.async_llm_call(prompt)
+        second = await util.async_llm_call(prompt)
+        return loop_thread, first, second
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = util.enable_cache(os.path.join(tmp, "responses.db"))
+        get, put = cache.get, cache.put
+        try:
+            with mock.patch.object(cache, "get", lambda *a: threads.append(threading.get_ident()) or get(*a)), \
+                    mock.patch.object(cache, "put", lambda *a: threads.append(threading.get_ident()) or put(*a)):
+                before = len(stub.message_requests())
+                loop_thread, first, second = asyncio.run(calls())
+                assert len(stub.message_requests()) - before == 1
+        finally:
+            util.disable_cache()
+            stub.configure()
+    assert first == second == "异步缓存回答"
+    assert len(threads) == 3 and loop_thread not in threads
+    print("✅ 缓存读写线程\n")
+
+
+def test_aanalyze_alert():
+    """测试异步告警分析，模板缓存写入不在事件循环线程执行"""
+    print("=== 测试 aanalyze_alert ===")
+    remembered = []
+    remember = workflow._remember_classification
+    stub.configure(reply=classification_reply)
+
+    async def analyze():
+        return threading.get_ident(), await workflow.aanalyze_alert(
+            f"告警级别: ERROR\n错误信息: 异步订单接口返回 HTTP 502 {time.monotonic()}", source="async-test")
+
+    try:
+        with mock.patch.object(workflow, "template_cache", TemplateClassificationCache(None)), \
+                mock.patch.dict(workflow.PRECLASSIFIER_CONFIG, {"enabled": False}), \
+                mock.patch.object(workflow, "_remember_classification",
+                                  lambda *a: remembered.append(threading.get_ident()) or remember(*a)):
+            loop_thread, result = asyncio.run(analyze())
+    finally:
+        stub.configure()
+    assert "专项分析结果" in result and "backend_api_error" in result
+    assert len(remembered) == 1 and remembered[0] != loop_thread
+    print("✅ aanalyze_alert\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_shared_client()
+        test_aparallel()
+        test_achain()
+        test_cache_off_loop()
+        test_aanalyze_alert()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
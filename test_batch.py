@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Message Batches 批量执行测试脚本
+
+使用本地 stub 服务器（stub_server.py）测试，不访问真实 API：
+- SimpleAgent.ask_batch 和 crisis 工作流的 parallel(batch=True) 通过批量接口提交
+- 结果按 custom_id 对应回输入顺序
+- 接口不支持批量时自动回退为实时调用；403 等权限错误照常报错
+- agent.py 和 crisis 工作流共用同一份 batch 模块
+"""
+
+import anthropic
+import httpx
+
+from stub_server import crisis_stub
+
+
+def _echo(body):
+    """回显用户消息的最后一行，便于核对结果与输入的对应关系"""
+    content = body["messages"][-1]["content"]
+    if isinstance(content, list):
+        content = content[-1]["text"]
+    return f"回答: {content.splitlines()[-1]}"
+
+
+stub = crisis_stub()
+
+import agent
+from agent import SimpleAgent
+
+QUESTIONS = ["什么是人工智能？", "Python中的装饰器是什么？", "如何学习机器学习？"]
+
+
+def _count(path):
+    return sum(1 for r in stub.requests if r["path"].split("?")[0] == path)
+
+
+def test_agent_ask_batch():
+    """测试 SimpleAgent 批量问答通过批量接口提交，结果顺序与问题一致"""
+    stub.reply = _echo
+    print("=== 测试 SimpleAgent 批量问答 ===")
+    stub.batches_supported = True
+    agent = SimpleAgent(api_key="stub-key", base_url=stub.url)
+    before_batches, before_messages = _count("/v1/messages/batches"), _count("/v1/messages")
+
+    answers = agent.ask_batch(QUESTIONS)
+
+    assert answers == [f"回答: {q}" for q in QUESTIONS]
+    assert _count("/v1/messages/batches") == before_batches + 1
+    assert _count("/v1/messages") == before_messages
+    batch_body = [r["body"] for r in stub.requests if r["path"] == "/v1/messages/batches"][-1]
+    assert [item["custom_id"] for item in batch_body["requests"]] == ["q-0", "q-1", "q-2"]
+    print(f"✅ 回答: {answers}\n")
+
+
+def test_agent_ask_batch_fallback():
+    """测试接口不支持批量时回退为实时调用"""
+    stub.reply = _echo
+    print("=== 测试 SimpleAgent 批量问答回退 ===")
+    stub.batches_supported = False
+    agent = SimpleAgent(api_key="stub-key", base_url=stub.url)
+    before_messages = _count("/v1/messages")
+
+    answers = agent.ask_batch(QUESTIONS)
+
+    assert answers == [f"回答: {q}" for q in QUESTIONS]
+    assert _count("/v1/messages") == before_messages + len(QUESTIONS)
+    print(f"✅ 回退后的回答: {answers}\n")
+
+
+def test_workflow_parallel_batch():
+    """测试工作流 parallel(batch=True) 通过批量接口提交，并在不支持时回退"""
+    stub.reply = _echo
+    print("=== 测试工作流批量并行处理 ===")
+    import util
+    import workflow
+
+    inputs = ["告警A", "告警B", "告警C", "告警D"]
+    for supported in (True, False):
+        stub.batches_supported = supported
+        util.batch_runner.supported = None
+        before_batches, before_messages = _count("/v1/messages/batches"), _count("/v1/messages")
+
+        results = workflow.parallel("总结以下告警", inputs, batch=True)
+
+        assert results == [f"回答: Input: {x}" for x in inputs]
+        if supported:
+            assert _count("/v1/messages/batches") == before_batches + 1
+            assert _count("/v1/messages") == before_messages
+        else:
+            assert _count("/v1/messages") == before_messages + len(inputs)
+        print(f"✅ {'批量接口' if supported else '回退实时调用'}: {results}")
+    print(f"✅ 统计: {util.batch_stats()}\n")
+
+
+def test_unsupported_status():
+    """测试只有表示接口不存在的状态码才回退，agent.py 与工作流使用同一份模块"""
+    print("=== 测试回退判断 ===")
+    import batch
+    import util
+
+    def status_error(status):
+        response = httpx.Response(status, request=httpx.Request("POST", f"{stub.url}/v1/messages/batches"))
+        return anthropic.APIStatusError(f"HTTP {status}", response=response, body=None)
+
+    assert [batch.is_unsupported(status_error(s)) for s in (403, 404, 405, 501)] == [False, True, True, True]
+    assert agent.BatchRunner is util.BatchRunner is batch.BatchRunner
+    print("✅ 回退判断\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_agent_ask_batch()
+        test_agent_ask_batch_fallback()
+        test_workflow_parallel_batch()
+        test_unsupported_status()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
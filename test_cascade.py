@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+模型级联测试脚本
+
+检查 crisis/cascade.py 和工作流中的分类、路由选择级联，不访问真实 API：
+- 小模型置信度为 高 时直接采用，为 低/中 时升级到大模型
+- 路由选择解析失败（未知路由）时升级
+- 升级率、各级模型延迟和估算节省的延迟
+"""
+
+import asyncio
+import time
+from unittest import mock
+
+from stub_server import crisis_stub
+
+stub = crisis_stub()
+
+import workflow
+from cascade import ModelCascade
+from config import MODEL_CASCADE_CONFIG, PRECLASSIFIER_CONFIG, TEMPLATE_CACHE_CONFIG
+
+SMALL, LARGE = MODEL_CASCADE_CONFIG["tiers"]["classification"]
+
+ALERT = """
+告警级别: ERROR
+错误信息: 级联测试 {n} 号告警，页面白屏
+"""
+
+
+def _reply(small_confidence: str):
+    """小模型按给定置信度回复，大模型总是高置信度；大模型更慢"""
+    def reply(body):
+        text = str(body["messages"])
+        if "support team" in text:
+            if body["model"] == SMALL:
+                return "<reasoning>不确定</reasoning><selection>nobody</selection><confidence>high</confidence>"
+            time.sleep(0.1)
+            return "<reasoning>账单问题</reasoning><selection>billing</selection><confidence>high</confidence>"
+        if "分类" in text and "<category>" in text:
+            if body["model"] == SMALL:
+                return f"<category>javascript_error</category><reasoning>小模型</reasoning><confidence>{small_confidence}</confidence>"
+            time.sleep(0.1)
+            return "<category>javascript_error</category><reasoning>大模型</reasoning><confidence>高</confidence>"
+        return "专项分析结果"
+    return reply
+
+
+def _analyze(small_confidence: str, n: int) -> list:
+    """分类一条告警，返回分类请求使用的模型"""
+    stub.configure(reply=_reply(small_confidence))
+    before = len(stub.message_requests())
+    # 关闭本地预分类和模板缓存，使告警经过分类 LLM 调用
+    try:
+        with mock.patch.dict(PRECLASSIFIER_CONFIG, enabled=False), mock.patch.dict(TEMPLATE_CACHE_CONFIG, enabled=False):
+            result = workflow.analyze_alert(ALERT.format(n=n), source="cascade-test")
+    finally:
+        stub.configure()
+    assert "javascript_error" in result
+    bodies = stub.message_requests()[before:]
+    return [body["model"] for body in bodies if "<category>" in str(body["messages"])]
+
+
+def test_classification_cascade():
+    """测试分类级联：置信度 高 不升级，低/中 升级到大模型"""
+    print("=== 测试分类级联 ===")
+    assert _analyze("高", 1) == [SMALL]
+    assert _analyze("低", 2) == [SMALL, LARGE]
+    assert _analyze("中", 3) == [SMALL, LARGE]
+    stats = workflow.cascade_stats()["classification"]
+    print(f"分类级联统计: {stats}")
+    assert stats["calls"] >= 3 and stats["escalations"] >= 2
+    assert set(stats["avg_latency_s"]) == {SMALL, LARGE}
+    print("✅ 置信度不足时升级\n")
+
+
+def test_cascade_disabled():
+    """测试关闭级联时只使用默认模型"""
+    print("=== 测试关闭级联 ===")
+    with mock.patch.dict(MODEL_CASCADE_CONFIG, enabled=False):
+        assert _analyze("低", 4) == [MODEL_CASCADE_CONFIG["default_model"]]
+    print("✅ 关闭后不升级\n")
+
+
+def test_route_cascade():
+    """测试路由选择解析失败时升级（同步和异步）"""
+    print("=== 测试路由选择级联 ===")
+    routes = {"billing": "处理账单问题", "technical": "处理技术问题"}
+    stub.configure(reply=_reply("高"))
+    try:
+        before = len(stub.message_requests())
+        assert workflow.route("我被重复扣费了", routes) == "专项分析结果"
+        assert asyncio.run(workflow.aroute("发票金额不对", routes)) == "专项分析结果"
+        models = [body["model"] for body in stub.message_requests()[before:] if "support team" in str(body["messages"])]
+    finally:
+        stub.configure()
+    assert models == [SMALL, LARGE, SMALL, LARGE]
+    assert workflow.cascade_stats()["route_selection"]["escalation_rate"] == 1.0
+    print("✅ 未知路由时升级\n")
+
+
+def test_cascade_stats():
+    """测试升级率、调用出错时升级和节省延迟的估算"""
+    print("=== 测试级联统计 ===")
+    cascade = ModelCascade({**MODEL_CASCADE_CONFIG, "tiers": {"step": ["small", "large"]}})
+
+    def large():
+        time.sleep(0.05)
+        return "large"
+
+    def call(model):
+        if model == "large":
+            return large()
+        return "ok" if call.n % 4 else "bad"
+
+    for call.n in range(8):
+        assert cascade.run("step", call, lambda response: response == "ok") in ("ok", "large")
+
+    def failing(model):
+        if model == "small":
+            raise RuntimeError("small model overloaded")
+        return large()
+
+    assert cascade.run("step", failing, lambda response: True) == "large"
+    stats = cascade.stats()["step"]
+    print(stats)
+    assert stats["calls"] == 9 and stats["escalations"] == 3 and stats["errors"] == 1
+    assert stats["escalation_rate"] == round(3 / 9, 3)
+    # 9 次都用大模型约 0.45s，实际只有 3 次用到大模型
+    assert stats["latency_saved_s"] > 0.2
+    assert ModelCascade(MODEL_CASCADE_CONFIG).stats() == {}
+    print("✅ 统计正确\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_classification_cascade()
+        test_cascade_disabled()
+        test_route_cascade()
+        test_cascade_stats()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
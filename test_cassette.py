@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+请求录制与回放（cassette）测试脚本
+
+使用本地 stub 服务器（stub_server.py）录制，之后回放时不再访问 stub：
+- 智能体的普通/流式调用和 crisis 工作流的 chain 都可以录制和回放
+- 回放可以保持原始时间（包括流式数据块的间隔），也可以去掉等待
+- replay 模式下未录制的请求直接返回错误，不会访问 API
+- record 模式覆盖原有录制，auto 模式追加；.gz 文件只压缩为一个 gzip 成员
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import time
+import zlib
+
+from stub_server import crisis_stub
+
+stub = crisis_stub()
+
+from agent import SimpleAgent, telemetry
+from cassette import use_cassette
+
+
+def _recorded_path(tmp):
+    return os.path.join(tmp, "agent.jsonl.gz")
+
+
+def test_agent_record_and_replay():
+    """测试 SimpleAgent 的普通和流式调用录制后可以在不访问 API 的情况下回放"""
+    print("=== 测试智能体录制与回放 ===")
+    agent = SimpleAgent(api_key="stub-key", base_url=stub.url)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = _recorded_path(tmp)
+        stub.configure(reply="录制时的回复", ttft=0.2)
+        try:
+            with use_cassette(path, mode="record") as cassette:
+                recorded = [agent.ask("什么是人工智能？"), agent.ask_stream("Python中的装饰器是什么？")]
+                print()
+            assert cassette.stats()["recorded"] == 2
+        finally:
+            stub.configure(reply="回放时不应出现的回复")
+
+        before = len(stub.message_requests())
+        with use_cassette(path, mode="replay") as cassette:
+            start = time.perf_counter()
+            replayed = [agent.ask("什么是人工智能？"), agent.ask_stream("Python中的装饰器是什么？")]
+            original_timing = time.perf_counter() - start
+            stream_ttft = telemetry.records[-1]["ttft_s"]
+        print()
+        assert replayed == recorded == ["录制时的回复", "录制时的回复"]
+        assert len(stub.message_requests()) == before
+        assert cassette.stats()["replayed"] == 2
+        # 原始时间回放：两次调用各有约 0.2 秒的首 token 延迟
+        assert original_timing >= 0.4 and stream_ttft >= 0.2
+
+        with use_cassette(path, mode="replay", speed=0):
+            start = time.perf_counter()
+            assert agent.ask_stream("Python中的装饰器是什么？") == "录制时的回复"
+            assert time.perf_counter() - start < 0.15
+        print()
+    print(f"✅ 原始时间回放 {original_timing:.2f}s，流式 TTFT {stream_ttft}s\n")
+
+
+def test_replay_miss():
+    """测试 replay 模式下未录制的请求返回错误，不访问 API"""
+    print("=== 测试未录制请求 ===")
+    agent = SimpleAgent(api_key="stub-key", base_url=stub.url)
+    with tempfile.TemporaryDirectory() as tmp:
+        before = len(stub.message_requests())
+        with use_cassette(_recorded_path(tmp), mode="replay") as cassette:
+            answer = agent.ask("没有录制过的问题")
+        assert "cassette miss" in answer
+        assert len(stub.message_requests()) == before
+        assert cassette.stats()["misses"] == 1
+    print(f"✅ {answer}\n")
+
+
+def test_workflow_chain_auto_mode():
+    """测试 crisis 工作流在 auto 模式下首次录制、再次运行时回放"""
+    print("=== 测试工作流 auto 模式 ===")
+    import util
+    import workflow
+
+    stub.configure(reply=lambda body: f"步骤结果（{len(str(body['messages']))}）")
+    prompts = ["概括以下事件", "列出可能原因"]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "workflow.jsonl")
+        with use_cassette(path, mode="auto") as cassette:
+            first = workflow.chain("订单服务出现大量 504", prompts)
+            before = len(stub.message_requests())
+            second = workflow.chain("订单服务出现大量 504", prompts)
+        assert first == second
+        assert len(stub.message_requests()) == before
+        assert cassette.stats()["recorded"] == 2 and cassette.stats()["replayed"] == 2
+    stub.configure()
+    print(f"✅ 两次运行结果一致: {second}\n")
+
+
+def test_record_overwrites_and_single_gzip_member():
+    """测试重新录制时覆盖原文件，auto 模式追加，.gz 文件整体压缩一次"""
+    print("=== 测试录制文件写入 ===")
+    agent = SimpleAgent(api_key="stub-key", base_url=stub.url)
+    stub.configure(reply="录制时的回复")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = _recorded_path(tmp)
+        try:
+            for _ in range(2):
+                with use_cassette(path, mode="record"):
+                    agent.ask("第一个问题")
+                    agent.ask("第二个问题")
+            with use_cassette(path, mode="auto"):
+                agent.ask("第一个问题")
+                agent.ask("第三个问题")
+        finally:
+            stub.configure()
+
+        with open(path, "rb") as f:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            decompressor.decompress(f.read())
+        assert decompressor.eof and decompressor.unused_data == b""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            paths = [json.loads(line)["path"] for line in f]
+    # 两次 record 只保留最后一次的两条，auto 模式只追加未录制的第三个问题
+    assert len(paths) == 3
+    print("✅ 录制文件写入\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_agent_record_and_replay()
+        test_replay_miss()
+        test_workflow_chain_auto_mode()
+        test_record_overwrites_and_single_gzip_member()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+告警内容压缩测试脚本
+
+检查 crisis/compaction.py 和工作流中的压缩阶段，不访问真实 API：
+- 框架帧折叠、重复行合并、高熵 ID 掩码、User-Agent 缩短，错误码和应用帧保持原样
+- 只有时间戳或计数不同的行合并，错误码/状态码不同的行不合并
+- 超过 token 预算时按重要性省略行，压缩结果不超过预算
+- analyze_alert 发送的提示词使用压缩后的告警，并报告压缩前后的 token 数
+"""
+
+
+from stub_server import crisis_stub
+
+stub = crisis_stub()
+
+import workflow
+from compaction import AlertCompactor, compact_user_agent
+from config import COMPACTION_CONFIG
+from tokens import estimate_tokens
+
+APP_FRAMES = [
+    "at com.example.service.UserService.getProfile(UserService.java:156)",
+    "at com.example.controller.UserController.getProfile(UserController.java:89)",
+]
+
+
+def _big_alert() -> str:
+    framework = [f"at org.springframework.web.servlet.FrameworkServlet.service(FrameworkServlet.java:{i})"
+                 for i in range(30)]
+    recursion = ["at com.example.util.Tree.walk(Tree.java:42)", "at com.example.util.Tree.visit(Tree.java:17)"] * 25
+    logs = [f"2024-01-15 16:20:{i:02d} WARN 重试获取数据库连接 attempt={i}" for i in range(40)]
+    lines = [
+        "告警时间: 2024-01-15 16:20:15",
+        "告警级别: CRITICAL",
+        "接口路径: /api/v1/user/profile",
+        "HTTP状态码: 500",
+        "错误码: 10205",
+        "trace_id: 4bf92f3577b34da6a3ce929d0e0e4736 request_id: 3fa85f64-5717-4562-b3fc-2c963f66afa6",
+        "session: aZ3kQ9pL2mX7vB1nR8tY4wE6",
+        "用户代理: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/120.0.0.0 Safari/537.36",
+        "错误日志:",
+        "  java.sql.SQLException: Connection timeout",
+        "  at com.zaxxer.hikari.pool.HikariPool.getConnection(HikariPool.java:197)",
+        *("  " + frame for frame in APP_FRAMES),
+        *("  " + frame for frame in framework),
+        *("  " + frame for frame in recursion),
+        *logs,
+    ]
+    return "\n".join("    " + line for line in lines)
+
+
+def test_compaction_keeps_essentials():
+    """测试各项压缩，错误码、抛出位置和应用帧保持原样"""
+    print("=== 测试告警压缩 ===")
+    compactor = AlertCompactor({**COMPACTION_CONFIG, "token_budget": None})
+    alert = _big_alert()
+    result = compactor.compact(alert)
+    text = result.text
+    print(text)
+
+    assert result.tokens_before == estimate_tokens(alert)
+    assert result.tokens_after == estimate_tokens(text)
+    assert result.tokens_after < result.tokens_before / 4
+    # 错误码、异常、抛出位置（即使属于框架）和应用帧保持原样
+    for kept in ["错误码: 10205", "HTTP状态码: 500", "java.sql.SQLException: Connection timeout",
+                 "at com.zaxxer.hikari.pool.HikariPool.getConnection(HikariPool.java:197)", *APP_FRAMES]:
+        assert kept in text
+    assert "FrameworkServlet" not in text and "折叠 30 个框架帧: org.springframework" in text
+    assert "以上 2 行重复 24 次" in text and "上一行重复 39 次" in text
+    assert "<HEX>" in text and "<UUID>" in text and "session: <TOKEN>" in text
+    assert "Chrome/120.0.0.0 (Windows NT 10.0)" in text and "KHTML" not in text
+    assert result.actions["folded_frames"] == 30 and result.actions["user_agents"] == 1
+    # 再次压缩同一告警直接返回结果，不重复统计
+    assert compactor.compact(alert) is result
+    assert compactor.stats()["alerts"] == 1 and compactor.stats()["saved_ratio"] > 0.75
+    print(f"\n✅ {result}\n")
+
+
+def test_token_budget():
+    """测试超过预算时按重要性省略行"""
+    print("=== 测试 token 预算 ===")
+    compactor = AlertCompactor({**COMPACTION_CONFIG, "token_budget": 120})
+    result = compactor.compact(_big_alert())
+    print(result.text)
+    assert result.tokens_after <= 120
+    assert result.actions["dropped_lines"] > 0
+    assert "省略" in result.text
+    # 错误信息和应用帧最后才被省略
+    for kept in ["错误码: 10205", "java.sql.SQLException: Connection timeout", APP_FRAMES[0]]:
+        assert kept in result.text
+    print(f"\n✅ {result}\n")
+
+
+def test_repeats_keep_error_codes():
+    """测试状态码不同的日志行不被合并为重复行"""
+    print("=== 测试重复行与错误码 ===")
+    lines = [f"2024-01-15 16:20:{i:02d} ERROR upstream status={code} attempt={i}"
+             for i, code in enumerate([502, 502, 504, 500, 500, 500])]
+    lines += [f"2024-01-15 16:21:{i:02d} 调用失败，错误码: {code}" for i, code in enumerate([10205, 10015])]
+    lines += [f"2024-01-15 16:22:{i:02d} HTTP/1.1 {code} GET /api/v1/order" for i, code in enumerate([504, 504, 503])]
+    text = AlertCompactor({**COMPACTION_CONFIG, "token_budget": None}).compact("\n".join(lines)).text
+    print(text)
+    for kept in ["status=502 attempt=0", "status=504", "status=500 attempt=3", "错误码: 10205", "错误码: 10015",
+                 "HTTP/1.1 504", "HTTP/1.1 503"]:
+        assert kept in text
+    assert "status=502 attempt=1" not in text and "status=500 attempt=4" not in text
+    assert text.count("上一行重复 1 次") == 2 and "上一行重复 2 次" in text
+    print("✅ 错误码不同的行保持原样\n")
+
+
+def test_short_alert_unchanged():
+    """测试不需要压缩的告警只去掉公共缩进"""
+    print("=== 测试短告警 ===")
+    alert = """
+    告警级别: ERROR
+    错误信息: Uni bridge call failed with error code 10015
+    用户ID: user_12345
+    """
+    result = AlertCompactor(COMPACTION_CONFIG).compact(alert)
+    assert result.text == "告警级别: ERROR\n错误信息: Uni bridge call failed with error code 10015\n用户ID: user_12345"
+    assert compact_user_agent("Mozilla/5.0 (iPhone; CPU iPhone OS 16_1 like Mac OS X) AppleWebKit/605.1.15 "
+                              "(KHTML, like Gecko) Version/16.1 Mobile/15E148 Safari/604.1") == \
+        "Version/16.1 (iPhone; CPU iPhone OS 16_1 like Mac OS X)"
+    print("✅ 短告警保持不变\n")
+
+
+def test_workflow_prompt_uses_compacted_alert():
+    """测试 analyze_alert 发送压缩后的告警"""
+    print("=== 测试工作流中的压缩 ===")
+    stub.configure(reply="<category>backend_api_error</category><reasoning>连接池耗尽</reasoning>"
+                         "<confidence>低</confidence>")
+    before = len(stub.message_requests())
+    try:
+        workflow.analyze_alert(_big_alert(), source="compaction-test")
+    finally:
+        stub.configure()
+    prompts = [str(body["messages"]) for body in stub.message_requests()[before:]]
+    assert prompts
+    assert all("FrameworkServlet" not in prompt and "折叠 30 个框架帧" in prompt for prompt in prompts)
+    stats = workflow.compaction_stats()
+    assert stats["alerts"] >= 1 and stats["tokens_after"] < stats["tokens_before"]
+    print(f"✅ {len(prompts)} 个请求使用压缩后的告警，统计: {stats}\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_compaction_keeps_essentials()
+        test_token_budget()
+        test_repeats_keep_error_codes()
+        test_short_alert_unchanged()
+        test_workflow_prompt_uses_compacted_alert()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
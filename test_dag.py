@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+DAG 工作流测试脚本
+
+检查 crisis/dag.py 和 workflow.analyze_alert_dag，不访问真实 API：
+- 互不依赖的步骤并发执行，依赖的步骤在上游完成后开始，并发受全局上限约束
+- 相同输入的步骤结果直接复用，关闭记忆的步骤每次执行
+- 失败的步骤只跳过其下游，环和未知输入在运行前报错
+- 告警分析 DAG 返回与 analyze_alert 相同格式的结果和步骤时间线，只复用告警压缩结果，历史检索和 LLM 调用每次执行
+"""
+
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from stub_server import crisis_stub
+
+stub = crisis_stub()
+
+import workflow
+from config import KNOWLEDGE_BASE
+from dag import DAG, StepError
+from retrieval import IncidentRetriever
+
+
+def _sleepy(seconds: float, value):
+    def step(**inputs):
+        time.sleep(seconds)
+        return value if not inputs else f"{value}({','.join(str(v) for v in inputs.values())})"
+    return step
+
+
+def test_independent_steps_overlap():
+    """测试互不依赖的步骤并发执行"""
+    print("=== 测试并发执行 ===")
+    dag = DAG(max_concurrency=4)
+    dag.add("classify", _sleepy(0.2, "c"), ["alert"])
+    dag.add("scan", _sleepy(0.2, "s"), ["alert"])
+    dag.add("history", _sleepy(0.2, "h"), ["alert"])
+    dag.add("report", _sleepy(0.0, "r"), ["classify", "scan", "history"])
+    result = dag.run({"alert": "a"})
+    print(result.format_trace())
+    assert result.ok and result["report"] == "r(c(a),s(a),h(a))"
+    # 三个 0.2s 的步骤重叠执行
+    assert result.elapsed < 0.4
+    trace = {t.name: t for t in result.trace}
+    assert trace["report"].start >= max(trace[n].start + trace[n].duration for n in ("classify", "scan", "history"))
+    # 只执行需要的步骤
+    assert [t.name for t in dag.run({"alert": "b"}, targets=["scan"]).trace] == ["scan"]
+    print("✅ 并发执行\n")
+
+
+def test_concurrency_limit():
+    """测试全局并发上限（线程版本和异步版本）"""
+    print("=== 测试并发上限 ===")
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def step(x):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return x
+
+    dag = DAG(max_concurrency=2, memo_entries=0)
+    for i in range(6):
+        dag.add(f"s{i}", step, ["x"])
+    assert dag.run({"x": 1}).ok and peak[0] == 2
+
+    async def astep(x):
+        await asyncio.sleep(0.05)
+        return x * 2
+
+    adag = DAG(max_concurrency=2)
+    for i in range(4):
+        adag.add(f"a{i}", astep, ["x"])
+    adag.add("total", lambda **values: sum(values.values()), [f"a{i}" for i in range(4)])
+    start = time.monotonic()
+    result = asyncio.run(adag.arun({"x": 3}))
+    assert result["total"] == 24 and time.monotonic() - start >= 0.1
+    print(f"✅ 同时执行的步骤最多 {peak[0]} 个\n")
+
+
+def test_memoization():
+    """测试按输入哈希记忆结果"""
+    print("=== 测试结果记忆 ===")
+    calls = {"pure": 0, "fresh": 0}
+
+    def pure(x):
+        calls["pure"] += 1
+        return x.upper()
+
+    def fresh(pure):
+        calls["fresh"] += 1
+        return f"{pure}-{calls['fresh']}"
+
+    dag = DAG()
+    dag.add("pure", pure, ["x"]).add("fresh", fresh, ["pure"], memoize=False)
+    assert dag.run({"x": "a"})["fresh"] == "A-1"
+    second = dag.run({"x": "a"})
+    assert second["fresh"] == "A-2" and calls["pure"] == 1
+    assert {t.name: t.status for t in second.trace} == {"pure": "cached", "fresh": "ok"}
+    dag.run({"x": "b"})
+    assert calls["pure"] == 2
+    stats = dag.stats()
+    assert stats["runs"] == 3 and stats["memo_hits"] == 1 and stats["memo_entries"] == 2
+    print(f"✅ {stats}\n")
+
+
+def test_failures_and_validation():
+    """测试失败只影响下游，以及运行前的校验"""
+    print("=== 测试失败和校验 ===")
+
+    def broken(x):
+        raise RuntimeError("扫描服务不可用")
+
+    dag = DAG()
+    dag.add("scan", broken, ["x"]).add("summary", lambda scan: scan, ["scan"])
+    dag.add("history", _sleepy(0.0, "h"), ["x"])
+    result = dag.run({"x": 1})
+    assert not result.ok and result["history"] == "h(1)"
+    assert isinstance(result.errors["scan"].error, RuntimeError)
+    assert result.errors["summary"].upstream == "scan"
+    try:
+        result["summary"]
+        assert False, "被跳过的步骤应抛出 StepError"
+    except StepError as e:
+        print(e)
+    assert {t.name: t.status for t in result.trace} == {"scan": "error", "summary": "skipped", "history": "ok"}
+
+    cyclic = DAG().add("a", lambda b: b, ["b"]).add("b", lambda a: a, ["a"])
+    for bad, inputs in ((cyclic, {}), (dag, {}), (dag, {"x": 1, "scan": 2})):
+        try:
+            bad.run(inputs)
+            assert False, "应在运行前报错"
+        except ValueError as e:
+            print(e)
+    print("✅ 失败只跳过下游\n")
+
+
+def test_alert_dag():
+    """测试告警分析 DAG：压缩结果复用，历史检索和专项分析每次执行"""
+    print("=== 测试告警分析 DAG ===")
+
+    def reply(body):
+        if "<category>" in str(body["messages"]):
+            time.sleep(0.1)
+            return "<category>backend_api_error</category><reasoning>接口超时</reasoning><confidence>高</confidence>"
+        return "专项分析结果"
+
+    stub.configure(reply=reply)
+    alert = "库存服务 DAG 测试告警，接口响应超过 30 秒"
+    try:
+        with mock.patch.object(workflow.template_cache, "path", None), \
+                mock.patch.object(workflow, "retriever", IncidentRetriever(KNOWLEDGE_BASE)), \
+                mock.patch.object(workflow, "_prompt_details", wraps=workflow._prompt_details) as prompt_details:
+            result = workflow.analyze_alert_dag(alert, source="dag-test")
+            assert "专项分析结果" in result
+            # 分类和专项提示词使用 prompt_details 步骤的结果，不再各自压缩
+            assert prompt_details.call_count == 1
+
+            # 再次分析时压缩结果直接复用，分类命中模板缓存，新加入的历史事件被检索到，专项分析重新调用
+            before = len(stub.message_requests())
+            workflow.add_incident("incident_dag", {"description": "库存服务接口响应超时", "cause": "慢查询",
+                                                   "solution": "库存服务 DAG 测试：补充索引"})
+            again = workflow.analyze_alert_dag(alert, source="dag-test")
+            assert "专项分析结果" in again and "backend_api_error" in again
+            assert len(stub.message_requests()) - before == 1
+            assert "[incident_dag]" in str(stub.message_requests()[-1]["messages"])
+            asynchronous = asyncio.run(workflow.aanalyze_alert_dag(alert, source="dag-test"))
+            assert asynchronous == again
+            assert prompt_details.call_count == 1
+    finally:
+        stub.configure()
+    stats = workflow.dag_stats()
+    assert stats["runs"] >= 3 and stats["memo_hits"] >= 2
+    print(f"✅ {stats}\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_independent_steps_overlap()
+        test_concurrency_limit()
+        test_memoization()
+        test_failures_and_validation()
+        test_alert_dag()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+多端点选择与熔断测试脚本
+
+检查 crisis/endpoints.py、util.configure_endpoints 和 SimpleAgent 的端点池，不访问真实 API：
+- 端点故障时切换到下一个端点，连续失败后熔断，冷却结束后半开探测，成功则恢复
+- 请求本身的错误（如 400）直接抛出，不切换端点也不影响端点健康度
+- 优先选择延迟低的端点；全部熔断时只放行一个请求尝试最快恢复的端点，探测进行中的其余请求快速失败
+- call() 中报告了首 token 时以首 token 延迟作为样本，与 lease() 一致
+- llm_call、async_llm_call、stream_llm_call、SimpleAgent.ask 和 MCPWeatherAgent.chat / chat_stream 经端点池路由；
+  指定了 api_key 或 base_url 的智能体不使用模块级端点池
+"""
+
+import asyncio
+import socket
+import threading
+import time
+from unittest import mock
+
+from stub_server import StubServer, crisis_stub
+
+stub = crisis_stub()
+
+import agent as agent_module
+import util
+from agent import MCPWeatherAgent, SimpleAgent, endpoint_client
+from endpoints import CircuitOpenError, Endpoint, EndpointPool, is_endpoint_failure, report_first_token
+
+
+REPLY = "端点测试回答"
+
+
+class _StatusError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def _fake(behaviour, log):
+    """按端点名称执行给定行为：数字为耗时（秒），异常则抛出"""
+    def fn(endpoint):
+        log.append(endpoint.name)
+        action = behaviour[endpoint.name]
+        if isinstance(action, BaseException):
+            raise action
+        time.sleep(action)
+        return endpoint.name
+    return fn
+
+
+def _unused_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_failover_and_breaker():
+    """测试端点故障时切换、熔断、半开探测和恢复"""
+    print("=== 测试故障切换和熔断 ===")
+    pool = EndpointPool([Endpoint("relay"), Endpoint("direct")], failure_threshold=3, cooldown=0.2)
+    behaviour = {"relay": ConnectionError("relay reset"), "direct": 0.0}
+    log = []
+    for _ in range(5):
+        assert pool.call(_fake(behaviour, log)) == "direct"
+    # relay 失败后延迟评分变差，熔断前后都不再优先选择
+    assert log.count("relay") == 1
+    for _ in range(2):
+        pool.record(pool.endpoints[0], 0.01, ConnectionError("relay reset"))
+    assert pool.stats()["relay"]["state"] == "open"
+    log.clear()
+    pool.call(_fake(behaviour, log))
+    assert log == ["direct"]
+
+    # 冷却结束后半开，只放行一个探测请求；探测失败时冷却时间加倍
+    time.sleep(0.25)
+    log.clear()
+    assert pool.call(_fake(behaviour, log)) == "direct"
+    assert log == ["relay", "direct"]
+    stats = pool.stats()["relay"]
+    assert stats["state"] == "open" and 0.2 < stats["retry_in_s"] <= 0.4
+
+    # 探测成功后恢复
+    time.sleep(0.45)
+    behaviour["relay"] = 0.0
+    log.clear()
+    assert pool.call(_fake(behaviour, log)) == "relay"
+    stats = pool.stats()
+    print(stats)
+    assert stats["relay"]["state"] == "closed" and stats["relay"]["opens"] == 2
+    assert stats["direct"]["errors"] == 0
+    print("✅ 故障切换和熔断\n")
+
+
+def test_request_errors_and_all_open():
+    """测试请求错误不切换端点，全部熔断时仍尝试最快恢复的端点"""
+    print("=== 测试请求错误和全部熔断 ===")
+    assert is_endpoint_failure(_StatusError(529)) and is_endpoint_failure(_StatusError(429))
+    assert not is_endpoint_failure(_StatusError(400)) and not is_endpoint_failure(ValueError())
+
+    pool = EndpointPool([Endpoint("a"), Endpoint("b")])
+    log = []
+    try:
+        pool.call(_fake({"a": _StatusError(400), "b": 0.0}, log))
+        assert False, "应抛出请求错误"
+    except _StatusError:
+        pass
+    assert log == ["a"] and pool.stats()["a"]["errors"] == 0
+
+    # 单端点：熔断后仍然尝试（与不使用端点池时的行为相同），失败时抛出原异常
+    single = EndpointPool([Endpoint("only")], failure_threshold=1, cooldown=60)
+    for _ in range(2):
+        try:
+            single.call(_fake({"only": ConnectionError("down")}, log))
+            assert False, "应抛出端点故障"
+        except ConnectionError:
+            pass
+    assert single.stats()["only"]["state"] == "open" and single.stats()["only"]["calls"] == 2
+    assert single.call(_fake({"only": 0.0}, log)) == "only"
+    assert single.stats()["only"]["state"] == "closed"
+    print("✅ 请求错误和全部熔断\n")
+
+
+def test_all_open_fail_fast():
+    """测试全部熔断时只放行一个探测请求，其余请求快速失败而不是各自等待超时"""
+    print("=== 测试全部熔断时快速失败 ===")
+    pool = EndpointPool([Endpoint("a"), Endpoint("b")], failure_threshold=1, cooldown=60)
+    for endpoint in pool.endpoints:
+        pool.record(endpoint, 0.01, ConnectionError("down"))
+    assert {s["state"] for s in pool.stats().values()} == {"open"}
+
+    release, started = threading.Event(), threading.Event()
+
+    def probe(endpoint):
+        started.set()
+        release.wait(5)
+        return endpoint.name
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(pool.call(probe)))
+    thread.start()
+    assert started.wait(5)
+    try:
+        for _ in range(3):
+            start = time.monotonic()
+            try:
+                pool.call(lambda endpoint: "不应执行")
+                assert False, "应快速失败"
+            except CircuitOpenError:
+                pass
+            assert time.monotonic() - start < 0.05
+        try:
+            asyncio.run(pool.acall(lambda endpoint: asyncio.sleep(0)))
+            assert False, "应快速失败"
+        except CircuitOpenError:
+            pass
+        try:
+            with pool.lease():
+                assert False, "应快速失败"
+        except CircuitOpenError:
+            pass
+    finally:
+        release.set()
+        thread.join()
+    # 探测成功后端点恢复，请求照常执行
+    assert results == ["a"] and pool.stats()["a"]["state"] == "closed"
+    assert pool.call(lambda endpoint: endpoint.name) == "a"
+
+    # 已尝试过的端点失败、剩余端点在探测中时，抛出已尝试端点的异常
+    pool = EndpointPool([Endpoint("a"), Endpoint("b")], failure_threshold=1, cooldown=60)
+    pool.record(pool.endpoints[1], 0.01, ConnectionError("down"))
+    assert pool.select(exclude=["a"]).name == "b"  # b 已熔断，放行一个探测请求
+    try:
+        pool.call(_fake({"a": ConnectionError("a reset"), "b": 0.0}, []))
+        assert False, "应抛出 a 的异常"
+    except ConnectionError as e:
+        assert str(e) == "a reset"
+    print("✅ 全部熔断时快速失败\n")
+
+
+def test_latency_preference():
+    """测试优先选择延迟低的端点，rank=1 选择次优端点"""
+    print("=== 测试延迟优先 ===")
+    pool = EndpointPool([Endpoint("slow"), Endpoint("fast")])
+    log = []
+    behaviour = {"slow": 0.05, "fast": 0.005}
+    for _ in range(10):
+        pool.call(_fake(behaviour, log))
+    print(log)
+    # 两个端点各探索一次后都选择 fast
+    assert log[:2] == ["slow", "fast"] and set(log[2:]) == {"fast"}
+    assert pool.select().name == "fast" and pool.select(rank=1).name == "slow"
+    assert pool.select(exclude=["fast"], rank=1).name == "slow"
+    stats = pool.stats()
+    assert stats["slow"]["latency_ms"] > stats["fast"]["latency_ms"]
+    print(f"✅ {stats}\n")
+
+
+def test_first_token_latency():
+    """测试 call() 以首 token 延迟作为样本，未报告首 token 时使用总耗时"""
+    print("=== 测试首 token 延迟 ===")
+    pool = EndpointPool([Endpoint("stream"), Endpoint("plain")])
+
+    def fn(endpoint):
+        time.sleep(0.01)
+        if endpoint.name == "stream":
+            report_first_token()
+        time.sleep(0.1)
+        return endpoint.name
+
+    async def afn(endpoint):
+        await asyncio.sleep(0.01)
+        report_first_token()
+        await asyncio.sleep(0.1)
+        return endpoint.name
+
+    assert pool.call(fn) == "stream" and pool.call(fn) == "plain"
+    stats = pool.stats()
+    print(stats)
+    assert stats["stream"]["latency_ms"] < 50 and stats["plain"]["latency_ms"] > 100
+    assert asyncio.run(pool.acall(afn)) == "stream"
+    assert pool.stats()["stream"]["latency_ms"] < 50
+    # call() 之外报告首 token 不影响任何端点
+    report_first_token()
+    print("✅ 首 token 延迟\n")
+
+
+def test_util_routing():
+    """测试 util 的调用经端点池路由：故障中转站熔断，调用全部成功"""
+    print("=== 测试 util 端点路由 ===")
+    stub.configure(reply=REPLY)
+    flaky = StubServer(faults={"529": 1.0}, retry_after=0).start()
+    try:
+        util.configure_endpoints([
+            Endpoint("dead", api_key="stub-key", base_url=f"http://127.0.0.1:{_unused_port()}", max_retries=0),
+            Endpoint("flaky", api_key="stub-key", base_url=flaky.url, max_retries=0),
+            Endpoint("stub", api_key="stub-key", base_url=stub.url, max_retries=0),
+        ], cooldown=60)
+        start = time.monotonic()
+        for i in range(6):
+            assert util.llm_call(f"端点路由测试 {i} {start}") == REPLY
+        assert asyncio.run(util.async_llm_call(f"异步端点路由测试 {start}")) == REPLY
+        assert "".join(util.stream_llm_call(f"流式端点路由测试 {start}")) == REPLY
+        stats = util.endpoint_stats()
+        print(stats)
+        # 未探索的端点各试一次，失败后不再被选择
+        assert stats["dead"]["errors"] == 1 and stats["flaky"]["errors"] == 1
+        assert stats["stub"]["calls"] == 8 and stats["stub"]["errors"] == 0
+        assert "529" in stats["flaky"]["last_error"]
+    finally:
+        util.disable_endpoints()
+        flaky.stop()
+    assert util.endpoint_stats() == {}
+    print("✅ util 端点路由\n")
+
+
+def test_agent_endpoints():
+    """测试 SimpleAgent.ask 经端点池路由"""
+    print("=== 测试 SimpleAgent 端点池 ===")
+    pool = EndpointPool([
+        Endpoint("dead", api_key="stub-key", base_url=f"http://127.0.0.1:{_unused_port()}", max_retries=0),
+        Endpoint("stub", api_key="stub-key", base_url=stub.url, max_retries=0),
+    ], endpoint_client)
+    stub.configure(reply=REPLY)
+    agent = SimpleAgent(api_key="stub-key", base_url=stub.url, endpoints=pool)
+    for _ in range(3):
+        assert agent.ask("端点池问题") == REPLY
+    stats = agent.endpoint_stats()
+    print(stats)
+    assert stats["stub"]["calls"] == 3 and stats["dead"]["errors"] >= 1
+    assert SimpleAgent(api_key="stub-key", base_url=stub.url).endpoint_stats() == {}
+
+    # 模块级端点池只在未指定 api_key 和 base_url 时使用
+    with mock.patch.object(agent_module, "endpoint_pool", pool):
+        assert SimpleAgent(api_key="stub-key", base_url=stub.url).endpoints is None
+        assert SimpleAgent(api_key="stub-key").endpoints is None
+        assert SimpleAgent().endpoints is pool
+        assert MCPWeatherAgent(api_key="stub-key", mcp_server_url=f"{stub.url}/mcp").endpoints is None
+        assert MCPWeatherAgent(mcp_server_url=f"{stub.url}/mcp").endpoints is pool
+    print("✅ SimpleAgent 端点池\n")
+
+
+def test_weather_agent_endpoints():
+    """测试 MCPWeatherAgent 经端点池路由：非流式对话切换端点，流式对话选择端点并计入统计"""
+    print("=== 测试 MCPWeatherAgent 端点池 ===")
+    pool = EndpointPool([
+        Endpoint("dead", api_key="stub-key", base_url=f"http://127.0.0.1:{_unused_port()}", max_retries=0),
+        Endpoint("stub", api_key="stub-key", base_url=stub.url, max_retries=0),
+    ], endpoint_client)
+    stub.configure(reply=REPLY)
+    try:
+        agent = MCPWeatherAgent(mcp_server_url=f"{stub.url}/mcp", endpoints=pool)
+        assert agent.chat("旧金山今天的天气如何？") == REPLY
+        assert agent.chat_stream("纽约今天的天气如何？") == REPLY
+        print()
+    finally:
+        stub.configure()
+    stats = agent.endpoint_stats()
+    print(stats)
+    assert stats["dead"]["errors"] == 1 and stats["stub"]["calls"] == 2 and stats["stub"]["errors"] == 0
+    print("✅ MCPWeatherAgent 端点池\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_failover_and_breaker()
+        test_request_errors_and_all_open()
+        test_all_open_fail_fast()
+        test_latency_preference()
+        test_first_token_latency()
+        test_util_routing()
+        test_agent_endpoints()
+        test_weather_agent_endpoints()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+对冲请求测试脚本
+
+检查 crisis/hedging.py、util.llm_call 和 SimpleAgent.ask 的对冲模式，不访问真实 API：
+- 首个请求在对冲延迟内没有首 token 时发出对冲请求，先收到首 token 的生效，另一个立即被取消
+- 大量落败请求未结束时，新的调用不排队
+- SimpleAgent.last_usage 只记录胜出请求的用量
+- 首个请求及时响应时不对冲；预算用完时不对冲
+- 对冲延迟随首 token 延迟的分位数自适应
+"""
+
+import asyncio
+import threading
+import time
+
+from stub_server import crisis_stub
+
+stub = crisis_stub()
+
+import util
+from agent import SimpleAgent, telemetry as agent_telemetry
+from hedging import HedgePolicy, ahedged_call, hedged_call
+
+
+def _request(delays, cancelled):
+    """按序号（0 为首个请求）等待给定时间后返回；取消时记录序号"""
+    def request(attempt):
+        attempt.on_cancel(lambda: cancelled.append(attempt.index))
+        deadline = time.monotonic() + delays[attempt.index]
+        while time.monotonic() < deadline:
+            time.sleep(0.005)
+            attempt.check()
+        attempt.first_token()
+        return f"attempt-{attempt.index}"
+    return request
+
+
+def test_policy():
+    """测试对冲延迟的分位数和预算"""
+    print("=== 测试对冲策略 ===")
+    policy = HedgePolicy(percentile=0.9, budget=0.25, initial_delay=1.5, min_samples=10, burst=1)
+    assert policy.delay() == 1.5
+    for i in range(1, 11):
+        policy.observe(i / 10)
+    assert policy.delay() == 1.0
+    for _ in range(90):
+        policy.observe(0.1)
+    assert policy.delay() == 0.1
+    # burst=1：第一次对冲后需要 4 次调用（每次 0.25）才能再对冲
+    granted = []
+    for _ in range(8):
+        policy.begin()
+        granted.append(policy.acquire())
+    assert granted == [True, False, False, False, True, False, False, False]
+    stats = policy.stats()
+    assert stats["hedged"] == 2 and stats["budget_denied"] == 6 and stats["hedge_rate"] == 0.25
+    print(f"✅ {stats}\n")
+
+
+def test_hedged_call():
+    """测试同步对冲：慢请求被对冲请求取代并取消，快请求不对冲"""
+    print("=== 测试同步对冲 ===")
+    policy = HedgePolicy(initial_delay=0.05)
+    cancelled = []
+    start = time.monotonic()
+    assert hedged_call(_request([1.0, 0.05], cancelled), policy) == "attempt-1"
+    assert time.monotonic() - start < 0.5
+    assert cancelled == [0]
+    assert hedged_call(_request([0.0, 0.0], cancelled), policy) == "attempt-0"
+
+    # 首个请求在对冲后失败，由对冲请求给出结果
+    def flaky(attempt):
+        time.sleep(0.1 if attempt.index == 0 else 0.2)
+        if attempt.index == 0:
+            raise ConnectionError("relay reset")
+        return "recovered"
+
+    assert hedged_call(flaky, policy) == "recovered"
+    stats = policy.stats()
+    print(stats)
+    assert stats["calls"] == 3 and stats["hedged"] == 2 and stats["hedge_wins"] == 2
+    assert stats["errors_recovered"] == 1
+    print("✅ 慢请求被取代\n")
+
+
+def _streaming_request(first_token_at, finish_at, events):
+    """模拟流式请求：在 first_token_at 秒收到首 token，finish_at 秒生成完；记录首 token 和取消的时间"""
+    def request(attempt):
+        start = time.monotonic()
+        attempt.on_cancel(lambda: events.append(("cancelled", attempt.index, time.monotonic())))
+        first_sent = False
+        while time.monotonic() - start < finish_at[attempt.index]:
+            time.sleep(0.005)
+            attempt.check()
+            if not first_sent and time.monotonic() - start >= first_token_at[attempt.index]:
+                first_sent = True
+                events.append(("first_token", attempt.index, time.monotonic()))
+                attempt.first_token()
+        return f"attempt-{attempt.index}"
+    return request
+
+
+def test_cancel_on_first_token():
+    """测试对冲请求先收到首 token 时立即取消首个请求，不等它生成完"""
+    print("=== 测试首 token 胜出 ===")
+    policy = HedgePolicy(initial_delay=0.05)
+    events = []
+    start = time.monotonic()
+    assert hedged_call(_streaming_request([0.5, 0.05], [1.0, 0.4], events), policy) == "attempt-1"
+    first_token = next(t for kind, i, t in events if kind == "first_token" and i == 1)
+    cancelled_at = next(t for kind, i, t in events if kind == "cancelled" and i == 0)
+    # 首个请求在对冲请求收到首 token 时取消，而不是在对冲请求生成完（约 0.45 秒）时
+    assert cancelled_at - first_token < 0.05 and cancelled_at - start < 0.3
+    assert ("first_token", 0) not in [(kind, i) for kind, i, _ in events]
+
+    async def arequest(attempt):
+        try:
+            await asyncio.sleep(0.5 if attempt.index == 0 else 0.05)
+            attempt.first_token()
+            await asyncio.sleep(0.4)
+        except asyncio.CancelledError:
+            events.append(("cancelled", attempt.index, time.monotonic()))
+            raise
+        return f"attempt-{attempt.index}"
+
+    events.clear()
+    start = time.monotonic()
+    assert asyncio.run(ahedged_call(arequest, policy)) == "attempt-1"
+    assert [(kind, i) for kind, i, _ in events] == [("cancelled", 0)] and events[0][2] - start < 0.3
+    print("✅ 首 token 胜出\n")
+
+
+def test_no_queueing_behind_losers():
+    """测试大量对冲调用进行中时，新调用的请求立即开始执行"""
+    print("=== 测试调用不排队 ===")
+    policy = HedgePolicy(initial_delay=5.0)
+    release = threading.Event()
+
+    def blocked(attempt):
+        release.wait(5.0)
+        return "blocked"
+
+    threads = [threading.Thread(target=hedged_call, args=(blocked, policy)) for _ in range(80)]
+    for thread in threads:
+        thread.start()
+    try:
+        time.sleep(0.1)
+        start = time.monotonic()
+        assert hedged_call(lambda attempt: "fast", policy) == "fast"
+        elapsed = time.monotonic() - start
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+    print(f"耗时 {elapsed:.3f}s")
+    assert elapsed < 0.2
+    print("✅ 调用不排队\n")
+
+
+def test_hedged_errors():
+    """测试两个请求都失败时抛出首个请求的异常，预算用完时不对冲"""
+    print("=== 测试对冲失败和预算 ===")
+
+    def failing(attempt):
+        time.sleep(0.1)
+        raise ConnectionError(f"attempt {attempt.index} failed")
+
+    policy = HedgePolicy(initial_delay=0.02, burst=1, budget=0.0)
+    try:
+        hedged_call(failing, policy)
+        assert False, "应抛出异常"
+    except ConnectionError as e:
+        assert str(e) == "attempt 0 failed"
+    # 预算为 0，令牌用完后不再对冲
+    cancelled = []
+    assert hedged_call(_request([0.1, 0.0], cancelled), policy) == "attempt-0"
+    assert policy.stats()["hedged"] == 1 and policy.stats()["budget_denied"] == 1
+    print("✅ 失败和预算\n")
+
+
+def test_async_hedged_call():
+    """测试异步对冲：落败的任务被取消"""
+    print("=== 测试异步对冲 ===")
+    policy = HedgePolicy(initial_delay=0.05)
+    cancelled = []
+
+    async def request(attempt):
+        try:
+            await asyncio.sleep(1.0 if attempt.index == 0 else 0.05)
+        except asyncio.CancelledError:
+            cancelled.append(attempt.index)
+            raise
+        attempt.first_token()
+        return f"attempt-{attempt.index}"
+
+    start = time.monotonic()
+    assert asyncio.run(ahedged_call(request, policy)) == "attempt-1"
+    assert time.monotonic() - start < 0.5 and cancelled == [0]
+    assert policy.stats()["hedge_wins"] == 1
+    print("✅ 异步对冲\n")
+
+
+def _slow_first_reply():
+    """第一个请求延迟 1 秒才响应，之后的请求立即响应"""
+    count = [0]
+    lock = threading.Lock()
+
+    def reply(body):
+        with lock:
+            count[0] += 1
+            first = count[0] == 1
+        if first:
+            time.sleep(1.0)
+        return "对冲测试回答"
+    return reply
+
+
+def test_llm_call_hedging():
+    """测试 llm_call 和 async_llm_call 的对冲模式"""
+    print("=== 测试 llm_call 对冲 ===")
+    util.enable_hedging(initial_delay=0.1)
+    try:
+        for call in (util.llm_call, lambda prompt: asyncio.run(util.async_llm_call(prompt))):
+            stub.configure(reply=_slow_first_reply())
+            before = stub.stats()["messages"]
+            start = time.monotonic()
+            assert call(f"对冲测试 {time.monotonic()}") == "对冲测试回答"
+            elapsed = time.monotonic() - start
+            print(f"耗时 {elapsed:.2f}s")
+            assert elapsed < 0.8
+            assert stub.stats()["messages"] - before == 2
+        stats = util.hedging_stats()
+        print(stats)
+        assert stats["hedged"] == 2 and stats["hedge_wins"] == 2
+        assert any(row["source"] == "llm_call:hedge" for row in util.telemetry_stats())
+    finally:
+        util.disable_hedging()
+        stub.configure()
+    assert util.hedging_stats() == {}
+    print("✅ llm_call 对冲\n")
+
+
+def test_agent_hedging():
+    """测试 SimpleAgent.ask 的对冲模式"""
+    print("=== 测试 SimpleAgent.ask 对冲 ===")
+    agent = SimpleAgent(api_key="stub-key", base_url=stub.url, hedge=HedgePolicy(initial_delay=0.1))
+    stub.configure(reply=_slow_first_reply())
+    try:
+        start = time.monotonic()
+        assert agent.ask("对冲测试问题") == "对冲测试回答"
+        assert time.monotonic() - start < 0.8
+        # 及时响应时不对冲
+        assert agent.ask("第二个问题") == "对冲测试回答"
+    finally:
+        stub.configure()
+    stats = agent.hedging_stats()
+    print(stats)
+    assert stats["calls"] == 2 and stats["hedged"] == 1 and stats["hedge_wins"] == 1
+    assert agent.last_usage["output_tokens"] > 0
+    sources = {row["source"] for row in agent_telemetry.summary()}
+    assert "SimpleAgent.ask:hedge" in sources
+    assert SimpleAgent(api_key="stub-key", base_url=stub.url).hedging_stats() == {}
+    print("✅ SimpleAgent.ask 对冲\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_policy()
+        test_hedged_call()
+        test_cancel_on_first_token()
+        test_no_queueing_behind_losers()
+        test_hedged_errors()
+        test_async_hedged_call()
+        test_llm_call_hedging()
+        test_agent_hedging()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+持续事件增量分析测试脚本
+
+检查 crisis/incident.py 和 workflow.analyze_incident_update，不访问真实 API：
+- 分类签名只包含错误码、HTTP 状态码、异常类型、uni 调用和关键词，服务器名和时间不影响签名
+- 追加式和改写式更新都只返回新增内容
+- 会话按容量和过期时间淘汰
+- 分类相关内容未变化的更新复用上次结果，不调用 LLM
+"""
+
+import time
+from unittest import mock
+
+from stub_server import classification_reply, crisis_stub
+
+stub = crisis_stub()
+
+import workflow
+from incident import IncidentSession, IncidentStore, classification_signature
+
+ALERT = """告警级别: ERROR
+服务: order-service
+错误信息: 下单接口返回 HTTP 502
+服务器: web-01
+时间: 2024-01-15 10:30:00"""
+
+
+def test_signature():
+    """测试分类签名"""
+    print("=== 测试分类签名 ===")
+    signature = classification_signature(ALERT)
+    print(signature)
+    assert "http:502" in signature and "kw:接口" in signature
+    # 服务器和时间变化不影响签名
+    assert classification_signature(ALERT.replace("web-01", "web-07").replace("10:30", "10:45")) == signature
+    # 新的状态码、错误码、异常类型或 uni 调用会改变签名
+    for extra in ("HTTP 504", "错误码 50012", "java.lang.NullPointerException", "uni.request 失败"):
+        assert classification_signature(f"{ALERT}\n{extra}") != signature, extra
+    print("✅ 分类签名\n")
+
+
+def test_session_updates():
+    """测试追加式和改写式更新只返回新增内容"""
+    print("=== 测试会话更新 ===")
+    session = IncidentSession("inc-1")
+    assert session.is_new
+    assert session.apply_update(ALERT) == ALERT
+    assert session.apply_update(f"{ALERT}\n服务器: web-02") == "\n服务器: web-02"
+    # 改写式更新：按行去重，只保留新出现的行
+    rewritten = "服务器: web-02\n错误信息: 下单接口返回 HTTP 504\n" + ALERT
+    assert session.apply_update(rewritten) == "错误信息: 下单接口返回 HTTP 504"
+    assert session.apply_update(rewritten) == "" and session.updates == 4
+    print("✅ 会话更新\n")
+
+
+def test_store_eviction():
+    """测试会话按 LRU 和过期时间淘汰"""
+    print("=== 测试会话淘汰 ===")
+    store = IncidentStore(max_sessions=2, session_ttl=0.1)
+    first = store.get_or_create("a")
+    store.get_or_create("b")
+    assert store.get_or_create("a") is first
+    store.get_or_create("c")
+    assert store.active_incidents() == ["a", "c"]
+    assert store.close("a") is first and store.get("a") is None
+    time.sleep(0.15)
+    assert store.active_incidents() == []
+    print("✅ 会话淘汰\n")
+
+
+def test_incident_reanalysis():
+    """测试分类相关内容未变化时复用上次分析，变化时重新分析"""
+    print("=== 测试事件增量分析 ===")
+    stub.configure(reply=classification_reply)
+    incident_id = f"order-outage-{time.monotonic()}"
+    try:
+        with mock.patch.object(workflow.template_cache, "path", None):
+            before = len(stub.message_requests())
+            first = workflow.analyze_incident_update(incident_id, ALERT, source="incident-test")
+            calls = len(stub.message_requests()) - before
+            assert calls >= 1 and "专项分析结果" in first
+
+            # 只新增服务器：签名不变，直接复用
+            before = len(stub.message_requests())
+            again = workflow.analyze_incident_update(incident_id, f"{ALERT}\n服务器: web-02", source="incident-test")
+            assert again is first and len(stub.message_requests()) == before
+
+            # 新的状态码：重新分析，且提示词包含累计的告警文本
+            before = len(stub.message_requests())
+            updated = workflow.analyze_incident_update(
+                incident_id, f"{ALERT}\n服务器: web-02\n支付接口返回 HTTP 504", source="incident-test")
+            bodies = stub.message_requests()[before:]
+            assert updated is not first and bodies
+            assert any("web-02" in str(body["messages"]) and "504" in str(body["messages"]) for body in bodies)
+    finally:
+        workflow.close_incident(incident_id)
+        stub.configure()
+    assert workflow.incidents.get(incident_id) is None
+    print("✅ 事件增量分析\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_signature()
+        test_session_updates()
+        test_store_eviction()
+        test_incident_reanalysis()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+按完成顺序返回的并行调用测试脚本
+
+检查 crisis/completion.py 和 workflow.iter_parallel / aiter_parallel，不访问真实 API：
+- 结果按完成顺序逐个返回，单项失败不影响其他项
+- 单项时限和总时限到期时返回 TimeoutError，asyncio 版本取消超时的协程
+- 慢调用被对冲后，先完成的一次生效，对冲请求不会被相同请求合并吞掉
+- 工作线程记录开始时间与迭代线程检查时限并发时不出错
+"""
+
+import asyncio
+import sys
+import threading
+import time
+
+from stub_server import crisis_stub
+
+stub = crisis_stub()
+
+import workflow
+from completion import aiter_completed, iter_completed
+
+
+def test_completion_order_and_errors():
+    """测试按完成顺序返回，失败的项以异常返回"""
+    print("=== 测试完成顺序和错误隔离 ===")
+
+    def work(x):
+        time.sleep(0.05 * (4 - x))
+        if x == 2:
+            raise ValueError("处理失败")
+        return x * 10
+
+    results = list(iter_completed(work, range(4), max_workers=4))
+    assert [index for index, _ in results] == [3, 2, 1, 0]
+    values = dict(results)
+    assert isinstance(values[2], ValueError)
+    assert [values[i] for i in (0, 1, 3)] == [0, 10, 30]
+    print(f"✅ 完成顺序: {[index for index, _ in results]}\n")
+
+
+def test_deadlines():
+    """测试单项时限和总时限"""
+    print("=== 测试单项时限和总时限 ===")
+
+    def work(x):
+        time.sleep(x)
+        return x
+
+    start = time.perf_counter()
+    results = dict(iter_completed(work, [0.01, 1.0, 0.02], max_workers=3, item_timeout=0.2))
+    assert time.perf_counter() - start < 0.5
+    assert results[0] == 0.01 and results[2] == 0.02
+    assert isinstance(results[1], TimeoutError)
+
+    start = time.perf_counter()
+    results = list(iter_completed(work, [0.01, 1.0, 1.0, 1.0], max_workers=2, timeout=0.3))
+    elapsed = time.perf_counter() - start
+    assert results[0] == (0, 0.01)
+    assert [index for index, _ in results[1:]] == [1, 2, 3]
+    assert all(isinstance(value, TimeoutError) for _, value in results[1:])
+    assert elapsed < 0.5
+    print(f"✅ 总时限 0.3s，实际 {elapsed:.2f}s\n")
+
+
+def test_hedging():
+    """测试对冲：慢调用的重复请求先完成时生效"""
+    print("=== 测试对冲 ===")
+    lock = threading.Lock()
+    attempts = {}
+
+    def work(x):
+        with lock:
+            attempts[x] = attempts.get(x, 0) + 1
+            first = attempts[x] == 1
+        # 第 3 项的首次调用很慢，重复调用正常
+        time.sleep(2.0 if x == 3 and first else 0.05)
+        return x
+
+    start = time.perf_counter()
+    results = dict(iter_completed(work, range(6), max_workers=6, hedge_after="p50"))
+    elapsed = time.perf_counter() - start
+    assert results == {i: i for i in range(6)}
+    assert attempts[3] == 2
+    assert elapsed < 1.0
+    print(f"✅ 对冲后耗时 {elapsed:.2f}s\n")
+
+
+def test_concurrent_start_times():
+    """测试大量项同时开始时，检查时限和对冲不会因开始时间被并发修改而出错"""
+    print("=== 测试开始时间并发记录 ===")
+
+    def work(x):
+        time.sleep(0.0005)
+        return x
+
+    interval = sys.getswitchinterval()
+    # 缩短线程切换间隔，使工作线程记录开始时间时迭代线程大概率正在遍历
+    sys.setswitchinterval(1e-6)
+    try:
+        for _ in range(3):
+            results = dict(iter_completed(work, range(2000), max_workers=32, item_timeout=5.0, hedge_after=10.0))
+            assert results == {i: i for i in range(2000)}
+    finally:
+        sys.setswitchinterval(interval)
+    print("✅ 开始时间并发记录\n")
+
+
+def test_async_cancels_stragglers():
+    """测试 asyncio 版本取消超时的协程"""
+    print("=== 测试 asyncio 版本取消超时项 ===")
+    cancelled = []
+
+    async def work(x):
+        try:
+            await asyncio.sleep(x)
+            return x
+        except asyncio.CancelledError:
+            cancelled.append(x)
+            raise
+
+    async def collect():
+        return [item async for item in aiter_completed(work, [0.01, 5.0, 0.02], item_timeout=0.2)]
+
+    start = time.perf_counter()
+    results = dict(asyncio.run(collect()))
+    assert time.perf_counter() - start < 0.5
+    assert isinstance(results[1], TimeoutError)
+    assert cancelled == [5.0]
+    print("✅ 超时的协程已取消\n")
+
+
+def test_iter_parallel_hedges_slow_call():
+    """测试 iter_parallel 在 stub 上的流式返回、时限和对冲"""
+    print("=== 测试 iter_parallel ===")
+    lock = threading.Lock()
+    seen = {}
+
+    def reply(body):
+        text = body["messages"][-1]["content"]
+        with lock:
+            seen[text] = seen.get(text, 0) + 1
+            first = seen[text] == 1
+        if "慢" in text and first:
+            time.sleep(1.5)
+        return f"已处理: {text.splitlines()[-1]}"
+
+    stub.configure(reply=reply)
+    inputs = ["告警 A", "告警 B", "慢告警 C", "告警 D"]
+    try:
+        start = time.perf_counter()
+        results = list(workflow.iter_parallel("分析告警", inputs, n_workers=4, hedge_after=0.3))
+        hedged_elapsed = time.perf_counter() - start
+
+        async def collect():
+            return [item async for item in workflow.aiter_parallel("总结告警", inputs, item_timeout=0.5)]
+
+        async_results = dict(asyncio.run(collect()))
+    finally:
+        stub.configure()
+
+    assert dict(results)[2] == "已处理: Input: 慢告警 C"
+    assert [index for index, _ in results][-1] == 2
+    assert seen["分析告警\nInput: 慢告警 C"] == 2
+    assert hedged_elapsed < 1.2
+    assert isinstance(async_results[2], TimeoutError)
+    assert async_results[0] == "已处理: Input: 告警 A"
+    print(f"✅ 对冲后 {hedged_elapsed:.2f}s 返回全部结果\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_completion_order_and_errors()
+        test_deadlines()
+        test_hedging()
+        test_concurrent_start_times()
+        test_async_cancels_stragglers()
+        test_iter_parallel_hedges_slow_call()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+LLM 响应缓存测试脚本
+
+检查 crisis/llm_cache.py 和 llm_call 的缓存路径，不访问真实 API：
+- 缓存键只由请求内容决定，字典键顺序不影响缓存键
+- 内存 LRU 淘汰后从 SQLite 命中，重新打开后仍可命中
+- 过期条目不返回，磁盘按最近访问时间淘汰
+- 读路径不写磁盘：命中（含内存命中）的访问时间批量写回；写入时不统计行数，超出上限 10% 才批量淘汰
+- 相同请求第二次不访问上游，use_cache=False 时跳过缓存
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+
+from stub_server import crisis_stub
+
+stub = crisis_stub()
+
+import util
+from llm_cache import LLMCache, make_cache_key
+
+
+def test_cache_key():
+    """测试缓存键"""
+    print("=== 测试缓存键 ===")
+    block = [{"type": "text", "text": "告警", "cache_control": {"type": "ephemeral"}}]
+    reordered = [{"cache_control": {"type": "ephemeral"}, "text": "告警", "type": "text"}]
+    key = make_cache_key("m", "", block, 0.1, 100)
+    assert key == make_cache_key("m", "", reordered, 0.1, 100)
+    for other in (("m2", "", block, 0.1, 100), ("m", "系统", block, 0.1, 100),
+                  ("m", "", "告警", 0.1, 100), ("m", "", block, 0.2, 100), ("m", "", block, 0.1, 200)):
+        assert make_cache_key(*other) != key, other
+    print("✅ 缓存键\n")
+
+
+def test_two_tier():
+    """测试内存 LRU 和 SQLite 两级缓存"""
+    print("=== 测试两级缓存 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "responses.db")
+        cache = LLMCache(path, memory_entries=2)
+        for i in range(3):
+            cache.put(f"k{i}", f"v{i}")
+        assert cache.get("k2") == "v2"  # 内存命中
+        assert cache.get("k0") == "v0"  # 已被 LRU 淘汰，从磁盘命中
+        assert cache.get("missing") is None
+        stats = cache.stats()
+        print(stats)
+        assert stats["memory_hits"] == 1 and stats["disk_hits"] == 1 and stats["misses"] == 1
+        assert stats["disk_entries"] == 3 and stats["memory_entries"] == 2 and stats["hit_rate"] == 0.6667
+        cache.close()
+
+        reopened = LLMCache(path)
+        assert reopened.get("k1") == "v1"
+        reopened.clear()
+        assert reopened.get("k1") is None
+        reopened.close()
+    print("✅ 两级缓存\n")
+
+
+def test_ttl_and_eviction():
+    """测试过期和磁盘淘汰"""
+    print("=== 测试过期和淘汰 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        expiring = LLMCache(os.path.join(tmp, "ttl.db"), ttl=0.1)
+        expiring.put("k", "v")
+        assert expiring.get("k") == "v"
+        time.sleep(0.15)
+        assert expiring.get("k") is None and expiring.stats()["expired"] >= 1
+        expiring.close()
+
+        bounded = LLMCache(os.path.join(tmp, "bounded.db"), max_entries=2, memory_entries=0)
+        bounded.put("a", "1")
+        bounded.put("b", "2")
+        time.sleep(0.01)
+        assert bounded.get("a") == "1"  # 访问后 a 比 b 新
+        time.sleep(0.01)
+        bounded.put("c", "3")
+        assert bounded.get("b") is None and bounded.get("a") == "1" and bounded.get("c") == "3"
+        assert bounded.stats()["evictions"] == 1
+        bounded.close()
+    print("✅ 过期和淘汰\n")
+
+
+def test_batched_touches():
+    """测试命中不提交磁盘事务，访问时间批量写回，淘汰按批进行"""
+    print("=== 测试批量写回 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "touches.db")
+        cache = LLMCache(path, max_entries=10, touch_batch=1000)
+        statements = []
+        cache._db.set_trace_callback(statements.append)
+        for i in range(11):
+            cache.put(f"k{i}", f"v{i}")
+            time.sleep(0.002)
+        assert not any("COUNT" in sql for sql in statements)  # 未超出上限 10%，不统计行数
+        assert cache.stats()["disk_entries"] == 11
+
+        # 内存命中同样刷新访问时间，但读路径不写磁盘
+        changes = cache._db.total_changes
+        for _ in range(3):
+            assert cache.get("k0") == "v0" and cache.get("k1") == "v1"
+        assert cache._db.total_changes == changes and not cache._db.in_transaction
+
+        statements.clear()
+        cache.put("k11", "v11")  # 超出上限 10%：写回访问时间后淘汰到 10 条
+        assert sum("COUNT" in sql for sql in statements) == 1
+        with sqlite3.connect(path) as db:
+            keys = {row[0] for row in db.execute("SELECT key FROM responses")}
+        assert len(keys) == 10 and {"k0", "k1"} <= keys and not keys & {"k2", "k3"}
+        assert cache.stats()["evictions"] == 2
+
+        cache.get("k5")
+        cache.flush()
+        with sqlite3.connect(path) as db:
+            newest = db.execute("SELECT key FROM responses ORDER BY accessed_at DESC LIMIT 1").fetchone()[0]
+        assert newest == "k5"
+        cache.close()
+    print("✅ 批量写回\n")
+
+
+def test_llm_call_cache():
+    """测试 llm_call 的相同请求命中缓存，不访问上游"""
+    print("=== 测试 llm_call 缓存 ===")
+    stub.configure(reply="缓存测试回答")
+    prompt = f"缓存测试问题 {time.monotonic()}"
+    try:
+        util.enable_cache()
+        before = len(stub.message_requests())
+        assert util.llm_call(prompt) == "缓存测试回答"
+        assert util.llm_call(prompt) == "缓存测试回答"
+        assert len(stub.message_requests()) - before == 1
+        util.llm_call(prompt, use_cache=False)
+        util.llm_call(prompt, temperature=0.5)
+        assert len(stub.message_requests()) - before == 3
+        stats = util.cache_stats()
+    finally:
+        util.disable_cache()
+        stub.configure()
+    print(stats)
+    assert stats["memory_hits"] == 1 and stats["writes"] == 2
+    assert util.cache_stats() == {}
+    print("✅ llm_call 缓存\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_cache_key()
+        test_two_tier()
+        test_ttl_and_eviction()
+        test_batched_touches()
+        test_llm_call_cache()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+流水线执行测试脚本
+
+检查 crisis/pipeline.py 的流水线执行和 workflow.chain_many / achain_many，不访问真实 API：
+- 结果按输入顺序返回，或按完成顺序返回
+- 单个输入失败时以 StageError 返回，其余输入不受影响
+- 每个阶段的并发不超过上限，消费方提前停止时不再读取新的输入
+- 多个输入的链式调用以流水线方式执行，总耗时明显少于逐个串行执行
+"""
+
+import asyncio
+import threading
+import time
+
+from stub_server import crisis_stub
+
+stub = crisis_stub()
+
+import workflow
+from pipeline import StageError, arun_pipeline, run_pipeline
+
+
+def test_ordered_and_unordered():
+    """测试按输入顺序和按完成顺序返回结果"""
+    print("=== 测试结果顺序 ===")
+
+    def slow_first(x):
+        # 序号越小越慢，完成顺序与输入顺序相反
+        time.sleep(0.05 * (5 - x))
+        return x * 10
+
+    ordered = list(run_pipeline(range(5), [slow_first, lambda x: x + 1], concurrency=[5, 1]))
+    assert ordered == [(i, i * 10 + 1) for i in range(5)]
+
+    completed = list(run_pipeline(range(5), [slow_first, lambda x: x + 1], concurrency=[5, 1], ordered=False))
+    assert sorted(completed) == ordered
+    assert [index for index, _ in completed] != list(range(5))
+    print(f"✅ 完成顺序: {[index for index, _ in completed]}\n")
+
+
+def test_error_isolation():
+    """测试单个输入失败不影响其他输入，错误注明失败的阶段"""
+    print("=== 测试错误隔离 ===")
+    calls = []
+
+    def second(x):
+        calls.append(x)
+        return x * 2
+
+    def parse(x):
+        if x == 3:
+            raise ValueError("无法解析")
+        return x
+
+    results = dict(run_pipeline(range(6), [parse, second], concurrency=2))
+    assert isinstance(results[3], StageError)
+    assert results[3].stage == 0 and isinstance(results[3].error, ValueError)
+    assert {i: r for i, r in results.items() if i != 3} == {0: 0, 1: 2, 2: 4, 4: 8, 5: 10}
+    # 失败的输入不再进入后续阶段
+    assert 3 not in calls
+    print(f"✅ {results[3]}\n")
+
+
+def test_concurrency_limit_and_early_stop():
+    """测试每个阶段的并发上限，以及消费方提前停止时不再读取输入"""
+    print("=== 测试并发上限和提前停止 ===")
+    lock = threading.Lock()
+    in_flight = [0]
+    peak = [0]
+    fed = []
+
+    def inputs():
+        for i in range(100):
+            fed.append(i)
+            yield i
+
+    def step(x):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.02)
+        with lock:
+            in_flight[0] -= 1
+        return x
+
+    results = run_pipeline(inputs(), [step], concurrency=3, queue_size=2)
+    first = [next(results) for _ in range(5)]
+    results.close()
+    time.sleep(0.2)
+    assert [index for index, _ in first] == list(range(5))
+    assert peak[0] <= 3
+    # 有界队列提供背压：只读取了少量超出已消费部分的输入
+    assert len(fed) < 20
+    print(f"✅ 最大并发 {peak[0]}，停止时读取了 {len(fed)} 个输入\n")
+
+
+def test_async_pipeline():
+    """测试异步流水线支持异步输入和错误隔离"""
+    print("=== 测试异步流水线 ===")
+
+    async def inputs():
+        for i in range(4):
+            yield i
+
+    async def step(x):
+        await asyncio.sleep(0.01 * (4 - x))
+        if x == 1:
+            raise RuntimeError("失败")
+        return x + 100
+
+    async def collect():
+        return [item async for item in arun_pipeline(inputs(), [step], concurrency=4)]
+
+    results = asyncio.run(collect())
+    assert [index for index, _ in results] == [0, 1, 2, 3]
+    assert isinstance(results[1][1], StageError)
+    assert [r for i, r in results if i != 1] == [100, 102, 103]
+    print("✅ 异步流水线按顺序返回\n")
+
+
+def test_chain_many_is_pipelined():
+    """测试 chain_many 的结果与 chain 一致，且以流水线方式执行"""
+    print("=== 测试 chain_many ===")
+    stub.configure(reply=lambda body: f"结果[{body['messages'][-1]['content'][-12:]}]", ttft=0.1)
+    prompts = ["概括以下事件", "列出可能原因", "给出排查建议"]
+    inputs = [f"服务 {i} 出现大量 504" for i in range(6)]
+    try:
+        start = time.perf_counter()
+        results = list(workflow.chain_many(inputs, prompts, concurrency=3))
+        elapsed = time.perf_counter() - start
+
+        async def collect():
+            return [item async for item in workflow.achain_many(inputs, prompts, concurrency=3, ordered=False)]
+
+        async_results = asyncio.run(collect())
+    finally:
+        stub.configure()
+
+    expected = [workflow.llm_call(f"{prompts[2]}\nInput: " + workflow.llm_call(
+        f"{prompts[1]}\nInput: " + workflow.llm_call(f"{prompts[0]}\nInput: {x}"))) for x in inputs]
+    assert [result for _, result in results] == expected
+    assert sorted(async_results) == results
+    # 逐个串行执行需要 6 × 3 × 0.1 = 1.8 秒以上
+    assert elapsed < 1.2
+    print(f"✅ 6 个输入 × 3 步耗时 {elapsed:.2f}s\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_ordered_and_unordered()
+        test_error_isolation()
+        test_concurrency_limit_and_early_stop()
+        test_async_pipeline()
+        test_chain_many_is_pipelined()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
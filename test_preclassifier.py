@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+告警本地预分类器测试脚本
+
+检查 crisis/preclassifier.py 和 analyze_alert 的本地分类路径，不访问真实 API：
+- 只命中一条规则时即使概率超过阈值也回退到 LLM；多条规则或已训练模型佐证时直接分类
+- 训练、保存和加载朴素贝叶斯模型，评估覆盖率和一致率
+- 本地直接分类时不调用分类 LLM；设置语料路径后按 audit_rate 抽样交给 LLM 复核并记录来源
+"""
+
+import json
+import os
+import tempfile
+from unittest import mock
+
+from stub_server import classification_reply, crisis_stub
+
+stub = crisis_stub()
+
+import workflow
+from preclassifier import PreClassifier, evaluate, load_corpus, record_sample
+from template_miner import TemplateClassificationCache
+
+SINGLE_SIGNAL = "告警: JS bridge 调用超时"
+MULTI_SIGNAL = "告警: HTTP 502 Bad Gateway，接口路径 /api/v1/order"
+
+
+def test_evidence_required():
+    """测试单条规则不足以直接分类"""
+    print("=== 测试佐证要求 ===")
+    classifier = PreClassifier(threshold=0.9)
+    category, probability = classifier.classify(SINGLE_SIGNAL)
+    print(f"单条规则: 概率 {probability:.4f}")
+    assert category is None and probability > 0.9
+    assert classifier.classify(MULTI_SIGNAL)[0] == "backend_api_error"
+    assert classifier.classify("订单服务响应变慢")[0] is None
+    assert PreClassifier(min_signals=1).classify(SINGLE_SIGNAL)[0] == "uni_error"
+    stats = classifier.stats()
+    print(stats)
+    assert stats["decided"] == 1 and stats["deferred"] == 2 and stats["unsupported"] == 1
+    print("✅ 佐证要求\n")
+
+
+def test_trained_model():
+    """测试训练后的模型佐证单条规则，模型可保存和加载"""
+    print("=== 测试模型训练 ===")
+    samples = [(f"JS bridge 第 {i} 次调用超时，原生模块无响应", "uni_error") for i in range(5)]
+    samples += [(f"订单接口 {i} 返回 HTTP 500", "backend_api_error") for i in range(5)]
+    samples += [(f"TypeError: x{i} is not a function", "javascript_error") for i in range(5)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "model.json")
+        classifier = PreClassifier(threshold=0.9)
+        classifier.train(samples)
+        classifier.save(path)
+        loaded = PreClassifier(path, threshold=0.9)
+    assert loaded.trained and loaded.class_counts == {c: 5 for c in ("uni_error", "backend_api_error", "javascript_error")}
+    assert loaded.classify(SINGLE_SIGNAL)[0] == "uni_error"
+    # 模型与规则不一致时不直接分类
+    assert not loaded.supported("订单接口返回 HTTP 500", "uni_error")
+
+    report = evaluate(loaded, samples)
+    print(report)
+    assert report["samples"] == 15 and report["agreement"] == 1.0 and report["coverage"] > 0.5
+    print("✅ 模型训练\n")
+
+
+def test_local_decision_and_audit():
+    """测试本地直接分类不调用分类 LLM，抽样复核的告警交给 LLM 并记录为 audit 样本"""
+    print("=== 测试本地分类和抽样复核 ===")
+    stub.configure(reply=classification_reply)
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = os.path.join(tmp, "corpus.jsonl")
+        try:
+            with mock.patch.object(workflow, "template_cache", TemplateClassificationCache(None)):
+                with mock.patch.dict(workflow.PRECLASSIFIER_CONFIG, {"corpus_path": None}):
+                    before = len(stub.message_requests())
+                    result = workflow.analyze_alert(MULTI_SIGNAL, source="preclassifier-test")
+                    bodies = stub.message_requests()[before:]
+                    assert "本地预分类器" in result and len(bodies) == 1
+                    assert "智能告警分类代理" not in str(bodies[0]["messages"])
+
+                with mock.patch.dict(workflow.PRECLASSIFIER_CONFIG, {"corpus_path": corpus, "audit_rate": 1.0}):
+                    before = len(stub.message_requests())
+                    workflow.analyze_alert(MULTI_SIGNAL, source="preclassifier-test")
+                    workflow.analyze_alert(SINGLE_SIGNAL, source="preclassifier-test")
+                    bodies = stub.message_requests()[before:]
+        finally:
+            stub.configure()
+        assert sum("智能告警分类代理" in str(body["messages"]) for body in bodies) >= 2
+        with open(corpus, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        assert [(r["alert"], r["source"]) for r in records] == [(MULTI_SIGNAL, "audit"), (SINGLE_SIGNAL, "deferred")]
+        assert load_corpus(corpus) == [(MULTI_SIGNAL, "backend_api_error"), (SINGLE_SIGNAL, "backend_api_error")]
+
+        record_sample(corpus, "告警", "uni_error")
+        with open(corpus, encoding="utf-8") as f:
+            assert json.loads(f.readlines()[-1])["source"] == "deferred"
+    print("✅ 本地分类和抽样复核\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_evidence_required()
+        test_trained_model()
+        test_local_decision_and_audit()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
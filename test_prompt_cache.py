@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+提示词前缀缓存测试脚本
+
+使用本地 stub 服务器（stub_server.py）检查请求结构，不访问真实 API：
+- 前缀达到模型的最小可缓存长度（Sonnet 1024、Haiku 2048 token）才带 cache_control 断点，不足时不发送断点
+- MCPWeatherAgent 的默认系统提示词不足最小长度，不带断点；足够长的自定义系统提示词带断点并命中缓存
+- crisis 工作流的提示词为「静态前缀 + 告警等可变内容」，目前的模板前缀都不足最小长度
+- usage 中的缓存写入/命中 token 数被正确汇总
+"""
+
+from unittest import mock
+
+from stub_server import classification_reply, crisis_stub
+
+stub = crisis_stub()
+
+from agent import MCPWeatherAgent, WEATHER_SYSTEM_PROMPT, cached_system
+from prompts import apply_cache_minimum, cache_min_tokens
+from tokens import estimate_tokens
+
+WEATHER_MODEL = "claude-sonnet-4-20250514"
+HAIKU = "claude-3-5-haiku-20241022"
+SONNET = "claude-3-5-sonnet-20241022"
+BREAKPOINT = {"cache_control": {"type": "ephemeral"}}
+
+
+def _long_text(tokens: int) -> str:
+    """约 tokens 个 token 的固定说明文本"""
+    return "处理告警时先确认影响范围。" * (tokens // 12 + 1)
+
+
+def test_cache_minimum():
+    """测试断点只在前缀达到模型的最小可缓存长度时保留"""
+    print("=== 测试最小可缓存长度 ===")
+    assert cache_min_tokens(SONNET) == 1024 and cache_min_tokens(HAIKU) == 2048
+    assert cache_min_tokens(WEATHER_MODEL) == 1024
+
+    middle = _long_text(1500)
+    assert 1024 <= estimate_tokens(middle) < 2048
+    blocks = [{"type": "text", "text": middle, **BREAKPOINT}, {"type": "text", "text": "告警内容"}]
+    assert apply_cache_minimum(blocks, SONNET) == blocks
+    assert apply_cache_minimum(blocks, HAIKU) == [{"type": "text", "text": middle}, {"type": "text", "text": "告警内容"}]
+    assert "cache_control" in blocks[0]  # 不修改传入的内容块
+    # 系统提示词计入前缀
+    short = [{"type": "text", "text": "简短说明", **BREAKPOINT}]
+    assert "cache_control" not in apply_cache_minimum(short, SONNET)[0]
+    assert "cache_control" in apply_cache_minimum(short, SONNET, prefix_tokens=1100)[0]
+    assert apply_cache_minimum("纯文本", HAIKU) == "纯文本"
+
+    # 天气智能体的默认系统提示词（约 140 token）不带断点
+    assert estimate_tokens(WEATHER_SYSTEM_PROMPT) < 1024
+    assert cached_system(WEATHER_SYSTEM_PROMPT, WEATHER_MODEL) == [{"type": "text", "text": WEATHER_SYSTEM_PROMPT}]
+    print("✅ 最小可缓存长度\n")
+
+
+def test_llm_call_breakpoints():
+    """测试 llm_call 按实际模型决定是否发送断点"""
+    print("=== 测试 llm_call 断点 ===")
+    import util
+
+    stub.configure(reply="断点测试回答")
+    middle = _long_text(1500)
+    try:
+        kept = []
+        for model in (SONNET, SONNET, HAIKU):
+            before = len(stub.message_requests())
+            util.llm_call([{"type": "text", "text": middle, **BREAKPOINT}, {"type": "text", "text": f"问题 {model}"}],
+                          model=model, use_cache=False, hedge=False)
+            body = stub.message_requests()[before]
+            kept.append("cache_control" in body["messages"][0]["content"][0])
+    finally:
+        stub.configure()
+    assert kept == [True, True, False]
+    print("✅ llm_call 断点\n")
+
+
+def test_weather_agent_system_prompt_cached():
+    """测试天气智能体：默认系统提示词不带断点，足够长的系统提示词带断点并在第二次调用命中缓存"""
+    stub.configure(reply=classification_reply)
+    print("=== 测试天气智能体系统提示词缓存 ===")
+    agent = MCPWeatherAgent(api_key="stub-key", mcp_server_url=f"{stub.url}/mcp", base_url=stub.url)
+    start = len(stub.message_requests())
+
+    agent.chat("旧金山今天的天气如何？")
+    default_usage = agent.last_usage
+    long_prompt = WEATHER_SYSTEM_PROMPT + "\n" + _long_text(1100)
+    agent.chat("纽约今天的天气如何？", system_prompt=long_prompt)
+    first_usage = agent.last_usage
+    agent.chat("洛杉矶今天的天气如何？", system_prompt=long_prompt)
+    second_usage = agent.last_usage
+
+    bodies = stub.message_requests()[start:]
+    assert len(bodies) == 3
+    assert bodies[0]["system"] == [{"type": "text", "text": WEATHER_SYSTEM_PROMPT}]
+    for body in bodies[1:]:
+        assert body["system"] == [{"type": "text", "text": long_prompt, **BREAKPOINT}]
+    for body in bodies:
+        assert body["mcp_servers"][0]["name"] == "weather-server"
+    headers = [r["headers"] for r in stub.requests if r["path"].startswith("/v1/messages")][-1]
+    assert "mcp-client-2025-04-04" in headers.get("anthropic-beta", "")
+
+    assert default_usage["cache_creation_input_tokens"] == 0 and default_usage["cache_read_input_tokens"] == 0
+    assert first_usage["cache_creation_input_tokens"] > 0
+    assert second_usage["cache_read_input_tokens"] > 0
+    print(f"✅ 默认系统提示词: {default_usage}")
+    print(f"✅ 第一次调用: {first_usage}")
+    print(f"✅ 第二次调用: {second_usage}\n")
+
+
+def test_weather_agent_stream_usage():
+    """测试流式调用同样按长度带缓存断点并记录缓存命中"""
+    stub.configure(reply=classification_reply)
+    print("=== 测试天气智能体流式调用 ===")
+    agent = MCPWeatherAgent(api_key="stub-key", mcp_server_url=f"{stub.url}/mcp", base_url=stub.url)
+    long_prompt = WEATHER_SYSTEM_PROMPT + "\n" + _long_text(1100)
+    agent.chat("芝加哥的天气如何？", system_prompt=long_prompt)
+    response = agent.chat_stream("迈阿密的天气如何？", system_prompt=long_prompt)
+    print()
+
+    body = stub.message_requests()[-1]
+    assert body["stream"] is True
+    assert body["system"] == cached_system(long_prompt, WEATHER_MODEL)
+    assert "cache_control" in body["system"][0]
+    assert response == "stub 分析结果"
+    assert agent.last_usage["cache_read_input_tokens"] > 0
+    print(f"✅ 流式调用用量: {agent.last_usage}\n")
+
+
+def test_workflow_prompt_prefix():
+    """测试工作流提示词为静态前缀 + 可变后缀，静态前缀在不同告警间一致，不足最小长度时不带断点"""
+    stub.configure(reply=classification_reply)
+    print("=== 测试告警工作流提示词前缀 ===")
+    import util
+    import workflow
+
+    alerts = ["订单服务响应变慢，用户反馈页面卡顿", "支付服务响应变慢，部分用户无法下单"]
+    start = len(stub.message_requests())
+    # 不写入模板缓存文件；每条告警只发送一次分类请求，关闭分类的模型级联（见 test_cascade.py）
+    with mock.patch.object(workflow.template_cache, "path", None), \
+            mock.patch.dict(workflow.MODEL_CASCADE_CONFIG, enabled=False):
+        for alert in alerts:
+            workflow.analyze_alert(alert, source="prompt-cache-test")
+
+    bodies = stub.message_requests()[start:]
+    classification = [b for b in bodies if "智能告警分类代理" in str(b["messages"])]
+    specialized = [b for b in bodies if b not in classification]
+    assert len(classification) == 2 and len(specialized) == 2
+
+    for group in (classification, specialized):
+        prefixes = []
+        for body, alert in zip(group, alerts):
+            blocks = body["messages"][0]["content"]
+            # 目前的模板前缀（约 400～800 token）都不足模型的最小可缓存长度
+            assert estimate_tokens(blocks[0]["text"]) < cache_min_tokens(body["model"])
+            assert "cache_control" not in blocks[0]
+            assert alert not in blocks[0]["text"]
+            assert alert in blocks[-1]["text"]
+            prefixes.append(blocks[0]["text"])
+        assert prefixes[0] == prefixes[1]
+    print(f"✅ 工作流累计用量: {util.usage_stats()}\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_cache_minimum()
+        test_llm_call_breakpoints()
+        test_weather_agent_system_prompt_cached()
+        test_weather_agent_stream_usage()
+        test_workflow_prompt_prefix()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
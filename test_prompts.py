@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+提示词模板注册表测试脚本
+
+检查 crisis/prompts.py 和工作流的提示词渲染，不访问真实 API：
+- 模板预编译为静态片段和变量片段，未提供的变量保留占位符
+- render_blocks 把静态前缀放在带 cache_control 的第一块
+- 路径与当前工作目录无关；只有文件修改时间变化时才重新加载，检查间隔内不访问文件系统
+- 工作流的分类和专项分析请求由注册表渲染，静态前缀不足模型的最小可缓存长度时发送前去掉缓存断点
+"""
+
+import os
+import tempfile
+import time
+from unittest import mock
+
+from stub_server import classification_reply, crisis_stub
+
+stub = crisis_stub()
+
+import workflow
+from config import PROMPT_TEMPLATES
+from prompts import PromptRegistry, PromptTemplate
+from template_miner import TemplateClassificationCache
+
+
+def test_template_render():
+    """测试模板预编译和渲染"""
+    print("=== 测试模板渲染 ===")
+    template = PromptTemplate("t", "说明\n<alert>{{ALERT}}</alert>\n历史: {{HISTORY}}")
+    assert template.variables == ["ALERT", "HISTORY"]
+    assert template.static_prefix == "说明\n<alert>"
+    assert template.render(ALERT="502") == "说明\n<alert>502</alert>\n历史: {{HISTORY}}"
+
+    blocks = template.render_blocks(ALERT="502", HISTORY="无")
+    assert blocks[0] == {"type": "text", "text": "说明\n<alert>", "cache_control": {"type": "ephemeral"}}
+    assert blocks[1] == {"type": "text", "text": "502</alert>\n历史: 无"}
+    # 没有静态前缀或只有静态内容时只生成一块
+    assert PromptTemplate("v", "{{X}} 尾部").render_blocks(X="a") == [{"type": "text", "text": "a 尾部"}]
+    assert len(PromptTemplate("s", "只有静态内容").render_blocks()) == 1
+    print("✅ 模板渲染\n")
+
+
+def test_registry_reload():
+    """测试与工作目录无关的加载和按修改时间重新加载"""
+    print("=== 测试注册表重新加载 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "greeting.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("你好 {{NAME}}")
+        registry = PromptRegistry(tmp, {"greeting": "greeting.md"}, check_interval=0.1)
+        cwd = os.getcwd()
+        os.chdir(tempfile.gettempdir())
+        try:
+            registry.preload()
+        finally:
+            os.chdir(cwd)
+        first = registry.get("greeting")
+        assert registry.render("greeting", NAME="值班") == "你好 值班"
+
+        # 检查间隔内不访问文件系统
+        with mock.patch("prompts.os.stat", side_effect=AssertionError("不应访问文件系统")):
+            assert registry.get("greeting") is first
+
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("您好 {{NAME}}")
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        time.sleep(0.15)
+        assert registry.render("greeting", NAME="值班") == "您好 值班"
+        reloaded = registry.get("greeting")
+        assert reloaded is not first
+
+        # 文件暂时不可访问时继续使用已加载的版本
+        os.remove(path)
+        time.sleep(0.15)
+        assert registry.get("greeting") is reloaded
+    print("✅ 注册表重新加载\n")
+
+
+def test_workflow_prompts():
+    """测试工作流的所有模板可加载，请求内容由注册表渲染"""
+    print("=== 测试工作流提示词 ===")
+    for name in PROMPT_TEMPLATES:
+        template = workflow.prompt_registry.get(name)
+        assert "ALERT_DETAILS" in template.variables, name
+
+    stub.configure(reply=classification_reply)
+    try:
+        with mock.patch.object(workflow, "template_cache", TemplateClassificationCache(None)), \
+                mock.patch.dict(workflow.PRECLASSIFIER_CONFIG, {"enabled": False}):
+            before = len(stub.message_requests())
+            workflow.analyze_alert("告警级别: ERROR\n错误信息: 订单接口返回 HTTP 502", source="prompts-test")
+            bodies = stub.message_requests()[before:]
+    finally:
+        stub.configure()
+    classification = workflow.prompt_registry.get("classification")
+    analysis = workflow.prompt_registry.get("backend_api_error")
+    contents = [body["messages"][0]["content"] for body in bodies]
+    assert contents[0][0]["text"] == classification.static_prefix and "cache_control" not in contents[0][0]
+    assert contents[-1][0]["text"] == analysis.static_prefix
+    assert "HTTP 502" in contents[-1][1]["text"] and "{{" not in contents[-1][1]["text"]
+    print("✅ 工作流提示词\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_template_render()
+        test_registry_reload()
+        test_workflow_prompts()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+相似历史事件检索测试脚本
+
+检查 crisis/retrieval.py 和专项分析提示词中的相似事件注入，不访问真实 API：
+- 中英文混合分词（英文按词、中文按字二元组）
+- BM25 按相关性排序，替换文档后旧词项不再命中
+- 摘要不超过 token 预算，低于 min_score 的事件不注入
+- 专项分析请求包含检索到的相似事件，新增的事件立即可检索
+"""
+
+from unittest import mock
+
+from stub_server import classification_reply, crisis_stub
+
+stub = crisis_stub()
+
+import workflow
+from config import KNOWLEDGE_BASE
+from retrieval import BM25Index, IncidentRetriever, tokenize
+from tokens import estimate_tokens
+
+
+def test_tokenize():
+    """测试中英文混合分词"""
+    print("=== 测试分词 ===")
+    assert tokenize("uni.request 超时") == ["uni.request", "超时"]
+    assert tokenize("数据库连接 HTTP 502") == ["http", "502", "数据", "据库", "库连", "连接"]
+    assert tokenize("慢") == ["慢"]
+    print("✅ 分词\n")
+
+
+def test_bm25_ranking():
+    """测试 BM25 排序和文档替换"""
+    print("=== 测试 BM25 排序 ===")
+    index = BM25Index()
+    index.add("db", "数据库连接池耗尽 新连接无法建立")
+    index.add("cpu", "CPU使用率持续90%以上 系统响应缓慢")
+    index.add("login", "uni服务请求超时 用户无法登录")
+    hits = index.search("数据库连接失败", k=2)
+    assert hits[0][1] == "db" and len(hits) == 1
+    # 只共享 "无法" 的文档排在最后
+    ranked = [doc_id for _, doc_id, _ in index.search("系统响应缓慢 用户无法登录")]
+    assert set(ranked[:2]) == {"cpu", "login"} and ranked[2] == "db"
+
+    # 替换文档后旧词项不再命中
+    index.add("db", "磁盘空间不足")
+    assert index.search("数据库连接失败") == [] and len(index) == 3
+    assert index.search("磁盘")[0][1] == "db"
+    assert BM25Index().search("任意") == []
+    print("✅ BM25 排序\n")
+
+
+def test_summary_budget():
+    """测试摘要 token 预算和最低得分"""
+    print("=== 测试摘要预算 ===")
+    retriever = IncidentRetriever(KNOWLEDGE_BASE, top_k=3, token_budget=40)
+    context = retriever.context_for("数据库连接池耗尽，uni服务请求超时，CPU使用率持续90%")
+    print(context)
+    assert context.startswith("- [incident_00") and estimate_tokens(context) <= 40 + 3
+    assert retriever.context_for("完全无关的内容 xyz") == "无"
+
+    strict = IncidentRetriever(KNOWLEDGE_BASE, min_score=100.0)
+    assert strict.retrieve("数据库连接池耗尽") == []
+    stats = retriever.stats()
+    print(stats)
+    assert stats["indexed_incidents"] == len(KNOWLEDGE_BASE) and stats["retrievals"] == 2
+    assert 0 < stats["injected_tokens"] <= 43
+    print("✅ 摘要预算\n")
+
+
+def test_prompt_injection():
+    """测试专项分析请求包含相似事件，新增事件立即可检索"""
+    print("=== 测试提示词注入 ===")
+    retriever = IncidentRetriever(KNOWLEDGE_BASE)
+    alert = "告警级别: ERROR\n错误信息: 数据库连接池耗尽，订单接口无法读取用户数据"
+    stub.configure(reply=classification_reply)
+    try:
+        with mock.patch.object(workflow, "retriever", retriever), \
+                mock.patch.object(workflow.template_cache, "path", None):
+            before = len(stub.message_requests())
+            workflow.analyze_alert(alert, source="retrieval-test")
+            analysis = str(stub.message_requests()[-1]["messages"])
+            assert len(stub.message_requests()) > before
+            assert "<similar_incidents>" in analysis and "[incident_002]" in analysis
+
+            workflow.add_incident("incident_new", {
+                "description": "订单接口连接池配置错误导致无法读取用户数据",
+                "cause": "发布时连接池上限被改为 1",
+                "solution": "回滚配置",
+            })
+            workflow.analyze_alert(alert, source="retrieval-test")
+            analysis = str(stub.message_requests()[-1]["messages"])
+            assert "[incident_new]" in analysis and "回滚配置" in analysis
+            stats = workflow.retrieval_stats()
+    finally:
+        stub.configure()
+    print(stats)
+    assert stats["retrievals"] == 2 and stats["indexed_incidents"] == len(KNOWLEDGE_BASE) + 1
+    print("✅ 提示词注入\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_tokenize()
+        test_bm25_ranking()
+        test_summary_budget()
+        test_prompt_injection()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
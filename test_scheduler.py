@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+限流感知并行调度器测试脚本
+
+检查 crisis/scheduler.py 和 parallel(..., scheduler=...)，不访问真实 API：
+- 判断异常是否可重试、是否为限流信号，读取 retry-after
+- 令牌桶的取出、归还和等待时间；RPM 预算限制请求速率
+- 遇到 429/529 时并发减半并暂停到 retry-after 之后，成功时并发加性增长
+- 不可重试的错误只影响对应输入，其余结果照常返回
+"""
+
+import threading
+import time
+from unittest import mock
+
+import anthropic
+import httpx
+
+from stub_server import Fault, crisis_stub
+
+stub = crisis_stub()
+
+import workflow
+from admission import TokenBucket
+from scheduler import RateLimitScheduler, retry_info
+
+
+def _status_error(status: int, headers=None) -> anthropic.APIStatusError:
+    request = httpx.Request("POST", "http://stub/v1/messages")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return anthropic.APIStatusError(f"HTTP {status}", response=response, body=None)
+
+
+def test_retry_info():
+    """测试可重试判断和 retry-after 解析"""
+    print("=== 测试重试判断 ===")
+    assert retry_info(_status_error(429, {"retry-after": "2"})) == (True, True, 2.0)
+    assert retry_info(_status_error(529, {"retry-after-ms": "250"})) == (True, True, 0.25)
+    assert retry_info(_status_error(503)) == (True, False, None)
+    assert retry_info(_status_error(400)) == (False, False, None)
+    assert retry_info(ValueError()) == (False, False, None)
+    print("✅ 重试判断\n")
+
+
+def test_token_bucket():
+    """测试令牌桶的取出、归还和等待时间"""
+    print("=== 测试令牌桶 ===")
+    bucket = TokenBucket(rate=10.0, capacity=2)
+    assert bucket.try_acquire() and bucket.try_acquire() and not bucket.try_acquire()
+    assert 0.05 < bucket.wait_time() <= 0.1
+    bucket.release()
+    assert bucket.wait_time() == 0.0 and bucket.try_acquire()
+    bucket.release(5)  # 归还不超过容量
+    assert bucket.tokens <= 2
+
+    # RPM=600（每秒 10 个，突发 1 个）时 6 个请求至少需要 0.5 秒
+    scheduler = RateLimitScheduler(rpm=600, tpm=10 ** 6, initial_concurrency=4)
+    scheduler._request_bucket = TokenBucket(10.0, 1)
+    start = time.monotonic()
+    assert scheduler.map(lambda x: x * 2, range(6)) == [0, 2, 4, 6, 8, 10]
+    assert time.monotonic() - start >= 0.45
+    print("✅ 令牌桶\n")
+
+
+def test_aimd():
+    """测试限流时并发减半并遵守 retry-after，成功后并发加性增长"""
+    print("=== 测试 AIMD ===")
+    scheduler = RateLimitScheduler(rpm=6000, tpm=10 ** 6, initial_concurrency=8, max_concurrency=16,
+                                   base_backoff=0.01)
+    attempts = []
+    lock = threading.Lock()
+
+    def call(item):
+        with lock:
+            attempts.append((item, time.monotonic()))
+            first = sum(1 for i, _ in attempts if i == item) == 1
+        if item == 0 and first:
+            raise _status_error(529, {"retry-after": "0.3"})
+        return item
+
+    start = time.monotonic()
+    assert scheduler.map(call, range(4)) == [0, 1, 2, 3]
+    stats = scheduler.stats()
+    print(stats)
+    retried_at = [t for i, t in attempts if i == 0][1]
+    assert retried_at - start >= 0.3
+    assert stats["rate_limited"] == 1 and stats["retries"] == 1 and stats["completed"] == 4
+    assert 4 <= stats["concurrency_limit"] < 8
+
+    for _ in range(20):
+        scheduler.run(lambda: None)
+    assert scheduler.concurrency_limit > stats["concurrency_limit"]
+    print("✅ AIMD\n")
+
+
+def test_parallel_with_scheduler():
+    """测试 parallel 使用调度器：限流后重试成功，不可重试的错误不丢弃其他结果"""
+    print("=== 测试 parallel 调度 ===")
+    stub.configure(reply="调度回答")
+    stub.enqueue(Fault("529", retry_after=0.1))
+    scheduler = workflow.create_scheduler(initial_concurrency=2, base_backoff=0.01)
+    try:
+        results = workflow.parallel("调度测试", [f"输入 {i} {time.monotonic()}" for i in range(3)], scheduler=scheduler)
+    finally:
+        stub.configure()
+    assert results == ["调度回答"] * 3
+    assert scheduler.stats()["rate_limited"] == 1
+
+    def flaky_call(prompt, **kwargs):
+        if "坏输入" in prompt:
+            raise _status_error(400)
+        return "好结果"
+
+    with mock.patch.object(workflow, "llm_call", flaky_call):
+        results = workflow.parallel("调度测试", ["输入 a", "坏输入", "输入 b"], scheduler=workflow.create_scheduler())
+    assert results[0] == results[2] == "好结果"
+    assert isinstance(results[1], anthropic.APIStatusError) and results[1].status_code == 400
+    print("✅ parallel 调度\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_retry_info()
+        test_token_bucket()
+        test_aimd()
+        test_parallel_with_scheduler()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
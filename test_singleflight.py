@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+相同请求合并（single-flight）测试脚本
+
+检查 crisis/singleflight.py 和 llm_call / async_llm_call 的请求合并，不访问真实 API：
+- 并发的相同请求只调用一次上游，结果和异常共享给所有等待者
+- 领导者协程被取消时上游调用继续，等待者照常拿到结果；所有等待者都取消后才取消上游调用
+- 跨进程合并：等待锁的一方从共享存储读取结果，锁文件用完即删除
+- 并发的相同 LLM 请求只发送一次
+"""
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from stub_server import crisis_stub
+
+stub = crisis_stub()
+
+import util
+from llm_cache import LLMCache
+from singleflight import FileLockSingleFlight, SingleFlight
+
+
+def test_threads():
+    """测试线程间合并，异常共享给等待者"""
+    print("=== 测试线程合并 ===")
+    flight = SingleFlight()
+    calls = []
+
+    def slow(value):
+        def fn():
+            calls.append(value)
+            time.sleep(0.2)
+            if isinstance(value, Exception):
+                raise value
+            return value
+        return fn
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        results = list(executor.map(lambda _: flight.do("k", slow("结果")), range(5)))
+        assert results == ["结果"] * 5 and calls == ["结果"]
+
+        futures = [executor.submit(flight.do, "err", slow(ValueError("上游失败"))) for _ in range(3)]
+        errors = [f.exception() for f in futures]
+    assert all(isinstance(e, ValueError) for e in errors) and len(calls) == 2
+    stats = flight.stats()
+    assert stats["leaders"] == 2 and stats["coalesced"] == 6 and stats["in_flight"] == 0
+    print("✅ 线程合并\n")
+
+
+def test_async_leader_cancelled():
+    """测试领导者被取消时等待者仍拿到结果，全部取消时才取消上游调用"""
+    print("=== 测试领导者取消 ===")
+    flight = SingleFlight()
+    started, cancelled = [], []
+
+    async def upstream():
+        started.append(1)
+        try:
+            await asyncio.sleep(0.2)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+        return "共享结果"
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.ado("k", upstream))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.ensure_future(flight.ado("k", upstream)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(*waiters)
+        assert leader.cancelled() and results == ["共享结果"] * 3
+        assert started == [1] and cancelled == []
+
+        # 所有等待者都取消：上游调用被取消，新的相同请求重新发起
+        tasks = [asyncio.ensure_future(flight.ado("k2", upstream)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert cancelled == [1]
+        assert await flight.ado("k2", upstream) == "共享结果" and len(started) == 3
+
+    asyncio.run(scenario())
+    stats = flight.stats()
+    print(stats)
+    assert stats["leaders"] == 3 and stats["coalesced"] == 4 and stats["in_flight"] == 0
+    print("✅ 领导者取消\n")
+
+
+def test_file_lock():
+    """测试跨进程合并和锁文件清理（两个实例模拟两个进程）"""
+    print("=== 测试跨进程合并 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LLMCache()
+        first = FileLockSingleFlight(tmp, store)
+        second = FileLockSingleFlight(tmp, store)
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return "跨进程结果"
+
+        leader = threading.Thread(target=first.do, args=("key", slow))
+        leader.start()
+        time.sleep(0.05)
+        assert os.listdir(tmp) == ["key.lock"]
+        assert second.do("key", slow) == "跨进程结果"
+        leader.join()
+        assert calls == [1] and os.listdir(tmp) == []
+        assert second.stats()["cross_process_coalesced"] == 1 and first.stats()["cross_process_leaders"] == 1
+
+        # 锁文件删除后，后续请求照常加锁并直接命中共享存储
+        assert first.do("key", slow) == "跨进程结果" and calls == [1] and os.listdir(tmp) == []
+    print("✅ 跨进程合并\n")
+
+
+def test_llm_coalescing():
+    """测试并发的相同 LLM 请求只发送一次，领导者取消不影响其他请求"""
+    print("=== 测试 LLM 请求合并 ===")
+
+    def slow_reply(body):
+        time.sleep(0.3)
+        return "合并回答"
+
+    stub.configure(reply=slow_reply)
+    prompt = f"合并测试问题 {time.monotonic()}"
+
+    async def scenario():
+        leader = asyncio.ensure_future(util.async_llm_call(prompt))
+        await asyncio.sleep(0.05)
+        waiters = [asyncio.ensure_future(util.async_llm_call(prompt)) for _ in range(4)]
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        return await asyncio.gather(*waiters)
+
+    try:
+        before = len(stub.message_requests())
+        assert asyncio.run(scenario()) == ["合并回答"] * 4
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: util.llm_call(prompt + " 同步"), range(4)))
+        assert results == ["合并回答"] * 4
+        assert len(stub.message_requests()) - before == 2
+    finally:
+        stub.configure()
+    print("✅ LLM 请求合并\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_threads()
+        test_async_leader_cancelled()
+        test_file_lock()
+        test_llm_coalescing()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+推测执行测试脚本
+
+检查 crisis/speculation.py 和 route / analyze_alert 的推测路径，不访问真实 API：
+- 预测命中时复用已启动的分支调用，未命中时取消推测调用并按实际分支重新调用
+- 推测并发数和浪费的 token 数受预算限制，预算不足时按顺序执行
+- 同步接口在已有事件循环的线程中也能推测执行，多次调用共用同一个后台事件循环和异步客户端
+- 命中时分类与专项分析并发，端到端延迟接近一次调用
+"""
+
+import asyncio
+import time
+from unittest import mock
+
+from stub_server import crisis_stub
+
+stub = crisis_stub()
+
+import util
+import workflow
+from speculation import SpeculationBudget, speculate
+from template_miner import TemplateClassificationCache
+
+ROUTES = {
+    "billing": "你是账单支持专员，处理退款、发票和扣费问题。",
+    "technical": "你是技术支持专员，处理登录失败、报错和性能问题。",
+}
+
+
+def _branch_log():
+    started, cancelled = [], []
+
+    async def branch(key):
+        started.append(key)
+        try:
+            await asyncio.sleep(0.1)
+        except asyncio.CancelledError:
+            cancelled.append(key)
+            raise
+        return f"{key} 结果"
+    return branch, started, cancelled
+
+
+def test_speculate():
+    """测试命中、未命中和决策失败"""
+    print("=== 测试推测执行 ===")
+
+    async def decide_as(key, delay=0.1):
+        await asyncio.sleep(delay)
+        return key
+
+    branch, started, cancelled = _branch_log()
+    start = time.monotonic()
+    decision, result, hit = asyncio.run(speculate(lambda: decide_as("a"), str, branch, "a"))
+    assert (decision, result, hit) == ("a", "a 结果", True) and started == ["a"]
+    assert time.monotonic() - start < 0.18  # 决策与分支并发
+
+    decision, result, hit = asyncio.run(speculate(lambda: decide_as("b"), str, branch, "a"))
+    assert (result, hit) == ("b 结果", False) and started == ["a", "a", "b"] and cancelled == ["a"]
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("分类失败")
+
+    try:
+        asyncio.run(speculate(failing, str, branch, "a"))
+        assert False, "应抛出决策异常"
+    except ValueError:
+        pass
+    assert cancelled == ["a", "a"]
+    print("✅ 推测执行\n")
+
+
+def test_budget():
+    """测试推测预算"""
+    print("=== 测试推测预算 ===")
+    budget = SpeculationBudget(max_in_flight=1, waste_tokens_per_min=100)
+    assert budget.try_acquire(50) and not budget.try_acquire(50)  # 并发上限
+    budget.release(False, 80)
+    assert not budget.try_acquire(50)  # 浪费预算不足
+    assert budget.try_acquire(10)
+    budget.release(True, 10)
+
+    async def decide():
+        return "b"
+
+    branch, started, _ = _branch_log()
+    empty = SpeculationBudget(max_in_flight=0)
+    _, result, hit = asyncio.run(speculate(decide, str, branch, "a", empty, 10))
+    assert (result, hit) == ("b 结果", None) and started == ["b"]
+    stats = budget.stats()
+    print(stats)
+    assert stats["speculated"] == 2 and stats["hits"] == 1 and stats["misses"] == 1 and stats["wasted_tokens"] == 80
+    assert stats["skipped"] == 2 and stats["in_flight"] == 0
+    print("✅ 推测预算\n")
+
+
+def test_sync_route_in_running_loop():
+    """测试同步 route 在事件循环中推测执行，多次调用共用一个异步客户端"""
+    print("=== 测试同步接口的后台事件循环 ===")
+
+    def reply(body):
+        text = str(body["messages"])
+        if "select the most appropriate support team" in text:
+            return "<reasoning>登录报错</reasoning><selection>technical</selection><confidence>high</confidence>"
+        return "技术支持回答"
+
+    stub.configure(reply=reply)
+    ticket = f"登录失败，页面报错 {time.monotonic()}"
+    try:
+        assert workflow.route(ticket, ROUTES, speculative=True) == "技术支持回答"
+        clients = len(util._async_clients)
+
+        async def inside_loop():
+            return workflow.route(ticket + " 再次", ROUTES, speculative=True)
+
+        assert asyncio.run(inside_loop()) == "技术支持回答"
+        for i in range(3):
+            workflow.route(f"{ticket} {i}", ROUTES, speculative=True)
+        assert len(util._async_clients) == clients
+        stats = workflow.speculation_stats()
+    finally:
+        stub.configure()
+    print(stats)
+    assert stats["hits"] >= 5
+    print("✅ 同步接口的后台事件循环\n")
+
+
+def test_analyze_alert_speculation():
+    """测试 analyze_alert 推测命中时分类与专项分析并发"""
+    print("=== 测试告警分析推测 ===")
+
+    def slow_reply(body):
+        time.sleep(0.3)
+        if "智能告警分类代理" in str(body["messages"]):
+            return ("<classification><category>backend_api_error</category><reasoning>接口 5xx</reasoning>"
+                    "<confidence>高</confidence></classification>")
+        return "推测分析结果"
+
+    stub.configure(reply=slow_reply)
+    alert = f"告警级别: ERROR\n错误信息: 订单接口返回 HTTP 502 {time.monotonic()}"
+    try:
+        with mock.patch.dict(workflow.SPECULATION_CONFIG, {"enabled": True}), \
+                mock.patch.dict(workflow.PRECLASSIFIER_CONFIG, {"threshold": 1.1}), \
+                mock.patch.object(workflow, "template_cache", TemplateClassificationCache(None)):
+            start = time.monotonic()
+            result = workflow.analyze_alert(alert, source="speculation-test")
+            elapsed = time.monotonic() - start
+    finally:
+        stub.configure()
+    print(f"耗时 {elapsed:.2f}s")
+    assert "推测分析结果" in result and "backend_api_error" in result
+    assert elapsed < 0.55
+    print("✅ 告警分析推测\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_speculate()
+        test_budget()
+        test_sync_route_in_running_loop()
+        test_analyze_alert_speculation()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+流式分类测试脚本
+
+检查 crisis/util.py 的 StreamingTagParser 和 analyze_alert 的流式分类路径，不访问真实 API：
+- 标签跨多个分块到达时，在关闭标签到达的那一块返回，内层标签先于外层标签
+- 未闭合的内层标签和多余的关闭标签不影响其他标签，同名标签只保留第一次的内容
+- </category> 到达时立即发出专项分析请求，不等待分类依据生成完
+- stop_after_category 时提前关闭分类流，不缓存未完整生成的分类
+"""
+
+import asyncio
+import time
+from unittest import mock
+
+from stub_server import CLASSIFICATION_REPLY, crisis_stub
+
+stub = crisis_stub()
+
+import workflow
+from template_miner import TemplateClassificationCache
+from util import StreamingTagParser
+
+LONG_REASONING = "接口返回 502，" + "网关到订单服务的连接被重置，" * 12
+
+
+def test_chunk_boundaries():
+    """测试标签被切分到多个分块时的解析"""
+    print("=== 测试分块边界 ===")
+    parser = StreamingTagParser()
+    completed = [parser.feed(chunk) for chunk in
+                 ["<classifi", "cation>\n<cate", "gory>uni_er", "ror</cat", "egory>\n<reasoning>原因", "</", "reasoning>",
+                  "</classification>"]]
+    assert completed[:3] == [[], [], []]
+    assert completed[3] == [] and completed[4] == [("category", "uni_error")]
+    assert completed[5] == [] and completed[6] == [("reasoning", "原因")]
+    assert completed[7][0][0] == "classification"
+    assert parser.values["category"] == "uni_error"
+
+    # 整段一次到达：内层标签先于外层标签
+    assert [tag for tag, _ in StreamingTagParser().feed(CLASSIFICATION_REPLY)] == \
+        ["category", "reasoning", "confidence", "classification"]
+
+    # 每个字符单独到达，结果与整段一致
+    parser = StreamingTagParser()
+    for char in CLASSIFICATION_REPLY:
+        parser.feed(char)
+    whole = StreamingTagParser()
+    whole.feed(CLASSIFICATION_REPLY)
+    assert parser.values == whole.values
+    print("✅ 分块边界\n")
+
+
+def test_malformed_tags():
+    """测试未闭合、多余和重复的标签"""
+    print("=== 测试不规范的标签 ===")
+    parser = StreamingTagParser()
+    assert parser.feed("</stray><a>前 <b>未闭合 后</a>") == [("a", "前 <b>未闭合 后")]
+    assert parser.feed("<a>第二次</a>") == [("a", "第二次")]
+    assert parser.values == {"a": "前 <b>未闭合 后"}
+    assert parser.feed("a < b 且 <c") == [] and parser.feed(">值</c>") == [("c", "值")]
+    print("✅ 不规范的标签\n")
+
+
+def _timed_reply(arrivals):
+    def reply(body):
+        text = str(body["messages"])
+        if "智能告警分类代理" in text:
+            arrivals.append(("classification", time.monotonic()))
+            return (f"<classification>\n<category>backend_api_error</category>\n"
+                    f"<reasoning>{LONG_REASONING}</reasoning>\n<confidence>高</confidence>\n</classification>")
+        arrivals.append(("analysis", time.monotonic()))
+        return "流式专项分析结果"
+    return reply
+
+
+def _analyze(alert, stop_after_category=False, use_async=False):
+    arrivals = []
+    stub.configure(reply=_timed_reply(arrivals), tokens_per_sec=100)
+    cache = TemplateClassificationCache(None)
+    try:
+        with mock.patch.dict(workflow.STREAMING_CONFIG, {"enabled": True, "stop_after_category": stop_after_category}), \
+                mock.patch.dict(workflow.PRECLASSIFIER_CONFIG, {"enabled": False}), \
+                mock.patch.object(workflow, "template_cache", cache):
+            before = stub.stats()["streams"]
+            start = time.monotonic()
+            if use_async:
+                result = asyncio.run(workflow.aanalyze_alert(alert, source="streaming-test"))
+            else:
+                result = workflow.analyze_alert(alert, source="streaming-test")
+            elapsed = time.monotonic() - start
+            streams = stub.stats()["streams"] - before
+    finally:
+        stub.configure()
+    return result, elapsed, dict(arrivals), streams, cache
+
+
+def test_dispatch_on_category():
+    """测试 </category> 到达时立即发出专项分析请求（同步和异步）"""
+    print("=== 测试分类标签到达即分派 ===")
+    for use_async in (False, True):
+        alert = f"告警级别: ERROR\n错误信息: 订单接口返回 HTTP 502 {time.monotonic()}"
+        result, elapsed, arrivals, streams, cache = _analyze(alert, use_async=use_async)
+        dispatch = arrivals["analysis"] - arrivals["classification"]
+        print(f"{'异步' if use_async else '同步'}: 分派 {dispatch:.2f}s，总耗时 {elapsed:.2f}s")
+        assert streams == 1
+        assert "流式专项分析结果" in result and "backend_api_error" in result and LONG_REASONING in result
+        # 分类依据生成需要数百毫秒，专项分析在此之前已发出
+        assert dispatch < elapsed / 2
+        assert cache.get(cache.template_id(alert)) is not None
+    print("✅ 分类标签到达即分派\n")
+
+
+def test_stop_after_category():
+    """测试提前终止生成时不缓存不完整的分类"""
+    print("=== 测试提前终止生成 ===")
+    alert = f"告警级别: ERROR\n错误信息: 订单接口返回 HTTP 502 {time.monotonic()}"
+    result, elapsed, _, _, cache = _analyze(alert, stop_after_category=True)
+    print(f"总耗时 {elapsed:.2f}s")
+    assert "流式专项分析结果" in result and "提前终止生成" in result and LONG_REASONING not in result
+    assert cache.get(cache.template_id(alert)) is None
+    print("✅ 提前终止生成\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_chunk_boundaries()
+        test_malformed_tags()
+        test_dispatch_on_category()
+        test_stop_after_category()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
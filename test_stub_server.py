@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+stub 服务器测试脚本
+
+检查本地 stub 服务器（stub_server.py）的各项能力，不访问真实 API：
+- MCP Connector 的 mcp_tool_use / mcp_tool_result 内容块（普通和流式响应）
+- 按脚本依次给出的回复和注入的 429 / 529 / 断开连接故障
+- 首 token 延迟和输出速度分布，以及固定种子下的可复现性
+"""
+
+import random
+
+from stub_server import Distribution, Fault, mcp_tool_reply, crisis_stub
+
+stub = crisis_stub()
+
+from agent import MCPWeatherAgent, SimpleAgent, telemetry
+
+FORECAST = mcp_tool_reply("get-forecast", {"latitude": 37.7749, "longitude": -122.4194},
+                          "Today: Sunny, 18°C", "旧金山今天晴，18°C。")
+
+
+def test_mcp_tool_blocks():
+    """测试 MCPWeatherAgent 能处理 stub 返回的 MCP 工具调用块（普通和流式）"""
+    stub.configure(reply=FORECAST)
+    print("=== 测试 MCP 工具调用内容块 ===")
+    agent = MCPWeatherAgent(api_key="stub-key", mcp_server_url=f"{stub.url}/mcp", base_url=stub.url)
+
+    answer = agent.chat("旧金山的天气如何？")
+    streamed = agent.chat_stream("旧金山的天气如何？")
+    print()
+
+    expected = "\n🛠️ 正在使用工具: get-forecast (来自: weather-server)旧金山今天晴，18°C。"
+    assert answer == expected
+    assert streamed == expected
+    print(f"✅ 回答: {answer!r}\n")
+
+
+def test_scripted_faults_are_retried():
+    """测试按脚本注入的 529 / 429 / 断开连接被 SDK 重试，重试次数记录在遥测中"""
+    stub.configure(reply="正常回复")
+    print("=== 测试脚本化故障注入 ===")
+    agent = SimpleAgent(api_key="stub-key", base_url=stub.url)
+    before = stub.stats()
+
+    stub.enqueue(Fault("529", retry_after=0.01), Fault("429", retry_after=0.01), "脚本回复")
+    assert agent.ask("你好") == "脚本回复"
+    assert telemetry.records[-1]["retries"] == 2
+
+    stub.enqueue(Fault("disconnect"))
+    assert agent.ask("你好") == "正常回复"
+    assert telemetry.records[-1]["retries"] == 1
+
+    after = stub.stats()
+    assert after["faults_529"] - before["faults_529"] == 1
+    assert after["faults_429"] - before["faults_429"] == 1
+    assert after["faults_disconnect"] - before["faults_disconnect"] == 1
+    print(f"✅ 故障计数: {after}\n")
+
+
+def test_midstream_disconnect():
+    """测试流式响应中途断开时智能体返回错误而不是挂起"""
+    stub.configure(reply="这是一段会在中途被切断的较长回复。" * 4)
+    print("=== 测试流式响应中途断开 ===")
+    agent = SimpleAgent(api_key="stub-key", base_url=stub.url)
+
+    stub.enqueue(Fault("disconnect", after_events=4))
+    answer = agent.ask_stream("你好")
+    print()
+
+    assert answer.startswith("❌ 错误")
+    assert telemetry.records[-1]["error"] is not None
+    print(f"✅ 中途断开: {answer}\n")
+
+
+def test_latency_profile():
+    """测试 TTFT 和输出速度按配置的分布生效"""
+    stub.configure(reply="延迟测试回复" * 8, ttft=0.2, tokens_per_sec=400)
+    print("=== 测试延迟分布 ===")
+    agent = SimpleAgent(api_key="stub-key", base_url=stub.url)
+    try:
+        agent.ask_stream("你好")
+        print()
+        record = telemetry.records[-1]
+        # 输出约 48 个字符 ≈ 12 token，400 tokens/sec 约需 0.03 秒
+        assert 0.2 <= record["ttft_s"] < 1.0
+        assert record["latency_s"] >= record["ttft_s"] + 0.02
+
+        agent.ask("你好")
+        assert telemetry.records[-1]["latency_s"] >= 0.2
+    finally:
+        stub.configure()
+    print(f"✅ 流式调用 TTFT {record['ttft_s']}s，总延迟 {record['latency_s']}s\n")
+
+
+def test_seeded_faults_reproducible():
+    """测试固定种子下故障和延迟序列可复现"""
+    print("=== 测试固定种子可复现 ===")
+    lognormal = Distribution.parse("lognormal:0.3,0.5")
+    first = [lognormal.sample(random.Random(7)) for _ in range(3)]
+    assert first == [lognormal.sample(random.Random(7)) for _ in range(3)]
+
+    sequences = []
+    for _ in range(2):
+        stub.configure(reply="ok", faults={"529": 0.3, "429": 0.2}, seed=42)
+        sequences.append([type(stub.next_response({})).__name__ for _ in range(20)])
+    stub.configure()
+    assert sequences[0] == sequences[1]
+    assert "Fault" in sequences[0] and "str" in sequences[0]
+    print(f"✅ 故障序列: {sequences[0]}\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_mcp_tool_blocks()
+        test_scripted_faults_are_retried()
+        test_midstream_disconnect()
+        test_latency_profile()
+        test_seeded_faults_reproducible()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
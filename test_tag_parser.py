@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+结构化响应解析测试脚本
+
+检查 crisis/util.py 的 parse_tags，不访问 API：
+- 分类和路由响应的字段与原来的 extract_xml 结果一致
+- 嵌套、重复、带属性和自闭合的标签
+- 输出被截断时不报错，未闭合的标签可按需取出已生成的部分
+- 正文中的泛型（Optional<T>、List<String>）不被当作截断的标签
+"""
+
+import re
+
+from stub_server import crisis_stub
+
+stub = crisis_stub()
+
+from util import extract_xml, parse_tags
+
+CLASSIFICATION = """
+<classification>
+<category>uni_error</category>
+<reasoning>发现Uni相关关键词和错误码特征</reasoning>
+<confidence>高</confidence>
+</classification>
+"""
+
+
+def _legacy_extract_xml(text, tag):
+    match = re.search(f'<{tag}>(.*?)</{tag}>', text, re.DOTALL)
+    return match.group(1) if match else ""
+
+
+def test_matches_extract_xml():
+    """测试分类和路由响应的字段与原实现一致"""
+    print("=== 测试与 extract_xml 一致 ===")
+    route = "<reasoning>用户无法登录</reasoning>\n<selection>Account</selection>"
+    for text, tags in [(CLASSIFICATION, ["category", "reasoning", "confidence", "missing"]),
+                       (route, ["reasoning", "selection"])]:
+        parsed = parse_tags(text)
+        assert [parsed.get(tag) for tag in tags] == [_legacy_extract_xml(text, tag) for tag in tags]
+        assert [extract_xml(text, tag) for tag in tags] == [_legacy_extract_xml(text, tag) for tag in tags]
+    print("✅ 字段一致\n")
+
+
+def test_nested_repeated_and_attributes():
+    """测试嵌套、重复、带属性和自闭合的标签"""
+    print("=== 测试嵌套、重复和属性 ===")
+    text = """
+<analysis>
+  <step id="1" kind='check'>检查网关日志</step>
+  <step id="2">确认 <service>order</service> 的连接池</step>
+  <step id=3/>
+  <note>a < b 时不是标签</note>
+</analysis>
+"""
+    parsed = parse_tags(text)
+    assert [tag.name for tag in parsed.tags] == ["analysis"]
+    assert [tag.name for tag in parsed.find("analysis").children] == ["step", "step", "step", "note"]
+    assert parsed.get_all("step") == ["检查网关日志", "确认 <service>order</service> 的连接池", ""]
+    assert [tag.attrs for tag in parsed.find_all("step")] == [{"id": "1", "kind": "check"}, {"id": "2"}, {"id": "3"}]
+    assert parsed.get("service") == "order"
+    assert parsed.find_all("step")[1].children[0].name == "service"
+    assert parsed.get("note") == "a < b 时不是标签"
+    assert "service" in parsed and "category" not in parsed
+    assert not parsed.truncated
+
+    same_name = parse_tags("<item>外层 <item>内层</item></item>")
+    assert same_name.get_all("item") == ["外层 <item>内层</item>", "内层"]
+    print("✅ 嵌套和重复标签按文档顺序返回\n")
+
+
+def test_truncated_output():
+    """测试输出被截断时的解析"""
+    print("=== 测试截断的输出 ===")
+    text = "<classification>\n<category>backend_api_error</category>\n<reasoning>接口返回 504，可能"
+    assert not parse_tags(text).truncated  # 未指定期望的标签时，从未闭合过的标签名无法与正文区分
+    parsed = parse_tags(text, expected=["classification", "category", "reasoning", "confidence"])
+    assert parsed.truncated
+    assert parsed.get("category") == "backend_api_error"
+    assert parsed.get("reasoning") == ""
+    assert parsed.get("reasoning", partial=True) == "接口返回 504，可能"
+    assert parsed.find("classification", partial=True).children[0].name == "category"
+    assert not parsed.find("classification", partial=True).complete
+
+    # 未闭合的内层标签按文本处理，不影响外层标签
+    assert parse_tags("<a>前 <b>未闭合 后</a>").get("a") == "前 <b>未闭合 后"
+    assert parse_tags("</a><a").tags == []
+    print("✅ 截断的输出可以解析\n")
+
+
+def test_generics_in_text():
+    """测试正文中的泛型不会让完整的响应被判为截断"""
+    print("=== 测试正文中的泛型 ===")
+    parsed = parse_tags("<category>a</category> Optional<T>")
+    assert not parsed.truncated and parsed.get("category") == "a" and parsed.get("T") == ""
+    analysis = "<analysis>接口返回 List<String>，调用方按 Map<String, Integer> 解析</analysis>"
+    parsed = parse_tags(analysis, expected=["analysis"])
+    assert not parsed.truncated and "List<String>" in parsed.get("analysis")
+    assert parse_tags("<analysis>返回 List<String>，", expected=["analysis"]).truncated
+    # 在别处闭合过的标签名未闭合时同样视为截断
+    truncated = parse_tags("<step>a</step><step>b")
+    assert truncated.truncated and truncated.get_all("step") == ["a"]
+    print("✅ 正文中的泛型\n")
+
+
+def main():
+    """主测试函数"""
+    try:
+        test_matches_extract_xml()
+        test_nested_repeated_and_attributes()
+        test_truncated_output()
+        test_generics_in_text()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+调用遥测测试脚本
+
+使用本地 stub 服务器（stub_server.py）测试，不访问真实 API：
+- 智能体的普通/流式调用记录 token、延迟、首 token 延迟和停止原因
+- crisis 工作流的调用按步骤（classification / analysis）聚合
+- 遥测可导出为 Prometheus 文本和 JSONL，实时 JSONL 由后台线程合并写入
+"""
+
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from stub_server import classification_reply, crisis_stub
+
+stub = crisis_stub()
+
+from agent import SimpleAgent, telemetry as agent_telemetry
+from telemetry import Telemetry
+
+
+def _row(rows, **labels):
+    matches = [r for r in rows if all(r[k] == v for k, v in labels.items())]
+    assert len(matches) == 1, (labels, rows)
+    return matches[0]
+
+
+def test_agent_call_telemetry():
+    """测试 SimpleAgent 的普通和流式调用都被记录，流式调用带首 token 延迟"""
+    stub.configure(reply=classification_reply)
+    print("=== 测试智能体调用遥测 ===")
+    agent_telemetry.reset()
+    agent = SimpleAgent(api_key="stub-key", base_url=stub.url)
+
+    agent.ask("什么是人工智能？")
+    agent.ask_stream("Python中的装饰器是什么？")
+    print()
+
+    rows = agent_telemetry.summary()
+    ask = _row(rows, source="SimpleAgent.ask")
+    stream = _row(rows, source="SimpleAgent.ask_stream")
+    for row in (ask, stream):
+        assert row["calls"] == 1 and row["errors"] == 0 and row["retries"] == 0
+        assert row["input_tokens"] > 0 and row["output_tokens"] > 0
+        assert row["stop_reasons"] == {"end_turn": 1}
+        assert row["avg_latency_s"] > 0 and row["cost_usd"] > 0
+    assert ask["avg_ttft_s"] is None
+    assert stream["avg_ttft_s"] is not None and stream["tokens_per_s"] > 0
+
+    record = agent_telemetry.records[-1]
+    assert record["model"] == "claude-sonnet-4-20250514"
+    assert record["ttft_s"] <= record["latency_s"]
+    print(f"✅ 流式调用记录: {record}\n")
+
+
+def test_agent_error_telemetry():
+    """测试调用失败时记录错误类型"""
+    print("=== 测试调用失败遥测 ===")
+    agent_telemetry.reset()
+    agent = SimpleAgent(api_key="stub-key", base_url="http://127.0.0.1:9")
+    agent.client = agent.client.with_options(max_retries=0)
+
+    answer = agent.ask("什么是人工智能？")
+
+    assert answer.startswith("❌ 错误")
+    row = _row(agent_telemetry.summary(), source="SimpleAgent.ask")
+    assert row["errors"] == 1
+    assert agent_telemetry.records[-1]["error"] == "APIConnectionError"
+    print(f"✅ 失败记录: {agent_telemetry.records[-1]}\n")
+
+
+def test_workflow_step_telemetry():
+    """测试工作流调用按步骤聚合，并导出 Prometheus 文本和 JSONL"""
+    stub.configure(reply=classification_reply)
+    print("=== 测试工作流步骤遥测 ===")
+    import util
+    import workflow
+
+    util.telemetry.reset()
+    # 不写入模板缓存文件；每个步骤只调用一次模型，关闭分类的模型级联（见 test_cascade.py）
+    with mock.patch.object(workflow.template_cache, "path", None), \
+            mock.patch.dict(workflow.MODEL_CASCADE_CONFIG, enabled=False):
+        # 预分类器判定时不调用分类 LLM，这里使用其无法判定的告警
+        workflow.analyze_alert("订单服务响应变慢，用户反馈页面卡顿", source="telemetry-test")
+
+    rows = workflow.telemetry_stats()
+    classification = _row(rows, step="classification")
+    analysis = _row(rows, step="analysis")
+    assert classification["calls"] == 1 and analysis["calls"] == 1
+    assert classification["source"] == analysis["source"] == "llm_call"
+
+    text = util.telemetry.to_prometheus()
+    assert 'llm_calls_total{model="claude-3-5-sonnet-20241022",step="analysis",source="llm_call",status="ok"} 1' in text
+    assert "llm_request_latency_seconds_bucket" in text
+    assert 'le="+Inf"' in text
+    assert 'llm_stop_reason_total{' in text
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "telemetry.jsonl")
+        assert util.telemetry.export_jsonl(path) == 2
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+    assert [r["step"] for r in records] == ["classification", "analysis"]
+    print(f"✅ 步骤汇总: {[(r['step'], r['calls'], r['avg_latency_s']) for r in rows]}\n")
+
+
+def test_jsonl_background_writer():
+    """测试调用记录先缓冲，由后台线程按间隔合并追加到 JSONL"""
+    print("=== 测试 JSONL 后台写入 ===")
+    usage = SimpleNamespace(input_tokens=10, output_tokens=5)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "telemetry.jsonl")
+        telemetry = Telemetry(jsonl_path=path, flush_interval=0.2)
+        for i in range(3):
+            telemetry.record_usage("claude-3-5-haiku-20241022", usage, f"source-{i}")
+        assert not os.path.exists(path)
+        assert telemetry.flush() == 3 and telemetry.flush() == 0
+
+        telemetry.record_usage("claude-3-5-haiku-20241022", usage, "source-3")
+        time.sleep(0.4)
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+    assert [r["source"] for r in records] == [f"source-{i}" for i in range(4)]
+    assert telemetry.totals()["calls"] == 4
+    print("✅ JSONL 后台写入\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_agent_call_telemetry()
+        test_agent_error_telemetry()
+        test_workflow_step_telemetry()
+        test_jsonl_background_writer()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
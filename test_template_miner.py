@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+告警模板挖掘与分类缓存测试脚本
+
+检查 crisis/template_miner.py 和 analyze_alert 的模板缓存路径，不访问真实 API：
+- 参数（时间、IP、数字）被掩码，参数不同的告警映射到同一个模板ID；错误码/状态码保持原样，码值不同的告警不合并
+- 模板被泛化后缓存结果失效；泛化后分类结果不同的模板标记为歧义，不再缓存
+- 缓存修改合并写入，flush 立即写入，重新加载后模板ID保持稳定；查询时发现的失效也会安排写入
+- 同一模板的第二条告警命中缓存，不调用分类 LLM；模板缓存关闭时不更新解析树
+"""
+
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from stub_server import crisis_stub
+
+stub = crisis_stub()
+
+import workflow
+from template_miner import TemplateClassificationCache, TemplateMiner, mask_parameters
+
+CONFIDENT_REPLY = """<classification>
+<category>backend_api_error</category>
+<reasoning>下单接口返回 5xx</reasoning>
+<confidence>高</confidence>
+</classification>"""
+
+
+def _alert(message: str, server: str = "web-01", time_of_day: str = "10:30:00") -> str:
+    return f"告警级别: ERROR 服务: order-service 错误信息: {message} 服务器: {server} 时间: 2024-01-15 {time_of_day}"
+
+
+def test_masking():
+    """测试参数掩码和模板ID稳定"""
+    print("=== 测试参数掩码 ===")
+    assert mask_parameters("2024-01-15 10:30:00 10.0.0.1:8080 耗时 350ms") == "<DATE> <TIME> <IP> 耗时 <NUM>ms"
+    miner = TemplateMiner(similarity_threshold=0.7)
+    first = miner.add(_alert("下单接口超时", "web-01", "10:30:00"))
+    second = miner.add(_alert("下单接口超时", "web-07", "11:45:10"))
+    assert first is second and second.size == 2 and second.version == 1
+    print(f"✅ 模板: {' '.join(second.tokens)}\n")
+
+
+def test_codes_kept():
+    """测试错误码/状态码不被掩码，码值不同的告警不合并到同一模板"""
+    print("=== 测试错误码保留 ===")
+    assert mask_parameters("status=502 错误码: 10205 耗时 350ms") == "status=502 错误码: 10205 耗时 <NUM>ms"
+    assert mask_parameters("HTTP 404 重试 3 次") == "HTTP 404 重试 <NUM> 次"
+    miner = TemplateMiner(similarity_threshold=0.5)
+    first = miner.add(_alert("下单接口 status=502", "web-01"))
+    assert miner.add(_alert("下单接口 status=502", "web-02")) is first
+    assert miner.add(_alert("下单接口 status=404", "web-01")) is not first
+    assert miner.add(_alert("支付失败 错误码: 10205")) is not miner.add(_alert("支付失败 错误码: 10206"))
+    assert first.version == 1
+    print("✅ 错误码保留\n")
+
+
+def test_generalization_invalidates():
+    """测试模板泛化后缓存失效，分类不同时标记为歧义模板"""
+    print("=== 测试模板泛化 ===")
+    cache = TemplateClassificationCache(None, miner_config={"similarity_threshold": 0.7})
+    tid = cache.template_id(_alert("下单接口超时"))
+    assert cache.put(tid, "backend_api_error", "高")
+    assert not cache.put(cache.template_id("前端 页面白屏"), "javascript_error", "中")  # 置信度不足不缓存
+    assert cache.get(tid)["category"] == "backend_api_error"
+
+    # 只有错误信息不同的告警合并到同一模板，模板被泛化，之前的缓存结果失效
+    assert cache.template_id(_alert("uni.request失败")) == tid
+    assert cache.miner.cluster(tid).version == 2
+    assert cache.get(tid) is None
+    # 重新分类得到不同类别：模板同时覆盖了不同类别的告警，不再缓存
+    assert not cache.put(tid, "uni_error", "高")
+    assert cache.get(tid) is None and not cache.put(tid, "uni_error", "高")
+
+    # 泛化后分类结果不变的模板继续缓存
+    other = cache.template_id("支付回调 失败 订单 A")
+    cache.put(other, "backend_api_error", "高")
+    assert cache.template_id("支付回调 失败 订单 B") == other and cache.get(other) is None
+    assert cache.put(other, "backend_api_error", "高") and cache.get(other)["category"] == "backend_api_error"
+    stats = cache.stats()
+    print(stats)
+    assert stats["ambiguous_templates"] == 1 and stats["invalidated"] == 2
+    print("✅ 模板泛化\n")
+
+
+def test_debounced_save():
+    """测试缓存修改合并写入和重新加载"""
+    print("=== 测试合并写入 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "templates.json")
+        cache = TemplateClassificationCache(path, save_interval=0.2)
+        tids = [cache.template_id(f"服务 {name} 健康检查 失败") for name in ("order", "payment", "user")]
+        for tid, category in zip(tids, ("backend_api_error", "uni_error", "javascript_error")):
+            cache.put(tid, category, "高")
+        assert not os.path.exists(path)
+        time.sleep(0.4)
+        assert cache.stats()["saves"] == 1
+        with open(path, encoding="utf-8") as f:
+            assert len(json.load(f)["entries"]) == 3
+
+        cache.invalidate(tids[0])
+        cache.flush()
+        cache.flush()  # 没有未保存的修改时不写入
+        assert cache.stats()["saves"] == 2
+
+        reloaded = TemplateClassificationCache(path)
+        assert reloaded.template_id("服务 order 健康检查 失败") == tids[0]
+        assert reloaded.get(tids[0]) is None and reloaded.get(tids[1])["category"] == "uni_error"
+
+        # 查询时发现模板已泛化：失效同样在 save_interval 后写入，不依赖后续的 put
+        cache = TemplateClassificationCache(path, save_interval=0.2)
+        cache.template_id("服务 payment 健康检查 超时")
+        assert cache.get(tids[1]) is None
+        time.sleep(0.4)
+        assert TemplateClassificationCache(path).stats()["cached_templates"] == 1
+    print("✅ 合并写入\n")
+
+
+def test_cache_skips_classification():
+    """测试同一模板的第二条告警命中缓存，不调用分类 LLM"""
+    print("=== 测试模板缓存命中 ===")
+    cache = TemplateClassificationCache(None, miner_config={"similarity_threshold": 0.7})
+    stub.configure(reply=lambda body: CONFIDENT_REPLY if "智能告警分类代理" in str(body["messages"]) else "stub 分析结果")
+    try:
+        with mock.patch.object(workflow, "template_cache", cache), \
+                mock.patch.dict(workflow.PRECLASSIFIER_CONFIG, {"enabled": False, "corpus_path": None}):
+            workflow.analyze_alert(_alert("下单接口返回 HTTP 502", "web-01"), source="template-test")
+            before = len(stub.message_requests())
+            result = workflow.analyze_alert(_alert("下单接口返回 HTTP 502", "web-09", "12:00:00"), source="template-test")
+            bodies = stub.message_requests()[before:]
+    finally:
+        stub.configure()
+    assert "专项分析结果" in result and "backend_api_error" in result
+    assert len(bodies) == 1 and "智能告警分类代理" not in str(bodies[0]["messages"])
+    assert cache.stats()["hits"] == 1
+
+    # 模板缓存关闭时不计算模板ID，解析树不增长
+    disabled = TemplateClassificationCache(None)
+    stub.configure(reply=CONFIDENT_REPLY)
+    try:
+        with mock.patch.object(workflow, "template_cache", disabled), \
+                mock.patch.dict(workflow.TEMPLATE_CACHE_CONFIG, {"enabled": False}), \
+                mock.patch.dict(workflow.PRECLASSIFIER_CONFIG, {"enabled": False, "corpus_path": None}):
+            workflow.analyze_alert(_alert(f"库存接口返回 HTTP 503 {time.monotonic()}"), source="template-test")
+    finally:
+        stub.configure()
+    assert disabled.miner.clusters == {} and disabled.stats()["cached_templates"] == 0
+    print("✅ 模板缓存命中\n")
+
+
+def main():
+    """主测试函数"""
+    print(f"🚀 stub 服务器: {stub.url}\n")
+    try:
+        test_masking()
+        test_codes_kept()
+        test_generalization_invalidates()
+        test_debounced_save()
+        test_cache_skips_classification()
+        print("🎉 所有测试通过")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()